@@ -15,8 +15,7 @@ import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 
 from garmindb import GarminConnectConfigManager
-from garmindb.garmindb import MonitoringDb, Monitoring, MonitoringHeartRate, ActivitiesDb
-from garmindb.summarydb import DaysSummary, WeeksSummary, MonthsSummary, SummaryDb
+from garmindb import frames
 
 
 config = {
@@ -68,9 +67,9 @@ class Graph():
     """A class that generates graphs for GarminDb data sets."""
 
     __table = {
-        'days'      : DaysSummary,
-        'weeks'     : WeeksSummary,
-        'months'    : MonthsSummary
+        'days'      : frames.days_summary,
+        'weeks'     : frames.weeks_summary,
+        'months'    : frames.months_summary
     }
 
     def __init__(self, debug=False, save=False):
@@ -82,13 +81,8 @@ class Graph():
 
     @classmethod
     def __remove_discontinuities(cls, data):
-        last = 0
-        for index, entry in enumerate(data):
-            if not entry:
-                data[index] = last
-            else:
-                last = data[index]
-        return data
+        # replace missing and zero values with the last value before them
+        return data.where(data.notna() & (data != 0)).ffill().fillna(0)
 
     @classmethod
     def _graph_scatter(cls, time, data, stat_name, ylabel, save=False, geometry=111):
@@ -180,33 +174,31 @@ class Graph():
             figure.savefig(save_name)
 
     def _graph_steps(self, time, data, period, geometry=111):
-        steps = self.__remove_discontinuities([entry.steps for entry in data])
-        steps_goal_percent = self.__remove_discontinuities([entry.steps_goal_percent for entry in data])
+        steps = self.__remove_discontinuities(data['steps'])
+        steps_goal_percent = self.__remove_discontinuities(data['steps_goal_percent'])
         yrange_list = [(0, max(steps) * 1.1), (0, max(steps_goal_percent) * 2)]
         self.__graph_multiple(time, [steps, steps_goal_percent], 'Steps', period, ['Steps', 'Step Goal Percent'], yrange_list, self.save, geometry)
 
     def _graph_hr(self, time, data, period, geometry=111):
-        rhr = self.__remove_discontinuities([entry.rhr_avg for entry in data])
-        inactive_hr = self.__remove_discontinuities([entry.inactive_hr_avg for entry in data])
+        rhr = self.__remove_discontinuities(data['rhr_avg'])
+        inactive_hr = self.__remove_discontinuities(data['inactive_hr_avg'])
         self.__graph_multiple(time, [rhr, inactive_hr], 'Heart Rate', period, ['RHR', 'Inactive hr'], [(30, 100), (30, 100)], self.save, geometry)
 
     def _graph_itime(self, time, data, period, geometry=111):
-        itime = [entry.intensity_time_mins for entry in data]
-        itime_goal_percent = self.__remove_discontinuities([entry.intensity_time_goal_percent for entry in data])
-        itime_goal_max = max([entry.intensity_time_goal_mins for entry in data])
+        itime = data['intensity_time_mins']
+        itime_goal_percent = self.__remove_discontinuities(data['intensity_time_goal_percent'])
+        itime_goal_max = data['intensity_time_goal_mins'].max()
         yrange_list = [(0, itime_goal_max * 5), (0, max(itime_goal_percent) * 1.1)]
         self.__graph_multiple(time, [itime, itime_goal_percent], 'Intensity Minutes', period, ['Intensity Minutes', 'Intensity Minutes Goal Percent'],
                               yrange_list, self.save, geometry)
 
     def _graph_rhr(self, time, data, period, geometry=111):
         """Generate a rhr graph"""
-        weight = [entry.rhr_avg for entry in data]
-        self._graph_multiple_single_axes(time, [weight], 'Resting Heart Rate', 'rhr', self.save, geometry)
+        self._graph_multiple_single_axes(time, [data['rhr_avg']], 'Resting Heart Rate', 'rhr', self.save, geometry)
 
     def _graph_weight(self, time, data, period, geometry=111):
         """Generate a weight graph"""
-        weight = [entry.weight_avg for entry in data]
-        self._graph_multiple_single_axes(time, [weight], 'Weight', 'weight', self.save, geometry)
+        self._graph_multiple_single_axes(time, [data['weight_avg']], 'Weight', 'weight', self.save, geometry)
 
     def graph_activity(self, activity, period=None, days=None, geometry=111):
         """Generate a graph for the given activity with points every period spanning days."""
@@ -214,57 +206,44 @@ class Graph():
             period = config[activity]['period']
         if days is None:
             days = config[activity]['days']
-        sum_db = SummaryDb(self.db_params, self.debug)
         end_ts = datetime.datetime.now()
         start_ts = end_ts - datetime.timedelta(days=days)
-        table = self.__table[period]
-        data = table.get_for_period(sum_db, start_ts, end_ts, table)
-        if period == 'days':
-            time = [entry.day for entry in data]
-        else:
-            time = [entry.first_day for entry in data]
+        data = self.__table[period](self.db_params, start_ts, end_ts)
+        time = data['day'] if period == 'days' else data['first_day']
         graph_func_name = '_graph_' + activity
         graph_func = getattr(self, graph_func_name, None)
         graph_func(time, data, period, geometry)
 
     def __format_steps(self, data):
-        steps = []
-        steps_count = {}
-        for entry in data:
-            if entry.steps is not None:
-                if entry.activity_type in steps_count:
-                    if entry.steps > steps_count[entry.activity_type]:
-                        steps_count[entry.activity_type] = entry.steps
-                else:
-                    steps_count[entry.activity_type] = entry.steps
-            steps.append(sum(steps_count.values()))
-        return steps
+        # steps are cumulative per activity type, so the total is the sum of the running maximum of each activity type
+        activity_type = data['activity_type'].fillna('')
+        steps = data['steps'].groupby(activity_type).cummax().groupby(activity_type).ffill()
+        return steps.groupby(activity_type).diff().fillna(steps).fillna(0).cumsum()
 
     def graph_date(self, date, geometry=111):
         """Generate a graph for the given date."""
         if date is None:
             date = (datetime.datetime.now() - datetime.timedelta(days=1)).date()
-        mon_db = MonitoringDb(self.db_params, self.debug)
         start_ts = datetime.datetime.combine(date, datetime.datetime.min.time())
         end_ts = datetime.datetime.combine(date, datetime.datetime.max.time())
-        hr_data = MonitoringHeartRate.get_for_period(mon_db, start_ts, end_ts, MonitoringHeartRate)
-        data = Monitoring.get_for_period(mon_db, start_ts, end_ts, Monitoring)
+        hr_data = frames.monitoring_hr(self.db_params, start_ts, end_ts)
+        data = frames.monitoring(self.db_params, start_ts, end_ts)
         over_data_dict = [
             {
                 'label'     : 'Cumulative Steps',
-                'time'      : [entry.timestamp for entry in data],
+                'time'      : data['timestamp'],
                 'data'      : self.__format_steps(data),
             },
             {
                 'label'     : 'Heart Rate',
-                'time'      : [entry.timestamp for entry in hr_data],
-                'data'      : [entry.heart_rate for entry in hr_data],
+                'time'      : hr_data['timestamp'],
+                'data'      : hr_data['heart_rate'],
                 'limits'    : (30, 220)
             }
         ]
         under_data_dict = {
-            'time'      : [entry.timestamp for entry in data],
-            'data'      : self.__remove_discontinuities([entry.intensity for entry in data]),
+            'time'      : data['timestamp'],
+            'data'      : self.__remove_discontinuities(data['intensity']),
             'limits'    : (0, 10)
         }
         save_name = f"{date}_daily.png" if self.save else None
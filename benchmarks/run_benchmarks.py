@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+
+"""
+A script that times importing and analyzing synthetic Garmin data and saves the results so that runs can be compared across commits.
+
+Synthetic monitoring and activity FIT files and sleep, resting heart rate, daily summary, and weight JSON files are generated for each span
+of years, imported into new databases, summarized, and queried. Everything runs offline.
+"""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import sys
+import logging
+import argparse
+import datetime
+import json
+import glob
+import platform
+import subprocess
+import tempfile
+import time
+
+import fitfile
+import idbutils
+from sqlalchemy import inspect, func, select, text
+
+from garmindb import Analyze, ActivityExporter, PluginManager, run_metrics
+from garmindb import MonitoringFitFileProcessor, ActivityFitFileProcessor
+from garmindb import GarminMonitoringFitData, GarminActivitiesFitData, GarminSleepData, GarminRhrData, GarminSummaryData, GarminWeightData
+from garmindb.garmindb import GarminDb, Attributes, Sleep, RestingHeartRate, Weight, DailySummary, MonitoringDb, Monitoring, MonitoringHeartRate, Stress, \
+    ActivitiesDb, Activities, ActivityRecords, GarminSummaryDb, DaysSummary, IntensityHR
+from garmindb.summarydb import SummaryDb
+
+from synthetic_data import SyntheticData
+
+
+logging.basicConfig(filename='benchmarks.log', filemode='w', level=logging.WARNING)
+logger = logging.getLogger(__file__)
+logger.addHandler(logging.StreamHandler(stream=sys.stdout))
+logger.setLevel(logging.INFO)
+root_logger = logging.getLogger()
+
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+start_day = datetime.date(2020, 1, 1)
+row_count_tables = [Monitoring, MonitoringHeartRate, Stress, Sleep, RestingHeartRate, Weight, DailySummary, Activities, ActivityRecords, DaysSummary, IntensityHR]
+
+
+class BenchmarkConfig():
+    """The part of the GarminDb config that the analyzer uses."""
+
+    def __init__(self, db_params):
+        """Return a config for the databases described by db_params."""
+        self.db_params = db_params
+
+    def get_db_params(self):
+        """Return the database configuration."""
+        return self.db_params
+
+    def course_views(self, type):
+        """Return the ids of the courses to create views for."""
+        return []
+
+
+def git_commit():
+    """Return the commit that the tree is at and whether the tree has uncommitted changes, or None if it isn't a git tree."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=benchmarks_dir, capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=benchmarks_dir, capture_output=True, text=True, check=True).stdout
+        return (commit, bool(status.strip()))
+    except (OSError, subprocess.CalledProcessError):
+        return (None, False)
+
+
+def generate_data(data_dir, years, monitoring_interval):
+    """Generate the synthetic data for a span of years into data_dir unless data generated with the same parameters is already there."""
+    params = {'start_day': start_day.isoformat(), 'days': years * 365, 'monitoring_interval': monitoring_interval}
+    params_file = os.path.join(data_dir, 'synthetic_data.json')
+    if os.path.isfile(params_file):
+        with open(params_file) as file:
+            saved = json.load(file)
+        if saved['params'] == params:
+            logger.info("Using existing %d year(s) of synthetic data in %s", years, data_dir)
+            return saved['counts']
+    logger.info("Generating %d year(s) of synthetic data in %s", years, data_dir)
+    counts = SyntheticData(data_dir, start_day, years * 365, monitoring_interval=monitoring_interval).generate()
+    with open(params_file, 'w') as file:
+        json.dump({'params': params, 'counts': counts}, file)
+    return counts
+
+
+def import_monitoring(data_dir, db_params, plugin_manager, workers):
+    """Import the monitoring FIT files."""
+    gfd = GarminMonitoringFitData(os.path.join(data_dir, SyntheticData.monitoring_dir), False, fitfile.field_enums.DisplayMeasure.metric, 0, workers)
+    gfd.process_files(MonitoringFitFileProcessor(db_params, plugin_manager, 0))
+
+
+def import_activities(data_dir, db_params, plugin_manager, workers):
+    """Import the activity FIT files."""
+    gfd = GarminActivitiesFitData(os.path.join(data_dir, SyntheticData.activities_dir), False, fitfile.field_enums.DisplayMeasure.metric, 0, workers)
+    gfd.process_files(ActivityFitFileProcessor(db_params, plugin_manager, 0))
+
+
+def import_json(data_dir, db_params):
+    """Return the JSON importers in the order they are benchmarked."""
+    metric = fitfile.field_enums.DisplayMeasure.metric
+    return [
+        ('import_weight_json', GarminWeightData(db_params, os.path.join(data_dir, SyntheticData.weight_dir), False, metric, 0)),
+        ('import_summary_json', GarminSummaryData(db_params, os.path.join(data_dir, SyntheticData.summary_dir), False, metric, 0)),
+        ('import_sleep_json', GarminSleepData(db_params, os.path.join(data_dir, SyntheticData.sleep_dir), False, 0)),
+        ('import_rhr_json', GarminRhrData(db_params, os.path.join(data_dir, SyntheticData.rhr_dir), False, 0))
+    ]
+
+
+def export_activities(db_params, export_dir, count):
+    """Export the first count activities as TCX files. Return the number exported."""
+    with ActivitiesDb(db_params).managed_session() as session:
+        activity_ids = [activity_id for (activity_id,) in session.execute(select(Activities.activity_id).order_by(Activities.start_time).limit(count))]
+    for activity_id in activity_ids:
+        exporter = ActivityExporter(export_dir, activity_id, fitfile.field_enums.DisplayMeasure.metric, 0)
+        exporter.process(db_params)
+        exporter.write(f'activity_{activity_id}.tcx')
+    return len(activity_ids)
+
+
+def query_summary_views(db_params):
+    """Read every row of every view in the summary databases. Return the number of rows read per view."""
+    rows = {}
+    for db in [GarminSummaryDb(db_params), SummaryDb(db_params)]:
+        with db.engine.connect() as connection:
+            for view_name in inspect(db.engine).get_view_names():
+                rows[view_name] = len(connection.execute(text(f'SELECT * FROM {view_name}')).fetchall())
+    return rows
+
+
+def count_rows(db_params):
+    """Return the number of rows in the tables that the benchmarks fill."""
+    counts = {}
+    for table in row_count_tables:
+        with table.db(db_params).managed_session() as session:
+            counts[table.__tablename__] = session.execute(select(func.count()).select_from(table)).scalar()
+    return counts
+
+
+def run_size(years, data_dir, work_dir, workers, export_count):
+    """Run the benchmarks against a span of years of synthetic data. Return the results."""
+    db_dir = os.path.join(work_dir, 'dbs')
+    export_dir = os.path.join(work_dir, 'export')
+    plugin_dir = os.path.join(work_dir, 'plugins')
+    for directory in [db_dir, export_dir, plugin_dir]:
+        os.makedirs(directory, exist_ok=True)
+    db_params = idbutils.DbParams(db_type='sqlite', db_path=db_dir)
+    GarminDb(db_params)
+    MonitoringDb(db_params)
+    ActivitiesDb(db_params)
+    Attributes.set(GarminDb(db_params), 'measurement_system', fitfile.field_enums.DisplayMeasure.metric)
+    plugin_manager = PluginManager(plugin_dir, db_params)
+    results = {}
+    run_metrics.reset()
+
+    def timed(name, function, *args):
+        logger.info("%d year(s): %s", years, name)
+        with run_metrics.stage(name):
+            start = time.perf_counter()
+            value = function(*args)
+            results[name] = {'seconds': time.perf_counter() - start}
+        return value
+
+    timed('import_monitoring_fit', import_monitoring, data_dir, db_params, plugin_manager, workers)
+    timed('import_activities_fit', import_activities, data_dir, db_params, plugin_manager, workers)
+    for name, importer in import_json(data_dir, db_params):
+        timed(name, importer.process)
+    timed('analyze_summary', Analyze(BenchmarkConfig(db_params), 0).summary, False, workers)
+    exported = timed('export_activities', export_activities, db_params, export_dir, export_count)
+    results['export_activities']['activities'] = exported
+    view_rows = timed('query_summary_views', query_summary_views, db_params)
+    results['query_summary_views']['rows'] = view_rows
+    stages = run_metrics.report()['stages']
+    for name, result in results.items():
+        result.update({count: value for count, value in stages[name].items() if count not in ['calls', 'duration']})
+    return {
+        'benchmarks'    : results,
+        'stages'        : {path: stage['duration'] for path, stage in stages.items() if '/' in path},
+        'rows'          : count_rows(db_params)
+    }
+
+
+def latest_results_file(results_dir):
+    """Return the most recent results file in results_dir or None if there aren't any."""
+    results_files = sorted(glob.glob(os.path.join(results_dir, '*.json')))
+    return results_files[-1] if results_files else None
+
+
+def compare(previous, current, threshold):
+    """Print the change in the time of each benchmark between two runs. Return the number of benchmarks that slowed down by more than threshold percent."""
+    print(f"Comparing {current['commit'] or 'uncommitted'} to {previous['commit'] or 'uncommitted'} from {previous['timestamp']}")
+    regressions = 0
+    for size, size_results in current['sizes'].items():
+        previous_results = previous['sizes'].get(size)
+        if previous_results is None:
+            continue
+        print(f'{size} year(s):')
+        for name, result in size_results['benchmarks'].items():
+            previous_result = previous_results['benchmarks'].get(name)
+            if previous_result is None:
+                print(f"    {name:24} {'':>10} {result['seconds']:10.3f}s")
+                continue
+            change = (result['seconds'] - previous_result['seconds']) * 100 / previous_result['seconds'] if previous_result['seconds'] else 0.0
+            flag = ' <-- slower' if change > threshold else ''
+            regressions += 1 if flag else 0
+            print(f"    {name:24} {previous_result['seconds']:10.3f}s {result['seconds']:10.3f}s {change:+7.1f}%{flag}")
+    return regressions
+
+
+def main(argv):
+    """Run the benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-y", "--years", help="The spans of years of data to benchmark.", type=int, nargs='+', default=[1])
+    parser.add_argument("-r", "--results-dir", help="The directory to save the results in.", default=os.path.join(benchmarks_dir, 'results'))
+    parser.add_argument("-c", "--compare", help="The results file to compare to, the latest file in the results directory by default.", default=None)
+    parser.add_argument("-d", "--data-dir", help="Keep the synthetic data in this directory and reuse it in later runs.", default=None)
+    parser.add_argument("-w", "--workers", help="The number of processes to parse FIT files and analyze years with.", type=int, default=1)
+    parser.add_argument("-e", "--export-count", help="The number of activities to export.", type=int, default=25)
+    parser.add_argument("-i", "--monitoring-interval", help="The number of seconds between synthetic monitoring messages.", type=int, default=60)
+    parser.add_argument("-t", "--threshold", help="The percent slow down that is reported as a regression.", type=float, default=10.0)
+    parser.add_argument("--no-save", help="Don't save the results.", dest='save', action='store_false', default=True)
+    args = parser.parse_args(argv)
+
+    commit, dirty = git_commit()
+    results = {
+        'commit'    : commit,
+        'dirty'     : dirty,
+        'timestamp' : datetime.datetime.now().isoformat(timespec='seconds'),
+        'python'    : platform.python_version(),
+        'platform'  : platform.platform(),
+        'workers'   : args.workers,
+        'sizes'     : {}
+    }
+    run_metrics.track_sql()
+    for years in args.years:
+        with tempfile.TemporaryDirectory() as work_dir:
+            data_dir = os.path.join(args.data_dir, f'{years}_years') if args.data_dir else os.path.join(work_dir, 'data')
+            os.makedirs(data_dir, exist_ok=True)
+            start = time.perf_counter()
+            counts = generate_data(data_dir, years, args.monitoring_interval)
+            logger.info("%d year(s): data ready in %.1fs", years, time.perf_counter() - start)
+            size_results = run_size(years, data_dir, work_dir, args.workers, args.export_count)
+            size_results['data'] = counts
+            results['sizes'][str(years)] = size_results
+        for name, result in size_results['benchmarks'].items():
+            print(f"{years} year(s) {name:24} {result['seconds']:10.3f}s")
+
+    previous_file = args.compare or latest_results_file(args.results_dir)
+    regressions = 0
+    if previous_file:
+        with open(previous_file) as file:
+            regressions = compare(json.load(file), results, args.threshold)
+    if args.save:
+        os.makedirs(args.results_dir, exist_ok=True)
+        results_file = os.path.join(args.results_dir, f"{results['timestamp'].replace(':', '')}_{(commit or 'nogit')[:10]}.json")
+        with open(results_file, 'w') as file:
+            json.dump(results, file, indent=4)
+        print(f'Saved results to {results_file}')
+    return regressions
+
+
+if __name__ == "__main__":
+    sys.exit(1 if main(sys.argv[1:]) else 0)
@@ -0,0 +1,366 @@
+"""Objects for generating synthetic Garmin data files for benchmarking the importers and analyzers."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import struct
+import datetime
+import json
+import random
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class FitFileWriter():
+    """
+    Write minimal little endian FIT files.
+
+    Only what's needed to produce files the fitfile decoder and the GarminDb FIT importers accept: a file header, definition messages, data
+    messages with uncompressed timestamps, and the file CRC.
+    """
+
+    fit_epoch = datetime.datetime(1989, 12, 31, tzinfo=datetime.timezone.utc)
+    base_types = {
+        'enum'      : (0x00, 'B'),
+        'uint8'     : (0x02, 'B'),
+        'sint16'    : (0x83, 'h'),
+        'uint16'    : (0x84, 'H'),
+        'sint32'    : (0x85, 'i'),
+        'uint32'    : (0x86, 'I'),
+        'uint32z'   : (0x8c, 'I'),
+    }
+    crc_table = [0x0000, 0xCC01, 0xD801, 0x1400, 0xF001, 0x3C00, 0x2800, 0xE401, 0xA001, 0x6C00, 0x7800, 0xB401, 0x5000, 0x9C01, 0x8801, 0x4400]
+    protocol_version = 0x10
+    profile_version = 2093
+
+    def __init__(self):
+        """Return a new FitFileWriter with no messages."""
+        self.data = bytearray()
+        self.definitions = {}
+
+    @classmethod
+    def timestamp(cls, dt):
+        """Return the FIT timestamp for a datetime, naive datetimes are FIT local time values and are encoded as is."""
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=datetime.timezone.utc)
+        return int((dt - cls.fit_epoch).total_seconds())
+
+    @classmethod
+    def semicircles(cls, degrees):
+        """Return the FIT semicircles value for a position in degrees."""
+        return int(degrees * (2 ** 31) / 180)
+
+    @classmethod
+    def crc(cls, data, crc=0):
+        """Return the FIT CRC of data."""
+        for byte in data:
+            for nibble in (byte & 0xf, byte >> 4):
+                tmp = cls.crc_table[crc & 0xf]
+                crc = (crc >> 4) & 0x0fff
+                crc = crc ^ tmp ^ cls.crc_table[nibble]
+        return crc
+
+    def define(self, local_message_num, global_message_num, fields):
+        """
+        Write a definition message for a local message number.
+
+        Parameters:
+        ----------
+        local_message_num (int): the local message number, 0-15, that data messages are written with
+        global_message_num (int): the FIT profile message number
+        fields (list): (field number, base type name, array length) tuples in the order the values are written
+
+        """
+        self.definitions[local_message_num] = fields
+        self.data += struct.pack('<BBBHB', 0x40 | local_message_num, 0, 0, global_message_num, len(fields))
+        for field_num, base_type, count in fields:
+            type_id, type_format = self.base_types[base_type]
+            self.data += struct.pack('<BBB', field_num, struct.calcsize(type_format) * count, type_id)
+
+    def write(self, local_message_num, *values):
+        """Write a data message with one value, or a list of values for array fields, per defined field."""
+        self.data += struct.pack('<B', local_message_num)
+        for (_, base_type, count), value in zip(self.definitions[local_message_num], values):
+            type_format = self.base_types[base_type][1]
+            self.data += struct.pack(f'<{count}{type_format}', *(value if count > 1 else [value]))
+
+    def save(self, filename):
+        """Write the FIT file to disk."""
+        header = struct.pack('<BBHI4s', 14, self.protocol_version, self.profile_version, len(self.data), b'.FIT')
+        header += struct.pack('<H', self.crc(header))
+        with open(filename, 'wb') as file:
+            file.write(header)
+            file.write(self.data)
+            file.write(struct.pack('<H', self.crc(self.data, self.crc(header))))
+
+
+class SyntheticData():
+    """
+    Generate a repeatable set of Garmin data files that cover a span of days.
+
+    Monitoring and activity data are written as FIT files, sleep, resting heart rate, daily summary, and weight data as Garmin Connect JSON
+    files. Each type of data is written to its own directory, named by the directory attributes, under the root directory.
+    """
+
+    monitoring_dir = 'monitoring'
+    activities_dir = 'activities'
+    sleep_dir = 'sleep'
+    rhr_dir = 'rhr'
+    summary_dir = 'summary'
+    weight_dir = 'weight'
+
+    manufacturer_garmin = 1
+    product = 2697
+    serial_number = 3912345678
+    file_type_activity = 4
+    file_type_monitoring_b = 32
+    activity_type_walking = 6
+    activity_type_running = 1
+    sport_running = 1
+
+    def __init__(self, root_dir, start_day, days, monitoring_interval=60, stress_interval=180, record_interval=5, activities_per_week=3, utc_offset=-18000,
+                 seed=42):
+        """
+        Return a SyntheticData instance that will write its files under root_dir.
+
+        Parameters:
+        ----------
+        root_dir (string): the directory to write the data directories to
+        start_day (date): the first day of data
+        days (int): the number of days of data to generate
+        monitoring_interval (int): the number of seconds between monitoring messages
+        stress_interval (int): the number of seconds between stress messages
+        record_interval (int): the number of seconds between activity records
+        activities_per_week (int): the average number of activities per week
+        utc_offset (int): the offset, in seconds, of the local time zone the data was recorded in
+        seed (int): the seed for the random values, the same seed always generates the same files
+
+        """
+        self.root_dir = root_dir
+        self.start_day = start_day
+        self.days = days
+        self.monitoring_interval = monitoring_interval
+        self.stress_interval = stress_interval
+        self.record_interval = record_interval
+        self.activities_per_week = activities_per_week
+        self.utc_offset = datetime.timedelta(seconds=utc_offset)
+        self.random = random.Random(seed)
+        self.counts = {}
+
+    def dir(self, name):
+        """Return the full path of a data directory, creating it if needed."""
+        path = os.path.join(self.root_dir, name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def __count(self, name, value=1):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def __local_to_utc(self, local_dt):
+        return (local_dt - self.utc_offset).replace(tzinfo=datetime.timezone.utc)
+
+    def generate(self):
+        """Write all of the data files. Return a dict of the number of files and messages written by type."""
+        for day_num in range(self.days):
+            day = self.start_day + datetime.timedelta(days=day_num)
+            self.write_monitoring(day)
+            self.write_sleep(day)
+            self.write_rhr(day)
+            self.write_summary(day)
+            self.write_weight(day)
+            if self.random.random() < self.activities_per_week / 7:
+                self.write_activity(day)
+        logger.info("Generated %r", self.counts)
+        return self.counts
+
+    def __write_file_id(self, fit_file, file_type, time_created):
+        fit_file.define(0, 0, [(0, 'enum', 1), (1, 'uint16', 1), (2, 'uint16', 1), (3, 'uint32z', 1), (4, 'uint32', 1)])
+        fit_file.write(0, file_type, self.manufacturer_garmin, self.product, self.serial_number, FitFileWriter.timestamp(time_created))
+
+    def write_monitoring(self, day):
+        """Write a day of monitoring data: heart rate, steps, intensity, and calories monitoring messages and stress messages."""
+        start = datetime.datetime.combine(day, datetime.time.min)
+        start_utc = self.__local_to_utc(start)
+        fit_file = FitFileWriter()
+        self.__write_file_id(fit_file, self.file_type_monitoring_b, start_utc)
+        # monitoring_info: timestamp, local_timestamp, activity_type, cycles_to_distance, cycles_to_calories, resting_metabolic_rate
+        fit_file.define(1, 103, [(253, 'uint32', 1), (0, 'uint32', 1), (1, 'enum', 2), (3, 'uint16', 2), (4, 'uint16', 2), (5, 'uint16', 1)])
+        fit_file.write(1, FitFileWriter.timestamp(start_utc), FitFileWriter.timestamp(start), [self.activity_type_walking, self.activity_type_running],
+                       [7800, 9500], [4200, 5100], 1650)
+        # monitoring: timestamp, activity_type, current_activity_type_intensity, heart_rate, cycles, active_calories
+        fit_file.define(2, 55, [(253, 'uint32', 1), (5, 'enum', 1), (24, 'uint8', 1), (27, 'uint8', 1), (3, 'uint32', 1), (19, 'uint16', 1)])
+        # stress_level: stress_level, local_timestamp
+        fit_file.define(3, 227, [(0, 'sint16', 1), (1, 'uint32', 1)])
+        cycles = 0
+        calories = 0
+        messages = 0
+        for second in range(self.monitoring_interval, 86400, self.monitoring_interval):
+            timestamp = start + datetime.timedelta(seconds=second)
+            awake = 7 <= timestamp.hour < 23
+            intensity = self.random.choice([0, 0, 0, 1, 2, 3]) if awake else 0
+            heart_rate = self.random.randint(55, 75) + intensity * self.random.randint(5, 25)
+            if awake:
+                cycles += self.random.randint(0, 40) + intensity * 20
+                calories += self.random.randint(0, 2) + intensity
+            fit_file.write(2, FitFileWriter.timestamp(self.__local_to_utc(timestamp)), self.activity_type_walking, (intensity << 5) | self.activity_type_walking,
+                           heart_rate, cycles, calories)
+            messages += 1
+            if second % self.stress_interval == 0:
+                fit_file.write(3, self.random.randint(10, 60) if awake else self.random.randint(0, 25), FitFileWriter.timestamp(timestamp))
+                messages += 1
+        fit_file.save(os.path.join(self.dir(self.monitoring_dir), f'{day.strftime("%Y%m%d")}_MONITORING.fit'))
+        self.__count('monitoring_files')
+        self.__count('monitoring_messages', messages)
+
+    def write_activity(self, day):
+        """Write an activity FIT file for a run on the day with records, laps, and a session."""
+        start = datetime.datetime.combine(day, datetime.time(hour=self.random.randint(6, 18), minute=self.random.randint(0, 59)))
+        start_utc = self.__local_to_utc(start)
+        duration = self.random.randint(20, 90) * 60
+        activity_id = 1000000000 + (day - self.start_day).days
+        fit_file = FitFileWriter()
+        self.__write_file_id(fit_file, self.file_type_activity, start_utc)
+        # record: timestamp, position_lat, position_long, heart_rate, cadence, distance, speed
+        fit_file.define(1, 20, [(253, 'uint32', 1), (0, 'sint32', 1), (1, 'sint32', 1), (3, 'uint8', 1), (4, 'uint8', 1), (5, 'uint32', 1), (6, 'uint16', 1)])
+        # lap and session: timestamp, start_time, total_elapsed_time, total_timer_time, total_distance, total_calories, avg and max heart rate
+        lap_fields = [(253, 'uint32', 1), (2, 'uint32', 1), (7, 'uint32', 1), (8, 'uint32', 1), (9, 'uint32', 1), (11, 'uint16', 1), (15, 'uint8', 1), (16, 'uint8', 1)]
+        fit_file.define(2, 19, lap_fields)
+        # session: the lap fields plus sport, sub_sport, avg and max speed, and the number of laps
+        fit_file.define(3, 18, [(253, 'uint32', 1), (2, 'uint32', 1), (7, 'uint32', 1), (8, 'uint32', 1), (9, 'uint32', 1), (11, 'uint16', 1), (16, 'uint8', 1),
+                                (17, 'uint8', 1), (5, 'enum', 1), (6, 'enum', 1), (14, 'uint16', 1), (15, 'uint16', 1), (26, 'uint16', 1)])
+        lat = 42.3 + self.random.random() / 10
+        long = -71.1 + self.random.random() / 10
+        distance = 0.0
+        heart_rates = []
+        lap_start = 0
+        lap_distance = 0.0
+        laps = 0
+        records = 0
+        max_speed = 0.0
+        for second in range(0, duration + 1, self.record_interval):
+            speed = 2.5 + self.random.random()
+            max_speed = max(max_speed, speed)
+            heart_rate = self.random.randint(120, 175)
+            heart_rates.append(heart_rate)
+            distance += speed * self.record_interval if second else 0.0
+            lat += self.random.uniform(-0.0001, 0.0001)
+            long += self.random.uniform(-0.0001, 0.0001)
+            timestamp = FitFileWriter.timestamp(start_utc + datetime.timedelta(seconds=second))
+            fit_file.write(1, timestamp, FitFileWriter.semicircles(lat), FitFileWriter.semicircles(long), heart_rate, self.random.randint(80, 90), int(distance * 100),
+                           int(speed * 1000))
+            records += 1
+            if second - lap_start >= 600 or second + self.record_interval > duration:
+                lap_heart_rates = heart_rates[-((second - lap_start) // self.record_interval + 1):]
+                fit_file.write(2, timestamp, FitFileWriter.timestamp(start_utc + datetime.timedelta(seconds=lap_start)), (second - lap_start) * 1000,
+                               (second - lap_start) * 1000, int((distance - lap_distance) * 100), int((distance - lap_distance) / 15),
+                               sum(lap_heart_rates) // len(lap_heart_rates), max(lap_heart_rates))
+                lap_start = second
+                lap_distance = distance
+                laps += 1
+        fit_file.write(3, timestamp, FitFileWriter.timestamp(start_utc), duration * 1000, duration * 1000, int(distance * 100), int(distance / 15),
+                       sum(heart_rates) // len(heart_rates), max(heart_rates), self.sport_running, 0, int(distance * 1000 / duration), int(max_speed * 1000), laps)
+        fit_file.save(os.path.join(self.dir(self.activities_dir), f'{activity_id}_ACTIVITY.fit'))
+        self.__count('activity_files')
+        self.__count('activity_records', records)
+
+    def __save_json(self, dir_name, filename, json_data):
+        with open(os.path.join(self.dir(dir_name), filename), 'w') as file:
+            json.dump(json_data, file)
+
+    @classmethod
+    def __epoch_ms(cls, dt):
+        return int(dt.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+
+    @classmethod
+    def __gmt_str(cls, dt):
+        return dt.strftime('%Y-%m-%dT%H:%M:%S.0')
+
+    def write_sleep(self, day):
+        """Write the Garmin Connect sleep JSON file for the night that ends on the day."""
+        start = datetime.datetime.combine(day, datetime.time.min) - datetime.timedelta(minutes=self.random.randint(30, 90))
+        start_utc = start - self.utc_offset
+        levels = []
+        level_start = start_utc
+        seconds = {0: 0, 1: 0, 2: 0, 3: 0}
+        while level_start < start_utc + datetime.timedelta(hours=7):
+            level = self.random.choice([0, 1, 1, 2, 3])
+            level_end = level_start + datetime.timedelta(minutes=self.random.randint(5, 40))
+            seconds[level] += int((level_end - level_start).total_seconds())
+            levels.append({'startGMT': self.__gmt_str(level_start), 'endGMT': self.__gmt_str(level_end), 'activityLevel': level})
+            level_start = level_end
+        json_data = {
+            'dailySleepDTO': {
+                'calendarDate'              : day.isoformat(),
+                'sleepTimeSeconds'          : seconds[0] + seconds[1] + seconds[2],
+                'sleepStartTimestampGMT'    : self.__epoch_ms(start_utc),
+                'sleepEndTimestampGMT'      : self.__epoch_ms(level_start),
+                'sleepStartTimestampLocal'  : self.__epoch_ms(start),
+                'sleepEndTimestampLocal'    : self.__epoch_ms(level_start + self.utc_offset),
+                'deepSleepSeconds'          : seconds[0],
+                'lightSleepSeconds'         : seconds[1],
+                'remSleepSeconds'           : seconds[2],
+                'awakeSleepSeconds'         : seconds[3],
+                'averageRespirationValue'   : 14.0,
+                'avgSleepStress'            : 12.0,
+                'sleepScores'               : {'overall': {'value': self.random.randint(50, 95), 'qualifierKey': 'GOOD'}}
+            },
+            'remSleepData': True,
+            'sleepLevels': levels
+        }
+        self.__save_json(self.sleep_dir, f'sleep_{day.isoformat()}.json', json_data)
+        self.__count('sleep_files')
+
+    def write_rhr(self, day):
+        """Write the Garmin Connect resting heart rate JSON file for the day."""
+        json_data = {
+            'statisticsStartDate': day.isoformat(),
+            'allMetrics': {'metricsMap': {'WELLNESS_RESTING_HEART_RATE': [{'value': float(self.random.randint(48, 62)), 'calendarDate': day.isoformat()}]}}
+        }
+        self.__save_json(self.rhr_dir, f'rhr_{day.isoformat()}.json', json_data)
+        self.__count('rhr_files')
+
+    def write_summary(self, day):
+        """Write the Garmin Connect daily summary JSON file for the day."""
+        json_data = {
+            'calendarDate'              : day.isoformat(),
+            'minHeartRate'              : self.random.randint(45, 55),
+            'maxHeartRate'              : self.random.randint(120, 180),
+            'restingHeartRate'          : self.random.randint(48, 62),
+            'averageStressLevel'        : self.random.randint(20, 45),
+            'dailyStepGoal'             : 10000,
+            'totalSteps'                : self.random.randint(3000, 20000),
+            'userFloorsAscendedGoal'    : 10,
+            'moderateIntensityMinutes'  : self.random.randint(0, 60),
+            'vigorousIntensityMinutes'  : self.random.randint(0, 30),
+            'intensityMinutesGoal'      : 150,
+            'floorsAscended'            : self.random.randint(0, 20),
+            'floorsDescended'           : self.random.randint(0, 20),
+            'totalDistanceMeters'       : self.random.randint(2000, 15000),
+            'netCalorieGoal'            : 2000,
+            'totalKilocalories'         : self.random.randint(1800, 3200),
+            'bmrKilocalories'           : 1650,
+            'activeKilocalories'        : self.random.randint(150, 1500),
+            'averageSpo2'               : self.random.randint(92, 98),
+            'lowestSpo2'                : self.random.randint(85, 92),
+            'avgWakingRespirationValue' : 15.0,
+            'highestRespirationValue'   : 22.0,
+            'lowestRespirationValue'    : 10.0,
+            'bodyBatteryChargedValue'   : self.random.randint(20, 80),
+            'bodyBatteryHighestValue'   : self.random.randint(60, 100),
+            'bodyBatteryLowestValue'    : self.random.randint(5, 40)
+        }
+        self.__save_json(self.summary_dir, f'daily_summary_{day.isoformat()}.json', json_data)
+        self.__count('summary_files')
+
+    def write_weight(self, day):
+        """Write the Garmin Connect weight JSON file for the day."""
+        json_data = {
+            'startDate': day.isoformat(),
+            'dateWeightList': [{'weight': 75000 + self.random.randint(-1500, 1500), 'bodyFat': 18.5, 'bodyWater': 55.0, 'boneMass': 3200, 'muscleMass': 33000}]
+        }
+        self.__save_json(self.weight_dir, f'weight_{day.isoformat()}.json', json_data)
+        self.__count('weight_files')
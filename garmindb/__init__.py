@@ -37,3 +37,6 @@ from .import_monitoring import GarminMonitoringFitData, GarminSleepFitData, Garm
 from .activities_fit_data import GarminActivitiesFitData
 from .garmin_tcx_data import GarminTcxData
 from .garmin_json_data import GarminJsonSummaryData, GarminJsonDetailsData
+from .import_pipeline import ImportPipeline
+from .columnar_export import ColumnarExporter, ColumnarLoader, ColumnarFormat
+from .metrics import RunMetrics, run_metrics
@@ -13,7 +13,7 @@ from .fit_data import FitData
 class GarminActivitiesFitData(FitData):
     """Class for importing Garmin activity data from FIT files."""
 
-    def __init__(self, input_dir, latest, measurement_system, debug):
+    def __init__(self, input_dir, latest, measurement_system, debug, workers=1, retry_failed=False):
         """
         Return an instance of GarminActivitiesFitData.
 
@@ -24,6 +24,8 @@ class GarminActivitiesFitData(FitData):
         latest (Boolean): check for latest files only
         measurement_system (enum): which measurement system to use when importing the files
         debug (Boolean): enable debug logging
+        workers (int): number of processes to use for parsing files
+        retry_failed (Boolean): only import files that failed to import the last time they were imported
 
         """
-        super().__init__(input_dir, debug, latest, False, [fitfile.FileType.activity], measurement_system)
+        super().__init__(input_dir, debug, latest, False, [fitfile.FileType.activity], measurement_system, workers, retry_failed)
@@ -9,8 +9,8 @@ import sys
 
 import fitfile
 
-from .garmindb import File, ActivitiesDb, Activities, ActivityRecords, ActivityLaps, ActivitySplits, ActivitiesDevices, StepsActivities, \
-    CycleActivities, ClimbingActivities, PaddleActivities
+from .garmindb import File, ActivitiesDb, Activities, ActivityRecords, ActivityStorage, ActivityStreamBuffer, ActivityLaps, ActivitySplits, ActivitiesDevices, StepsActivities, \
+    CycleActivities, ClimbingActivities, PaddleActivities, ExportDirty
 from .fit_file_processor import FitFileProcessor
 
 
@@ -22,76 +22,113 @@ root_logger = logging.getLogger()
 class ActivityFitFileProcessor(FitFileProcessor):
     """Class that takes a parsed activity FIT file object and imports it into a database."""
 
+    streamed_message_types = [fitfile.MessageType.record, fitfile.MessageType.lap]
+
+    def __init__(self, db_params, plugin_manager=None, debug=0):
+        """
+        Return a new ActivityFitFileProcessor instance.
+
+        Paramters:
+        db_params (dict): database access configuration, activity_storage selects whether records are also written to activity_streams
+        plugin_manager (PluginManager): the plugins that handle the files' messages
+        debug (Boolean): if True, debug logging is enabled
+        """
+        super().__init__(db_params, plugin_manager, debug)
+        self.activity_storage = ActivityStorage(getattr(db_params, 'activity_storage', ActivityStorage.records.value))
+
     def write_file(self, fit_file):
         """Given a Fit File object, write all of its messages to the DB."""
-        self.activity_fit_file_plugins = [plugin for plugin in self.plugin_manager.get_file_processors('ActivityFit', fit_file).values()]
+        self.activity_fit_file_plugins = self._load_plugins('ActivityFit', fit_file)
         if len(self.activity_fit_file_plugins):
             root_logger.info("Loaded %d activity plugins %r for file %s", len(self.activity_fit_file_plugins), self.activity_fit_file_plugins, fit_file)
         # Create the db after setting up the plugins so that plugin tables are handled properly
-        self.garmin_act_db = ActivitiesDb(self.db_params, self.debug - 1)
+        self.garmin_act_db = ActivitiesDb.get(self.db_params, self.debug - 1)
+        self.activity_id = File.id_from_path(fit_file.filename)
+        self.activity_stream = ActivityStreamBuffer(self.activity_id) if self.activity_storage is ActivityStorage.streams else None
         with self.garmin_db.managed_session() as self.garmin_db_session, self.garmin_act_db.managed_session() as self.garmin_act_db_session:
             self._write_message_types(fit_file, fit_file.message_types)
+            if self.activity_stream is not None:
+                self.activity_stream.flush(self.garmin_act_db_session)
+            self._mark_dirty_days(fit_file)
+        self._file_committed()
 
-    def _plugin_dispatch(self, handler_name, *args, **kwargs):
-        return super()._plugin_dispatch(self.activity_fit_file_plugins, handler_name, *args, **kwargs)
+    def _mark_dirty_days(self, fit_file):
+        super()._mark_dirty_days(fit_file)
+        if fit_file.time_created_local is not None and fit_file.time_ended_local is not None:
+            ExportDirty.s_mark_period(self.garmin_db_session, [ActivityRecords], fit_file.time_created_local, fit_file.time_ended_local)
 
     def _write_device_info_entry(self, fit_file, message_fields):
         device_serial_number = super()._write_device_info_entry(fit_file, message_fields)
         if device_serial_number:
-            activity_id = File.id_from_path(fit_file.filename)
+            activity_id = self.activity_id
             entry = {'activity_id' : activity_id, 'device_serial_number' : device_serial_number}
             if not ActivitiesDevices.s_exists(self.garmin_act_db_session, entry):
                 root_logger.debug("_write_device_info_entry activity_id %s, device serial number %s doesn't exist", activity_id, device_serial_number)
                 self.garmin_act_db_session.add(ActivitiesDevices(**entry))
 
-    def _write_lap(self, fit_file, message_type, messages):
-        """Write all lap messages to the database."""
-        for lap_num, message in enumerate(messages):
-            self._write_lap_entry(fit_file, message.fields, lap_num)
+    def _flush_chunk(self):
+        super()._flush_chunk()
+        self.garmin_act_db_session.flush()
+
+    def _write_lap(self, fit_file, message_type, messages, first_lap_num=0):
+        """Write all lap messages, or a chunk of them starting with lap first_lap_num, to the database."""
+        plugin_laps = self._plugin_dispatch_batch('write_lap_entries', messages, self.garmin_act_db_session, fit_file, self.activity_id)
+        for index, message in enumerate(messages):
+            self._write_lap_entry(fit_file, message.fields, first_lap_num + index, self._column_values(plugin_laps, index))
 
     def _write_split(self, fit_file, message_type, messages):
         """Write all split messages to the database."""
         for split_num, message in enumerate(messages):
             self._write_split_entry(fit_file, message.fields, split_num)
 
-    def _write_record(self, fit_file, message_type, messages):
-        """Write all record messages to the database."""
-        for record_num, message in enumerate(messages):
-            self._write_record_entry(fit_file, message.fields, record_num)
-
-    def _write_record_entry(self, fit_file, message_fields, record_num):
+    def _write_record(self, fit_file, message_type, messages, first_record_num=0):
+        """Write all record messages, or a chunk of them starting with record first_record_num, to the database."""
         # We don't get record data from multiple sources so we don't need to coellesce data in the DB.
-        # It's fastest to just write the new data out if it doesn't currently exist.
-        activity_id = File.id_from_path(fit_file.filename)
-        plugin_record = self._plugin_dispatch('write_record_entry', self.garmin_act_db_session, fit_file, activity_id, message_fields, record_num)
-        if not ActivityRecords.s_exists(self.garmin_act_db_session, {'activity_id' : activity_id, 'record' : record_num}):
-            record = {
-                'activity_id'                       : activity_id,
-                'record'                            : record_num,
-                'timestamp'                         : fit_file.utc_datetime_to_local(message_fields.timestamp),
-                'position_lat'                      : message_fields.get('position_lat'),
-                'position_long'                     : message_fields.get('position_long'),
-                'distance'                          : message_fields.get('distance'),
-                'cadence'                           : message_fields.get('cadence'),
-                'hr'                                : message_fields.get('heart_rate'),
-                'rr'                                : message_fields.get('respiration_rate'),
-                'power'                             : message_fields.get('power'),
-                'altitude'                          : message_fields.get('altitude'),
-                'speed'                             : message_fields.get('speed'),
-                'temperature'                       : message_fields.get('temperature'),
-            }
-            record.update(plugin_record)
-            root_logger.debug("_write_record_entry activity_id %s, record %s doesn't exist", activity_id, record_num)
-            self.garmin_act_db_session.add(ActivityRecords(**record))
+        # It's fastest to just write out the records that don't currently exist with a single bulk insert.
+        activity_id = self.activity_id
+        records = [self._get_record_entry(fit_file, activity_id, message.fields, record_num) for record_num, message in enumerate(messages, first_record_num)]
+        plugin_records = self._plugin_dispatch_batch('write_record_entries', messages, self.garmin_act_db_session, fit_file, activity_id)
+        for name, values in plugin_records.items():
+            for record, value in zip(records, values):
+                record[name] = value
+        if self.activity_stream is not None:
+            # the records are collected and written as one row of arrays once the whole file has been read
+            self.activity_stream.add(records)
+        inserted = ActivityRecords.s_insert_new(self.garmin_act_db_session, records)
+        root_logger.debug("_write_record activity_id %s, inserted %d of %d records", activity_id, inserted, len(records))
+
+    def _get_record_entry(self, fit_file, activity_id, message_fields, record_num):
+        plugin_record = self._plugin_dispatch('write_record_entry', self.garmin_act_db_session, fit_file, activity_id, message_fields, record_num,
+                                              batch_handler_name='write_record_entries')
+        record = {
+            'activity_id'                       : activity_id,
+            'record'                            : record_num,
+            'timestamp'                         : fit_file.utc_datetime_to_local(message_fields.timestamp),
+            'position_lat'                      : message_fields.get('position_lat'),
+            'position_long'                     : message_fields.get('position_long'),
+            'distance'                          : message_fields.get('distance'),
+            'cadence'                           : message_fields.get('cadence'),
+            'hr'                                : message_fields.get('heart_rate'),
+            'rr'                                : message_fields.get('respiration_rate'),
+            'power'                             : message_fields.get('power'),
+            'altitude'                          : message_fields.get('altitude'),
+            'speed'                             : message_fields.get('speed'),
+            'temperature'                       : message_fields.get('temperature'),
+        }
+        record.update(plugin_record)
+        return record
 
-    def _write_lap_entry(self, fit_file, message_fields, lap_num):
+    def _write_lap_entry(self, fit_file, message_fields, lap_num, plugin_batch_lap=None):
         # we don't get laps data from multiple sources so we don't need to coellesce data in the DB.
         # It's fastest to just write new data out if the it doesn't currently exist.
-        activity_id = File.id_from_path(fit_file.filename)
-        plugin_lap = self._plugin_dispatch('write_lap_entry', self.garmin_act_db_session, fit_file, activity_id, message_fields, lap_num)
+        activity_id = self.activity_id
+        plugin_lap = self._plugin_dispatch('write_lap_entry', self.garmin_act_db_session, fit_file, activity_id, message_fields, lap_num,
+                                           batch_handler_name='write_lap_entries')
+        if plugin_batch_lap:
+            plugin_lap = {**plugin_lap, **plugin_batch_lap}
         if not ActivityLaps.s_exists(self.garmin_act_db_session, {'activity_id' : activity_id, 'lap' : lap_num}):
             lap = {
-                'activity_id'                       : File.id_from_path(fit_file.filename),
+                'activity_id'                       : self.activity_id,
                 'lap'                               : lap_num,
                 'start_time'                        : fit_file.utc_datetime_to_local(message_fields.start_time),
                 'stop_time'                         : fit_file.utc_datetime_to_local(message_fields.timestamp),
@@ -127,12 +164,12 @@ class ActivityFitFileProcessor(FitFileProcessor):
     def _write_split_entry(self, fit_file, message_fields, split_num):
         # we don't get splits data from multiple sources so we don't need to coellesce data in the DB.
         # It's fastest to just write new data out if the it doesn't currently exist.
-        activity_id = File.id_from_path(fit_file.filename)
+        activity_id = self.activity_id
         plugin_split = self._plugin_dispatch('write_split_entry', self.garmin_act_db_session, fit_file, activity_id, message_fields, split_num)
 
         if not ActivitySplits.s_exists(self.garmin_act_db_session, {'activity_id' : activity_id, 'split' : split_num}):
             split = {
-                'activity_id'                       : File.id_from_path(fit_file.filename),
+                'activity_id'                       : self.activity_id,
                 'split'                             : split_num,
                 'start_time'                        : fit_file.utc_datetime_to_local(message_fields.start_time),
                 'stop_time'                         : fit_file.utc_datetime_to_local(message_fields.timestamp),
@@ -320,7 +357,7 @@ class ActivityFitFileProcessor(FitFileProcessor):
         return {'sport' : fitfile.field_enums.name_for_enum(sport), 'sub_sport' : fitfile.field_enums.name_for_enum(sub_sport)}
 
     def _write_session_entry(self, fit_file, message_fields):
-        activity_id = File.id_from_path(fit_file.filename)
+        activity_id = self.activity_id
         sport = message_fields.sport
         sub_sport = message_fields.sub_sport
         activity = {
@@ -411,7 +448,7 @@ class ActivityFitFileProcessor(FitFileProcessor):
     def _write_hr_zones_timer_lap_entry(self, fit_file, message_fields):
         """Write lap hz zones message to the database."""
         root_logger.info("writing lap hr zone data %r for %s", message_fields, fit_file.filename)
-        activity_id = File.id_from_path(fit_file.filename)
+        activity_id = self.activity_id
         lap = {
             'activity_id'   : activity_id,
             'lap'           : message_fields.get('record_num'),
@@ -423,7 +460,7 @@ class ActivityFitFileProcessor(FitFileProcessor):
     def _write_hr_zones_timer_session_entry(self, fit_file, message_fields):
         """Write session hz zones message to the database."""
         root_logger.info("writing session hr zone data %r for %s", message_fields, fit_file.filename)
-        activity_id = File.id_from_path(fit_file.filename)
+        activity_id = self.activity_id
         session = {
             'activity_id'   : activity_id,
         }
@@ -13,7 +13,17 @@ logger = logging.getLogger(__file__)
 
 
 class ActivityFitPluginBase(PluginBase):
-    """Base class for GarminDb activity FIT file plugins that handle data based on ids of applications or developer fields, sport or sub-sport ids, etc."""
+    """
+    Base class for GarminDb activity FIT file plugins that handle data based on ids of applications or developer fields, sport or sub-sport ids, etc.
+
+    Plugins handle messages by defining handlers, which are looked up once per file. Per message handlers, like
+    write_record_entry(session, fit_file, activity_id, message_fields, record_num), are called for every message and return a dict of values
+    to merge into the row written for it. Record and lap messages can be handled in batches instead by defining
+    write_record_entries(session, fit_file, activity_id, records) or write_lap_entries(session, fit_file, activity_id, laps). Batch handlers
+    are called once per file, or once per chunk for files that are streamed, with all of the messages of the type as column arrays, a dict of
+    field name to a list of the field's values, and return a dict of column arrays to merge into the rows. A plugin that defines a batch
+    handler isn't called per message for that type.
+    """
 
     _type = 'ActivityFit'
 
@@ -8,55 +8,133 @@ import sys
 import logging
 import datetime
 import calendar
+import bisect
+import concurrent.futures
 from tqdm import tqdm
 
+from sqlalchemy import select
+
 import fitfile
 
 from garmindb import summarydb
-from .garmindb import GarminDb, Attributes, Weight, Stress, RestingHeartRate, IntensityHR, Sleep, SleepEvents
+from .garmindb import GarminDb, Attributes, Weight, Stress, RestingHeartRate, IntensityHR, Sleep, SleepEvents, SummaryDirty, StressRollup
 from .garmindb import MonitoringDb, Monitoring, MonitoringHeartRate, MonitoringIntensity, MonitoringClimb
+from .garmindb import MonitoringHeartRateRollup, MonitoringRespirationRateRollup, MonitoringPulseOxRollup
 from .garmindb import ActivitiesDb, Activities, StepsActivities
 from .garmindb import GarminSummaryDb, DaysSummary, DailySummary, WeeksSummary, MonthsSummary, YearsSummary
+from .garmindb import UpsertBuffer, MirroredUpsertBuffer
+from .metrics import run_metrics
 
 
 logger = logging.getLogger(__file__)
 logger.addHandler(logging.StreamHandler(stream=sys.stdout))
 
 
+_worker_analyze = None
+
+
+def analyze_year(gc_config, debug, stage, year, days=None):
+    """
+    Compute the derived rows or the summary rows, depending on the stage, of a year in a worker process.
+
+    Return the rows as lists of dicts keyed by the table they belong in. The worker's databases are opened once, with read-only connections.
+    """
+    global _worker_analyze
+    if _worker_analyze is None:
+        _worker_analyze = Analyze(gc_config, debug, read_only=True)
+    if stage == 'derived':
+        return _worker_analyze.derived_rows(year, days)
+    return _worker_analyze.summary_rows(year, days)
+
+
 class Analyze():
     """Object for analyzing health data from Garmin devices."""
 
-    def __init__(self, gc_config, debug):
-        """Return an instance of the Analyze class."""
+    summary_tables = {
+        DaysSummary     : summarydb.DaysSummary,
+        WeeksSummary    : summarydb.WeeksSummary,
+        MonthsSummary   : summarydb.MonthsSummary,
+        YearsSummary    : summarydb.YearsSummary
+    }
+
+    def __init__(self, gc_config, debug, read_only=False):
+        """
+        Return an instance of the Analyze class.
+
+        Parameters:
+        ----------
+        gc_config (GarminConnectConfigManager): the config for accessing the databases
+        debug (int): 0 is no logging, higher is more logging
+        read_only (Boolean): open the databases with read-only connections
+
+        """
         self.gc_config = gc_config
-        self.garmin_db = GarminDb(self.gc_config.get_db_params(), debug)
-        self.garmin_mon_db = MonitoringDb(self.gc_config.get_db_params(), debug)
-        self.garmin_sum_db = GarminSummaryDb(self.gc_config.get_db_params(), debug)
-        self.sum_db = summarydb.SummaryDb(self.gc_config.get_db_params(), debug)
-        self.garmin_act_db = ActivitiesDb(self.gc_config.get_db_params(), debug)
+        self.debug = debug
+        db_params = self.gc_config.get_db_params()
+        if read_only:
+            # read-only connections can't be shared with the rest of the process
+            self.garmin_db, self.garmin_mon_db, self.garmin_sum_db, self.sum_db, self.garmin_act_db = [
+                db_class(db_params, debug) for db_class in [GarminDb, MonitoringDb, GarminSummaryDb, summarydb.SummaryDb, ActivitiesDb]
+            ]
+            for db in [self.garmin_db, self.garmin_mon_db, self.garmin_sum_db, self.sum_db, self.garmin_act_db]:
+                db.set_read_only()
+        else:
+            self.garmin_db = GarminDb.get(db_params, debug)
+            self.garmin_mon_db = MonitoringDb.get(db_params, debug)
+            self.garmin_sum_db = GarminSummaryDb.get(db_params, debug)
+            self.sum_db = summarydb.SummaryDb.get(db_params, debug)
+            self.garmin_act_db = ActivitiesDb.get(db_params, debug)
         self.measurement_system = Attributes.measurements_type(self.garmin_db)
         self.unit_strings = fitfile.units.unit_strings[self.measurement_system]
 
-    def __populate_hr_intensity(self, day_date, garmin_mon_session, garmin_sum_session, overwrite=False):
-        if IntensityHR.s_row_count_for_day(garmin_sum_session, day_date) == 0 or overwrite:
-            monitoring_rows = Monitoring._get_for_day(garmin_mon_session, day_date, not_none_col=Monitoring.intensity)
-            previous_ts = None
-            for monitoring in monitoring_rows:
-                # Heart rate value is for one minute, reported at the end of the minute. Only take HR values where the
-                # measurement period falls within the activity period.
-                if previous_ts is not None and (monitoring.timestamp - previous_ts).total_seconds() > 60:
-                    hr_rows = MonitoringHeartRate.s_get_for_period(garmin_mon_session, previous_ts, previous_ts + datetime.timedelta(seconds=60), not_none_col=monitoring.timestamp)
-                    for hr in hr_rows:
-                        entry = {
-                            'timestamp'     : hr.timestamp,
-                            'intensity'     : monitoring.intensity,
-                            'heart_rate'    : hr.heart_rate
-                        }
-                        IntensityHR.s_insert_or_update(garmin_sum_session, entry, ignore_none=True)
-                previous_ts = monitoring.timestamp
-
-    def __populate_sleep_for_day(self, day_date, garmin_session, overwrite=False):
-        """Ensure a Sleep row exists for the given day by summarizing SleepEvents if needed."""
+    def __populate_hr_intensity_for_days(self, day_dates, garmin_mon_session, intensity_hr_rows):
+        start_ts = datetime.datetime.combine(day_dates[0], datetime.time.min)
+        end_ts = datetime.datetime.combine(day_dates[-1], datetime.time.min) + datetime.timedelta(days=1)
+        monitoring_query = (
+            select(Monitoring.timestamp, Monitoring.intensity).where(Monitoring.timestamp >= start_ts, Monitoring.timestamp < end_ts, Monitoring.intensity.isnot(None))
+            .order_by(Monitoring.timestamp)
+        )
+        # the HR window of the last intensity minute of a day can extend into the next day
+        hr_query = (
+            select(MonitoringHeartRate.timestamp, MonitoringHeartRate.heart_rate)
+            .where(MonitoringHeartRate.timestamp >= start_ts, MonitoringHeartRate.timestamp < end_ts + datetime.timedelta(seconds=60))
+            .order_by(MonitoringHeartRate.timestamp)
+        )
+        hr_rows = garmin_mon_session.execute(hr_query).all()
+        hr_timestamps = [hr_row[0] for hr_row in hr_rows]
+        previous_ts = None
+        previous_day = None
+        for timestamp, intensity in garmin_mon_session.execute(monitoring_query):
+            # intensity periods don't span days
+            if timestamp.date() != previous_day:
+                previous_day = timestamp.date()
+                previous_ts = None
+            # Heart rate value is for one minute, reported at the end of the minute. Only take HR values where the
+            # measurement period falls within the activity period.
+            if previous_ts is not None and previous_day in day_dates and (timestamp - previous_ts).total_seconds() > 60:
+                first = bisect.bisect_left(hr_timestamps, previous_ts)
+                last = bisect.bisect_left(hr_timestamps, previous_ts + datetime.timedelta(seconds=60), first)
+                for hr_timestamp, heart_rate in hr_rows[first:last]:
+                    intensity_hr_rows.add({'timestamp': hr_timestamp, 'intensity': intensity, 'heart_rate': heart_rate})
+            previous_ts = timestamp
+
+    def __get_hr_intensity_rows(self, year, days, garmin_mon_session, garmin_sum_session, overwrite=False):
+        if not overwrite:
+            days_populated = set(IntensityHR.s_get_days(garmin_sum_session, year) or [])
+            days = [day for day in days if day not in days_populated]
+        # load the intensity minutes and HR samples a month at a time and join them in memory
+        days_by_month = {}
+        for day in days:
+            day_date = datetime.date(year, 1, 1) + datetime.timedelta(day - 1)
+            days_by_month.setdefault(day_date.month, []).append(day_date)
+        intensity_hr_rows = UpsertBuffer(IntensityHR)
+        for day_dates in days_by_month.values():
+            self.__populate_hr_intensity_for_days(day_dates, garmin_mon_session, intensity_hr_rows)
+        logger.debug("Found %d intensity HR rows for %d days of %d", len(intensity_hr_rows), len(days), year)
+        return list(intensity_hr_rows.rows.values())
+
+    def __get_sleep_for_day(self, day_date, garmin_session, overwrite=False):
+        """Return a Sleep row for the given day summarized from SleepEvents if one doesn't exist."""
         existing = Sleep.s_row_count_for_day(garmin_session, day_date)
 
         if existing == 0 or overwrite:
@@ -65,165 +143,291 @@ class Analyze():
             first_event = SleepEvents.s_get_col_min(garmin_session, SleepEvents.timestamp, day_start_ts, day_stop_ts)
             if first_event is None:
 
-                return
+                return None
             last_event = SleepEvents.s_get_col_max(garmin_session, SleepEvents.timestamp, day_start_ts, day_stop_ts)
             stats = SleepEvents.get_day_stats(garmin_session, day_date)
-            entry = {
+            return {
                 'day': day_date,
                 'start': first_event,
                 'end': last_event,
                 **stats,
             }
+        return None
 
-            Sleep.s_insert_or_update(garmin_session, entry, ignore_none=True)
+    def __get_daily_stats(self, year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session):
+        # Each source table is queried once for the whole year, grouped by day. Days, weeks, months, and the year are all rolled up from these.
+        start_day_date = datetime.date(year, 1, 1)
+        end_day_date = datetime.date(year + 1, 1, 1)
+        return {
+            DailySummary        : DailySummary.s_get_grouped_stats(garmin_session, start_day_date, end_day_date),
+            RestingHeartRate    : RestingHeartRate.s_get_grouped_stats(garmin_session, start_day_date, end_day_date),
+            Stress              : Stress.s_get_grouped_stats(garmin_session, start_day_date, end_day_date),
+            Weight              : Weight.s_get_grouped_stats(garmin_session, start_day_date, end_day_date),
+            Sleep               : Sleep.s_get_grouped_stats(garmin_session, start_day_date, end_day_date),
+            MonitoringIntensity : MonitoringIntensity.s_get_grouped_stats(garmin_mon_session, start_day_date, end_day_date),
+            MonitoringClimb     : MonitoringClimb.s_get_grouped_stats(garmin_mon_session, start_day_date, end_day_date, self.measurement_system),
+            Monitoring          : Monitoring.s_get_grouped_stats(garmin_mon_session, start_day_date, end_day_date),
+            MonitoringHeartRate : MonitoringHeartRate.s_get_grouped_stats(garmin_mon_session, start_day_date, end_day_date),
+            IntensityHR         : IntensityHR.s_get_grouped_stats(garmin_sum_session, start_day_date, end_day_date),
+            Activities          : Activities.s_get_grouped_stats(garmin_act_session, start_day_date, end_day_date),
+        }
 
-    def __calculate_day_stats(self, day_date, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session):
-        stats = DailySummary.get_daily_stats(garmin_session, day_date)
+    def __calculate_day_stats(self, day_date, daily_stats):
+        stats = daily_stats[DailySummary].get_daily_stats(day_date)
         # prefer getting stats from the daily summary.
         if stats.get('rhr_avg') is None:
-            stats.update(RestingHeartRate.get_daily_stats(garmin_session, day_date))
+            stats.update(daily_stats[RestingHeartRate].get_daily_stats(day_date))
         if stats.get('stress_avg') is None:
-            stats.update(Stress.get_daily_stats(garmin_session, day_date))
+            stats.update(daily_stats[Stress].get_daily_stats(day_date))
         if stats.get('intensity_time') is None:
-            stats.update(MonitoringIntensity.get_daily_stats(garmin_mon_session, day_date))
+            stats.update(daily_stats[MonitoringIntensity].get_daily_stats(day_date))
         if stats.get('floors') is None:
-            stats.update(MonitoringClimb.get_daily_stats(garmin_mon_session, day_date, self.measurement_system))
+            stats.update(daily_stats[MonitoringClimb].get_daily_stats(day_date))
         if stats.get('steps') is None:
-            stats.update(Monitoring.get_daily_stats(garmin_mon_session, day_date))
-        stats.update(MonitoringHeartRate.get_daily_stats(garmin_mon_session, day_date))
-        stats.update(IntensityHR.get_daily_stats(garmin_sum_session, day_date))
-        stats.update(Weight.get_daily_stats(garmin_session, day_date))
-        stats.update(Sleep.get_daily_stats(garmin_session, day_date))
-        # save it to the db
-        DaysSummary.s_insert_or_update(garmin_sum_session, stats)
-        summarydb.DaysSummary.s_insert_or_update(sum_session, stats)
-
-    def __calculate_days(self, year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session):
+            stats.update(daily_stats[Monitoring].get_daily_stats(day_date))
+        stats.update(daily_stats[MonitoringHeartRate].get_daily_stats(day_date))
+        stats.update(daily_stats[IntensityHR].get_daily_stats(day_date))
+        stats.update(daily_stats[Weight].get_daily_stats(day_date))
+        stats.update(daily_stats[Sleep].get_daily_stats(day_date))
+        return stats
+
+    def __get_days(self, year, garmin_session, garmin_mon_session, days=None):
         days_mon = Monitoring.s_get_days(garmin_mon_session, year) or []
         days_sleep = SleepEvents.s_get_days(garmin_session, year) or []
         days_all = sorted(set(days_mon) | set(days_sleep))
+        if days is not None:
+            days_all = [day for day in days_all if day in days]
+        return days_all
 
+    def __get_derived_rows(self, year, days_all, garmin_session, garmin_mon_session, garmin_sum_session, days=None):
+        # When only recalculating some days, the day's data may have changed since derived data was last calculated.
+        overwrite = days is not None
+        derived_rows = {IntensityHR: [], Sleep: []}
         if days_all:
+            derived_rows[IntensityHR] = self.__get_hr_intensity_rows(year, days_all, garmin_mon_session, garmin_sum_session, overwrite)
             for day in tqdm(days_all, unit='days'):
                 day_date = datetime.date(year, 1, 1) + datetime.timedelta(day - 1)
-                self.__populate_hr_intensity(day_date, garmin_mon_session, garmin_sum_session)
                 # Ensure a summarized Sleep row exists when only SleepEvents are present
-                self.__populate_sleep_for_day(day_date, garmin_session)
-                self.__calculate_day_stats(day_date, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session)
-        days = Activities.s_get_days(garmin_act_session, year)
-        if len(days):
-            for day in tqdm(days, unit='days'):
-                stats = Activities.get_daily_stats(garmin_act_session, datetime.date(year, 1, 1) + datetime.timedelta(day - 1))
-                DaysSummary.s_insert_or_update(garmin_sum_session, stats)
-                summarydb.DaysSummary.s_insert_or_update(sum_session, stats)
-
-    def __calculate_week_stats(self, day_date, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session):
-        stats = DailySummary.get_weekly_stats(garmin_session, day_date)
+                sleep_row = self.__get_sleep_for_day(day_date, garmin_session)
+                if sleep_row is not None:
+                    derived_rows[Sleep].append(sleep_row)
+        return derived_rows
+
+    def __write_derived_rows(self, derived_rows, garmin_session, garmin_sum_session):
+        for table, session in [(IntensityHR, garmin_sum_session), (Sleep, garmin_session)]:
+            rows = UpsertBuffer(table)
+            for row in derived_rows[table]:
+                rows.add(row)
+            rows.flush(session)
+
+    def __get_days_rows(self, year, days_all, daily_stats, days=None):
+        days_stats = [self.__calculate_day_stats(datetime.date(year, 1, 1) + datetime.timedelta(day - 1), daily_stats) for day in days_all]
+        days_act = daily_stats[Activities].days()
+        if days is not None:
+            days_act = [day_date for day_date in days_act if day_date.timetuple().tm_yday in days]
+        return days_stats + [daily_stats[Activities].get_daily_stats(day_date) for day_date in days_act]
+
+    def __calculate_week_stats(self, day_date, daily_stats):
+        stats = daily_stats[DailySummary].get_weekly_stats(day_date)
         # prefer getting stats from the daily summary.
         if stats.get('rhr_avg') is None:
-            stats.update(RestingHeartRate.get_weekly_stats(garmin_session, day_date))
+            stats.update(daily_stats[RestingHeartRate].get_weekly_stats(day_date))
         if stats.get('stress_avg') is None:
-            stats.update(Stress.get_weekly_stats(garmin_session, day_date))
+            stats.update(daily_stats[Stress].get_weekly_stats(day_date))
         if stats.get('intensity_time') is None:
-            stats.update(MonitoringIntensity.get_weekly_stats(garmin_mon_session, day_date))
+            stats.update(daily_stats[MonitoringIntensity].get_weekly_stats(day_date))
         if stats.get('floors') is None:
-            stats.update(MonitoringClimb.get_weekly_stats(garmin_mon_session, day_date, self.measurement_system))
+            stats.update(daily_stats[MonitoringClimb].get_weekly_stats(day_date))
         if stats.get('steps') is None:
-            stats.update(Monitoring.get_weekly_stats(garmin_mon_session, day_date))
-        stats.update(MonitoringHeartRate.get_weekly_stats(garmin_mon_session, day_date))
-        stats.update(IntensityHR.get_weekly_stats(garmin_sum_session, day_date))
-        stats.update(Weight.get_weekly_stats(garmin_session, day_date))
-        stats.update(Sleep.get_weekly_stats(garmin_session, day_date))
-        stats.update(Activities.get_weekly_stats(garmin_act_session, day_date))
-        # save it to the db
-        WeeksSummary.s_insert_or_update(garmin_sum_session, stats)
-        summarydb.WeeksSummary.s_insert_or_update(sum_session, stats)
-
-    def __calculate_weeks(self, year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session):
-        for week_starting_day in tqdm(range(1, 365, 7), unit='weeks'):
+            stats.update(daily_stats[Monitoring].get_weekly_stats(day_date))
+        stats.update(daily_stats[MonitoringHeartRate].get_weekly_stats(day_date))
+        stats.update(daily_stats[IntensityHR].get_weekly_stats(day_date))
+        stats.update(daily_stats[Weight].get_weekly_stats(day_date))
+        stats.update(daily_stats[Sleep].get_weekly_stats(day_date))
+        stats.update(daily_stats[Activities].get_weekly_stats(day_date))
+        return stats
+
+    def __get_weeks_rows(self, year, daily_stats, days=None):
+        week_starting_days = range(1, 365, 7)
+        if days is not None:
+            week_starting_days = sorted({day - ((day - 1) % 7) for day in days} & set(week_starting_days))
+        weeks_stats = []
+        for week_starting_day in tqdm(week_starting_days, unit='weeks'):
             day_date = datetime.date(year, 1, 1) + datetime.timedelta(week_starting_day - 1)
             if day_date < datetime.datetime.now().date():
-                self.__calculate_week_stats(day_date, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session)
+                weeks_stats.append(self.__calculate_week_stats(day_date, daily_stats))
+        return weeks_stats
 
-    def __calculate_monitoring_month_stats(self, start_day_date, end_day_date, garmin_session, garmin_mon_session, garmin_sum_session, sum_session):
-        stats = DailySummary.get_monthly_stats(garmin_session, start_day_date, end_day_date)
+    def __calculate_monitoring_month_stats(self, start_day_date, end_day_date, daily_stats):
+        stats = daily_stats[DailySummary].get_monthly_stats(start_day_date, end_day_date)
         # prefer getting stats from the daily summary.
         if 'rhr_avg' in stats:
-            stats.update(RestingHeartRate.get_monthly_stats(garmin_session, start_day_date, end_day_date))
+            stats.update(daily_stats[RestingHeartRate].get_monthly_stats(start_day_date, end_day_date))
         if 'stress_avg' in stats:
-            stats.update(Stress.get_monthly_stats(garmin_session, start_day_date, end_day_date))
+            stats.update(daily_stats[Stress].get_monthly_stats(start_day_date, end_day_date))
         if 'intensity_time' in stats:
-            stats.update(MonitoringIntensity.get_monthly_stats(garmin_mon_session, start_day_date, end_day_date))
+            stats.update(daily_stats[MonitoringIntensity].get_monthly_stats(start_day_date, end_day_date))
         if 'floors' in stats:
-            stats.update(MonitoringClimb.get_monthly_stats(garmin_mon_session, start_day_date, end_day_date, self.measurement_system))
+            stats.update(daily_stats[MonitoringClimb].get_monthly_stats(start_day_date, end_day_date))
         if 'steps' in stats:
-            stats.update(Monitoring.get_monthly_stats(garmin_mon_session, start_day_date, end_day_date))
-        stats.update(MonitoringHeartRate.get_monthly_stats(garmin_mon_session, start_day_date, end_day_date))
-        stats.update(IntensityHR.get_monthly_stats(garmin_sum_session, start_day_date, end_day_date))
-        stats.update(Weight.get_monthly_stats(garmin_session, start_day_date, end_day_date))
-        stats.update(Sleep.get_monthly_stats(garmin_session, start_day_date, end_day_date))
-        # save it to the db
-        MonthsSummary.s_insert_or_update(garmin_sum_session, stats)
-        summarydb.MonthsSummary.s_insert_or_update(sum_session, stats)
-
-    def __calculate_months(self, year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session):
-        months = Monitoring.s_get_months(garmin_mon_session, year)
+            stats.update(daily_stats[Monitoring].get_monthly_stats(start_day_date, end_day_date))
+        stats.update(daily_stats[MonitoringHeartRate].get_monthly_stats(start_day_date, end_day_date))
+        stats.update(daily_stats[IntensityHR].get_monthly_stats(start_day_date, end_day_date))
+        stats.update(daily_stats[Weight].get_monthly_stats(start_day_date, end_day_date))
+        stats.update(daily_stats[Sleep].get_monthly_stats(start_day_date, end_day_date))
+        return stats
+
+    def __get_months_rows(self, year, daily_stats, days=None):
+        if days is not None:
+            days_months = {(datetime.date(year, 1, 1) + datetime.timedelta(day - 1)).month for day in days}
+        months_stats = []
+        months = sorted({day_date.month for day_date in daily_stats[Monitoring].days()})
+        if days is not None:
+            months = [month for month in months if month in days_months]
         if len(months):
             for month in tqdm(months, unit='months'):
                 start_day_date = datetime.date(year, month, 1)
                 end_day_date = datetime.date(year, month, calendar.monthrange(year, month)[1])
-                self.__calculate_monitoring_month_stats(start_day_date, end_day_date, garmin_session, garmin_mon_session, garmin_sum_session, sum_session)
-        months = Activities.s_get_months(garmin_act_session, year)
+                months_stats.append(self.__calculate_monitoring_month_stats(start_day_date, end_day_date, daily_stats))
+        months = sorted({day_date.month for day_date in daily_stats[Activities].days()})
+        if days is not None:
+            months = [month for month in months if month in days_months]
         if len(months):
             for month in tqdm(months, unit='months'):
-                stats = Activities.get_monthly_stats(garmin_act_session, datetime.date(year, month, 1), datetime.date(year, month, calendar.monthrange(year, month)[1]))
-                MonthsSummary.s_insert_or_update(garmin_sum_session, stats)
-                summarydb.MonthsSummary.s_insert_or_update(sum_session, stats)
+                months_stats.append(daily_stats[Activities].get_monthly_stats(datetime.date(year, month, 1), datetime.date(year, month, calendar.monthrange(year, month)[1])))
+        return months_stats
 
-    def __calculate_year_stats(self, year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session):
-        stats = DailySummary.get_yearly_stats(garmin_session, year)
+    def __calculate_year_stats(self, year, daily_stats):
+        stats = daily_stats[DailySummary].get_yearly_stats(year)
         # prefer getting stats from the daily summary.
         if 'rhr_avg' in stats:
-            stats.update(RestingHeartRate.get_yearly_stats(garmin_session, year))
+            stats.update(daily_stats[RestingHeartRate].get_yearly_stats(year))
         if 'stress_avg' in stats:
-            stats.update(Stress.get_yearly_stats(garmin_session, year))
+            stats.update(daily_stats[Stress].get_yearly_stats(year))
         if 'intensity_time' in stats:
-            stats.update(MonitoringIntensity.get_yearly_stats(garmin_mon_session, year))
+            stats.update(daily_stats[MonitoringIntensity].get_yearly_stats(year))
         if 'floors' in stats:
-            stats.update(MonitoringClimb.get_yearly_stats(garmin_mon_session, year, self.measurement_system))
+            stats.update(daily_stats[MonitoringClimb].get_yearly_stats(year))
         if 'steps' in stats:
-            stats.update(Monitoring.get_yearly_stats(garmin_mon_session, year))
-        stats.update(MonitoringHeartRate.get_yearly_stats(garmin_mon_session, year))
-        stats.update(IntensityHR.get_yearly_stats(garmin_sum_session, year))
-        stats.update(Weight.get_yearly_stats(garmin_session, year))
-        stats.update(Sleep.get_yearly_stats(garmin_session, year))
-        stats.update(Activities.get_yearly_stats(garmin_act_session, year))
-        # save it to the db
-        YearsSummary.s_insert_or_update(garmin_sum_session, stats)
-        summarydb.YearsSummary.s_insert_or_update(sum_session, stats)
-
-    def __calculate_year(self, year):
+            stats.update(daily_stats[Monitoring].get_yearly_stats(year))
+        stats.update(daily_stats[MonitoringHeartRate].get_yearly_stats(year))
+        stats.update(daily_stats[IntensityHR].get_yearly_stats(year))
+        stats.update(daily_stats[Weight].get_yearly_stats(year))
+        stats.update(daily_stats[Sleep].get_yearly_stats(year))
+        stats.update(daily_stats[Activities].get_yearly_stats(year))
+        return stats
+
+    def __get_summary_rows(self, year, days_all, daily_stats, days=None):
+        # calculate part of the years, then the year itself
+        return {
+            DaysSummary     : self.__get_days_rows(year, days_all, daily_stats, days),
+            WeeksSummary    : self.__get_weeks_rows(year, daily_stats, days),
+            MonthsSummary   : self.__get_months_rows(year, daily_stats, days),
+            YearsSummary    : [self.__calculate_year_stats(year, daily_stats)]
+        }
+
+    def __write_summary_rows(self, years_summary_rows, garmin_sum_session, sum_session):
+        # The summary tables are the same in both databases. Each table's rows for all of the years are merged once and written to both
+        # with the same batched statements.
+        for table, summary_table in self.summary_tables.items():
+            summaries = MirroredUpsertBuffer(table, [summary_table])
+            for summary_rows in years_summary_rows:
+                for stats in summary_rows[table]:
+                    summaries.add(stats)
+            summaries.flush(garmin_sum_session, sum_session)
+
+    def derived_rows(self, year, days=None):
+        """Return the derived data rows for a year, or the given days of the year, as lists of dicts keyed by the table they belong in."""
         with self.garmin_db.managed_session() as garmin_session, self.garmin_mon_db.managed_session() as garmin_mon_session, \
+                self.garmin_sum_db.managed_session() as garmin_sum_session:
+            days_all = self.__get_days(year, garmin_session, garmin_mon_session, days)
+            return self.__get_derived_rows(year, days_all, garmin_session, garmin_mon_session, garmin_sum_session, days)
+
+    def summary_rows(self, year, days=None):
+        """Return the summary rows for a year, or the weeks and months that contain the given days of the year, as lists of dicts keyed by table."""
+        with self.garmin_db.managed_session() as garmin_session, self.garmin_mon_db.managed_session() as garmin_mon_session, \
+                self.garmin_act_db.managed_session() as garmin_act_session, self.garmin_sum_db.managed_session() as garmin_sum_session:
+            days_all = self.__get_days(year, garmin_session, garmin_mon_session, days)
+            daily_stats = self.__get_daily_stats(year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session)
+            return self.__get_summary_rows(year, days_all, daily_stats, days)
+
+    def __calculate_year(self, year, days=None):
+        with run_metrics.stage(str(year)), self.garmin_db.managed_session() as garmin_session, self.garmin_mon_db.managed_session() as garmin_mon_session, \
                 self.garmin_act_db.managed_session() as garmin_act_session, self.garmin_sum_db.managed_session() as garmin_sum_session, \
                 self.sum_db.managed_session() as sum_session:
-            # calculate part of the years
-            self.__calculate_days(year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session)
-            self.__calculate_weeks(year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session)
-            self.__calculate_months(year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session)
-            # now calculate the year itself
-            self.__calculate_year_stats(year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session, sum_session)
+            # derived data has to be in place before the stats are queried
+            with run_metrics.stage('derived'):
+                days_all = self.__get_days(year, garmin_session, garmin_mon_session, days)
+                derived_rows = self.__get_derived_rows(year, days_all, garmin_session, garmin_mon_session, garmin_sum_session, days)
+                self.__write_derived_rows(derived_rows, garmin_session, garmin_sum_session)
+            with run_metrics.stage('daily_stats'):
+                daily_stats = self.__get_daily_stats(year, garmin_session, garmin_mon_session, garmin_act_session, garmin_sum_session)
+            with run_metrics.stage('summaries'):
+                self.__write_summary_rows([self.__get_summary_rows(year, days_all, daily_stats, days)], garmin_sum_session, sum_session)
+
+    def __compute_years(self, executor, stage, years_days):
+        futures = [executor.submit(analyze_year, self.gc_config, self.debug, stage, year, days) for year, days in years_days.items()]
+        return [future.result() for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures), unit='years')]
+
+    def __calculate_years_parallel(self, years_days, workers):
+        # The years are computed in worker processes with read-only connections. The stats are queried from the derived data, so all of the
+        # derived data is computed and committed first, then the summaries. Nothing is written while the workers are reading, and each pass
+        # is written in one transaction per database.
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            with run_metrics.stage('derived'):
+                years_derived_rows = self.__compute_years(executor, 'derived', years_days)
+                with self.garmin_db.managed_session() as garmin_session, self.garmin_sum_db.managed_session() as garmin_sum_session:
+                    for derived_rows in years_derived_rows:
+                        self.__write_derived_rows(derived_rows, garmin_session, garmin_sum_session)
+            with run_metrics.stage('summaries'):
+                years_summary_rows = self.__compute_years(executor, 'summaries', years_days)
+                with self.garmin_sum_db.managed_session() as garmin_sum_session, self.sum_db.managed_session() as sum_session:
+                    self.__write_summary_rows(years_summary_rows, garmin_sum_session, sum_session)
+
+    def __calculate_years(self, years_days, workers=1):
+        if workers > 1 and len(years_days) > 1:
+            self.__calculate_years_parallel(years_days, workers)
+        else:
+            for year, days in sorted(years_days.items()):
+                self.__calculate_year(year, days)
+
+    def __backfill_rollups(self):
+        # the rollups are updated as data is imported, only compute the days that are missing, i.e. data imported before the rollups existed
+        rollup_dbs = [(MonitoringHeartRateRollup, self.garmin_mon_db), (MonitoringRespirationRateRollup, self.garmin_mon_db),
+                      (MonitoringPulseOxRollup, self.garmin_mon_db), (StressRollup, self.garmin_db)]
+        for rollup_table, db in rollup_dbs:
+            with run_metrics.stage(rollup_table.__tablename__):
+                days = rollup_table.backfill(db)
+            if days:
+                logger.info("Backfilled %s for %d days", rollup_table.__tablename__, days)
 
-    def summary(self):
-        """Summarize Garmin health data. Daily, weekly, and monthly, tables will be generated."""
+    def summary(self, incremental=False, workers=1):
+        """
+        Summarize Garmin health data. Daily, weekly, and monthly, tables will be generated.
 
-        years_mon = Monitoring.get_years(self.garmin_mon_db)
-        years_act = Activities.get_years(self.garmin_act_db)
-        years_sleep = SleepEvents.get_years(self.garmin_db)
-        years_all = sorted(list(set(years_mon + years_act + years_sleep)))
+        Parameters:
+        ----------
+        incremental (Boolean): only recalculate the days that have had data imported since the last summary and the weeks, months, and years
+            that contain them
+        workers (int): the number of processes to compute years in, with more than one the years are computed concurrently
 
-        for year in years_all:
+        """
+        dirty_days = SummaryDirty.get_days(self.garmin_db)
+        if incremental:
+            years_days = {}
+            for dirty_day in dirty_days:
+                years_days.setdefault(dirty_day.year, set()).add(dirty_day.timetuple().tm_yday)
+            logger.info("Incrementally summarizing %d days in years %s", len(dirty_days), sorted(years_days.keys()))
+            self.__calculate_years(years_days, workers)
+        else:
+            years_mon = Monitoring.get_years(self.garmin_mon_db)
+            years_act = Activities.get_years(self.garmin_act_db)
+            years_sleep = SleepEvents.get_years(self.garmin_db)
+            years_all = sorted(list(set(years_mon + years_act + years_sleep)))
 
-            self.__calculate_year(year)
+            self.__calculate_years({year: None for year in years_all}, workers)
+            self.__backfill_rollups()
+        SummaryDirty.clear_days(self.garmin_db, dirty_days)
 
     def create_dynamic_views(self):
         """Create database views specific to the data in this database."""
@@ -30,7 +30,7 @@ class Checkup():
         self.paragraph_func = paragraph_func
         self.heading_func = heading_func
         self.debug = debug
-        self.garmin_db = GarminDb(self.db_params)
+        self.garmin_db = GarminDb.get(self.db_params)
         self.measurement_system = Attributes.measurements_type(self.garmin_db)
         self.unit_strings = fitfile.units.unit_strings[self.measurement_system]
 
@@ -96,7 +96,7 @@ class Checkup():
 
     def activity_course(self, course_id):
         """Run a checkup on all activities matching the course_id."""
-        activity_db = ActivitiesDb(self.db_params, self.debug)
+        activity_db = ActivitiesDb.get(self.db_params, self.debug)
         activities = Activities.get_by_course_id(activity_db, course_id)
         activities_count = len(activities)
         fastest_activity = Activities.get_fastest_by_course_id(activity_db, course_id)
@@ -0,0 +1,266 @@
+"""Objects for exporting the large time series tables to partitioned Parquet or Arrow files and loading them back as Arrow tables or DataFrames."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import sys
+import logging
+import datetime
+import enum
+import json
+import shutil
+
+from sqlalchemy import func, select, Integer, Float, DateTime, Date, Time, Boolean
+
+from .garmindb import GarminDb, ExportDirty, MonitoringHeartRate, Monitoring, ActivityRecords
+
+
+logger = logging.getLogger(__file__)
+logger.addHandler(logging.StreamHandler(stream=sys.stdout))
+root_logger = logging.getLogger()
+
+
+def import_pyarrow():
+    """Return the pyarrow module, which is only needed for the columnar export, raising an ImportError that explains what to install if it's missing."""
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.feather
+        import pyarrow.parquet
+        return pyarrow
+    except ImportError as e:
+        raise ImportError(f"The columnar export requires pyarrow, install it with 'pip install pyarrow': {e}") from e
+
+
+class ColumnarFormat(enum.Enum):
+    """The file formats that the tables can be exported to."""
+
+    parquet     = 'parquet'
+    arrow       = 'arrow'
+
+    def file_name(self):
+        """Return the name of the data file in each partition directory."""
+        return f'data.{self.value}'
+
+    def dataset_format(self):
+        """Return the pyarrow.dataset name for the format."""
+        return 'parquet' if self is ColumnarFormat.parquet else 'ipc'
+
+
+class ColumnarExporter():
+    """
+    Export the monitoring and activity record tables to Parquet or Arrow IPC files partitioned by year and month.
+
+    Each table is written to <export_dir>/<table>/year=<year>/month=<month>/data.<format>. Exports are incremental: the importers mark the
+    days they write in the export_dirty table and only the months that contain those days are written again. The first export of a table
+    writes all of its months.
+    """
+
+    tables = {
+        'monitoring_hr'     : MonitoringHeartRate,
+        'monitoring'        : Monitoring,
+        'activity_records'  : ActivityRecords
+    }
+    state_file_name = '_export_state.json'
+    state_version = 2
+
+    def __init__(self, db_params, export_dir, file_format=ColumnarFormat.parquet, debug=0):
+        """
+        Return a new ColumnarExporter instance.
+
+        Parameters:
+        ----------
+        db_params (dict): configuration data for accessing the database
+        export_dir (string): directory (full path) to write the exported tables to
+        file_format (ColumnarFormat): the file format to write
+        debug (Boolean): enable debug logging
+
+        """
+        self.pyarrow = import_pyarrow()
+        self.db_params = db_params
+        self.export_dir = export_dir
+        self.file_format = ColumnarFormat(file_format)
+        self.debug = debug
+        self.garmin_db = GarminDb.get(db_params, debug - 1)
+        self.dbs = {}
+
+    def __db(self, table):
+        if table.db not in self.dbs:
+            self.dbs[table.db] = table.db.get(self.db_params, self.debug - 1)
+        return self.dbs[table.db]
+
+    @classmethod
+    def __arrow_type(cls, pa, column):
+        if isinstance(column.type, DateTime):
+            return pa.timestamp('us')
+        if isinstance(column.type, Date):
+            return pa.date32()
+        if isinstance(column.type, Time):
+            return pa.time64('us')
+        if isinstance(column.type, Boolean):
+            return pa.bool_()
+        if isinstance(column.type, Integer):
+            return pa.int64()
+        if isinstance(column.type, Float):
+            return pa.float64()
+        # Strings and enums, enums are exported by name
+        return pa.string()
+
+    @classmethod
+    def schema(cls, table_name):
+        """Return the Arrow schema a table is exported with."""
+        pa = import_pyarrow()
+        return pa.schema([(column.name, cls.__arrow_type(pa, column)) for column in cls.tables[table_name].__table__.columns])
+
+    @classmethod
+    def __month_key(cls, day):
+        # SQLite returns dates from func.date as strings, other databases as date objects
+        return str(day)[:7]
+
+    def __months(self, session, table):
+        day = func.date(table.timestamp)
+        return sorted({self.__month_key(day) for day, in session.query(day).filter(table.timestamp.isnot(None)).distinct()})
+
+    def __partition_dir(self, table_name, month):
+        year, month = month.split('-')
+        return os.path.join(self.export_dir, table_name, f'year={int(year)}', f'month={int(month)}')
+
+    def __load_state(self, table_name):
+        state_file = os.path.join(self.export_dir, table_name, self.state_file_name)
+        if os.path.isfile(state_file):
+            with open(state_file, 'r') as file:
+                state = json.load(file)
+            # exports from before the importers marked the days they write are started over
+            if state.get('format') == self.file_format.value and state.get('version') == self.state_version:
+                return state['months']
+        return {}
+
+    def __save_state(self, table_name, months):
+        table_dir = os.path.join(self.export_dir, table_name)
+        state_file = os.path.join(table_dir, self.state_file_name)
+        temp_file = os.path.join(table_dir, '.' + self.state_file_name)
+        with open(temp_file, 'w') as file:
+            json.dump({'format': self.file_format.value, 'version': self.state_version, 'months': months}, file, indent=4)
+        os.replace(temp_file, state_file)
+
+    @classmethod
+    def __export_value(cls, value):
+        if isinstance(value, enum.Enum):
+            return value.name
+        return value
+
+    def __write_month(self, session, table, table_name, schema, month):
+        pa = self.pyarrow
+        start = datetime.datetime.strptime(month, '%Y-%m')
+        end = (start + datetime.timedelta(days=32)).replace(day=1)
+        columns = list(table.__table__.columns)
+        query = select(*columns).where(table.timestamp >= start, table.timestamp < end).order_by(table.timestamp)
+        values = [[] for _ in columns]
+        for row in session.execute(query):
+            for index, value in enumerate(row):
+                values[index].append(self.__export_value(value))
+        arrow_table = pa.Table.from_arrays([pa.array(column_values, type=field.type) for column_values, field in zip(values, schema)], schema=schema)
+        partition_dir = self.__partition_dir(table_name, month)
+        if arrow_table.num_rows == 0:
+            shutil.rmtree(partition_dir, ignore_errors=True)
+            return 0
+        os.makedirs(partition_dir, exist_ok=True)
+        # write to a hidden file that the loader ignores and then move it into place so readers never see a partial file
+        temp_file = os.path.join(partition_dir, '.' + self.file_format.file_name())
+        if self.file_format is ColumnarFormat.parquet:
+            pa.parquet.write_table(arrow_table, temp_file, compression='zstd')
+        else:
+            pa.feather.write_feather(arrow_table, temp_file, compression='zstd')
+        os.replace(temp_file, os.path.join(partition_dir, self.file_format.file_name()))
+        return arrow_table.num_rows
+
+    def export_table(self, table_name, full=False):
+        """Export the months of a table that have had data imported since the last export, or all months if full is True. Return the number of months written."""
+        table = self.tables[table_name]
+        schema = self.schema(table_name)
+        exported_months = {} if full else self.__load_state(table_name)
+        dirty_days = ExportDirty.get_days(self.garmin_db, table)
+        with self.__db(table).managed_session() as session:
+            if exported_months:
+                months = sorted({self.__month_key(day) for day in dirty_days})
+            else:
+                # start from a clean directory so no files from a previous export in another format or of deleted months are left behind
+                shutil.rmtree(os.path.join(self.export_dir, table_name), ignore_errors=True)
+                months = self.__months(session, table)
+            for month in months:
+                rows = self.__write_month(session, table, table_name, schema, month)
+                logger.debug("Exported %d %s rows for %s", rows, table_name, month)
+                if rows:
+                    exported_months[month] = rows
+                else:
+                    exported_months.pop(month, None)
+        os.makedirs(os.path.join(self.export_dir, table_name), exist_ok=True)
+        self.__save_state(table_name, exported_months)
+        ExportDirty.clear_days(self.garmin_db, table, dirty_days)
+        root_logger.info("Exported %d of %d months of %s to %s", len(months), len(exported_months), table_name, self.export_dir)
+        return len(months)
+
+    def export(self, table_names=None, full=False):
+        """Export the given tables, or all of the exported tables if none are given. Return a dict of the number of months written per table."""
+        return {table_name: self.export_table(table_name, full) for table_name in (table_names or self.tables)}
+
+
+class ColumnarLoader():
+    """Load tables exported by ColumnarExporter as Arrow tables or pandas DataFrames."""
+
+    def __init__(self, export_dir, file_format=ColumnarFormat.parquet):
+        """
+        Return a new ColumnarLoader instance.
+
+        Parameters:
+        ----------
+        export_dir (string): directory (full path) the tables were exported to
+        file_format (ColumnarFormat): the file format the tables were exported in
+
+        """
+        self.pyarrow = import_pyarrow()
+        self.export_dir = export_dir
+        self.file_format = ColumnarFormat(file_format)
+
+    def tables(self):
+        """Return the names of the tables that have been exported."""
+        return sorted(name for name in ColumnarExporter.tables if os.path.isdir(os.path.join(self.export_dir, name)))
+
+    def load_table(self, table_name, start=None, end=None, columns=None):
+        """
+        Return an Arrow table of the rows of an exported table with timestamps in the range [start, end).
+
+        Parameters:
+        ----------
+        table_name (string): the name of the exported table, i.e. monitoring_hr
+        start (datetime): only return rows at or after this time if given
+        end (datetime): only return rows before this time if given
+        columns (list): the names of the columns to return, all of the table's columns if None
+
+        """
+        ds = self.pyarrow.dataset
+        dataset = ds.dataset(os.path.join(self.export_dir, table_name), format=self.file_format.dataset_format(), partitioning='hive')
+        conditions = []
+        # filter on the partition columns too so that only the files for the months in the range are read
+        if start is not None:
+            conditions += [ds.field('year') >= start.year, ds.field('timestamp') >= start]
+        if end is not None:
+            conditions += [ds.field('year') <= end.year, ds.field('timestamp') < end]
+        row_filter = None
+        for condition in conditions:
+            row_filter = condition if row_filter is None else row_filter & condition
+        if columns is None:
+            columns = ColumnarExporter.schema(table_name).names
+        if dataset.files:
+            arrow_table = dataset.to_table(columns=columns, filter=row_filter)
+        else:
+            arrow_table = ColumnarExporter.schema(table_name).empty_table().select(columns)
+        if 'timestamp' in columns:
+            return arrow_table.sort_by('timestamp')
+        return arrow_table
+
+    def load_frame(self, table_name, start=None, end=None, columns=None):
+        """Return a pandas DataFrame of the rows of an exported table with timestamps in the range [start, end)."""
+        return self.load_table(table_name, start, end, columns).to_pandas()
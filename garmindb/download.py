@@ -6,19 +6,22 @@ __license__ = "GPL"
 
 import os
 import sys
-import re
 import logging
 import datetime
-import time
 import tempfile
+import functools
 import zipfile
+import zlib
 import json
+import threading
 from garth import Client as GarthClient
 from garth.exc import GarthHTTPError, GarthException
-from tqdm import tqdm
 
 import fitfile.conversions as conversions
 
+from .download_scheduler import DownloadScheduler
+from .download_manifest import DownloadManifest
+
 
 logger = logging.getLogger(__file__)
 logger.addHandler(logging.StreamHandler(stream=sys.stdout))
@@ -47,14 +50,28 @@ class Download():
     # https://connect.garmin.com/modern/proxy/usersummary-service/usersummary/hydration/allData/2019-11-29
 
     download_days_overlap = 3  # Existing donloaded data will be redownloaded and overwritten if it is within this number of days of now.
+    zip_spool_max_size = 16 * 1024 * 1024  # Downloaded zip files larger than this are spooled to disk instead of being held in memory.
+
+    def __init__(self, gc_config, file_handler=None):
+        """
+        Create a new Download class instance.
+
+        Parameters:
+        ----------
+        gc_config (GarminConnectConfigManager): the configuration to use
+        file_handler (function): if supplied, called with the stat name and the list of files saved as each item finishes downloading
 
-    def __init__(self, gc_config):
-        """Create a new Download class instance."""
+        """
         logger.debug("__init__")
         self.gc_config = gc_config
+        self.file_handler = file_handler
         self.garth_session_file = self.gc_config.get_session_file()
         self.garth = GarthClient()
         self.garth.configure(domain=self.gc_config.get_garmin_base_domain())
+        self.scheduler = DownloadScheduler(self.gc_config.download_workers(), self.gc_config.download_requests_per_second())
+        self.manifest = DownloadManifest(self.gc_config.get_download_manifest_file())
+        self.dir_listings = {}
+        self.dir_listings_lock = threading.Lock()
 
     def __resume_session(self):
         if os.path.isfile(self.garth_session_file):
@@ -94,26 +111,57 @@ class Download():
 
         profile_dir = self.gc_config.get_fit_files_dir()
         self.save_json_to_file(f'{profile_dir}/social-profile', self.garth.profile)
-        self.save_json_to_file(f'{profile_dir}/user-settings', self.garth.connectapi(f'{self.garmin_connect_user_profile_url}/user-settings'), True)
-        self.save_json_to_file(f'{profile_dir}/personal-information', self.garth.connectapi(f'{self.garmin_connect_user_profile_url}/personal-information'), True)
+        self.save_json_to_file(f'{profile_dir}/user-settings', self.__connectapi(f'{self.garmin_connect_user_profile_url}/user-settings'), True)
+        self.save_json_to_file(f'{profile_dir}/personal-information', self.__connectapi(f'{self.garmin_connect_user_profile_url}/personal-information'), True)
 
         self.display_name = self.garth.profile['displayName']
         self.full_name = self.garth.profile['fullName']
         root_logger.info("login: %s (%s)", self.full_name, self.display_name)
         return True
 
-    def __unzip_files(self, outdir):
-        """Unzip and downloaded zipped files into the directory supplied."""
-        root_logger.info("unzip_files: from %s to %s", self.temp_dir, outdir)
-        for filename in os.listdir(self.temp_dir):
-            match = re.search(r'.*\.zip', filename)
-            if match:
-                full_pathname = f'{self.temp_dir}/{filename}'
-                with zipfile.ZipFile(full_pathname, 'r') as files_zip:
-                    try:
-                        files_zip.extractall(outdir)
-                    except Exception as e:
-                        logger.error('Failed to unzip %s to %s: %s', full_pathname, outdir, e)
+    def wait(self):
+        """Wait for all of the scheduled downloads to finish."""
+        self.scheduler.wait()
+        self.manifest.close()
+
+    def __connectapi(self, url, params=None):
+        return self.scheduler.request(self.garth.connectapi, url, params=params)
+
+    def __download_zip(self, url):
+        """Download a zip file into a temporary file that is kept in memory unless it is large."""
+        response = self.scheduler.request(self.garth.get, "connectapi", url, api=True)
+        zip_file = tempfile.SpooledTemporaryFile(max_size=self.zip_spool_max_size)
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            zip_file.write(chunk)
+        zip_file.seek(0)
+        return zip_file
+
+    def __extract_zip(self, url, outdir):
+        """Download a zip file and extract the files in it into the directory supplied. Return a list of the files extracted."""
+        root_logger.info("extract_zip: from %s to %s", url, outdir)
+        files = []
+        with self.__download_zip(url) as zip_file:
+            try:
+                with zipfile.ZipFile(zip_file, 'r') as files_zip:
+                    for info in files_zip.infolist():
+                        if not info.is_dir():
+                            files.append(self.__file_record(files_zip.extract(info, outdir), info.file_size, info.CRC))
+            except zipfile.BadZipFile as e:
+                logger.error('Failed to unzip %s to %s: %s', url, outdir, e)
+                return None
+        return files
+
+    @classmethod
+    def __file_record(cls, filename, size=None, crc32=None):
+        return {'file': filename, 'size': size, 'crc32': crc32}
+
+    def __file_exists(self, filename):
+        # Files downloaded before the manifest existed are found with one directory listing per directory instead of checking each file.
+        directory, name = os.path.split(filename)
+        with self.dir_listings_lock:
+            if directory not in self.dir_listings:
+                self.dir_listings[directory] = set(os.listdir(directory)) if os.path.isdir(directory) else set()
+            return name in self.dir_listings[directory]
 
     @classmethod
     def __convert_to_json(cls, object):
@@ -121,32 +169,61 @@ class Download():
 
     @classmethod
     def save_json_to_file(cls, filename, json_data, overwrite=False):
-        """Save JSON formatted data to a file."""
+        """Save JSON formatted data to a file. Return the name, size, and CRC of the file if it was written."""
         full_filename = f'{filename}.json'
         exists = os.path.isfile(full_filename)
         if not exists or overwrite:
             logger.debug("%s %s", 'Overwriting' if exists else 'Saving', full_filename)
-            with open(full_filename, 'w') as file:
-                file.write(json.dumps(json_data, default=cls.__convert_to_json))
+            data = json.dumps(json_data, default=cls.__convert_to_json).encode()
+            with open(full_filename, 'wb') as file:
+                file.write(data)
+            return cls.__file_record(full_filename, len(data), zlib.crc32(data))
 
     def save_binary_file(self, filename, url, overwrite=False):
-        """Save binary data to a file."""
+        """Save binary data to a file. Return the name, size, and CRC of the file if it was written."""
         exists = os.path.isfile(filename)
         if not exists or overwrite:
             logger.debug("%s %s", 'Overwriting' if exists else 'Saving', filename)
-            response = self.garth.get("connectapi", url, api=True)
+            response = self.scheduler.request(self.garth.get, "connectapi", url, api=True)
+            size = 0
+            crc32 = 0
             with open(filename, 'wb') as file:
                 for chunk in response:
                     file.write(chunk)
-
-    def __get_stat(self, stat_function, directory, date, days, overwrite):
-        for day in tqdm(range(0, days), unit='days'):
+                    size += len(chunk)
+                    crc32 = zlib.crc32(chunk, crc32)
+            return self.__file_record(filename, size, crc32)
+
+    def __save_json(self, json_filename, url, params=None, overwrite=False):
+        """Download JSON data and save it unless the file is already present. Return a list of the files the data is in."""
+        full_filename = f'{json_filename}.json'
+        if not overwrite and self.__file_exists(full_filename):
+            root_logger.debug("Skipping download of %s, already present", full_filename)
+            return [self.__file_record(full_filename)]
+        return [self.save_json_to_file(json_filename, self.__connectapi(url, params=params), True)]
+
+    def __download_item(self, key, partial, function, *args):
+        files = function(*args)
+        # items that failed to download aren't recorded so that they are tried again next time
+        if files is not None:
+            self.manifest.record(key, files, partial)
+            # files that were already present have no size, only the newly saved files are handed on
+            saved_files = [file['file'] for file in files if file['size'] is not None]
+            if self.file_handler and saved_files:
+                self.file_handler(key.split('/')[0], saved_files)
+
+    def __get_stat(self, stat_name, stat_function, directory, date, days, overwrite):
+        tasks = []
+        today = datetime.datetime.now().date()
+        for day in range(0, days):
             download_date = date + datetime.timedelta(days=day)
+            key = f'{stat_name}/{download_date}'
             # always overwrite for yesterday and today since the last download may have been a partial result
-            delta = datetime.datetime.now().date() - download_date
-            stat_function(directory, download_date, overwrite or delta.days <= self.download_days_overlap)
-            # pause for a second between every page access
-            time.sleep(1)
+            partial = (today - download_date).days <= self.download_days_overlap
+            if overwrite or partial or self.manifest.needs_download(key):
+                tasks.append(functools.partial(self.__download_item, key, partial, stat_function, directory, download_date, overwrite or partial))
+        root_logger.info("Downloading %d of %d days of %s", len(tasks), days, stat_name)
+        self.scheduler.submit(stat_name, tasks)
 
     def __get_summary_day(self, directory_func, date, overwrite=False):
         root_logger.info("get_summary_day: %s", date)
@@ -158,34 +235,27 @@ class Download():
         url = f'{self.garmin_connect_daily_summary_url}/{self.display_name}'
         json_filename = f'{directory_func(date.year)}/daily_summary_{date_str}'
         try:
-            self.save_json_to_file(json_filename, self.garth.connectapi(url, params=params), overwrite)
+            return self.__save_json(json_filename, url, params, overwrite)
         except GarthHTTPError as e:
             root_logger.error("Exception getting daily summary: %s", e)
 
     def get_daily_summaries(self, directory_func, date, days, overwrite):
         """Download the daily summary data from Garmin Connect and save to a JSON file."""
         root_logger.info("Getting daily summaries: %s (%d)", date, days)
-        self.__get_stat(self.__get_summary_day, directory_func, date, days, overwrite)
+        self.__get_stat('summary', self.__get_summary_day, directory_func, date, days, overwrite)
 
-    def __get_monitoring_day(self, date):
-        root_logger.info("get_monitoring_day: %s to %s", date, self.temp_dir)
-        zip_filename = f'{self.temp_dir}/{date}.zip'
+    def __get_monitoring_day(self, directory_func, date, overwrite=False):
+        root_logger.info("get_monitoring_day: %s", date)
         url = f'{self.garmin_connect_download_service_url}/wellness/{date.strftime("%Y-%m-%d")}'
         try:
-            self.save_binary_file(zip_filename, url)
+            return self.__extract_zip(url, directory_func(date.year))
         except GarthHTTPError as e:
             root_logger.error("Exception getting daily summary: %s", e)
 
-    def get_monitoring(self, directory_func, date, days):
+    def get_monitoring(self, directory_func, date, days, overwrite=False):
         """Download the daily monitoring data from Garmin Connect, unzip and save the raw files."""
         root_logger.info("Getting monitoring: %s (%d)", date, days)
-        for day in tqdm(range(0, days), unit='days'):
-            day_date = date + datetime.timedelta(day)
-            self.temp_dir = tempfile.mkdtemp()
-            self.__get_monitoring_day(day_date)
-            self.__unzip_files(directory_func(day_date.year))
-            # pause for a second between every page access
-            time.sleep(1)
+        self.__get_stat('monitoring', self.__get_monitoring_day, directory_func, date, days, overwrite)
 
     def __get_weight_day(self, directory, day, overwrite=False):
         root_logger.info("Checking weight: %s overwrite %r", day, overwrite)
@@ -197,15 +267,14 @@ class Download():
         }
         json_filename = f'{directory}/weight_{date_str}'
         try:
-            self.save_json_to_file(json_filename, self.garth.connectapi(self.garmin_connect_weight_url, params=params), overwrite)
+            return self.__save_json(json_filename, self.garmin_connect_weight_url, params, overwrite)
         except GarthHTTPError as e:
             root_logger.error("Exception getting daily summary: %s", e)
 
     def get_weight(self, directory, date, days, overwrite):
         """Download the sleep data from Garmin Connect and save to a JSON file."""
         root_logger.info("Getting weight: %s (%d)", date, days)
-        self.__get_stat(self.__get_weight_day,
-                        directory, date, days, overwrite)
+        self.__get_stat('weight', self.__get_weight_day, directory, date, days, overwrite)
 
     def __get_activity_summaries(self, start, count):
         root_logger.info("get_activity_summaries")
@@ -214,7 +283,7 @@ class Download():
             "limit" : str(count)
         }
         try:
-            return self.garth.connectapi(self.garmin_connect_activity_search_url, params=params)
+            return self.__connectapi(self.garmin_connect_activity_search_url, params=params)
         except GarthHTTPError as e:
             root_logger.error("Exception getting activity summary: %s", e)
 
@@ -223,41 +292,48 @@ class Download():
         json_filename = f'{directory}/activity_details_{activity_id_str}'
         try:
             url = f'{self.garmin_connect_activity_service_url}/{activity_id_str}'
-            self.save_json_to_file(
-                json_filename, self.garth.connectapi(url), overwrite)
+            return self.__save_json(json_filename, url, overwrite=overwrite)
         except GarthHTTPError as e:
             root_logger.error("Exception getting daily summary %s", e)
 
-    def __save_activity_file(self, activity_id_str):
+    def __save_activity_file(self, directory, activity_id_str):
         root_logger.debug("save_activity_file: %s", activity_id_str)
-        zip_filename = f'{self.temp_dir}/activity_{activity_id_str}.zip'
         url = f'{self.garmin_connect_download_service_url}/activity/{activity_id_str}'
         try:
-            self.save_binary_file(zip_filename, url)
+            return self.__extract_zip(url, directory)
         except GarthHTTPError as e:
             root_logger.error("Exception downloading activity file: %s", e)
 
+    def __get_activity(self, directory, activity, overwrite):
+        activity_id_str = str(activity['activityId'])
+        activity_name_str = conversions.printable(activity.get('activityName'))
+        root_logger.info("get_activities: %s (%s)", activity_name_str, activity_id_str)
+        json_filename = f'{directory}/activity_{activity_id_str}'
+        if not overwrite and self.__file_exists(json_filename + '.json'):
+            root_logger.info("get_activities: skipping download of %s, already present", activity_id_str)
+            return [self.__file_record(json_filename + '.json')]
+        root_logger.info("get_activities: %s <- %r", json_filename, activity)
+        details_files = self.__save_activity_details(directory, activity_id_str, overwrite)
+        if not overwrite and self.__file_exists(f'{directory}/{activity_id_str}.fit'):
+            activity_files = [self.__file_record(f'{directory}/{activity_id_str}.fit')]
+        else:
+            activity_files = self.__save_activity_file(directory, activity_id_str)
+        if details_files is None or activity_files is None:
+            return None
+        # the activity summary is saved last, its presence marks the activity as downloaded
+        return details_files + activity_files + [self.save_json_to_file(json_filename, activity, True)]
+
     def get_activities(self, directory, count, overwrite=False):
         """Download activities files from Garmin Connect and save the raw files."""
-        self.temp_dir = tempfile.mkdtemp()
-        logger.info("Getting activities: '%s' (%d) temp %s", directory, count, self.temp_dir)
-        activities = self.__get_activity_summaries(0, count)
-        for activity in tqdm(activities or [], unit='activities'):
-            activity_id_str = str(activity['activityId'])
-            activity_name_str = conversions.printable(activity.get('activityName'))
-            root_logger.info("get_activities: %s (%s)", activity_name_str, activity_id_str)
-            json_filename = f'{directory}/activity_{activity_id_str}'
-            if not os.path.isfile(json_filename + '.json') or overwrite:
-                root_logger.info("get_activities: %s <- %r", json_filename, activity)
-                self.__save_activity_details(directory, activity_id_str, overwrite)
-                self.save_json_to_file(json_filename, activity)
-                if not os.path.isfile(f'{directory}/{activity_id_str}.fit') or overwrite:
-                    self.__save_activity_file(activity_id_str)
-                # pause for a second between every page access
-                time.sleep(1)
-            else:
-                root_logger.info("get_activities: skipping download of %s, already present", activity_id_str)
-        self.__unzip_files(directory)
+        logger.info("Getting activities: '%s' (%d)", directory, count)
+        activities = self.__get_activity_summaries(0, count) or []
+        tasks = []
+        for activity in activities:
+            key = f'activity/{activity["activityId"]}'
+            if overwrite or self.manifest.needs_download(key):
+                tasks.append(functools.partial(self.__download_item, key, False, self.__get_activity, directory, activity, overwrite))
+        root_logger.info("Downloading %d of %d activities", len(tasks), len(activities))
+        self.scheduler.submit('activities', tasks, unit='activities')
 
     def get_activity_types(self, directory, overwrite):
         """Download the activity types from Garmin Connect and save to a JSON file."""
@@ -265,8 +341,7 @@ class Download():
         json_filename = f'{directory}/activity_types'
         try:
             url = f'{self.garmin_connect_activity_service_url}/activityTypes'
-            self.save_json_to_file(
-                json_filename, self.garth.connectapi(url), overwrite)
+            self.save_json_to_file(json_filename, self.__connectapi(url), overwrite)
         except GarthHTTPError as e:
             root_logger.error("Exception getting activity types: %s", e)
 
@@ -278,14 +353,14 @@ class Download():
         }
         url = f'{self.garmin_connect_sleep_daily_url}/{self.display_name}'
         try:
-            self.save_json_to_file(json_filename, self.garth.connectapi(url, params=params), overwrite)
+            return self.__save_json(json_filename, url, params, overwrite)
         except GarthHTTPError as e:
             root_logger.error("Exception getting daily summary: %s", e)
 
     def get_sleep(self, directory, date, days, overwrite):
         """Download the sleep data from Garmin Connect and save to a JSON file."""
         root_logger.info("Getting sleep: %s (%d)", date, days)
-        self.__get_stat(self.__get_sleep_day, directory, date, days, overwrite)
+        self.__get_stat('sleep', self.__get_sleep_day, directory, date, days, overwrite)
 
     def __get_rhr_day(self, directory, day, overwrite=False):
         date_str = day.strftime('%Y-%m-%d')
@@ -297,40 +372,39 @@ class Download():
         }
         url = f'{self.garmin_connect_rhr}/{self.display_name}'
         try:
-            self.save_json_to_file(json_filename, self.garth.connectapi(
-                url, params=params), overwrite)
+            return self.__save_json(json_filename, url, params, overwrite)
         except GarthHTTPError as e:
             root_logger.error("Exception getting daily summary %s", e)
 
     def get_rhr(self, directory, date, days, overwrite):
         """Download the resting heart rate data from Garmin Connect and save to a JSON file."""
         root_logger.info("Getting rhr: %s (%d)", date, days)
-        self.__get_stat(self.__get_rhr_day, directory, date, days, overwrite)
+        self.__get_stat('rhr', self.__get_rhr_day, directory, date, days, overwrite)
 
     def __get_hydration_day(self, directory_func, day, overwrite=False):
         date_str = day.strftime('%Y-%m-%d')
         json_filename = f'{directory_func(day.year)}/hydration_{date_str}'
         url = f'{self.garmin_connect_daily_hydration_url}/{date_str}'
         try:
-            self.save_json_to_file(json_filename, self.garth.connectapi(url), overwrite)
+            return self.__save_json(json_filename, url, overwrite=overwrite)
         except GarthHTTPError as e:
             root_logger.error("Exception getting hydration: %s", e)
 
     def get_hydration(self, directory_func, date, days, overwrite):
         """Download the hydration data from Garmin Connect and save to a JSON file."""
         root_logger.info("Getting hydration: %s (%d)", date, days)
-        self.__get_stat(self.__get_hydration_day, directory_func, date, days, overwrite)
+        self.__get_stat('hydration', self.__get_hydration_day, directory_func, date, days, overwrite)
 
     def __get_hrv_day(self, directory, day, overwrite=False):
         date_str = day.strftime('%Y-%m-%d')
         json_filename = f'{directory}/hrv_{date_str}'
         url = f'{self.garmin_connect_hrv_url}/{date_str}'
         try:
-            self.save_json_to_file(json_filename, self.garth.connectapi(url), overwrite)
+            return self.__save_json(json_filename, url, overwrite=overwrite)
         except GarthHTTPError as e:
             root_logger.error("Exception getting daily summary %s", e)
 
     def get_hrv(self, directory, date, days, overwrite):
         """Download the heart rate variability (HRV) data from Garmin Connect and save to a JSON file."""
         root_logger.info("Getting hrv: %s (%d)", date, days)
-        self.__get_stat(self.__get_hrv_day, directory, date, days, overwrite)
+        self.__get_stat('hrv', self.__get_hrv_day, directory, date, days, overwrite)
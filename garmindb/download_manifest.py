@@ -0,0 +1,115 @@
+"""A persistent record of the data that has been downloaded from Garmin Connect."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import sys
+import logging
+import datetime
+import json
+import threading
+
+
+logger = logging.getLogger(__file__)
+logger.addHandler(logging.StreamHandler(stream=sys.stdout))
+root_logger = logging.getLogger()
+
+
+class DownloadManifest():
+    """
+    Record what was downloaded, when, the files it was saved to, and whether it may have been a partial day.
+
+    The manifest is a JSON lines file that is appended to as items are downloaded, later lines for an item replace earlier ones. It lets the
+    downloader decide which items need to be downloaded without checking for the files on disk.
+    """
+
+    def __init__(self, filename):
+        """
+        Return a new DownloadManifest instance.
+
+        Parameters:
+        ----------
+        filename (string): the path of the JSON lines file the manifest is stored in, it is created if it doesn't exist
+
+        """
+        self.filename = filename
+        self.items = {}
+        self.lock = threading.Lock()
+        self.file = None
+        self.__load()
+
+    def __load(self):
+        if not os.path.isfile(self.filename):
+            return
+        lines = 0
+        with open(self.filename, 'r', encoding='utf-8') as file:
+            for line in file:
+                lines += 1
+                try:
+                    item = json.loads(line)
+                    self.items[item['key']] = item
+                except (ValueError, KeyError) as e:
+                    # a line may have been cut short if a previous run was interrupted while writing it
+                    logger.warning("Skipping bad line %d in download manifest %s: %s", lines, self.filename, e)
+        root_logger.info("Loaded %d items from download manifest %s", len(self.items), self.filename)
+        if lines > 2 * len(self.items) + 100:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the manifest file with only the latest line for each item."""
+        with self.lock:
+            self.__close()
+            temp_filename = self.filename + '.tmp'
+            with open(temp_filename, 'w', encoding='utf-8') as file:
+                for item in self.items.values():
+                    file.write(json.dumps(item) + '\n')
+            os.replace(temp_filename, self.filename)
+
+    def __close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def close(self):
+        """Close the manifest file. It will be reopened if more items are recorded."""
+        with self.lock:
+            self.__close()
+
+    def __len__(self):
+        """Return the number of items in the manifest."""
+        return len(self.items)
+
+    def get(self, key):
+        """Return the manifest entry for an item or None if the item has not been downloaded."""
+        return self.items.get(key)
+
+    def needs_download(self, key):
+        """Return True if the item has not been downloaded or if the last download may have been a partial result."""
+        item = self.items.get(key)
+        return item is None or item['partial']
+
+    def record(self, key, files, partial=False):
+        """
+        Record that an item has been downloaded.
+
+        Parameters:
+        ----------
+        key (string): the name of the item, the stat type and the day or id, i.e. sleep/2024-01-01
+        files (list): a dict for each file the item was saved to with file, size, and crc32 values
+        partial (Boolean): the item may have been incomplete when it was downloaded and should be downloaded again
+
+        """
+        item = {
+            'key'           : key,
+            'downloaded'    : datetime.datetime.now().isoformat(timespec='seconds'),
+            'partial'       : partial,
+            'files'         : files
+        }
+        with self.lock:
+            self.items[key] = item
+            if self.file is None:
+                self.file = open(self.filename, 'a', encoding='utf-8')
+            self.file.write(json.dumps(item) + '\n')
+            self.file.flush()
@@ -0,0 +1,146 @@
+"""Objects for running rate limited Garmin Connect downloads concurrently."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import sys
+import logging
+import time
+import threading
+import concurrent.futures
+from garth.exc import GarthHTTPError
+from tqdm import tqdm
+
+
+logger = logging.getLogger(__file__)
+logger.addHandler(logging.StreamHandler(stream=sys.stdout))
+root_logger = logging.getLogger()
+
+
+class TokenBucket():
+    """A thread safe token bucket that limits the rate of requests made by all download threads combined."""
+
+    def __init__(self, rate, burst=1):
+        """
+        Return a new TokenBucket instance.
+
+        Parameters:
+        ----------
+        rate (float): the maximum number of requests per second
+        burst (int): the number of requests that can be made back to back after being idle
+
+        """
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = rate / 16
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request can be made."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + max(0, now - self.last) * self.rate)
+                self.last = max(self.last, now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (self.last - now) + (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttle(self, delay):
+        """Pause all requests for delay seconds and halve the request rate."""
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0
+            self.last = max(self.last, time.monotonic() + delay)
+        root_logger.info("Throttled downloads for %ds to %.2f requests per second", delay, self.rate)
+
+    def recover(self):
+        """Speed the request rate back up toward the configured rate after a successful request."""
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate * 1.1)
+
+
+class DownloadScheduler():
+    """
+    Run the downloads for different stats concurrently on a bounded thread pool.
+
+    The days of a stat are downloaded in order by one thread while other threads download other stats. All requests share one rate limiter
+    and requests that get a HTTP 429 Too Many Requests response are retried after backing off.
+    """
+
+    max_retries = 5
+    initial_backoff = 2
+    max_backoff = 300
+
+    def __init__(self, workers=1, rate=1.0, burst=1):
+        """
+        Return a new DownloadScheduler instance.
+
+        Parameters:
+        ----------
+        workers (int): the number of stats to download concurrently, tasks are run as they are submitted if less than 2
+        rate (float): the maximum number of requests per second across all workers
+        burst (int): the number of requests that can be made back to back after being idle
+
+        """
+        self.workers = workers
+        self.rate_limiter = TokenBucket(rate, burst)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='download') if workers > 1 else None
+        self.futures = []
+        self.progress_position = 0
+
+    @classmethod
+    def status_code(cls, error):
+        """Return the HTTP status code of a failed request or None if there was no response."""
+        response = getattr(error.error, 'response', None)
+        return response.status_code if response is not None else None
+
+    def __backoff(self, error, attempt):
+        response = error.error.response
+        retry_after = response.headers.get('Retry-After')
+        if retry_after is not None and retry_after.isdigit():
+            return min(int(retry_after), self.max_backoff)
+        return min(self.initial_backoff * (2 ** attempt), self.max_backoff)
+
+    def request(self, function, *args, **kwargs):
+        """Make a rate limited request, retrying with backoff if the server responds that too many requests have been made."""
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                result = function(*args, **kwargs)
+                self.rate_limiter.recover()
+                return result
+            except GarthHTTPError as e:
+                if self.status_code(e) != 429 or attempt == self.max_retries:
+                    raise
+                delay = self.__backoff(e, attempt)
+                root_logger.warning("Too many requests, retrying in %ds (attempt %d of %d)", delay, attempt + 1, self.max_retries)
+                self.rate_limiter.throttle(delay)
+
+    def __run_tasks(self, name, tasks, unit, position):
+        for task in tqdm(tasks, desc=name, unit=unit, position=position, leave=True):
+            try:
+                task()
+            except Exception as e:
+                logger.error("Failed to download %s: %s", name, e)
+
+    def submit(self, name, tasks, unit='days'):
+        """Schedule a stat's download tasks. The tasks are run in order, in the thread pool if there is one, otherwise now."""
+        if self.executor is None:
+            self.__run_tasks(name, tasks, unit, None)
+        else:
+            self.futures.append(self.executor.submit(self.__run_tasks, name, tasks, unit, self.progress_position))
+            self.progress_position += 1
+
+    def wait(self):
+        """Wait for all scheduled downloads to finish."""
+        for future in concurrent.futures.as_completed(self.futures):
+            future.result()
+        self.futures = []
+        self.progress_position = 0
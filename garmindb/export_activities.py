@@ -24,7 +24,7 @@ class ActivityExporter():
 
     def process(self, db_params):
         """Process database data for an activity into a an XML tree in TCX format."""
-        garmin_act_db = ActivitiesDb(db_params, self.debug - 1)
+        garmin_act_db = ActivitiesDb.get(db_params, self.debug - 1)
         with garmin_act_db.managed_session() as garmin_act_db_session:
             activity = Activities.s_get(garmin_act_db_session, self.activity_id)
             self.tcx = Tcx()
@@ -39,7 +39,7 @@ class ActivityExporter():
                         alititude = Distance.from_meters_or_feet(record.altitude, self.measurement_system)
                         speed = Speed.from_kph_or_mph(record.speed, self.measurement_system)
                         self.tcx.add_point(track, record.timestamp, record.position, alititude, record.hr, speed)
-        gdb = GarminDb(db_params)
+        gdb = GarminDb.get(db_params)
         with gdb.managed_session() as garmin_db_session:
             file = File.s_get(garmin_db_session, self.activity_id)
             device = Device.s_get(garmin_db_session, file.serial_number)
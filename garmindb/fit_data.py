@@ -5,55 +5,304 @@ __copyright__ = "Copyright Tom Goetz"
 __license__ = "GPL"
 
 
+import os
 import sys
 import logging
+import time
 import traceback
+import collections
+import pickle
+import tempfile
+import concurrent.futures
 from tqdm import tqdm
 
 import fitfile
 from idbutils import FileProcessor
 
+from .garmindb import ImportLedger
+from .import_ledger import FileImportTracker
+from .metrics import run_metrics
+
 
 logger = logging.getLogger(__file__)
 logger.addHandler(logging.StreamHandler(stream=sys.stdout))
 root_logger = logging.getLogger()
 
 
+class ParsedFitMessage():
+    """A lightweight, picklable copy of a parsed FIT file data message."""
+
+    def __init__(self, data_message):
+        """Return an instance of ParsedFitMessage copied from a fitfile DataMessage."""
+        self.type = data_message.type
+        self.fields = data_message.fields
+
+    def __str__(self):
+        """Return a string representation of the class instance."""
+        return f'{self.__class__.__name__}({repr(self.type)} {self.fields})'
+
+
+class ParsedFitFile():
+    """
+    A lightweight, picklable copy of a parsed FIT file.
+
+    A fitfile File keeps references to the open file and its decoders, so it can't be passed between processes. This class keeps only
+    the summary attributes and the decoded message fields that the FIT file processors use.
+    """
+
+    summary_attributes = [
+        'filename', 'measurement_system', 'type', 'time_created', 'time_created_local', 'time_ended_local', 'product', 'serial_number', 'device',
+        'utc_offset', 'local_tz', 'start_time', 'end_time', 'sport_type', 'sub_sport_type', 'dev_application_ids', 'dev_fields', 'record_count',
+        'last_message_timestamp'
+    ]
+
+    def __init__(self, fit_file):
+        """Return an instance of ParsedFitFile copied from a fitfile File."""
+        for attribute in self.summary_attributes:
+            setattr(self, attribute, getattr(fit_file, attribute, None))
+        self.message_types = list(fit_file.message_types)
+        self.messages = []
+        for message_type in self.message_types:
+            messages = [ParsedFitMessage(message) for message in fit_file[message_type]]
+            vars(self)[message_type.name] = messages
+            self.messages.extend(messages)
+
+    def __getattr__(self, name):
+        """Return an empty list for message types that aren't in the file, same as a fitfile File does."""
+        if name in fitfile.MessageType.__members__:
+            return []
+        raise AttributeError(f'{self.__class__.__name__} has no attribute {name}')
+
+    def date_span(self):
+        """Return a tuple of the start and end dates of the file."""
+        return (self.start_time, self.end_time)
+
+    def utc_datetime_to_local(self, dt):
+        """Return a local datetime based on the passed in UTC datetime and the file's known UTC offset."""
+        return fitfile.file.File.utc_datetime_to_local(self, dt)
+
+    def __getitem__(self, message_type):
+        """Return the list of messages of the given type."""
+        return vars(self).get(message_type.name, [])
+
+    def __str__(self):
+        """Return a string representation of the class instance."""
+        return f'ParsedFitFile({repr(self.type)} {self.filename} {self.type} {repr(self.message_types)} dev fields {repr(self.dev_fields)})'
+
+
+class StreamingFitFile(fitfile.file.File):
+    """
+    A FIT file whose messages of the streamed types are read from the file in chunks while they're processed instead of being held in memory.
+
+    The file is decoded once. The messages of the streamed types are spilled to a temporary file a chunk at a time as they're decoded and
+    read back from it each time write_chunks() is called. Memory use is bounded by the chunk size and the number of messages of types that
+    aren't streamed.
+    """
+
+    # the streamed messages are taken from File's private message hook, which not all fitfile releases have
+    supported = hasattr(fitfile.file.File, '_File__save_message')
+
+    def __init__(self, filename, measurement_system, streamed_message_types, chunk_size):
+        """
+        Return an instance of StreamingFitFile for a FIT file.
+
+        Parameters:
+        ----------
+        filename (string): The name of the FIT file including full path.
+        measurement_system (DisplayMeasure): The measurement units to use when parsing the FIT file.
+        streamed_message_types (list): the message types that are read in chunks instead of being kept in memory
+        chunk_size (int): the maximum number of messages in a chunk
+
+        """
+        self.streamed_message_types = streamed_message_types
+        self.chunk_size = chunk_size
+        self.chunk = []
+        self.chunks = tempfile.TemporaryFile()
+        self.message_count = 0
+        try:
+            super().__init__(filename, measurement_system)
+            if self.chunk:
+                self.__spill_chunk()
+        except Exception:
+            self.chunks.close()
+            raise
+
+    def __spill_chunk(self):
+        pickle.dump(self.chunk, self.chunks, pickle.HIGHEST_PROTOCOL)
+        self.chunk = []
+
+    def _File__save_message(self, data_message_type, data_message):
+        # File has no public hook for decoded messages, this is the one method its parser calls with each of them
+        self.message_count += 1
+        if data_message_type not in self.streamed_message_types:
+            super()._File__save_message(data_message_type, data_message)
+            return
+        if data_message_type not in self.message_types:
+            self.message_types.append(data_message_type)
+        self.chunk.append(ParsedFitMessage(data_message))
+        if len(self.chunk) >= self.chunk_size:
+            self.__spill_chunk()
+
+    def write_chunks(self, chunk_handler):
+        """Pass lists of up to chunk_size of the file's messages of the streamed types, in the order they're in the file, to chunk_handler."""
+        self.chunks.seek(0)
+        while True:
+            try:
+                chunk = pickle.load(self.chunks)
+            except EOFError:
+                break
+            chunk_handler(chunk)
+
+    def close(self):
+        """Remove the temporary file that holds the streamed messages."""
+        self.chunks.close()
+
+    def __str__(self):
+        """Return a string representation of the class instance."""
+        return f'StreamingFitFile({repr(self.type)} {self.filename} {self.type} {repr(self.message_types)} dev fields {repr(self.dev_fields)})'
+
+
+def parse_fit_file(file_name, measurement_system, fit_types):
+    """
+    Parse a FIT file in a worker process.
+
+    Return a tuple of the file name, the parsed file or None if it didn't match, an error, and the time taken to parse the file.
+    """
+    start = time.perf_counter()
+    try:
+        fit_file = fitfile.file.File(file_name, measurement_system)
+        if fit_types is None or fit_file.type in fit_types:
+            return (file_name, ParsedFitFile(fit_file), None, time.perf_counter() - start)
+        return (file_name, None, f'skipping non-matching {fit_file}', time.perf_counter() - start)
+    except Exception as e:
+        return (file_name, None, (e, traceback.format_exc()), time.perf_counter() - start)
+
+
 class FitData():
     """Class for importing FIT files into a database."""
 
-    def __init__(self, input_dir, debug, latest=False, recursive=False, fit_types=None, measurement_system=fitfile.field_enums.DisplayMeasure.metric):
+    in_flight_per_worker = 2
+    # files at least this large have the message types that their processor can stream read in chunks while they're written
+    streaming_file_size = 16 * 1024 * 1024
+    streaming_chunk_size = 10000
+
+    def __init__(self, input_dir, debug, latest=False, recursive=False, fit_types=None, measurement_system=fitfile.field_enums.DisplayMeasure.metric, workers=1,
+                 retry_failed=False):
         """
         Return an instance of FitData.
 
         Parameters:
-        input_dir (string): directory (full path) to check for monitoring data files
+        input_dir (string): directory (full path) to check for monitoring data files, if None file_names is set by the caller
         debug (Boolean): enable debug logging
-        latest (Boolean): check for latest files only
+        latest (Boolean): only import files that are new or have changed since they were last imported
         fit_types (Fit.field_enums.FileType): check for this file type only
         measurement_system (enum): which measurement system to use when importing the files
+        workers (int): number of processes to use for parsing files, files are parsed in the importing process if less than 2
+        retry_failed (Boolean): only import files that failed to import the last time they were imported
 
         """
         logger.info("Processing %s FIT data from %s", fit_types, input_dir)
         self.measurement_system = measurement_system
         self.debug = debug
+        self.latest = latest
         self.fit_types = fit_types
-        self.file_names = FileProcessor.dir_to_files(input_dir, fitfile.file.name_regex, latest, recursive)
+        self.workers = workers
+        self.retry_failed = retry_failed
+        # list all of the files, the import ledger decides which of them need to be imported
+        self.file_names = FileProcessor.dir_to_files(input_dir, fitfile.file.name_regex, False, recursive) if input_dir else []
+        self.tracker = None
 
     def file_count(self):
         """Return the number of files that will be processed."""
         return len(self.file_names)
 
-    def process_files(self, fit_file_processor):
-        """Import FIT files into the database."""
-        for file_name in tqdm(self.file_names, unit='files'):
-            try:
+    @classmethod
+    def __message_count(cls, fit_file):
+        return fit_file.message_count if isinstance(fit_file, StreamingFitFile) else len(fit_file.messages)
+
+    def __streamed(self, fit_file_processor, file_name):
+        return StreamingFitFile.supported and fit_file_processor.streamed_message_types and os.path.getsize(file_name) >= self.streaming_file_size
+
+    def __write_file(self, fit_file_processor, file_name, fit_file, parse_duration):
+        start = time.perf_counter()
+        try:
+            fit_file_processor.write_file(fit_file)
+            root_logger.debug("Wrote %s to the database", fit_file)
+            self.tracker.record(file_name, ImportLedger.Status.imported, self.__message_count(fit_file), parse_duration + time.perf_counter() - start,
+                                parse_duration=parse_duration)
+        except Exception as e:
+            logger.error("Failed to import %s: %s", file_name, e)
+            root_logger.error("Failed to import %s: %s - %s", file_name, e, traceback.format_exc())
+            self.tracker.record(file_name, ImportLedger.Status.failed, 0, parse_duration + time.perf_counter() - start, e, parse_duration)
+
+    def __process_file(self, fit_file_processor, file_name):
+        start = time.perf_counter()
+        try:
+            if self.__streamed(fit_file_processor, file_name):
+                fit_file = StreamingFitFile(file_name, self.measurement_system, fit_file_processor.streamed_message_types, self.streaming_chunk_size)
+            else:
                 fit_file = fitfile.file.File(file_name, self.measurement_system)
-                if self.fit_types is None or fit_file.type in self.fit_types:
-                    fit_file_processor.write_file(fit_file)
-                    root_logger.debug("Wrote %s to the database", fit_file)
-                else:
-                    root_logger.info("skipping non-matching %s", fit_file)
-            except Exception as e:
-                logger.error("Failed to parse %s: %s", file_name, e)
-                root_logger.error("Failed to parse %s: %s - %s", file_name, e, traceback.format_exc())
+        except Exception as e:
+            parse_duration = time.perf_counter() - start
+            logger.error("Failed to parse %s: %s", file_name, e)
+            root_logger.error("Failed to parse %s: %s - %s", file_name, e, traceback.format_exc())
+            self.tracker.record(file_name, ImportLedger.Status.failed, 0, parse_duration, e, parse_duration)
+            return
+        parse_duration = time.perf_counter() - start
+        try:
+            if self.fit_types is None or fit_file.type in self.fit_types:
+                self.__write_file(fit_file_processor, file_name, fit_file, parse_duration)
+            else:
+                root_logger.info("skipping non-matching %s", fit_file)
+                self.tracker.record(file_name, ImportLedger.Status.skipped, 0, parse_duration, parse_duration=parse_duration)
+        finally:
+            if isinstance(fit_file, StreamingFitFile):
+                fit_file.close()
+
+    def __process_files_serial(self, fit_file_processor):
+        for file_name in tqdm(self.file_names, unit='files'):
+            self.__process_file(fit_file_processor, file_name)
+
+    def __handle_parsed_file(self, fit_file_processor, future):
+        file_name, fit_file, error, duration = future.result()
+        if fit_file is not None:
+            self.__write_file(fit_file_processor, file_name, fit_file, duration)
+        elif isinstance(error, tuple):
+            e, trace = error
+            logger.error("Failed to parse %s: %s", file_name, e)
+            root_logger.error("Failed to parse %s: %s - %s", file_name, e, trace)
+            self.tracker.record(file_name, ImportLedger.Status.failed, 0, duration, e, duration)
+        else:
+            root_logger.info(error)
+            self.tracker.record(file_name, ImportLedger.Status.skipped, 0, duration, parse_duration=duration)
+
+    def __process_files_parallel(self, fit_file_processor):
+        # Files are parsed in worker processes and written to the database in this process in the order they were listed. The number
+        # of parsed files held in memory is bounded by the size of the in flight queue. Files that are streamed can't be passed between
+        # processes, they're read in this process once the files before them have been written.
+        max_in_flight = self.workers * self.in_flight_per_worker
+        in_flight = collections.deque()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers) as executor:
+            for file_name in tqdm(self.file_names, unit='files'):
+                if self.__streamed(fit_file_processor, file_name):
+                    while in_flight:
+                        self.__handle_parsed_file(fit_file_processor, in_flight.popleft())
+                    self.__process_file(fit_file_processor, file_name)
+                    continue
+                if len(in_flight) >= max_in_flight:
+                    self.__handle_parsed_file(fit_file_processor, in_flight.popleft())
+                in_flight.append(executor.submit(parse_fit_file, file_name, self.measurement_system, self.fit_types))
+            while in_flight:
+                self.__handle_parsed_file(fit_file_processor, in_flight.popleft())
+
+    def process_files(self, fit_file_processor):
+        """Import the FIT files that are new or have changed, or all of them if latest isn't set, into the database."""
+        if self.tracker is None:
+            self.tracker = FileImportTracker(fit_file_processor.db_params, self.__class__.__name__, self.latest, self.retry_failed)
+        self.file_names = self.tracker.files_to_import(self.file_names)
+        with run_metrics.stage(self.__class__.__name__):
+            if self.workers > 1 and len(self.file_names) > 1:
+                self.__process_files_parallel(fit_file_processor)
+            else:
+                self.__process_files_serial(fit_file_processor)
+            self.tracker.flush()
@@ -7,10 +7,14 @@ __license__ = "GPL"
 import logging
 import sys
 import traceback
+import threading
+import collections
 
 import fitfile
 
-from .garmindb import GarminDb, File, Device, DeviceInfo, Stress, Attributes
+from .garmindb import GarminDb, File, Device, DeviceInfo, Stress, Attributes, SummaryDirty
+from .fit_data import StreamingFitFile
+from .metrics import run_metrics
 
 
 logger = logging.getLogger(__file__)
@@ -19,7 +23,19 @@ root_logger = logging.getLogger()
 
 
 class FitFileProcessor():
-    """Class that takes a parsed FIT file object and imports it into a database."""
+    """
+    Class that takes a parsed FIT file object and imports it into a database.
+
+    The device rows that have been written are remembered across files in an LRU shared by all processors in the process, so that a device
+    row is only written when one of its values changes.
+    """
+
+    # message types that are written a chunk at a time when the file is a StreamingFitFile, their handlers take the number of the
+    # first message in the chunk
+    streamed_message_types = []
+    known_devices_max = 256
+    _known_devices = collections.OrderedDict()
+    _known_devices_lock = threading.Lock()
 
     def __init__(self, db_params, plugin_manager=None, debug=0):
         """
@@ -33,17 +49,65 @@ class FitFileProcessor():
         self.plugin_manager = plugin_manager
         self.db_params = db_params
         self.debug = debug
-        self.garmin_db = GarminDb(db_params, debug - 1)
+        self.garmin_db = GarminDb.get(db_params, debug - 1)
+
+    def _load_plugins(self, file_type, fit_file):
+        """Return the plugins that handle the file. Their handlers are looked up once per file, the first time each is dispatched."""
+        self.file_plugins = list(self.plugin_manager.get_file_processors(file_type, fit_file).values()) if self.plugin_manager else []
+        self.plugin_handlers = {}
+        return self.file_plugins
+
+    def _plugin_handlers(self, handler_name, batch_handler_name=None):
+        handlers = self.plugin_handlers.get(handler_name)
+        if handlers is None:
+            # plugins that handle a message type in batches aren't also called per message
+            handlers = [getattr(plugin, handler_name) for plugin in self.file_plugins
+                        if hasattr(plugin, handler_name) and not (batch_handler_name and hasattr(plugin, batch_handler_name))]
+            self.plugin_handlers[handler_name] = handlers
+        return handlers
+
+    def _plugin_dispatch(self, handler_name, *args, batch_handler_name=None, **kwargs):
+        """Call the handler_name handler of each plugin for a message. Return the merged dicts of values that they return."""
+        handlers = self._plugin_handlers(handler_name, batch_handler_name)
+        if len(handlers) == 1:
+            return handlers[0](*args, **kwargs)
+        result = {}
+        for function in handlers:
+            result.update(function(*args, **kwargs))
+        return result
+
+    @classmethod
+    def _message_columns(cls, messages):
+        """Return the fields of messages as column arrays: a dict of field name to a list with the field's value for each message, None where it's missing."""
+        columns = {}
+        for index, message in enumerate(messages):
+            for field_name, value in message.fields.items():
+                column = columns.get(field_name)
+                if column is None:
+                    column = columns[field_name] = [None] * len(messages)
+                column[index] = value
+        return columns
+
+    def _plugin_dispatch_batch(self, handler_name, messages, *args):
+        """
+        Call the handler_name batch handler of each plugin with all of the messages of a type as column arrays.
 
-    def _plugin_dispatch(self, plugins, handler_name, *args, **kwargs):
+        Return the merged dicts of column arrays, one value per message, that the handlers return.
+        """
+        handlers = self._plugin_handlers(handler_name)
         result = {}
-        for plugin in plugins:
-            function = getattr(plugin, handler_name, None)
-            if function:
-                result.update(function(*args, **kwargs))
+        if handlers:
+            columns = self._message_columns(messages)
+            for function in handlers:
+                result.update(function(*args, columns) or {})
         return result
 
-    def __write_generic(self, fit_file, message_type, messages):
+    @classmethod
+    def _column_values(cls, columns, index):
+        """Return the values at index of column arrays as a dict."""
+        return {name: values[index] for name, values in columns.items()}
+
+    def __write_generic(self, fit_file, message_type, messages, first_message_num=0):
         """Write all messages of a given message type to the database."""
         handler_name = '_write_' + message_type.name + '_entry'
         function = getattr(self, handler_name, None)
@@ -63,9 +127,6 @@ class FitFileProcessor():
 
     def _write_file_id(self, fit_file, message_type, messages):
         """Write all file id messages to the database."""
-        self.serial_number = None
-        self.manufacturer = None
-        self.product = None
         for message in messages:
             self._write_file_id_entry(fit_file, message.fields)
 
@@ -73,25 +134,128 @@ class FitFileProcessor():
         messages = fit_file[message_type]
         function = getattr(self, '_write_' + message_type.name, self.__write_generic)
         function(fit_file, message_type, messages)
+        run_metrics.count('messages', len(messages))
         root_logger.debug("Processed %d %r entries for %s", len(messages), message_type, fit_file.filename)
 
+    def __write_streamed_message_types(self, fit_file):
+        """Write the messages of all of the streamed types a chunk at a time, flushing each chunk to the database before the next is read."""
+        message_nums = {}
+
+        def write_chunk(chunk):
+            chunk_message_types = {}
+            for message in chunk:
+                chunk_message_types.setdefault(message.type, []).append(message)
+            for message_type, messages in chunk_message_types.items():
+                function = getattr(self, '_write_' + message_type.name, self.__write_generic)
+                first_message_num = message_nums.get(message_type, 0)
+                function(fit_file, message_type, messages, first_message_num)
+                message_nums[message_type] = first_message_num + len(messages)
+                run_metrics.count('messages', len(messages))
+            self._flush_chunk()
+
+        fit_file.write_chunks(write_chunk)
+        root_logger.debug("Processed %r streamed entries for %s", message_nums, fit_file.filename)
+
+    def _flush_chunk(self):
+        """Write the rows of a chunk of streamed messages out of the sessions so that they're not held in memory."""
+        self.garmin_db_session.flush()
+
     def _write_message_types(self, fit_file, message_types):
         """Write all messages from the FIT file to the database ordered by message type."""
         root_logger.info("Importing %s (%s) [%s] with message types: %s", fit_file.filename, fit_file.time_created_local, fit_file.type, message_types)
+        self._start_file(fit_file)
         #
         # Some ordering is important: 1. create new file entries 2. create new device entries
         #
         priority_message_types = [fitfile.MessageType.file_id, fitfile.MessageType.device_info]
         for message_type in priority_message_types:
             self.__write_message_type(fit_file, message_type)
+        # streamed message types are all read in one pass over the file, in the place of the first of them
+        streamed_message_types = fit_file.streamed_message_types if isinstance(fit_file, StreamingFitFile) else []
+        streamed = False
         for message_type in message_types:
-            if message_type not in priority_message_types:
+            if message_type in streamed_message_types:
+                if not streamed:
+                    self.__write_streamed_message_types(fit_file)
+                    streamed = True
+            elif message_type not in priority_message_types:
                 self.__write_message_type(fit_file, message_type)
+        self._write_device_timestamps()
 
     def write_file(self, fit_file):
         """Write all data from the FIT file to database files."""
         with self.garmin_db.managed_session() as self.garmin_db_session:
             self._write_message_types(fit_file, fit_file.message_types)
+        self._file_committed()
+
+    #
+    # Identity of the file being imported and the devices that it was recorded with
+    #
+    def _start_file(self, fit_file):
+        """Reset the identity of the file being imported, it's filled in as the file's messages are written."""
+        self.file_id = None
+        self.serial_number = None
+        self.manufacturer = None
+        self.product = None
+        # the device rows written by the file, they're only remembered across files once the file's session is committed
+        self.file_devices = {}
+        self.device_timestamps = set()
+
+    def _file_committed(self):
+        """Remember the device rows that the file that was just committed wrote."""
+        with self._known_devices_lock:
+            for serial_number, device in self.file_devices.items():
+                self._known_devices[(self.garmin_db, serial_number)] = device
+                self._known_devices.move_to_end((self.garmin_db, serial_number))
+            while len(self._known_devices) > self.known_devices_max:
+                self._known_devices.popitem(last=False)
+        self.file_devices = {}
+
+    def _file_id(self, fit_file):
+        """Return the id of the file row, looked up at most once per file if the file has no file id message."""
+        if self.file_id is None:
+            self.file_id = File.s_get_id(self.garmin_db_session, fit_file.filename)
+        return self.file_id
+
+    def __known_device(self, serial_number):
+        device = self.file_devices.get(serial_number)
+        if device is None:
+            with self._known_devices_lock:
+                device = self._known_devices.get((self.garmin_db, serial_number))
+            if device is None:
+                instance = Device.s_get(self.garmin_db_session, serial_number)
+                device = {column.name: getattr(instance, column.name) for column in Device.__table__.columns} if instance else {}
+            device = self.file_devices[serial_number] = dict(device)
+        return device
+
+    def _write_device(self, device):
+        """
+        Insert or update a device row, skipping the write if the row already has the device's values.
+
+        The device's timestamp only moves forward and updates to it are written once per file by _write_device_timestamps.
+        """
+        known_device = self.__known_device(device['serial_number'])
+        timestamp = device.get('timestamp')
+        changed_values = {name: value for name, value in device.items() if name != 'timestamp' and value is not None and known_device.get(name) != value}
+        newer = timestamp is not None and (known_device.get('timestamp') is None or timestamp > known_device['timestamp'])
+        if newer:
+            known_device['timestamp'] = timestamp
+        if changed_values or not known_device.get('serial_number'):
+            known_device.update(changed_values)
+            Device.s_insert_or_update(self.garmin_db_session, known_device, ignore_none=True)
+            self.device_timestamps.discard(device['serial_number'])
+        elif newer:
+            self.device_timestamps.add(device['serial_number'])
+
+    def _write_device_timestamps(self):
+        for serial_number in self.device_timestamps:
+            Device.s_insert_or_update(self.garmin_db_session, {'serial_number': serial_number, 'timestamp': self.file_devices[serial_number]['timestamp']})
+        self.device_timestamps = set()
+
+    def _mark_dirty_days(self, fit_file):
+        """Mark the days that the FIT file covers as needing their summaries recalculated."""
+        if fit_file.time_created_local is not None and fit_file.time_ended_local is not None:
+            SummaryDirty.s_mark_period(self.garmin_db_session, fit_file.time_created_local, fit_file.time_ended_local)
 
     #
     # Message type handlers
@@ -112,7 +276,7 @@ class FitFileProcessor():
                 'manufacturer'  : self.manufacturer,
                 'product'       : fitfile.field_enums.name_for_enum(self.product),
             }
-            Device.s_insert_or_update(self.garmin_db_session, device)
+            self._write_device(device)
         (file_id, file_name) = File.name_and_id_from_path(fit_file.filename)
         file = {
             'id'            : file_id,
@@ -121,6 +285,7 @@ class FitFileProcessor():
             'serial_number' : self.serial_number
         }
         File.s_insert_or_update(self.garmin_db_session, file)
+        self.file_id = file_id
 
     def _write_device_info_entry(self, fit_file, message_fields):
         timestamp = fit_file.utc_datetime_to_local(message_fields.timestamp)
@@ -141,9 +306,9 @@ class FitFileProcessor():
                 'product'           : fitfile.field_enums.name_for_enum(message_fields.product or self.product),
                 'hardware_version'  : message_fields.hardware_version
             }
-            Device.s_insert_or_update(self.garmin_db_session, device, ignore_none=True)
+            self._write_device(device)
             device_info = {
-                'file_id'               : File.s_get_id(self.garmin_db_session, fit_file.filename),
+                'file_id'               : self._file_id(fit_file),
                 'serial_number'         : serial_number,
                 'timestamp'             : timestamp,
                 'cum_operating_time'    : message_fields.cum_operating_time,
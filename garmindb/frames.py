@@ -0,0 +1,242 @@
+"""Functions that query the GarminDb tables directly into pandas DataFrames without creating ORM objects."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+import datetime
+
+import numpy
+import pandas
+from sqlalchemy import select, type_coerce, String, DateTime, Date, Time, Enum, Integer, Float
+
+from .garmindb import MonitoringHeartRate, MonitoringIntensity, MonitoringClimb, Monitoring, MonitoringRespirationRate, MonitoringPulseOx
+from .garmindb import MonitoringHeartRateRollup, MonitoringRespirationRateRollup, MonitoringPulseOxRollup, RollupResolution
+from .garmindb import Stress, StressRollup, Sleep, RestingHeartRate, Weight, DailySummary
+from .garmindb import ActivitiesDb, Activities, ActivityLaps, ActivityRecords, ActivityStreams
+from .summarydb import DaysSummary, WeeksSummary, MonthsSummary, YearsSummary
+
+
+logger = logging.getLogger(__name__)
+
+
+def _column_value(column, value):
+    # the time columns of the DateTime tables can't be compared to dates
+    if isinstance(column.type, DateTime) and type(value) is datetime.date:
+        return datetime.datetime.combine(value, datetime.time.min)
+    return value
+
+
+def _convert_columns(frame, columns):
+    for column in columns:
+        if isinstance(column.type, (DateTime, Date)):
+            frame[column.name] = pandas.to_datetime(frame[column.name], format='ISO8601')
+        elif isinstance(column.type, Time):
+            # SQLite returns the stored strings, other databases time or timedelta objects, all of which parse as strings
+            frame[column.name] = pandas.to_timedelta(frame[column.name].astype('string'))
+        elif isinstance(column.type, (Integer, Float)) and frame[column.name].dtype == object:
+            # columns with NULL values are read as objects, make them float columns with NaN for the NULLs
+            frame[column.name] = pandas.to_numeric(frame[column.name]).astype('float64')
+    return frame
+
+
+def read_table(db_params, table, start=None, end=None, columns=None, where=None, order_by=None):
+    """
+    Return a DataFrame of the rows of a table with their time column in the range [start, end).
+
+    The rows are read with a single query and no ORM objects are created. Date and time of day columns are returned as datetime64 columns,
+    time span columns as timedelta64 columns, enum columns as the names of the enum values, and numeric columns with NULL values as float64 columns.
+
+    Parameters:
+    ----------
+    db_params (dict): configuration data for accessing the database
+    table (DbObject): the table to read
+    start (datetime): only return rows at or after this time if given
+    end (datetime): only return rows before this time if given
+    columns (list): the names of the columns to return, all of the table's columns if None
+    where (expression): an additional filter for the rows
+    order_by (Column): the column to sort the rows by, the table's time column if None
+
+    """
+    db = table.db.get(db_params)
+    table_columns = [table.__table__.columns[name] for name in columns] if columns else list(table.__table__.columns)
+    # read dates, times, and enums as they are stored and convert whole columns at once instead of converting every value in Python
+    selected = [type_coerce(column, String).label(column.name) if isinstance(column.type, (DateTime, Date, Time, Enum)) else column for column in table_columns]
+    query = select(*selected)
+    time_col = table.__table__.columns[table.time_col_name]
+    if start is not None:
+        query = query.where(time_col >= _column_value(time_col, start))
+    if end is not None:
+        query = query.where(time_col < _column_value(time_col, end))
+    if where is not None:
+        query = query.where(where)
+    query = query.order_by(order_by if order_by is not None else time_col)
+    with db.engine.connect() as connection:
+        frame = pandas.read_sql_query(query, connection)
+    logger.debug("Read %d rows from %s", len(frame), table.__tablename__)
+    return _convert_columns(frame, table_columns)
+
+
+def monitoring_hr(db_params, start=None, end=None):
+    """Return a DataFrame of the monitoring heart rate values in the range [start, end)."""
+    return read_table(db_params, MonitoringHeartRate, start, end)
+
+
+def monitoring_intensity(db_params, start=None, end=None):
+    """Return a DataFrame of the monitoring intensity minutes in the range [start, end)."""
+    return read_table(db_params, MonitoringIntensity, start, end)
+
+
+def monitoring_climb(db_params, start=None, end=None):
+    """Return a DataFrame of the monitoring ascent and descent values in the range [start, end)."""
+    return read_table(db_params, MonitoringClimb, start, end)
+
+
+def monitoring(db_params, start=None, end=None):
+    """Return a DataFrame of the monitoring steps, activity, and calories values in the range [start, end)."""
+    return read_table(db_params, Monitoring, start, end)
+
+
+def monitoring_rr(db_params, start=None, end=None):
+    """Return a DataFrame of the monitoring respiration rate values in the range [start, end)."""
+    return read_table(db_params, MonitoringRespirationRate, start, end)
+
+
+def monitoring_pulse_ox(db_params, start=None, end=None):
+    """Return a DataFrame of the monitoring pulse ox values in the range [start, end)."""
+    return read_table(db_params, MonitoringPulseOx, start, end)
+
+
+def stress(db_params, start=None, end=None):
+    """Return a DataFrame of the stress values in the range [start, end)."""
+    return read_table(db_params, Stress, start, end)
+
+
+def sleep(db_params, start=None, end=None):
+    """Return a DataFrame of the nightly sleep values for the days in the range [start, end)."""
+    return read_table(db_params, Sleep, start, end)
+
+
+def resting_hr(db_params, start=None, end=None):
+    """Return a DataFrame of the resting heart rate values for the days in the range [start, end)."""
+    return read_table(db_params, RestingHeartRate, start, end)
+
+
+def weight(db_params, start=None, end=None):
+    """Return a DataFrame of the weight values for the days in the range [start, end)."""
+    return read_table(db_params, Weight, start, end)
+
+
+def daily_summary(db_params, start=None, end=None):
+    """Return a DataFrame of the Garmin Connect daily summaries for the days in the range [start, end)."""
+    return read_table(db_params, DailySummary, start, end)
+
+
+def read_rollup(db_params, rollup_table, start=None, end=None, resolution=RollupResolution.five_minutes):
+    """
+    Return a DataFrame of the min, avg, max, and count of a time series at the coarsest resolution that is no coarser than the one requested.
+
+    Parameters:
+    ----------
+    db_params (dict): configuration data for accessing the database
+    rollup_table (RollupBase): the rollup table of the time series
+    start (datetime): only return buckets starting at or after this time if given
+    end (datetime): only return buckets starting before this time if given
+    resolution (int): the longest bucket, in seconds, that is acceptable. If it's shorter than the finest rollup the source values are returned.
+
+    """
+    rollup_resolution = RollupResolution.coarsest(resolution)
+    if rollup_resolution is None:
+        source_col = getattr(rollup_table.source_table, rollup_table.source_col_name)
+        frame = read_table(db_params, rollup_table.source_table, start, end, where=(source_col > 0))
+        values = frame[rollup_table.source_col_name].astype('float64')
+        return pandas.DataFrame({'timestamp': frame['timestamp'], 'min': values, 'avg': values, 'max': values, 'count': 1})
+    return read_table(db_params, rollup_table, start, end, columns=['timestamp', 'min', 'avg', 'max', 'count'], where=(rollup_table.resolution == rollup_resolution.value))
+
+
+def heart_rate_rollup(db_params, start=None, end=None, resolution=RollupResolution.five_minutes):
+    """Return a DataFrame of heart rate min, avg, max, and count at the coarsest resolution no coarser than resolution seconds."""
+    return read_rollup(db_params, MonitoringHeartRateRollup, start, end, resolution)
+
+
+def rr_rollup(db_params, start=None, end=None, resolution=RollupResolution.five_minutes):
+    """Return a DataFrame of respiration rate min, avg, max, and count at the coarsest resolution no coarser than resolution seconds."""
+    return read_rollup(db_params, MonitoringRespirationRateRollup, start, end, resolution)
+
+
+def pulse_ox_rollup(db_params, start=None, end=None, resolution=RollupResolution.five_minutes):
+    """Return a DataFrame of pulse ox min, avg, max, and count at the coarsest resolution no coarser than resolution seconds."""
+    return read_rollup(db_params, MonitoringPulseOxRollup, start, end, resolution)
+
+
+def stress_rollup(db_params, start=None, end=None, resolution=RollupResolution.five_minutes):
+    """Return a DataFrame of stress min, avg, max, and count at the coarsest resolution no coarser than resolution seconds."""
+    return read_rollup(db_params, StressRollup, start, end, resolution)
+
+
+def activities(db_params, start=None, end=None):
+    """Return a DataFrame of the activities that started in the range [start, end)."""
+    return read_table(db_params, Activities, start, end)
+
+
+def activity_laps(db_params, activity_id):
+    """Return a DataFrame of the laps of an activity."""
+    return read_table(db_params, ActivityLaps, where=(ActivityLaps.activity_id == activity_id), order_by=ActivityLaps.lap)
+
+
+def _activity_stream_frame(activity_id, arrays):
+    frame = pandas.DataFrame({'activity_id': activity_id, 'record': range(len(arrays['timestamp']))})
+    for name in [column.name for column in ActivityRecords.__table__.columns if column.name in ActivityStreams.channels]:
+        typecode = ActivityStreams.channels[name]
+        values = arrays[name]
+        if name == 'timestamp':
+            # converted from the strings they're stored as in activity_records so that the column has the same resolution
+            values = numpy.datetime_as_string(values, unit='us')
+        elif name in ActivityStreams.position_channels:
+            values = pandas.Series(values).where(values != ActivityStreams.null_values[typecode]) * ActivityStreams.degrees_per_semicircle
+        elif typecode != 'd':
+            # the same as integer columns read from activity_records: float64 with NaN for missing values if there are any
+            missing = values == ActivityStreams.null_values[typecode]
+            values = pandas.Series(values).where(~missing).astype('float64') if missing.any() else values.astype('int64')
+        frame[name] = values
+    return _convert_columns(frame, [ActivityRecords.__table__.columns['timestamp']])
+
+
+def activity_records(db_params, activity_id):
+    """Return a DataFrame of the records of an activity, read from the activity's stream if it has one since that's one row instead of a row per record."""
+    arrays = ActivityStreams.get_arrays(ActivitiesDb.get(db_params), activity_id)
+    if arrays is not None:
+        return _activity_stream_frame(activity_id, arrays)
+    return read_table(db_params, ActivityRecords, where=(ActivityRecords.activity_id == activity_id), order_by=ActivityRecords.record)
+
+
+def _add_summary_percents(frame):
+    # the same values as the SummaryBase hybrid properties
+    frame['intensity_time_mins'] = frame['intensity_time'].dt.total_seconds() / 60
+    frame['intensity_time_goal_mins'] = frame['intensity_time_goal'].dt.total_seconds() / 60
+    for percent_col, value_col, goal_col in [('intensity_time_goal_percent', 'intensity_time_mins', 'intensity_time_goal_mins'), ('steps_goal_percent', 'steps', 'steps_goal'),
+                                             ('floors_goal_percent', 'floors', 'floors_goal')]:
+        goal = frame[goal_col].where(frame[goal_col] > 0)
+        frame[percent_col] = (frame[value_col] * 100 / goal).fillna(0.0)
+    return frame
+
+
+def days_summary(db_params, start=None, end=None):
+    """Return a DataFrame of the daily summaries for the days in the range [start, end)."""
+    return _add_summary_percents(read_table(db_params, DaysSummary, start, end))
+
+
+def weeks_summary(db_params, start=None, end=None):
+    """Return a DataFrame of the weekly summaries for the weeks starting in the range [start, end)."""
+    return _add_summary_percents(read_table(db_params, WeeksSummary, start, end))
+
+
+def months_summary(db_params, start=None, end=None):
+    """Return a DataFrame of the monthly summaries for the months starting in the range [start, end)."""
+    return _add_summary_percents(read_table(db_params, MonthsSummary, start, end))
+
+
+def years_summary(db_params, start=None, end=None):
+    """Return a DataFrame of the yearly summaries for the years starting in the range [start, end)."""
+    return _add_summary_percents(read_table(db_params, YearsSummary, start, end))
@@ -17,6 +17,8 @@ from fitfile import Sport
 from .statistics import Statistics
 from idbutils import DbParams
 
+from .garmindb import ProfiledDb
+
 
 class ConfigException(Exception):
     """Something unexpected happened while handling the configuration."""
@@ -66,6 +68,14 @@ class GarminConnectConfigManager(JsonConfig):
         """Return the type (SQLite, MySQL, etc) of database that is configured."""
         return self.get_node_value_default('db', 'type', 'sqlite')
 
+    def get_db_sqlite_profile(self):
+        """Return the SQLite profile, default or performance, that the SQLite databases are opened with."""
+        return self.get_node_value_default('db', 'sqlite_profile', 'default')
+
+    def get_db_activity_storage(self):
+        """Return how the records of activities are stored, records for a row per record or streams for compressed arrays per activity as well."""
+        return self.get_node_value_default('db', 'activity_storage', 'records')
+
     def get_db_user(self):
         """Return the configured username of the database."""
         return self.get_node_value('db', 'user')
@@ -78,6 +88,10 @@ class GarminConnectConfigManager(JsonConfig):
         """Return the configured hostname of the database."""
         return self.get_node_value('db', 'host')
 
+    def get_db_pool_options(self):
+        """Return the configured connection pool options, pool_size, max_overflow, pool_recycle, pool_timeout, and pool_pre_ping, of the database."""
+        return {name: value for name, value in self.get_node_value_default('db', 'pool', {}).items() if name in ProfiledDb.mysql_pool_options}
+
     def get_db_dir(self, test_dir=False):
         """Return the configured directory of where the database will be stored."""
         return self.__create_dir_if_needed(self.get_base_dir(test_dir) + os.sep + 'DBs')
@@ -86,15 +100,19 @@ class GarminConnectConfigManager(JsonConfig):
         """Return the database configuration."""
         db_type = self.get_db_type()
         db_params = {
-            'db_type' : db_type
+            'db_type'           : db_type,
+            'activity_storage'  : self.get_db_activity_storage()
         }
         if db_type == 'sqlite':
             db_params['db_path'] = self.get_db_dir(test_db)
+            db_params['sqlite_profile'] = self.get_db_sqlite_profile()
         elif db_type == "mysql":
             db_params['db_type'] = 'mysql'
             db_params['db_username'] = self.get_db_user()
             db_params['db_password'] = self.get_db_password()
             db_params['db_host'] = self.get_db_host()
+            for name, value in self.get_db_pool_options().items():
+                db_params['db_' + name] = value
         return DbParams(**db_params)
 
     def get_base_dir(self, test_dir=False):
@@ -115,6 +133,14 @@ class GarminConnectConfigManager(JsonConfig):
             return sync_dir
         return None
 
+    def get_download_manifest_file(self):
+        """Return the path to the file that records what has been downloaded from Garmin Connect."""
+        return self.get_base_dir() + os.sep + 'download_manifest.jsonl'
+
+    def get_columnar_export_dir(self):
+        """Return the path to the directory the monitoring and activity record tables are exported to as Parquet or Arrow files."""
+        return self.__create_dir_if_needed(self.get_base_dir() + os.sep + 'Columnar')
+
     def get_backup_dir(self):
         """Return the path to the backup directory."""
         return self.__create_dir_if_needed(self.get_base_dir() + os.sep + 'Backups')
@@ -208,6 +234,30 @@ class GarminConnectConfigManager(JsonConfig):
         """Return the Garmin base domain to use for api calls."""
         return self.get_node_value_default('garmin', 'domain', "garmin.com")
 
+    def download_workers(self):
+        """Return the number of stats to download from Garmin Connect concurrently."""
+        return self.get_node_value_default('garmin', 'download_workers', 1)
+
+    def download_requests_per_second(self):
+        """Return the maximum rate of requests to make to Garmin Connect across all download workers."""
+        return self.get_node_value_default('garmin', 'download_requests_per_second', 1.0)
+
+    def get_metrics_report_file(self):
+        """Return the path of the JSON file that the timings and counts of each run are written to."""
+        return self.get_node_value_default('metrics', 'report_file', self.get_base_dir() + os.sep + 'run_report.json')
+
+    def get_metrics_prometheus_file(self):
+        """Return the path of the Prometheus node exporter textfile that the timings and counts of each run are written to, if configured."""
+        return self.get_node_value_default('metrics', 'prometheus_textfile', None)
+
+    def columnar_export_enabled(self):
+        """Return True if the monitoring and activity record tables should be exported to Parquet or Arrow files after each import."""
+        return self.get_node_value_default('columnar_export', 'enabled', False)
+
+    def columnar_export_format(self):
+        """Return the file format, parquet or arrow, that the monitoring and activity record tables are exported to."""
+        return self.get_node_value_default('columnar_export', 'format', 'parquet')
+
     def default_display_activities(cls):
         """Return a list of the default activities to display."""
         return [Sport.strict_from_string(activity) for activity in super().default_display_activities]
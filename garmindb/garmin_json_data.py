@@ -7,13 +7,14 @@ __license__ = "GPL"
 
 import sys
 import logging
+import datetime
 import dateutil.parser
 
 import fitfile
-from idbutils import JsonFileProcessor
 
 from .garmin_connect_enums import Event, get_summary_sport, get_details_sport
-from .garmindb import ActivitiesDb, Activities, StepsActivities, PaddleActivities, CycleActivities
+from .import_ledger import LedgerJsonFileProcessor
+from .garmindb import GarminDb, ActivitiesDb, Activities, StepsActivities, PaddleActivities, CycleActivities
 
 
 logger = logging.getLogger(__file__)
@@ -21,10 +22,10 @@ logger.addHandler(logging.StreamHandler(stream=sys.stdout))
 root_logger = logging.getLogger()
 
 
-class GarminJsonActivityData(JsonFileProcessor):
+class GarminJsonActivityData(LedgerJsonFileProcessor):
     """Base class for importing Garmin activity data from JSON formatted Garmin Connect details downloads."""
 
-    def __init__(self, db_params, file_regex, input_dir, latest, measurement_system, debug):
+    def __init__(self, db_params, file_regex, input_dir, latest, measurement_system, debug, retry_failed=False):
         """
         Return an instance of GarminJsonDetailsData.
 
@@ -35,11 +36,13 @@ class GarminJsonActivityData(JsonFileProcessor):
         latest (Boolean): check for latest files only
         measurement_system (enum): which measurement system to use when importing the files
         debug (Boolean): enable debug logging
+        retry_failed (Boolean): only import files that failed to import the last time they were imported
 
         """
-        super().__init__(file_regex, input_dir=input_dir, latest=latest, debug=debug)
+        super().__init__(db_params, file_regex, input_dir=input_dir, latest=latest, debug=debug, retry_failed=retry_failed)
         self.measurement_system = measurement_system
-        self.garmin_act_db = ActivitiesDb(db_params, self.debug - 1)
+        self.garmin_db = GarminDb.get(db_params, self.debug - 1)
+        self.garmin_act_db = ActivitiesDb.get(db_params, self.debug - 1)
         self.conversions = {}
 
     def _process_common(self, json_data):
@@ -84,6 +87,14 @@ class GarminJsonActivityData(JsonFileProcessor):
             'avg_rr'                    : self._get_field(json_data, 'avgRespirationRate', float),
         }
 
+    def _mark_dirty_days(self, activity):
+        # mark every day the activity covers, the days are only marked if the file is imported
+        start_time = activity.get('start_time')
+        if start_time is not None:
+            start_day = start_time.date()
+            end_day = (activity.get('stop_time') or start_time).date()
+            self._mark_days([start_day + datetime.timedelta(days=day) for day in range((end_day - start_day).days + 1)])
+
     def _process_json(self, json_data):
         """Import data from files into the database."""
         with self.garmin_act_db.managed_session() as self.garmin_act_db_session:
@@ -93,7 +104,7 @@ class GarminJsonActivityData(JsonFileProcessor):
 class GarminJsonSummaryData(GarminJsonActivityData):
     """Class for importing Garmin activity data from JSON formatted Garmin Connect summary downloads."""
 
-    def __init__(self, db_params, input_dir, latest, measurement_system, debug):
+    def __init__(self, db_params, input_dir, latest, measurement_system, debug, retry_failed=False):
         """
         Return an instance of GarminTcxData.
 
@@ -104,10 +115,11 @@ class GarminJsonSummaryData(GarminJsonActivityData):
         latest (Boolean): check for latest files only
         measurement_system (enum): which measurement system to use when importing the files
         debug (Boolean): enable debug logging
+        retry_failed (Boolean): only import files that failed to import the last time they were imported
 
         """
         logger.info("Processing %s activities summary data from %s", 'latest' if latest else 'all', input_dir)
-        super().__init__(db_params, r'activity_\d*\.json', input_dir, latest, measurement_system, debug)
+        super().__init__(db_params, r'activity_\d*\.json', input_dir, latest, measurement_system, debug, retry_failed)
 
     def _process_steps_activity(self, activity_id, activity_summary):
         root_logger.debug("process_steps_activity for %s", activity_id)
@@ -208,6 +220,7 @@ class GarminJsonSummaryData(GarminJsonActivityData):
         }
         activity.update(self._process_common(json_data))
         Activities.s_insert_or_update(self.garmin_act_db_session, activity, ignore_none=True)
+        self._mark_dirty_days(activity)
         self._call_process_func(sport.name, sub_sport, activity_id, json_data)
         return 1
 
@@ -215,7 +228,7 @@ class GarminJsonSummaryData(GarminJsonActivityData):
 class GarminJsonDetailsData(GarminJsonActivityData):
     """Class for importing Garmin activity data from JSON formatted Garmin Connect details downloads."""
 
-    def __init__(self, db_params, input_dir, latest, measurement_system, debug):
+    def __init__(self, db_params, input_dir, latest, measurement_system, debug, retry_failed=False):
         """
         Return an instance of GarminJsonDetailsData.
 
@@ -226,10 +239,11 @@ class GarminJsonDetailsData(GarminJsonActivityData):
         latest (Boolean): check for latest files only
         measurement_system (enum): which measurement system to use when importing the files
         debug (Boolean): enable debug logging
+        retry_failed (Boolean): only import files that failed to import the last time they were imported
 
         """
         logger.info("Processing activities detail data")
-        super().__init__(db_params, r'activity_details_\d*\.json', input_dir, latest, measurement_system, debug)
+        super().__init__(db_params, r'activity_details_\d*\.json', input_dir, latest, measurement_system, debug, retry_failed)
 
     def _process_steps_activity(self, sub_sport, activity_id, json_data):
         summary_dto = json_data['summaryDTO']
@@ -326,5 +340,6 @@ class GarminJsonDetailsData(GarminJsonActivityData):
         }
         activity.update(self._process_common(summary_dto))
         Activities.s_insert_or_update(self.garmin_act_db_session, activity, ignore_none=True)
+        self._mark_dirty_days(activity)
         self._call_process_func(sport.name, sub_sport, activity_id, json_data)
         return 1
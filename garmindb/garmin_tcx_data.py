@@ -7,13 +7,16 @@ __license__ = "GPL"
 
 import sys
 import logging
+import time
 from tqdm import tqdm
 import traceback
 
 from idbutils import FileProcessor
 from .tcx import Tcx
 
-from .garmindb import GarminDb, Device, File, ActivitiesDb, Activities, ActivityRecords, ActivityLaps
+from .garmindb import GarminDb, Device, File, ActivitiesDb, Activities, ActivityRecords, ActivityLaps, SummaryDirty, ExportDirty, ImportLedger
+from .import_ledger import FileImportTracker
+from .metrics import run_metrics
 
 
 logger = logging.getLogger(__file__)
@@ -24,7 +27,7 @@ root_logger = logging.getLogger()
 class GarminTcxData():
     """Class for importing Garmin activity data from TCX files."""
 
-    def __init__(self, input_dir, latest, measurement_system, debug):
+    def __init__(self, input_dir, latest, measurement_system, debug, retry_failed=False):
         """
         Return an instance of GarminTcxData.
 
@@ -32,41 +35,43 @@ class GarminTcxData():
         ----------
         db_params (dict): configuration data for accessing the database
         input_dir (string): directory (full path) to check for data files
-        latest (Boolean): check for latest files only
+        latest (Boolean): only import files that are new or have changed since they were last imported
         measurement_system (enum): which measurement system to use when importing the files
         debug (Boolean): enable debug logging
+        retry_failed (Boolean): only import files that failed to import the last time they were imported
 
         """
         logger.info("Processing activities tcx data")
         self.measurement_system = measurement_system
         self.debug = debug
+        self.latest = latest
+        self.retry_failed = retry_failed
         if input_dir:
-            self.file_names = FileProcessor.dir_to_files(input_dir, Tcx.filename_regex, latest)
+            # list all of the files, the import ledger decides which of them need to be imported
+            self.file_names = FileProcessor.dir_to_files(input_dir, Tcx.filename_regex, False)
 
     def file_count(self):
         """Return the number of files that will be propcessed."""
         return len(self.file_names)
 
-    def __process_record(self, tcx, activity_id, record_number, point):
+    def __get_record(self, tcx, activity_id, record_number, point):
         root_logger.debug("Processing record: %r (%d)", point, record_number)
-        if not ActivityRecords.s_exists(self.garmin_act_db_session, {'activity_id' : activity_id, 'record' : record_number}):
-            record = {
-                'activity_id'                       : activity_id,
-                'record'                            : record_number,
-                'timestamp'                         : tcx.get_point_time(point),
-                'hr'                                : tcx.get_point_hr(point),
-                'altitude'                          : tcx.get_point_altitude(point).meters_or_feet(measurement_system=self.measurement_system),
-                'speed'                             : tcx.get_point_speed(point).kph_or_mph(measurement_system=self.measurement_system)
-            }
-            loc = tcx.get_point_loc(point)
-            if loc is not None:
-                record.update({'position_lat': loc.lat_deg, 'position_long': loc.long_deg})
-            self.garmin_act_db_session.add(ActivityRecords(**record))
+        record = {
+            'activity_id'                       : activity_id,
+            'record'                            : record_number,
+            'timestamp'                         : tcx.get_point_time(point),
+            'hr'                                : tcx.get_point_hr(point),
+            'altitude'                          : tcx.get_point_altitude(point).meters_or_feet(measurement_system=self.measurement_system),
+            'speed'                             : tcx.get_point_speed(point).kph_or_mph(measurement_system=self.measurement_system)
+        }
+        loc = tcx.get_point_loc(point)
+        if loc is not None:
+            record.update({'position_lat': loc.lat_deg, 'position_long': loc.long_deg})
+        return record
 
     def __process_lap(self, tcx, activity_id, lap_number, lap):
         root_logger.info("Processing lap: %d", lap_number)
-        for record_number, point in enumerate(tcx.get_lap_points(lap)):
-            self.__process_record(tcx, activity_id, record_number, point)
+        self.records.extend([self.__get_record(tcx, activity_id, record_number, point) for record_number, point in enumerate(tcx.get_lap_points(lap))])
         if not ActivityLaps.s_exists(self.garmin_act_db_session, {'activity_id' : activity_id, 'lap' : lap_number}):
             lap_data = {
                 'activity_id'                       : activity_id,
@@ -132,17 +137,31 @@ class GarminTcxData():
         if end_loc is not None:
             activity.update({'stop_lat': end_loc.lat_deg, 'stop_long': end_loc.long_deg})
         Activities.s_insert_or_update(self.garmin_act_db_session, activity, ignore_none=True, ignore_zero=True)
+        if start_time is not None:
+            end_time = tcx.end_time or start_time
+            SummaryDirty.s_mark_period(self.garmin_db_session, start_time, end_time)
+            ExportDirty.s_mark_period(self.garmin_db_session, [ActivityRecords], start_time, end_time)
+        self.records = []
         for lap_number, lap in enumerate(tcx.laps):
             self.__process_lap(tcx, file_id, lap_number, lap)
+        ActivityRecords.s_insert_new(self.garmin_act_db_session, self.records)
 
     def process_files(self, db_params):
-        """Import data from TCX files into the database."""
-        garmin_db = GarminDb(db_params, self.debug - 1)
-        garmin_act_db = ActivitiesDb(db_params, self.debug - 1)
-        with garmin_db.managed_session() as self.garmin_db_session, garmin_act_db.managed_session() as self.garmin_act_db_session:
-            for file_name in tqdm(self.file_names, unit='files'):
-                try:
-                    self.__process_file(file_name)
-                except Exception as e:
-                    logger.error('Failed to processes TCX file %s: %s', file_name, e)
-                    root_logger.error('Failed to processes TCX file %s: %s', file_name, traceback.format_exc())
+        """Import data from TCX files that are new or have changed, or all of them if latest isn't set, into the database."""
+        # the results are written to the ledger after the import session has been committed
+        tracker = FileImportTracker(db_params, self.__class__.__name__, self.latest, self.retry_failed, flush_count=None)
+        self.file_names = tracker.files_to_import(self.file_names)
+        garmin_db = GarminDb.get(db_params, self.debug - 1)
+        garmin_act_db = ActivitiesDb.get(db_params, self.debug - 1)
+        with run_metrics.stage(self.__class__.__name__):
+            with garmin_db.managed_session() as self.garmin_db_session, garmin_act_db.managed_session() as self.garmin_act_db_session:
+                for file_name in tqdm(self.file_names, unit='files'):
+                    start = time.perf_counter()
+                    try:
+                        self.__process_file(file_name)
+                        tracker.record(file_name, ImportLedger.Status.imported, len(self.records), time.perf_counter() - start)
+                    except Exception as e:
+                        logger.error('Failed to processes TCX file %s: %s', file_name, e)
+                        root_logger.error('Failed to processes TCX file %s: %s', file_name, traceback.format_exc())
+                        tracker.record(file_name, ImportLedger.Status.failed, 0, time.perf_counter() - start, e)
+            tracker.flush()
@@ -6,9 +6,14 @@ __license__ = "GPL"
 
 # flake8: noqa
 
-from .garmin_db import GarminDb, Attributes, Device, DeviceInfo, File, Weight, Stress, Sleep, SleepEvents, RestingHeartRate, DailySummary, Hrv
+from .garmin_db import GarminDb, Attributes, Device, DeviceInfo, File, Weight, Stress, Sleep, SleepEvents, RestingHeartRate, DailySummary, Hrv, SummaryDirty, ImportLedger, \
+    ExportDirty, StressRollup
 from .monitoring_db import MonitoringDb, MonitoringInfo, MonitoringHeartRate, MonitoringIntensity, MonitoringClimb, Monitoring, \
-    MonitoringRespirationRate, MonitoringPulseOx
+    MonitoringRespirationRate, MonitoringPulseOx, MonitoringHeartRateRollup, MonitoringRespirationRateRollup, MonitoringPulseOxRollup
 from .activities_db import ActivitiesDb, Activities, ActivityLaps, ActivityRecords, ActivitiesDevices, ActivitySplits, SportActivities, StepsActivities, \
-    PaddleActivities, CycleActivities, ClimbingActivities
+    PaddleActivities, CycleActivities, ClimbingActivities, ActivityStorage, ActivityStreams, ActivityStreamBuffer
 from .garmin_summary_db import GarminSummaryDb, Summary, YearsSummary, MonthsSummary, WeeksSummary, DaysSummary, IntensityHR
+from .upsert import UpsertBuffer, MirroredUpsertBuffer, s_upsert
+from .grouped_stats import GroupedStat, DailyStats
+from .rollup import RollupResolution, RollupBase
+from .sqlite_profile import SqliteProfile, ProfiledDb
@@ -4,9 +4,14 @@ __author__ = "Tom Goetz"
 __copyright__ = "Copyright Tom Goetz"
 __license__ = "GPL"
 
+import sys
+import enum
+import zlib
+import array
 import logging
 import datetime
-from sqlalchemy import Column, String, Float, Integer, Boolean, DateTime, Time, Enum, ForeignKey, PrimaryKeyConstraint, desc, literal_column
+import functools
+from sqlalchemy import Column, String, Float, Integer, Boolean, DateTime, Time, Enum, ForeignKey, PrimaryKeyConstraint, Index, LargeBinary, desc, literal_column, insert
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.hybrid import hybrid_property
@@ -14,10 +19,13 @@ from sqlalchemy.ext.hybrid import hybrid_property
 import fitfile
 import idbutils
 
+from .grouped_stats import GroupedStat, DailyStats
+from .sqlite_profile import ProfiledDb
+
 
 logger = logging.getLogger(__name__)
 
-ActivitiesDb = idbutils.DB.create('garmin_activities', 13, "Database for storing activities data.")
+ActivitiesDb = ProfiledDb.create('garmin_activities', 13, "Database for storing activities data.")
 
 
 class ActivitiesCommon(idbutils.DbObject):
@@ -124,6 +132,8 @@ class Activities(ActivitiesDb.Base, ActivitiesCommon):
     training_effect = Column(Float)
     anaerobic_training_effect = Column(Float)
 
+    __table_args__ = (Index('ix_activities_sport_start_time', 'sport', 'start_time'),)
+
     def is_steps_activity(self):
         """Return if the activity is a steps based activity."""
         return self.sport in ['walking', 'running', 'hiking']
@@ -186,6 +196,16 @@ class Activities(ActivitiesDb.Base, ActivitiesCommon):
         }
         return stats
 
+    @classmethod
+    def s_get_grouped_stats(cls, session, start_ts, end_ts):
+        """Return a DailyStats instance with the same statistics as get_stats for each day in the time span."""
+        stats = [
+            GroupedStat('activities', cls.activity_id, 'count'),
+            GroupedStat('activities_calories', cls.calories, 'sum'),
+            GroupedStat('activities_distance', cls.distance, 'sum'),
+        ]
+        return DailyStats.s_get(session, cls, stats, start_ts, end_ts)
+
 
 class ActivityLaps(ActivitiesDb.Base, ActivitiesCommon):
     """Class that holds data for an activity lap."""
@@ -299,7 +319,7 @@ class ActivityRecords(ActivitiesDb.Base, idbutils.DbObject):
     speed = Column(Float)           # kmph or mph
     temperature = Column(Float)     # C or F
 
-    __table_args__ = (PrimaryKeyConstraint("activity_id", "record"),)
+    __table_args__ = (PrimaryKeyConstraint("activity_id", "record"), Index('ix_activity_records_activity_id_timestamp', 'activity_id', 'timestamp'))
 
     @classmethod
     def s_get_activity(cls, session, activity_id):
@@ -312,6 +332,26 @@ class ActivityRecords(ActivitiesDb.Base, idbutils.DbObject):
         with db.managed_session() as session:
             return cls.s_get_activity(session, activity_id)
 
+    @classmethod
+    def s_insert_new(cls, session, records):
+        """Insert the records whose (activity_id, record) keys aren't in the table yet with one bulk insert. Return the number of records inserted."""
+        activity_ids = {record['activity_id'] for record in records}
+        if not activity_ids:
+            return 0
+        # records are written in chunks for large files, only the keys in the chunk's range of record numbers need to be checked
+        record_nums = [record['record'] for record in records]
+        query = session.query(cls.activity_id, cls.record).filter(cls.activity_id.in_(activity_ids), cls.record.between(min(record_nums), max(record_nums)))
+        existing = {(row.activity_id, row.record) for row in query}
+        new_records = []
+        for record in records:
+            key = (record['activity_id'], record['record'])
+            if key not in existing:
+                existing.add(key)
+                new_records.append(record)
+        if new_records:
+            session.execute(insert(cls), new_records)
+        return len(new_records)
+
     @hybrid_property
     def position(self):
         """Return the location where the record was recorded."""
@@ -323,6 +363,211 @@ class ActivityRecords(ActivitiesDb.Base, idbutils.DbObject):
         self.position_long = location.long_deg
 
 
+class ActivityStorage(enum.Enum):
+    """How the records of activities are stored: a row per record in activity_records, and with streams also a row of compressed arrays per activity in activity_streams."""
+
+    records = 'records'
+    streams = 'streams'
+
+
+def import_numpy():
+    """Return the numpy module, which is only needed for reading activity streams as arrays, raising an ImportError that explains what to install if it's missing."""
+    try:
+        import numpy
+        return numpy
+    except ImportError as e:
+        raise ImportError(f"Reading activity streams as arrays requires numpy, install it with 'pip install numpy': {e}") from e
+
+
+class ActivityStreams(ActivitiesDb.Base, idbutils.DbObject):
+    """
+    The records of an activity stored as one compressed, typed array per record channel.
+
+    Each channel is a zlib compressed little endian array: timestamps as the seconds since the previous record (the first since start_time),
+    positions as int32 semicircles, and the other channels as int16 or float64 values. Missing values are the channel's null value for
+    integer channels and NaN for float channels, channels with no values are NULL. The records are written to activity_records as well, so
+    SQL users and any database client can still query them as rows.
+    """
+
+    __tablename__ = 'activity_streams'
+
+    db = ActivitiesDb
+    table_version = 1
+
+    activity_id = Column(String, ForeignKey('activities.activity_id'), primary_key=True)
+    record_count = Column(Integer)
+    start_time = Column(DateTime)
+    timestamp = Column(LargeBinary)
+    position_lat = Column(LargeBinary)
+    position_long = Column(LargeBinary)
+    distance = Column(LargeBinary)
+    cadence = Column(LargeBinary)
+    altitude = Column(LargeBinary)
+    hr = Column(LargeBinary)
+    rr = Column(LargeBinary)
+    power = Column(LargeBinary)
+    speed = Column(LargeBinary)
+    temperature = Column(LargeBinary)
+
+    # the array typecode of each channel
+    channels = {
+        'timestamp'     : 'i',
+        'position_lat'  : 'i',
+        'position_long' : 'i',
+        'distance'      : 'd',
+        'cadence'       : 'h',
+        'altitude'      : 'd',
+        'hr'            : 'h',
+        'rr'            : 'd',
+        'power'         : 'h',
+        'speed'         : 'd',
+        'temperature'   : 'd'
+    }
+    dtypes = {'h': '<i2', 'i': '<i4', 'd': '<f8'}
+    null_values = {'h': -2 ** 15, 'i': -2 ** 31, 'd': float('nan')}
+    position_channels = ['position_lat', 'position_long']
+    degrees_per_semicircle = 180.0 / 2147483648.0
+
+    @classmethod
+    def encode_value(cls, name, value):
+        """Return the value of a record column as it's stored in the channel's array."""
+        typecode = cls.channels[name]
+        if value is None:
+            return cls.null_values[typecode]
+        if name in cls.position_channels:
+            return round(value / cls.degrees_per_semicircle)
+        if typecode == 'd':
+            return float(value)
+        return round(value)
+
+    @classmethod
+    def decode_value(cls, name, value):
+        """Return the value of a record column from the value stored in the channel's array."""
+        typecode = cls.channels[name]
+        if value != value or value == cls.null_values[typecode]:
+            return None
+        if name in cls.position_channels:
+            return value * cls.degrees_per_semicircle
+        return value
+
+    @classmethod
+    def encode_channel(cls, values):
+        """Return the compressed little endian bytes of a channel's array."""
+        if sys.byteorder == 'big':
+            values = array.array(values.typecode, values)
+            values.byteswap()
+        return zlib.compress(values.tobytes())
+
+    @classmethod
+    def decode_channel(cls, name, blob):
+        """Return the array of a channel from its compressed bytes."""
+        values = array.array(cls.channels[name])
+        values.frombytes(zlib.decompress(blob))
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return values
+
+    @classmethod
+    @functools.lru_cache(maxsize=32)
+    def _decoded_values(cls, name, blob, start_time=None):
+        values = cls.decode_channel(name, blob)
+        if name == 'timestamp':
+            timestamps = []
+            timestamp = start_time
+            for seconds in values:
+                timestamp += datetime.timedelta(seconds=seconds)
+                timestamps.append(timestamp)
+            return timestamps
+        return [cls.decode_value(name, value) for value in values]
+
+    def values(self, name):
+        """Return a list of the values of a record column, None for missing values."""
+        blob = getattr(self, name)
+        if blob is None:
+            return [None] * self.record_count
+        return self._decoded_values(name, blob, self.start_time)
+
+    @classmethod
+    def s_get_records(cls, session, activity_id):
+        """Return the records of an activity's stream as ActivityRecords instances that aren't added to the session."""
+        stream = session.query(cls).filter(cls.activity_id == activity_id).one_or_none()
+        if stream is None:
+            return []
+        channel_values = {name: stream.values(name) for name in cls.channels}
+        return [ActivityRecords(activity_id=activity_id, record=record_num, **{name: values[record_num] for name, values in channel_values.items()})
+                for record_num in range(stream.record_count)]
+
+    def arrays(self):
+        """
+        Return a dict of channel name to NumPy array of the values of the stream.
+
+        The arrays other than the timestamps are read only and share the memory of the decompressed channel without copying it: positions
+        are int32 semicircles and missing values are the channel's null value or NaN. Timestamps are a datetime64 array.
+        """
+        numpy = import_numpy()
+        arrays = {}
+        for name, typecode in self.channels.items():
+            blob = getattr(self, name)
+            if blob is None:
+                arrays[name] = numpy.full(self.record_count, self.null_values[typecode], dtype=self.dtypes[typecode])
+            else:
+                arrays[name] = numpy.frombuffer(zlib.decompress(blob), dtype=self.dtypes[typecode])
+        arrays['timestamp'] = numpy.datetime64(self.start_time, 's') + numpy.cumsum(arrays['timestamp'], dtype='int64').astype('timedelta64[s]')
+        return arrays
+
+    @classmethod
+    def s_get_arrays(cls, session, activity_id):
+        """Return a dict of channel name to NumPy array of the values of an activity's stream, None if the activity doesn't have a stream."""
+        stream = session.query(cls).filter(cls.activity_id == activity_id).one_or_none()
+        return stream.arrays() if stream is not None else None
+
+    @classmethod
+    def get_arrays(cls, db, activity_id):
+        """Return a dict of channel name to NumPy array of the values of an activity's stream, None if the activity doesn't have a stream."""
+        with db.managed_session() as session:
+            return cls.s_get_arrays(session, activity_id)
+
+
+class ActivityStreamBuffer():
+    """Collects the records of an activity, in the order they were recorded, into typed arrays and writes them as the activity's stream."""
+
+    def __init__(self, activity_id):
+        """Return a new ActivityStreamBuffer for the activity."""
+        self.activity_id = activity_id
+        self.start_time = None
+        self.last_timestamp = None
+        self.record_count = 0
+        self.arrays = {name: array.array(typecode) for name, typecode in ActivityStreams.channels.items()}
+        self.channels_with_values = set()
+
+    def add(self, records):
+        """Add a list of record dicts, numbered consecutively from the number of records already added."""
+        for record in records:
+            if record['record'] != self.record_count:
+                raise ValueError(f"Record {record['record']} of activity {self.activity_id} added out of order, expected {self.record_count}")
+            timestamp = record['timestamp']
+            if self.start_time is None:
+                self.start_time = self.last_timestamp = timestamp
+            self.arrays['timestamp'].append(round((timestamp - self.last_timestamp).total_seconds()))
+            self.last_timestamp = timestamp
+            for name, values in self.arrays.items():
+                if name != 'timestamp':
+                    value = record.get(name)
+                    if value is not None:
+                        self.channels_with_values.add(name)
+                    values.append(ActivityStreams.encode_value(name, value))
+            self.record_count += 1
+
+    def flush(self, session):
+        """Write the activity's stream, replacing any stream it already has. Return the number of records written."""
+        if self.record_count:
+            stream = {'activity_id': self.activity_id, 'record_count': self.record_count, 'start_time': self.start_time}
+            for name, values in self.arrays.items():
+                stream[name] = ActivityStreams.encode_channel(values) if name == 'timestamp' or name in self.channels_with_values else None
+            ActivityStreams.s_insert_or_update(session, stream, ignore_none=False)
+        return self.record_count
+
+
 class ActivitiesDevices(ActivitiesDb.Base, idbutils.DbObject):
     """Class represents a database table that maps device ids to activities (by id) that they were used in."""
 
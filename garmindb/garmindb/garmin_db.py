@@ -8,12 +8,19 @@ import os
 import datetime
 import logging
 import re
-from sqlalchemy import Column, Integer, Date, DateTime, Time, Float, String, Enum, ForeignKey, func, PrimaryKeyConstraint
+import enum
+import hashlib
+from sqlalchemy import Column, Integer, Date, DateTime, Time, Float, String, Enum, ForeignKey, func, PrimaryKeyConstraint, Index
 from sqlalchemy.ext.hybrid import hybrid_property
 
 import fitfile
 import idbutils
 
+from .upsert import s_upsert
+from .grouped_stats import GroupedStat, DailyStats, secs_to_time
+from .rollup import RollupBase
+from .sqlite_profile import ProfiledDb
+
 
 logger = logging.getLogger(__name__)
 
@@ -26,7 +33,7 @@ class GarminDbError_IdNotFound(GarminDbError):
     """File id not found"""
 
 
-GarminDb = idbutils.DB.create('garmin', 14, "Database for storing health data from a Garmin device.")
+GarminDb = ProfiledDb.create('garmin', 14, "Database for storing health data from a Garmin device.")
 
 
 class Attributes(GarminDb.Base, idbutils.KeyValueObject):
@@ -211,6 +218,22 @@ class Weight(GarminDb.Base, idbutils.DbObject):
             'visceral_fat_avg': cls.s_get_col_avg(session, cls.visceral_fat, start_ts, end_ts, True)
         }
 
+    @classmethod
+    def s_get_grouped_stats(cls, session, start_ts, end_ts):
+        """Return a DailyStats instance with the same statistics as get_stats for each day in the time span."""
+        stats = [
+            GroupedStat('weight_avg', cls.weight, 'avg', True),
+            GroupedStat('weight_min', cls.weight, 'min', True),
+            GroupedStat('weight_max', cls.weight, 'max'),
+            GroupedStat('bmi_avg', cls.bmi, 'avg', True),
+            GroupedStat('body_fat_avg', cls.body_fat, 'avg', True),
+            GroupedStat('body_water_avg', cls.body_water, 'avg', True),
+            GroupedStat('bone_mass_avg', cls.bone_mass, 'avg', True),
+            GroupedStat('muscle_mass_avg', cls.muscle_mass, 'avg', True),
+            GroupedStat('visceral_fat_avg', cls.visceral_fat, 'avg', True)
+        ]
+        return DailyStats.s_get(session, cls, stats, start_ts, end_ts)
+
 
 class Stress(GarminDb.Base, idbutils.DbObject):
     """Class representing a stress reading."""
@@ -230,6 +253,21 @@ class Stress(GarminDb.Base, idbutils.DbObject):
             'stress_avg': cls.s_get_col_avg(session, cls.stress, start_ts, end_ts, True),
         }
 
+    @classmethod
+    def s_get_grouped_stats(cls, session, start_ts, end_ts):
+        """Return a DailyStats instance with the same statistics as get_stats for each day in the time span."""
+        return DailyStats.s_get(session, cls, [GroupedStat('stress_avg', cls.stress, 'avg', True)], start_ts, end_ts)
+
+
+class StressRollup(GarminDb.Base, RollupBase):
+    """Class representing a table of stress readings rolled up to 5 minutes, hours, and days."""
+
+    __tablename__ = 'stress_rollup'
+
+    db = GarminDb
+    source_table = Stress
+    source_col_name = 'stress'
+
 
 class Sleep(GarminDb.Base, idbutils.DbObject):
     """Class representing a sleep session."""
@@ -265,6 +303,19 @@ class Sleep(GarminDb.Base, idbutils.DbObject):
             'rem_sleep_max' : cls.s_get_time_col_max(session, cls.rem_sleep, start_ts, end_ts),
         }
 
+    @classmethod
+    def s_get_grouped_stats(cls, session, start_ts, end_ts):
+        """Return a DailyStats instance with the same statistics as get_stats for each day in the time span."""
+        stats = [
+            GroupedStat('sleep_avg', cls.total_sleep, 'avg', time=True),
+            GroupedStat('sleep_min', cls.total_sleep, 'min', time=True),
+            GroupedStat('sleep_max', cls.total_sleep, 'max', time=True),
+            GroupedStat('rem_sleep_avg', cls.rem_sleep, 'avg', time=True),
+            GroupedStat('rem_sleep_min', cls.rem_sleep, 'min', time=True),
+            GroupedStat('rem_sleep_max', cls.rem_sleep, 'max', time=True),
+        ]
+        return DailyStats.s_get(session, cls, stats, start_ts, end_ts)
+
 
 class SleepEvents(GarminDb.Base, idbutils.DbObject):
     """Table that stores events recorded during sleep."""
@@ -278,6 +329,9 @@ class SleepEvents(GarminDb.Base, idbutils.DbObject):
     event = Column(String)
     duration = Column(Time, nullable=False, default=datetime.time.min)
 
+    # covers the per sleep level queries
+    __table_args__ = (Index('ix_sleep_events_event_timestamp', 'event', 'timestamp', 'duration'),)
+
     @classmethod
     def get_wake_time(cls, db, day_date):
         """Return the wake time for a given date."""
@@ -294,7 +348,10 @@ class SleepEvents(GarminDb.Base, idbutils.DbObject):
         day_stop_ts = datetime.datetime.combine(day_date, datetime.time.max)
         result = cls._s_query(session, cls._time_from_secs(func.sum(cls._secs_from_time(cls.duration))), None, day_start_ts, day_stop_ts,
                               cls._secs_from_time(cls.duration)).filter(cls.event == sleep_level).scalar()
-        return datetime.datetime.strptime(result, '%H:%M:%S').time() if result is not None else datetime.time.min
+        if result is None:
+            return datetime.time.min
+        # the Time typed expression is returned as a time by newer versions of idbutils and as a string by older ones
+        return datetime.datetime.strptime(result, '%H:%M:%S').time() if isinstance(result, str) else result
 
     @classmethod
     def get_day_stats(cls, session, day_date):
@@ -336,6 +393,16 @@ class RestingHeartRate(GarminDb.Base, idbutils.DbObject):
             'rhr_max': cls.s_get_col_max(session, cls.resting_heart_rate, start_ts, end_ts),
         }
 
+    @classmethod
+    def s_get_grouped_stats(cls, session, start_ts, end_ts):
+        """Return a DailyStats instance with the same statistics as get_stats for each day in the time span."""
+        stats = [
+            GroupedStat('rhr_avg', cls.resting_heart_rate, 'avg', True),
+            GroupedStat('rhr_min', cls.resting_heart_rate, 'min', True),
+            GroupedStat('rhr_max', cls.resting_heart_rate, 'max'),
+        ]
+        return DailyStats.s_get(session, cls, stats, start_ts, end_ts)
+
 
 class Hrv(GarminDb.Base, idbutils.DbObject):
     """Class representing daily Heart Rate Variability (HRV) data."""
@@ -521,3 +588,196 @@ class DailySummary(GarminDb.Base, idbutils.DbObject):
         )
         stats['first_day'] = first_day_ts
         return stats
+
+    @classmethod
+    def s_get_grouped_stats(cls, session, start_ts, end_ts):
+        """Return a DailyStats instance with the same statistics as get_stats for each day in the time span."""
+        stats = [
+            GroupedStat('rhr_avg', cls.rhr, 'avg'),
+            GroupedStat('rhr_min', cls.rhr, 'min'),
+            GroupedStat('rhr_max', cls.rhr, 'max'),
+            GroupedStat('stress_avg', cls.stress_avg, 'avg'),
+            GroupedStat('steps', cls.steps, 'sum'),
+            GroupedStat('steps_goal', cls.step_goal, 'sum'),
+            GroupedStat('floors', cls.floors_up, 'sum'),
+            GroupedStat('floors_goal', cls.floors_goal, 'sum'),
+            GroupedStat('intensity_time', cls.intensity_time, 'avg', time=True),
+            GroupedStat('moderate_activity_time', cls.moderate_activity_time, 'avg', time=True),
+            GroupedStat('vigorous_activity_time', cls.vigorous_activity_time, 'sum', time=True),
+            GroupedStat('intensity_time_goal', cls.intensity_time_goal, 'avg', time=True),
+            GroupedStat('calories_goal', cls.calories_goal, 'sum'),
+            GroupedStat('calories_avg', cls.calories_total, 'avg'),
+            GroupedStat('calories_bmr_avg', cls.calories_bmr, 'avg'),
+            GroupedStat('calories_active_avg', cls.calories_active, 'avg'),
+            GroupedStat('calories_consumed_avg', cls.calories_consumed, 'avg'),
+            GroupedStat('hydration_goal', cls.hydration_goal, 'sum'),
+            GroupedStat('hydration_avg', cls.hydration_intake, 'avg'),
+            GroupedStat('hydration_intake', cls.hydration_intake, 'sum'),
+            GroupedStat('sweat_loss_avg', cls.sweat_loss, 'avg'),
+            GroupedStat('sweat_loss', cls.sweat_loss, 'sum'),
+            GroupedStat('spo2_avg', cls.spo2_avg, 'avg'),
+            GroupedStat('spo2_min', cls.spo2_min, 'min'),
+            GroupedStat('rr_waking_avg', cls.rr_waking_avg, 'avg'),
+            GroupedStat('rr_max', cls.rr_max, 'max'),
+            GroupedStat('rr_min', cls.rr_min, 'min'),
+            GroupedStat('bb_max', cls.bb_max, 'avg'),
+            GroupedStat('bb_min', cls.bb_min, 'avg'),
+        ]
+        return DailySummaryStats.s_get(session, cls, stats, start_ts, end_ts)
+
+
+class DailySummaryStats(DailyStats):
+    """Per day statistics for the daily summary table with the same handling of the weekly intensity time goal as DailySummary."""
+
+    def get_daily_stats(self, day_ts):
+        """Return a dictionary of aggregate statistics for the given day."""
+        stats = super().get_daily_stats(day_ts)
+        # intensity_time_goal is a weekly goal, so the daily value is 1/7 of the weekly goal
+        stats['intensity_time_goal'] = secs_to_time(fitfile.conversions.time_to_secs(stats['intensity_time_goal']) // 7)
+        return stats
+
+    def get_monthly_stats(self, first_day_ts, last_day_ts):
+        """Return a dictionary of aggregate statistics for the given month."""
+        stats = super().get_monthly_stats(first_day_ts, last_day_ts)
+        # intensity time is a weekly goal, so sum up the weekly average values
+        weekly_goals = [self.get_stats(first_day_ts + datetime.timedelta(week * 7), first_day_ts + datetime.timedelta((week + 1) * 7))['intensity_time_goal']
+                        for week in range(4)]
+        stats['intensity_time_goal'] = fitfile.conversions.add_time(
+            fitfile.conversions.add_time(weekly_goals[0], weekly_goals[1]),
+            fitfile.conversions.add_time(weekly_goals[2], weekly_goals[3])
+        )
+        return stats
+
+
+class SummaryDirty(GarminDb.Base, idbutils.DbObject):
+    """Table of days that have had data imported since the summary tables were last calculated."""
+
+    __tablename__ = 'summary_dirty'
+
+    db = GarminDb
+    table_version = 1
+
+    day = Column(Date, primary_key=True)
+
+    @classmethod
+    def s_mark_days(cls, session, days):
+        """Mark the given days as needing their summaries recalculated."""
+        s_upsert(session, cls, [{'day': day} for day in set(days)])
+
+    @classmethod
+    def mark_days(cls, db, days):
+        """Mark the given days as needing their summaries recalculated."""
+        with db.managed_session() as session:
+            cls.s_mark_days(session, days)
+
+    @classmethod
+    def s_mark_period(cls, session, start, end):
+        """Mark all days from the start date or datetime through the end date or datetime as needing their summaries recalculated."""
+        start_day = start.date() if isinstance(start, datetime.datetime) else start
+        end_day = end.date() if isinstance(end, datetime.datetime) else end
+        cls.s_mark_days(session, [start_day + datetime.timedelta(days=day) for day in range((end_day - start_day).days + 1)])
+
+    @classmethod
+    def get_days(cls, db):
+        """Return a sorted list of the days that need their summaries recalculated."""
+        with db.managed_session() as session:
+            return [row.day for row in session.query(cls.day).order_by(cls.day)]
+
+    @classmethod
+    def clear_days(cls, db, days):
+        """Remove the given days from the table once their summaries have been recalculated."""
+        days = list(days)
+        with db.managed_session() as session:
+            for index in range(0, len(days), 500):
+                session.query(cls).filter(cls.day.in_(days[index:index + 500])).delete(synchronize_session=False)
+
+
+class ExportDirty(GarminDb.Base, idbutils.DbObject):
+    """Table of the days of each exported table that have had data imported since the table was last exported."""
+
+    __tablename__ = 'export_dirty'
+
+    db = GarminDb
+    table_version = 1
+
+    table_name = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+
+    @classmethod
+    def s_mark_period(cls, session, tables, start, end):
+        """Mark all days from the start date or datetime through the end date or datetime as needing the given tables exported again."""
+        start_day = start.date() if isinstance(start, datetime.datetime) else start
+        end_day = end.date() if isinstance(end, datetime.datetime) else end
+        days = [start_day + datetime.timedelta(days=day) for day in range((end_day - start_day).days + 1)]
+        s_upsert(session, cls, [{'table_name': table.__tablename__, 'day': day} for table in tables for day in days])
+
+    @classmethod
+    def get_days(cls, db, table):
+        """Return a sorted list of the days of the table that need to be exported again."""
+        with db.managed_session() as session:
+            return [row.day for row in session.query(cls.day).filter(cls.table_name == table.__tablename__).order_by(cls.day)]
+
+    @classmethod
+    def clear_days(cls, db, table, days):
+        """Remove the given days of the table once they have been exported."""
+        days = list(days)
+        with db.managed_session() as session:
+            for index in range(0, len(days), 500):
+                session.query(cls).filter(cls.table_name == table.__tablename__, cls.day.in_(days[index:index + 500])).delete(synchronize_session=False)
+
+
+class ImportLedger(GarminDb.Base, idbutils.DbObject):
+    """Table of the files that have been imported, used to only import files that are new or have changed since they were last imported."""
+
+    __tablename__ = 'import_ledger'
+
+    db = GarminDb
+    table_version = 1
+
+    class Status(enum.Enum):
+        """The result of importing a file."""
+
+        imported    = 0
+        failed      = 1
+        skipped     = 2     # the file was read, but it isn't the type of file the importer imports
+        existing    = 3     # the file was present when the ledger was started and is assumed to have been imported
+
+    # paths can be longer than some databases allow keys to be, so entries are keyed on a hash of the path
+    path_hash = Column(String(40), primary_key=True)
+    importer = Column(String(64), primary_key=True)
+    path = Column(String)
+    size = Column(Integer)
+    mtime = Column(Float)
+    hash = Column(String)
+    status = Column(Enum(Status))
+    rows = Column(Integer)
+    duration = Column(Float)
+    timestamp = Column(DateTime)
+    error = Column(String)
+
+    @classmethod
+    def get_entries(cls, db, importer):
+        """Return a dict of the ledger entries for an importer keyed by path."""
+        with db.managed_session() as session:
+            query = session.query(cls.path, cls.size, cls.mtime, cls.hash, cls.status).filter(cls.importer == importer)
+            return {entry.path: entry for entry in query.all()}
+
+    @classmethod
+    def hash_path(cls, path):
+        """Return the hash of a file's path that its entries are keyed on."""
+        return hashlib.sha1(path.encode()).hexdigest()
+
+    @classmethod
+    def record(cls, db, entries):
+        """Insert or update the ledger entries given as a list of dicts."""
+        with db.managed_session() as session:
+            s_upsert(session, cls, [dict(entry, path_hash=cls.hash_path(entry['path'])) for entry in entries])
+
+    @classmethod
+    def clear(cls, db, importers=None):
+        """Remove the entries of the given importers, or all entries, from the ledger so that their files are imported again."""
+        with db.managed_session() as session:
+            query = session.query(cls)
+            if importers is not None:
+                query = query.filter(cls.importer.in_(importers))
+            query.delete(synchronize_session=False)
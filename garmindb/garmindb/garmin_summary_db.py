@@ -11,11 +11,13 @@ from sqlalchemy import Column, Integer, Date, DateTime
 import idbutils
 
 from ..summarydb import SummaryBase
+from .grouped_stats import GroupedStat, DailyStats
+from .sqlite_profile import ProfiledDb
 
 
 logger = logging.getLogger(__name__)
 
-GarminSummaryDb = idbutils.DB.create('garmin_summary', 8, "Database for storing health summary data from a Garmin device.")
+GarminSummaryDb = ProfiledDb.create('garmin_summary', 8, "Database for storing health summary data from a Garmin device.")
 Summary = idbutils.DbObject.create('summary', GarminSummaryDb, 1, base=idbutils.KeyValueObject)
 
 
@@ -119,3 +121,13 @@ class IntensityHR(GarminSummaryDb.Base, idbutils.DbObject):
             'inactive_hr_min' : cls.s_get_col_min_for_value(session, cls.heart_rate, cls.intensity, 0, start_ts, end_ts, True),
             'inactive_hr_max' : cls.s_get_col_max_for_value(session, cls.heart_rate, cls.intensity, 0, start_ts, end_ts, True),
         }
+
+    @classmethod
+    def s_get_grouped_stats(cls, session, start_ts, end_ts):
+        """Return a DailyStats instance with the same statistics as get_stats for each day in the time span."""
+        stats = [
+            GroupedStat('inactive_hr_avg', cls.heart_rate, 'avg', True, cls.intensity == 0),
+            GroupedStat('inactive_hr_min', cls.heart_rate, 'min', True, cls.intensity == 0),
+            GroupedStat('inactive_hr_max', cls.heart_rate, 'max', True, cls.intensity == 0),
+        ]
+        return DailyStats.s_get(session, cls, stats, start_ts, end_ts)
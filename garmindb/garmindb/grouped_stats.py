@@ -0,0 +1,174 @@
+"""Objects for computing per day statistics with one grouped query per table and rolling them up to longer periods."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+import datetime
+from sqlalchemy import func, case, and_
+
+
+logger = logging.getLogger(__name__)
+
+
+def secs_to_time(secs):
+    """Convert seconds to a time value the same way the database does: truncated to whole seconds and wrapped within a day."""
+    if secs is None:
+        return datetime.time.min
+    total = (int(round(secs * 1000)) // 1000) % 86400
+    return datetime.time(total // 3600, (total % 3600) // 60, total % 60)
+
+
+class GroupedStat():
+    """
+    A statistic that is computed for every day from a table column and rolled up from the daily values to weeks, months, and years.
+
+    The daily values are kept in a form that rolls up exactly: averages as a sum and a count, minimums, maximums, and sums as is.
+    """
+
+    funcs = ['avg', 'min', 'max', 'sum', 'count', 'sum_of_max', 'avg_of_max']
+
+    def __init__(self, name, col, func_name, ignore_le_zero=False, where=None, time=False):
+        """
+        Return a new GroupedStat instance.
+
+        Parameters:
+        ----------
+        name (string): the key the statistic is returned under
+        col (Column): the column or column expression the statistic is computed from
+        func_name (string): the aggregate to compute, one of GroupedStat.funcs. sum_of_max and avg_of_max are the sum and average of the daily maximums.
+        ignore_le_zero (Boolean): ignore values that are less than or equal to zero
+        where (expression): only include rows that match this expression
+        time (Boolean): the column is a time column, values are aggregated as seconds and zero values are ignored
+
+        """
+        if func_name not in self.funcs:
+            raise ValueError(f'Unknown aggregate {func_name} for {name}')
+        self.name = name
+        self.col = col
+        self.func_name = func_name
+        self.ignore_le_zero = ignore_le_zero
+        self.where = where
+        self.time = time
+
+    def selectables(self, table):
+        """Return the aggregate columns needed to compute the statistic for a group of rows."""
+        value = table._secs_from_time(self.col) if self.time else self.col
+        conditions = []
+        if self.ignore_le_zero or self.time:
+            conditions.append(value > 0)
+        if self.where is not None:
+            conditions.append(self.where)
+        if conditions:
+            # Filtering with CASE instead of WHERE lets each statistic have its own filter while sharing a single query.
+            value = case((and_(*conditions), value))
+        if self.func_name == 'avg':
+            return [func.sum(value), func.count(value)]
+        if self.func_name == 'min':
+            return [func.min(value)]
+        if self.func_name in ['max', 'sum_of_max', 'avg_of_max']:
+            return [func.max(value)]
+        if self.func_name == 'sum':
+            return [func.sum(value)]
+        return [func.count(value)]
+
+    def daily_value(self, columns):
+        """Return the value kept for a day from the aggregate columns returned by the query."""
+        if self.func_name == 'avg':
+            return (columns[0], columns[1])
+        return columns[0]
+
+    def rollup(self, daily_values):
+        """Return the value of the statistic for a period from the values of the days in the period."""
+        if self.func_name == 'avg':
+            count = sum(daily_value[1] for daily_value in daily_values)
+            value = (sum(daily_value[0] for daily_value in daily_values if daily_value[0] is not None) / count) if count else None
+        elif self.func_name == 'count':
+            value = sum(daily_values)
+        else:
+            values = [daily_value for daily_value in daily_values if daily_value is not None]
+            if not values:
+                value = None
+            elif self.func_name == 'min':
+                value = min(values)
+            elif self.func_name == 'max':
+                value = max(values)
+            elif self.func_name == 'avg_of_max':
+                value = sum(values) / len(values)
+            else:
+                value = sum(values)
+        return secs_to_time(value) if self.time else value
+
+
+class DailyStats():
+    """Per day statistics for a table, queried once and then used to generate daily, weekly, monthly, and yearly statistics."""
+
+    def __init__(self, stats, daily_values):
+        """
+        Return a new DailyStats instance.
+
+        Parameters:
+        ----------
+        stats (list): the GroupedStat instances that were computed
+        daily_values (dict): for each day, a list with the day's value for each statistic
+
+        """
+        self.stats = stats
+        self.daily_values = daily_values
+
+    @classmethod
+    def s_get(cls, session, table, stats, start_ts, end_ts, **kwargs):
+        """Return a DailyStats instance for the table's rows within the time span computed with a single query grouped by day."""
+        day_col = func.date(table.time_col)
+        selectables = [day_col]
+        stat_columns = []
+        for stat in stats:
+            stat_selectables = stat.selectables(table)
+            stat_columns.append(slice(len(selectables), len(selectables) + len(stat_selectables)))
+            selectables.extend(stat_selectables)
+        query = session.query(*selectables).filter(table.during(start_ts, end_ts)).group_by(day_col)
+        daily_values = {}
+        for row in query.all():
+            day = row[0] if isinstance(row[0], datetime.date) else datetime.date.fromisoformat(row[0])
+            daily_values[day] = [stat.daily_value(row[columns]) for stat, columns in zip(stats, stat_columns)]
+        logger.debug("Found %d days of stats in %s from %s to %s", len(daily_values), table.__tablename__, start_ts, end_ts)
+        return cls(stats, daily_values, **kwargs)
+
+    @classmethod
+    def __to_date(cls, ts):
+        return ts.date() if isinstance(ts, datetime.datetime) else ts
+
+    def days(self):
+        """Return a sorted list of the days that have data."""
+        return sorted(self.daily_values.keys())
+
+    def get_stats(self, start_ts, end_ts):
+        """Return a dict of stats for the days within the time span."""
+        start_day = self.__to_date(start_ts)
+        end_day = self.__to_date(end_ts)
+        period_values = [values for day, values in self.daily_values.items() if day >= start_day and day < end_day]
+        return {stat.name: stat.rollup([values[index] for values in period_values]) for index, stat in enumerate(self.stats)}
+
+    def get_daily_stats(self, day_ts):
+        """Return a dict of stats for the given day."""
+        stats = self.get_stats(day_ts, day_ts + datetime.timedelta(1))
+        stats['day'] = day_ts
+        return stats
+
+    def get_weekly_stats(self, first_day_ts):
+        """Return a dict of stats for the week starting on the given day."""
+        stats = self.get_stats(first_day_ts, first_day_ts + datetime.timedelta(7))
+        stats['first_day'] = first_day_ts
+        return stats
+
+    def get_monthly_stats(self, first_day_ts, last_day_ts):
+        """Return a dict of stats for the month."""
+        stats = self.get_stats(first_day_ts, last_day_ts)
+        stats['first_day'] = first_day_ts
+        return stats
+
+    def get_yearly_stats(self, year):
+        """Return a dict of stats for the year."""
+        first_day_ts = datetime.datetime(year=year, month=1, day=1)
+        return self.get_monthly_stats(first_day_ts, first_day_ts + datetime.timedelta(365))
@@ -13,10 +13,14 @@ from sqlalchemy.ext.hybrid import hybrid_property
 import fitfile
 import idbutils
 
+from .grouped_stats import GroupedStat, DailyStats
+from .rollup import RollupBase
+from .sqlite_profile import ProfiledDb
+
 
 logger = logging.getLogger(__name__)
 
-MonitoringDb = idbutils.DB.create('garmin_monitoring', 6, "Database for storing daily health monitoring data from a Garmin device.")
+MonitoringDb = ProfiledDb.create('garmin_monitoring', 6, "Database for storing daily health monitoring data from a Garmin device.")
 
 
 class MonitoringInfo(MonitoringDb.Base, idbutils.DbObject):
@@ -77,6 +81,16 @@ class MonitoringHeartRate(MonitoringDb.Base, idbutils.DbObject):
             'hr_max' : cls.s_get_col_max(session, cls.heart_rate, start_ts, end_ts),
         }
 
+    @classmethod
+    def s_get_grouped_stats(cls, session, start_ts, end_ts):
+        """Return a DailyStats instance with the same statistics as get_stats for each day in the time span."""
+        stats = [
+            GroupedStat('hr_avg', cls.heart_rate, 'avg', True),
+            GroupedStat('hr_min', cls.heart_rate, 'min', True),
+            GroupedStat('hr_max', cls.heart_rate, 'max'),
+        ]
+        return DailyStats.s_get(session, cls, stats, start_ts, end_ts)
+
     @classmethod
     def get_resting_heartrate(cls, db, wake_ts):
         """Return a resting heart rate value for the day specified."""
@@ -84,6 +98,16 @@ class MonitoringHeartRate(MonitoringDb.Base, idbutils.DbObject):
         return cls.get_col_min(db, cls.heart_rate, start_ts, wake_ts, True)
 
 
+class MonitoringHeartRateRollup(MonitoringDb.Base, RollupBase):
+    """Class that represents a database table holding heart rate rolled up to 5 minutes, hours, and days."""
+
+    __tablename__ = 'monitoring_hr_rollup'
+
+    db = MonitoringDb
+    source_table = MonitoringHeartRate
+    source_col_name = 'heart_rate'
+
+
 class MonitoringIntensity(MonitoringDb.Base, idbutils.DbObject):
     """Class representing monitoring data about cardio minutes."""
 
@@ -118,6 +142,16 @@ class MonitoringIntensity(MonitoringDb.Base, idbutils.DbObject):
             'vigorous_activity_time'    : cls.s_get_time_col_sum(session, cls.vigorous_activity_time, start_ts, end_ts),
         }
 
+    @classmethod
+    def s_get_grouped_stats(cls, session, start_ts, end_ts):
+        """Return a DailyStats instance with the same statistics as get_stats for each day in the time span."""
+        stats = [
+            GroupedStat('intensity_time', cls.intensity_time, 'sum', time=True),
+            GroupedStat('moderate_activity_time', cls.moderate_activity_time, 'sum', time=True),
+            GroupedStat('vigorous_activity_time', cls.vigorous_activity_time, 'sum', time=True),
+        ]
+        return DailyStats.s_get(session, cls, stats, start_ts, end_ts)
+
 
 class MonitoringClimb(MonitoringDb.Base, idbutils.DbObject):
     """Class representing monitoring data about elvation gained."""
@@ -144,15 +178,7 @@ class MonitoringClimb(MonitoringDb.Base, idbutils.DbObject):
     @classmethod
     def get_stats(cls, session, func, start_ts, end_ts, measurement_system):
         """Return a dict of stats for table entries within the time span."""
-        cum_ascent = func(session, cls.cum_ascent, start_ts, end_ts)
-        if cum_ascent:
-            if measurement_system is fitfile.field_enums.DisplayMeasure.metric:
-                floors = cum_ascent / cls.feet_to_floors
-            else:
-                floors = cum_ascent / cls.meters_to_floors
-        else:
-            floors = 0
-        return {'floors' : floors}
+        return {'floors' : cls.floors(func(session, cls.cum_ascent, start_ts, end_ts), measurement_system)}
 
     @classmethod
     def get_daily_stats(cls, session, day_ts, measurement_system):
@@ -183,6 +209,34 @@ class MonitoringClimb(MonitoringDb.Base, idbutils.DbObject):
         stats['first_day'] = first_day_ts
         return stats
 
+    @classmethod
+    def floors(cls, cum_ascent, measurement_system):
+        """Return the number of floors climbed for the given ascent."""
+        if cum_ascent:
+            if measurement_system is fitfile.field_enums.DisplayMeasure.metric:
+                return cum_ascent / cls.feet_to_floors
+            return cum_ascent / cls.meters_to_floors
+        return 0
+
+    @classmethod
+    def s_get_grouped_stats(cls, session, start_ts, end_ts, measurement_system):
+        """Return a DailyStats instance with the same statistics as get_stats for each day in the time span."""
+        return MonitoringClimbStats.s_get(session, cls, [GroupedStat('cum_ascent', cls.cum_ascent, 'sum_of_max')], start_ts, end_ts,
+                                          measurement_system=measurement_system)
+
+
+class MonitoringClimbStats(DailyStats):
+    """Per day climb statistics. A day's ascent is the day's maximum cumulative ascent and longer periods sum the days."""
+
+    def __init__(self, stats, daily_values, measurement_system):
+        """Return a new MonitoringClimbStats instance that reports floors in the given measurement system."""
+        super().__init__(stats, daily_values)
+        self.measurement_system = measurement_system
+
+    def get_stats(self, start_ts, end_ts):
+        """Return a dict of stats for the days within the time span."""
+        return {'floors' : MonitoringClimb.floors(super().get_stats(start_ts, end_ts)['cum_ascent'], self.measurement_system)}
+
 
 class Monitoring(MonitoringDb.Base, idbutils.DbObject):
     """A table containing monitoring data."""
@@ -249,6 +303,30 @@ class Monitoring(MonitoringDb.Base, idbutils.DbObject):
         stats['first_day'] = first_day_ts
         return stats
 
+    @classmethod
+    def s_get_grouped_stats(cls, session, start_ts, end_ts):
+        """Return a DailyStats instance with the same statistics as get_stats for each day in the time span."""
+        stats = [GroupedStat('steps', cls.steps, 'sum_of_max')]
+        stats += [
+            GroupedStat(activity_type.name, cls.active_calories, 'avg_of_max', where=(cls.activity_type == activity_type))
+            for activity_type in MonitoringStats.active_calories_activity_types
+        ]
+        return MonitoringStats.s_get(session, cls, stats, start_ts, end_ts)
+
+
+class MonitoringStats(DailyStats):
+    """Per day monitoring statistics. A day's steps are the day's maximum cumulative steps and longer periods sum the days."""
+
+    active_calories_activity_types = [fitfile.field_enums.ActivityType.running, fitfile.field_enums.ActivityType.cycling, fitfile.field_enums.ActivityType.walking]
+
+    def get_stats(self, start_ts, end_ts):
+        """Return a dict of stats for the days within the time span."""
+        stats = super().get_stats(start_ts, end_ts)
+        return {
+            'steps'                 : stats['steps'],
+            'calories_active_avg'   : sum(stats[activity_type.name] or 0 for activity_type in self.active_calories_activity_types)
+        }
+
 
 class MonitoringRespirationRate(MonitoringDb.Base, idbutils.DbObject):
     """Class that represents a database table holding respiration rate measured in breaths per minute."""
@@ -290,3 +368,23 @@ class MonitoringPulseOx(MonitoringDb.Base, idbutils.DbObject):
             'pulse_ox_min' : cls.s_get_col_min(session, cls.pulse_ox, start_ts, end_ts, True),
             'pulse_ox_max' : cls.s_get_col_max(session, cls.pulse_ox, start_ts, end_ts),
         }
+
+
+class MonitoringRespirationRateRollup(MonitoringDb.Base, RollupBase):
+    """Class that represents a database table holding respiration rate rolled up to 5 minutes, hours, and days."""
+
+    __tablename__ = 'monitoring_rr_rollup'
+
+    db = MonitoringDb
+    source_table = MonitoringRespirationRate
+    source_col_name = 'rr'
+
+
+class MonitoringPulseOxRollup(MonitoringDb.Base, RollupBase):
+    """Class that represents a database table holding pulse ox rolled up to 5 minutes, hours, and days."""
+
+    __tablename__ = 'monitoring_pulse_ox_rollup'
+
+    db = MonitoringDb
+    source_table = MonitoringPulseOx
+    source_col_name = 'pulse_ox'
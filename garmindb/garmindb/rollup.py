@@ -0,0 +1,145 @@
+"""Objects for tables that summarize a time series table at 5 minute, hourly, and daily resolutions."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+import datetime
+import enum
+from sqlalchemy import Column, Integer, DateTime, Float, select, func
+
+import idbutils
+
+from .upsert import s_upsert
+
+
+logger = logging.getLogger(__name__)
+
+
+class RollupResolution(enum.IntEnum):
+    """The bucket sizes, in seconds, that time series are rolled up to."""
+
+    five_minutes    = 300
+    hour            = 3600
+    day             = 86400
+
+    def bucket(self, timestamp):
+        """Return the start of the bucket that a timestamp falls in."""
+        day_start = datetime.datetime.combine(timestamp.date(), datetime.time.min)
+        seconds = int((timestamp - day_start).total_seconds())
+        return day_start + datetime.timedelta(seconds=(seconds - seconds % self.value))
+
+    @classmethod
+    def coarsest(cls, seconds):
+        """Return the coarsest resolution with buckets no longer than the given number of seconds, or None if all of the buckets are longer."""
+        resolutions = [resolution for resolution in cls if resolution <= seconds]
+        return max(resolutions) if resolutions else None
+
+
+class RollupBase(idbutils.DbObject):
+    """
+    Base class for tables that hold the minimum, average, maximum, and count of a time series table's values per 5 minutes, hour, and day.
+
+    Subclasses set source_table and source_col_name. The rollups are recomputed from the source table a day at a time, values less than or
+    equal to zero, which devices use for missing or invalid readings, are not included.
+    """
+
+    table_version = 1
+
+    resolution = Column(Integer, primary_key=True)
+    timestamp = Column(DateTime, primary_key=True)
+    min = Column(Float)
+    avg = Column(Float)
+    max = Column(Float)
+    count = Column(Integer)
+
+    @classmethod
+    def __day(cls, value):
+        return value.date() if isinstance(value, datetime.datetime) else value
+
+    @classmethod
+    def __roll_up(cls, buckets, resolution):
+        rolled_up = {}
+        for timestamp, (min_value, max_value, sum_value, count) in buckets.items():
+            key = resolution.bucket(timestamp)
+            bucket = rolled_up.get(key)
+            if bucket is None:
+                rolled_up[key] = [min_value, max_value, sum_value, count]
+            else:
+                bucket[0] = min(bucket[0], min_value)
+                bucket[1] = max(bucket[1], max_value)
+                bucket[2] += sum_value
+                bucket[3] += count
+        return rolled_up
+
+    @classmethod
+    def s_update(cls, session, start, end):
+        """Recompute the rollups for the days from start through end, inclusive, from the source table. Return the number of rollup rows written."""
+        start_ts = datetime.datetime.combine(cls.__day(start), datetime.time.min)
+        end_ts = datetime.datetime.combine(cls.__day(end), datetime.time.min) + datetime.timedelta(days=1)
+        source_time_col = cls.source_table.timestamp
+        source_col = getattr(cls.source_table, cls.source_col_name)
+        query = select(source_time_col, source_col).where(source_time_col >= start_ts, source_time_col < end_ts, source_col > 0)
+        buckets = {}
+        for timestamp, value in session.execute(query):
+            key = RollupResolution.five_minutes.bucket(timestamp)
+            bucket = buckets.get(key)
+            if bucket is None:
+                buckets[key] = [value, value, value, 1]
+            else:
+                bucket[0] = min(bucket[0], value)
+                bucket[1] = max(bucket[1], value)
+                bucket[2] += value
+                bucket[3] += 1
+        rows = []
+        for resolution in RollupResolution:
+            # each resolution is rolled up from the next finer one, the buckets of each evenly divide the buckets of the next
+            buckets = cls.__roll_up(buckets, resolution)
+            rows += [
+                {'resolution': resolution.value, 'timestamp': timestamp, 'min': min_value, 'avg': sum_value / count, 'max': max_value, 'count': count}
+                for timestamp, (min_value, max_value, sum_value, count) in buckets.items()
+            ]
+        session.query(cls).filter(cls.timestamp >= start_ts, cls.timestamp < end_ts).delete(synchronize_session=False)
+        if rows:
+            s_upsert(session, cls, rows)
+        logger.debug("Updated %d %s rows from %s to %s", len(rows), cls.__tablename__, start_ts, end_ts)
+        return len(rows)
+
+    @classmethod
+    def update(cls, db, start, end):
+        """Recompute the rollups for the days from start through end, inclusive, from the source table. Return the number of rollup rows written."""
+        with db.managed_session() as session:
+            return cls.s_update(session, start, end)
+
+    @classmethod
+    def s_get_missing_days(cls, session):
+        """Return the days, in order, that have valid values in the source table but no rollups."""
+        source_day = func.date(cls.source_table.timestamp)
+        rolled_up_days = select(func.date(cls.timestamp)).where(cls.resolution == RollupResolution.day.value)
+        query = select(source_day).where(getattr(cls.source_table, cls.source_col_name) > 0, source_day.not_in(rolled_up_days)).distinct()
+        # SQLite returns dates from func.date as strings, other databases as date objects
+        return sorted(datetime.date.fromisoformat(str(day)[:10]) for day, in session.execute(query))
+
+    @classmethod
+    def backfill(cls, db):
+        """Compute the rollups for the days that have source values but no rollups, a month at a time. Return the number of days backfilled."""
+        with db.managed_session() as session:
+            missing_days = cls.s_get_missing_days(session)
+        months = {}
+        for day in missing_days:
+            months.setdefault((day.year, day.month), []).append(day)
+        for days in months.values():
+            cls.update(db, days[0], days[-1])
+        return len(missing_days)
+
+    @classmethod
+    def s_get_for_resolution(cls, session, start_ts, end_ts, resolution):
+        """Return the rollup rows in the time span using the coarsest resolution that has buckets no longer than resolution seconds."""
+        rollup_resolution = RollupResolution.coarsest(resolution)
+        if rollup_resolution is None:
+            raise ValueError(f'No {cls.__tablename__} rollup has a resolution of {resolution} seconds or less')
+        return (
+            session.query(cls).filter(cls.resolution == rollup_resolution.value).filter(cls.timestamp >= start_ts).filter(cls.timestamp < end_ts)
+            .order_by(cls.timestamp).all()
+        )
@@ -0,0 +1,206 @@
+"""Objects for sharing database engines, tuning SQLite databases, and migrating the indexes of existing databases."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import logging
+import enum
+import types
+import threading
+from sqlalchemy import create_engine, event, exc, inspect, text
+
+import idbutils
+
+
+logger = logging.getLogger(__name__)
+
+
+class SqliteProfile(enum.Enum):
+    """The sets of SQLite settings that the databases can be opened with."""
+
+    default     = 'default'
+    performance = 'performance'
+
+    def journal_mode(self):
+        """Return the journal mode for the profile."""
+        return 'wal' if self is SqliteProfile.performance else 'delete'
+
+    def pragmas(self):
+        """Return the pragmas that are set on every connection opened with the profile."""
+        if self is SqliteProfile.performance:
+            return {
+                # with WAL, NORMAL only risks losing the last transactions on power loss, never corrupts the database
+                'synchronous'   : 'NORMAL',
+                # negative values are in KiB
+                'cache_size'    : -65536,
+                'mmap_size'     : 268435456,
+                'temp_store'    : 'MEMORY'
+            }
+        return {}
+
+
+class ProfiledDb(idbutils.DB):
+    """
+    Database that applies the SQLite profile from the db params and creates the indexes that were added to the tables of an existing database.
+
+    Set sqlite_profile in the db params to the name of a SqliteProfile to use it, the default profile leaves SQLite's settings unchanged.
+    For MySQL, the connection pool is configured with db_pool_size, db_max_overflow, db_pool_recycle, db_pool_timeout, and db_pool_pre_ping
+    in the db params.
+
+    Use get() to open a database with the instance shared by everything in the process instead of creating an engine and checking the
+    tables every time it's opened.
+    """
+
+    mysql_pool_options = ['pool_size', 'max_overflow', 'pool_recycle', 'pool_timeout', 'pool_pre_ping']
+    _shared_dbs = {}
+    _shared_dbs_lock = threading.Lock()
+
+    read_only_statements = {
+        'sqlite'        : 'PRAGMA query_only=ON',
+        'mysql'         : 'SET SESSION TRANSACTION READ ONLY',
+        'postgresql'    : 'SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY'
+    }
+
+    def __init__(self, db_params, debug_level=0):
+        """
+        Return an instance a database access class.
+
+        Parameters:
+        ----------
+        db_params (dict): config data for accessing the database
+        debug_level (int): 0 is no logging, higher is more logging
+
+        """
+        super().__init__(db_params, debug_level)
+        self.create_missing_indexes()
+        self.table_count = len(self.Base.metadata.tables)
+        if db_params.db_type == 'sqlite':
+            self.sqlite_profile = SqliteProfile(getattr(db_params, 'sqlite_profile', SqliteProfile.default.value))
+            self.__apply_sqlite_profile()
+        elif db_params.db_type == 'mysql':
+            self.__apply_mysql_pool_options(db_params, debug_level)
+
+    @classmethod
+    def __shared_key(cls, db_params):
+        # engines can't be shared with forked processes, so each process opens its own
+        return (cls, tuple(sorted(vars(db_params).items())), os.getpid())
+
+    @classmethod
+    def get(cls, db_params, debug_level=0):
+        """
+        Return the instance of the database that is shared by everything in this process that opens it with the same db params.
+
+        The first call creates the engine and checks the tables, later calls reuse them. Tables that have been added since, like plugin
+        tables, are created before the instance is returned.
+        """
+        key = cls.__shared_key(db_params)
+        with cls._shared_dbs_lock:
+            db = cls._shared_dbs.get(key)
+            if db is None:
+                db = cls._shared_dbs[key] = cls(db_params, debug_level)
+            elif db.table_count != len(cls.Base.metadata.tables):
+                db.create_tables()
+        return db
+
+    @classmethod
+    def release(cls, db_params):
+        """Close the shared instance of the database for the db params, if there is one."""
+        with cls._shared_dbs_lock:
+            db = cls._shared_dbs.pop(cls.__shared_key(db_params), None)
+        if db is not None:
+            db.engine.dispose()
+
+    def create_tables(self):
+        """Create the tables and indexes that have been added to the database since it was opened."""
+        self.Base.metadata.create_all(self.engine)
+        self.create_missing_indexes()
+        self.table_count = len(self.Base.metadata.tables)
+
+    @classmethod
+    def create(cls, name, version, doc=None):
+        """Create a dynamic database class."""
+        db_class = super().create(name, version, doc)
+
+        def class_exec(namespace):
+            if doc:
+                namespace['__doc__'] = doc
+        return types.new_class(db_class.__name__, bases=(cls, db_class), exec_body=class_exec)
+
+    def create_missing_indexes(self):
+        """Create the indexes of tables that were created before the index was added. Return the number of indexes created."""
+        inspector = inspect(self.engine)
+        created = 0
+        for table in self.Base.metadata.sorted_tables:
+            if not table.indexes:
+                continue
+            existing_indexes = [index['name'] for index in inspector.get_indexes(table.name)]
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    logger.info("%s: creating index %s on %s", self.db_name, index.name, table.name)
+                    index.create(self.engine)
+                    created += 1
+        return created
+
+    def __apply_sqlite_profile(self):
+        pragmas = self.sqlite_profile.pragmas()
+
+        def set_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+            cursor.close()
+
+        # the journal mode is stored in the database file, the other pragmas have to be set on every connection
+        with self.engine.connect() as connection:
+            journal_mode = connection.execute(text('PRAGMA journal_mode')).scalar()
+            if journal_mode != self.sqlite_profile.journal_mode():
+                try:
+                    journal_mode = connection.execute(text(f'PRAGMA journal_mode={self.sqlite_profile.journal_mode()}')).scalar()
+                    logger.info("%s: journal mode %s", self.db_name, journal_mode)
+                except exc.OperationalError as e:
+                    # another connection has the database locked, the journal mode will be changed the next time it's opened
+                    logger.warning("%s: journal mode not changed from %s: %s", self.db_name, journal_mode, e)
+        if pragmas:
+            event.listen(self.engine, 'connect', set_pragmas)
+            # close the pooled connections that were opened without the pragmas
+            self.engine.dispose()
+
+    def __apply_mysql_pool_options(self, db_params, debug_level):
+        pool_options = {name: getattr(db_params, 'db_' + name) for name in self.mysql_pool_options if getattr(db_params, 'db_' + name, None) is not None}
+        if pool_options:
+            # the base class creates the engine with the default pool
+            self.engine.dispose()
+            self.engine = create_engine(self._mysql_url(db_params), echo=(debug_level > 1), **pool_options)
+            logger.info("%s: connection pool %r", self.db_name, pool_options)
+
+    def set_read_only(self):
+        """Open all further connections to the database read-only, so that any attempt to write with them fails."""
+        statement = self.read_only_statements.get(self.engine.dialect.name)
+        if statement is None:
+            raise ValueError(f'Read-only connections not supported for database type {self.engine.dialect.name}')
+
+        def set_connection_read_only(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute(statement)
+            cursor.close()
+
+        event.listen(self.engine, 'connect', set_connection_read_only)
+        # close the pooled connections that were opened read-write
+        self.engine.dispose()
+
+    @classmethod
+    def delete_db(cls, db_params):
+        """Delete a database, closing the shared instance of it first."""
+        cls.release(db_params)
+        super().delete_db(db_params)
+
+    @classmethod
+    def _sqlite_delete(cls, db_params):
+        super()._sqlite_delete(db_params)
+        # a write ahead log left behind would be applied to the new database
+        for suffix in ['-wal', '-shm']:
+            filename = cls._sqlite_path(db_params) + suffix
+            if os.path.exists(filename):
+                os.remove(filename)
@@ -0,0 +1,143 @@
+"""Objects for writing many database rows with set based insert or update statements."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+
+from sqlalchemy.dialects import sqlite, mysql, postgresql
+
+
+logger = logging.getLogger(__name__)
+
+
+def _upsert_statement(dialect_name, table, primary_key_cols, update_cols):
+    if dialect_name == 'mysql':
+        stmt = mysql.insert(table)
+        if update_cols:
+            return stmt.on_duplicate_key_update({col: stmt.inserted[col] for col in update_cols})
+        return stmt.prefix_with('IGNORE')
+    if dialect_name == 'postgresql':
+        stmt = postgresql.insert(table)
+    elif dialect_name == 'sqlite':
+        stmt = sqlite.insert(table)
+    else:
+        raise ValueError(f'Upsert not supported for database type {dialect_name}')
+    if update_cols:
+        return stmt.on_conflict_do_update(index_elements=primary_key_cols, set_={col: stmt.excluded[col] for col in update_cols})
+    return stmt.on_conflict_do_nothing(index_elements=primary_key_cols)
+
+
+def _group_rows(rows):
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(row.keys())), []).append(row)
+    return groups
+
+
+def _s_upsert_groups(session, table, groups):
+    dialect_name = session.get_bind().dialect.name
+    for cols, group_rows in groups.items():
+        update_cols = [col for col in cols if col not in table.primary_key_cols]
+        stmt = _upsert_statement(dialect_name, table.__table__, table.primary_key_cols, update_cols)
+        session.execute(stmt, group_rows)
+
+
+def s_upsert(session, table, rows):
+    """
+    Insert rows that don't exist in a table and update the rows that do with as few statements as possible.
+
+    Like DbObject.s_insert_or_update, only the columns present in a row are updated. Rows are grouped by the set of columns they have and each
+    group is written with one executemany insert or update statement.
+
+    Parameters:
+    ----------
+    session (Session): the database session to use
+    table (DbObject): the table class to write to
+    rows (list): a list of dicts of column values, all of which must have values for all of the table's primary key columns
+
+    """
+    _s_upsert_groups(session, table, _group_rows(rows))
+    return len(rows)
+
+
+class UpsertBuffer():
+    """Accumulate rows for a table, merging rows with the same primary key, and write them all at once."""
+
+    def __init__(self, table, ignore_none=True):
+        """
+        Return a new UpsertBuffer instance.
+
+        Parameters:
+        ----------
+        table (DbObject): the table class that the rows will be written to
+        ignore_none (Boolean): if True, columns with None values are not written
+
+        """
+        self.table = table
+        self.ignore_none = ignore_none
+        self.rows = {}
+
+    def __len__(self):
+        """Return the number of rows in the buffer."""
+        return len(self.rows)
+
+    def add(self, values):
+        """Add a row to the buffer, merging it with an already buffered row that has the same primary key."""
+        row = self.table.intersection(values)
+        if self.ignore_none:
+            row = {key: value for key, value in row.items() if value is not None}
+        missing_cols = [col for col in self.table.primary_key_cols if col not in row]
+        if missing_cols:
+            raise ValueError(f'{self.table.__name__} row {row} is missing primary key columns {missing_cols}')
+        key = tuple(row[col] for col in self.table.primary_key_cols)
+        if key in self.rows:
+            self.rows[key].update(row)
+        else:
+            self.rows[key] = row
+
+    def flush(self, session):
+        """Write all of the buffered rows to the database and empty the buffer. Return the number of rows written."""
+        count = len(self)
+        if self.rows:
+            s_upsert(session, self.table, list(self.rows.values()))
+        logger.debug("Flushed %d rows to %s", count, self.table.__tablename__)
+        self.rows = {}
+        return count
+
+
+class MirroredUpsertBuffer(UpsertBuffer):
+    """
+    An UpsertBuffer whose rows are also written to mirrors of its table.
+
+    Mirrors are tables in other databases with the same columns and primary key. Rows are merged and grouped once and the same batched
+    statements are executed against the table and each of its mirrors.
+    """
+
+    def __init__(self, table, mirror_tables, ignore_none=True):
+        """
+        Return a new MirroredUpsertBuffer instance.
+
+        Parameters:
+        ----------
+        table (DbObject): the table class that the rows will be written to
+        mirror_tables (list): the table classes that the rows will also be written to
+        ignore_none (Boolean): if True, columns with None values are not written
+
+        """
+        super().__init__(table, ignore_none)
+        self.mirror_tables = mirror_tables
+
+    def flush(self, session, *mirror_sessions):
+        """Write all of the buffered rows to the table and its mirrors, one session per mirror, and empty the buffer. Return the number of rows written."""
+        if len(mirror_sessions) != len(self.mirror_tables):
+            raise ValueError(f'{self.table.__name__} has {len(self.mirror_tables)} mirrors but {len(mirror_sessions)} mirror sessions were passed')
+        count = len(self)
+        if self.rows:
+            groups = _group_rows(self.rows.values())
+            for table, table_session in zip([self.table] + self.mirror_tables, (session,) + mirror_sessions):
+                _s_upsert_groups(table_session, table, groups)
+        logger.debug("Flushed %d rows to %s and %d mirrors", count, self.table.__tablename__, len(self.mirror_tables))
+        self.rows = {}
+        return count
@@ -0,0 +1,310 @@
+"""Objects for importing only the files that are new or have changed since they were last imported."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import sys
+import logging
+import datetime
+import time
+import hashlib
+import json
+import traceback
+import collections
+import concurrent.futures
+from tqdm import tqdm
+
+from idbutils import JsonFileProcessor
+
+from .garmindb import GarminDb, ImportLedger, SummaryDirty, UpsertBuffer
+from .metrics import run_metrics
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+logger = logging.getLogger(__file__)
+logger.addHandler(logging.StreamHandler(stream=sys.stdout))
+root_logger = logging.getLogger()
+
+
+class FileImportTracker():
+    """Use the import ledger to choose the files that an importer needs to import and record the result of importing each of them."""
+
+    def __init__(self, db_params, importer, latest, retry_failed=False, flush_count=100):
+        """
+        Return a new FileImportTracker instance.
+
+        Parameters:
+        ----------
+        db_params (dict): configuration data for accessing the database
+        importer (string): the name the importer's files are recorded under
+        latest (Boolean): only import files that are new or have changed since they were last imported
+        retry_failed (Boolean): only import files that failed to import the last time they were imported
+        flush_count (int): write the recorded results to the ledger every time this many are recorded, only when flush is called if None
+
+        """
+        self.garmin_db = GarminDb.get(db_params)
+        self.importer = importer
+        self.latest = latest
+        self.retry_failed = retry_failed
+        self.flush_count = flush_count
+        self.entries = ImportLedger.get_entries(self.garmin_db, importer)
+        self.pending_entries = []
+
+    @classmethod
+    def file_hash(cls, file_name):
+        """Return a hash of the contents of a file."""
+        file_hash = hashlib.sha1()
+        with open(file_name, 'rb') as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                file_hash.update(chunk)
+        return file_hash.hexdigest()
+
+    def __add_entry(self, file_name, stat, **values):
+        entry = {'path': file_name, 'importer': self.importer, 'size': stat.st_size, 'mtime': stat.st_mtime}
+        entry.update(values)
+        self.pending_entries.append(entry)
+        if self.flush_count and len(self.pending_entries) >= self.flush_count:
+            self.flush()
+
+    def __changed(self, file_name, stat, entry):
+        if entry.size == stat.st_size and entry.mtime == stat.st_mtime:
+            return False
+        # the file was touched, but if the contents are the same it doesn't need to be imported again
+        if entry.size == stat.st_size and entry.hash is not None and entry.hash == self.file_hash(file_name):
+            self.__add_entry(file_name, stat)
+            return False
+        return True
+
+    def __file_hash(self, file_name, stat):
+        # hashing reads the whole file, so the hash in the ledger is reused if the file hasn't changed size or been modified since it was recorded
+        entry = self.entries.get(file_name)
+        if entry is not None and entry.hash is not None and entry.size == stat.st_size and entry.mtime == stat.st_mtime:
+            return entry.hash
+        return self.file_hash(file_name)
+
+    def files_to_import(self, file_names):
+        """Return the files that need to be imported: all of them for a full import, otherwise the new, changed, or failed files."""
+        if self.retry_failed:
+            selected = [file_name for file_name in file_names if file_name in self.entries and self.entries[file_name].status == ImportLedger.Status.failed]
+        elif not self.latest:
+            selected = list(file_names)
+        elif not self.entries:
+            # Without any entries in the ledger, fall back to importing recently modified files and assume that the others were imported.
+            latest_threshold = (datetime.datetime.now() - datetime.timedelta(days=1)).timestamp()
+            selected = []
+            for file_name in file_names:
+                stat = os.stat(file_name)
+                if stat.st_mtime > latest_threshold:
+                    selected.append(file_name)
+                else:
+                    self.__add_entry(file_name, stat, status=ImportLedger.Status.existing)
+            self.flush()
+        else:
+            selected = []
+            for file_name in file_names:
+                entry = self.entries.get(file_name)
+                if entry is None or self.__changed(file_name, os.stat(file_name), entry):
+                    selected.append(file_name)
+            self.flush()
+        root_logger.info("%s: importing %d of %d files", self.importer, len(selected), len(file_names))
+        return selected
+
+    def record(self, file_name, status, rows=0, duration=None, error=None, parse_duration=None):
+        """Record the result of importing a file. The parse duration, if known, is only reported in the run metrics."""
+        run_metrics.record_file(self.importer, file_name, status.name, rows, duration, parse_duration)
+        try:
+            stat = os.stat(file_name)
+        except OSError:
+            return
+        values = {
+            'hash'      : self.__file_hash(file_name, stat),
+            'status'    : status,
+            'rows'      : rows,
+            'duration'  : duration,
+            'timestamp' : datetime.datetime.now(),
+            'error'     : str(error) if error is not None else None
+        }
+        self.__add_entry(file_name, stat, **values)
+
+    def flush(self):
+        """Write the recorded results to the ledger."""
+        if self.pending_entries:
+            ImportLedger.record(self.garmin_db, self.pending_entries)
+            self.pending_entries = []
+
+
+class LedgerJsonFileProcessor(JsonFileProcessor):
+    """
+    A JsonFileProcessor that uses the import ledger to only import new or changed files and records the result of importing each file.
+
+    Files are imported in batches. Rows written with _upsert and days marked with _mark_days while a batch is being imported are collected
+    and written with one session and commit per batch. Files can be parsed ahead in threads, and are decoded with orjson if it's installed.
+    """
+
+    batch_size = 100
+    in_flight_per_worker = 4
+
+    def __init__(self, db_params, file_regex, input_dir=None, latest=True, debug=False, recursive=False, retry_failed=False, workers=1):
+        """
+        Return an instance of LedgerJsonFileProcessor.
+
+        Parameters:
+        ----------
+        db_params (dict): configuration data for accessing the database
+        file_regex (string): only process files that match this regex
+        input_dir (string): directory (full path) to check for data files, if None file_names is set by the caller
+        latest (Boolean): only import files that are new or have changed since they were last imported
+        debug (Boolean): enable debug logging
+        recursive (Boolean): check the search directory recursively
+        retry_failed (Boolean): only import files that failed to import the last time they were imported
+        workers (int): number of threads to use for parsing files, files are parsed in the importing thread if less than 2
+
+        """
+        # list all of the files, the ledger decides which of them need to be imported
+        super().__init__(file_regex, input_dir=input_dir, latest=False, debug=debug, recursive=recursive)
+        self.garmin_db = GarminDb.get(db_params)
+        self.workers = workers
+        self.tracker = FileImportTracker(db_params, self.__class__.__name__, latest, retry_failed)
+        if input_dir:
+            self.file_names = self.tracker.files_to_import(self.file_names)
+        else:
+            self.file_names = []
+        self.__file_rows = None
+
+    def __convert(self, entry):
+        for (conversion_key, conversion_func) in self.conversions.items():
+            entry_value = entry.get(conversion_key)
+            if entry_value is not None:
+                entry[conversion_key] = conversion_func(entry_value)
+        return entry
+
+    def __convert_all(self, value):
+        # apply the conversions bottom up like a json object hook does
+        if isinstance(value, dict):
+            for key, item in value.items():
+                if isinstance(item, (dict, list)):
+                    value[key] = self.__convert_all(item)
+            return self.__convert(value)
+        if isinstance(value, list):
+            return [self.__convert_all(item) if isinstance(item, (dict, list)) else item for item in value]
+        return value
+
+    def _parse_file(self, file_name):
+        with open(file_name, 'rb') as file:
+            data = file.read()
+        if orjson is not None:
+            try:
+                return self.__convert_all(orjson.loads(data))
+            except orjson.JSONDecodeError:
+                # json accepts some non-standard JSON, like NaN, that orjson doesn't
+                pass
+        return json.loads(data, object_hook=self.__convert)
+
+    def __timed_parse(self, file_name):
+        start = time.perf_counter()
+        try:
+            return (file_name, self._parse_file(file_name), None, time.perf_counter() - start)
+        except Exception as e:
+            return (file_name, None, (e, traceback.format_exc()), time.perf_counter() - start)
+
+    def __parsed_files(self):
+        if self.workers < 2 or self.file_count() < 2:
+            for file_name in self.file_names:
+                yield self.__timed_parse(file_name)
+            return
+        # Files are parsed ahead in threads and returned in the order they were listed. The number of parsed files held in memory is
+        # bounded by the size of the in flight queue.
+        max_in_flight = self.workers * self.in_flight_per_worker
+        in_flight = collections.deque()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for file_name in self.file_names:
+                if len(in_flight) >= max_in_flight:
+                    yield in_flight.popleft().result()
+                in_flight.append(executor.submit(self.__timed_parse, file_name))
+            while in_flight:
+                yield in_flight.popleft().result()
+
+    def _upsert(self, table, values, ignore_none=True):
+        """Insert or update a row. While a batch of files is being imported the row is written when the batch is."""
+        if self.__file_rows is None:
+            table.insert_or_update(self.garmin_db, values, ignore_none=ignore_none)
+        else:
+            self.__file_rows.append((table, values, ignore_none))
+
+    def _mark_days(self, days):
+        """Mark days as needing their summaries recalculated. While a batch of files is being imported the days are marked when the batch is written."""
+        if self.__file_rows is None:
+            SummaryDirty.mark_days(self.garmin_db, days)
+        else:
+            self.__file_days.update(days)
+
+    def __start_batch(self):
+        self.__upsert_buffers = {}
+        self.__batch_days = set()
+        self.__batch_files = []
+
+    def __process_file(self, file_name, json_data, error, parse_duration):
+        if error is not None:
+            e, trace = error
+            self.logger.error("Failed to parse %s: %s", file_name, trace)
+            self.tracker.record(file_name, ImportLedger.Status.failed, 0, parse_duration, e, parse_duration)
+            return
+        start = time.perf_counter()
+        self.__file_rows = []
+        self.__file_days = set()
+        try:
+            updates = self._process_json(json_data)
+        except Exception as e:
+            # the rows collected from the failed file are dropped, the rest of the batch is still written
+            self.logger.error("Failed to import %s: %s", file_name, traceback.format_exc())
+            self.tracker.record(file_name, ImportLedger.Status.failed, 0, parse_duration + time.perf_counter() - start, e, parse_duration)
+            return
+        for table, values, ignore_none in self.__file_rows:
+            key = (table, ignore_none)
+            if key not in self.__upsert_buffers:
+                self.__upsert_buffers[key] = UpsertBuffer(table, ignore_none)
+            self.__upsert_buffers[key].add(values)
+        self.__batch_days.update(self.__file_days)
+        self.__batch_files.append((file_name, updates, parse_duration + time.perf_counter() - start, parse_duration))
+
+    def __write_batch(self):
+        try:
+            if self.__upsert_buffers or self.__batch_days:
+                with self.garmin_db.managed_session() as session:
+                    for upsert_buffer in self.__upsert_buffers.values():
+                        upsert_buffer.flush(session)
+                    if self.__batch_days:
+                        SummaryDirty.s_mark_days(session, self.__batch_days)
+            for file_name, updates, duration, parse_duration in self.__batch_files:
+                if updates > 0:
+                    self.logger.info("DB updated with %d entries from %s", updates, file_name)
+                    self.total_updates += updates
+                else:
+                    self.logger.warning("No data saved for %s", file_name)
+                self.tracker.record(file_name, ImportLedger.Status.imported, updates, duration, parse_duration=parse_duration)
+        except Exception as e:
+            self.logger.error("Failed to write %d files: %s", len(self.__batch_files), traceback.format_exc())
+            for file_name, updates, duration, parse_duration in self.__batch_files:
+                self.tracker.record(file_name, ImportLedger.Status.failed, 0, duration, e, parse_duration)
+        self.__start_batch()
+
+    def _process_files(self):
+        self.logger.info("Processing %d json files in batches of %d", self.file_count(), self.batch_size)
+        with run_metrics.stage(self.__class__.__name__):
+            self.__start_batch()
+            try:
+                for file_name, json_data, error, parse_duration in tqdm(self.__parsed_files(), total=self.file_count(), unit='files'):
+                    self.__process_file(file_name, json_data, error, parse_duration)
+                    if len(self.__batch_files) >= self.batch_size:
+                        self.__write_batch()
+                self.__write_batch()
+            finally:
+                self.__file_rows = None
+            self.tracker.flush()
+        self.logger.info("DB updated with %d entries from %d files.", self.total_updates, self.file_count())
@@ -15,6 +15,7 @@ from idbutils import JsonFileProcessor, Conversions
 
 from .garmindb import GarminDb, Attributes, Weight, Sleep, SleepEvents, RestingHeartRate, DailySummary, Hrv
 from .fit_data import FitData
+from .import_ledger import LedgerJsonFileProcessor
 
 
 logger = logging.getLogger(__file__)
@@ -22,10 +23,10 @@ logger.addHandler(logging.StreamHandler(stream=sys.stdout))
 root_logger = logging.getLogger()
 
 
-class GarminWeightData(JsonFileProcessor):
+class GarminWeightData(LedgerJsonFileProcessor):
     """Class for importing JSON formatted Garmin Connect weight data into a database."""
 
-    def __init__(self, db_params, input_dir, latest, measurement_system, debug):
+    def __init__(self, db_params, input_dir, latest, measurement_system, debug, retry_failed=False, workers=1):
         """
         Return an instance of GarminWeightData.
 
@@ -36,12 +37,14 @@ class GarminWeightData(JsonFileProcessor):
         latest (Boolean): check for latest files only
         measurement_system (enum): which measurement system to use when importing the files
         debug (Boolean): enable debug logging
+        retry_failed (Boolean): only import files that failed to import the last time they were imported
+        workers (int): number of threads to use for parsing files
 
         """
         logger.info("Processing weight data")
-        super().__init__(r'weight_\d{4}-\d{2}-\d{2}\.json', input_dir=input_dir, latest=latest, debug=debug)
+        super().__init__(db_params, r'weight_\d{4}-\d{2}-\d{2}\.json', input_dir=input_dir, latest=latest, debug=debug, retry_failed=retry_failed, workers=workers)
         self.measurement_system = measurement_system
-        self.garmin_db = GarminDb(db_params)
+        self.garmin_db = GarminDb.get(db_params)
         self.conversions = {'startDate': self._parse_date}
 
     def _process_json(self, json_data):
@@ -61,7 +64,8 @@ class GarminWeightData(JsonFileProcessor):
                 'muscle_mass'   : muscle_mass.kgs_or_lbs(self.measurement_system),
                 'visceral_fat'  : weight_item.get('visceralFat')
             }
-            Weight.insert_or_update(self.garmin_db, point)
+            self._upsert(Weight, point, ignore_none=False)
+            self._mark_days([point['day']])
             return 1
         return 0
 
@@ -69,7 +73,7 @@ class GarminWeightData(JsonFileProcessor):
 class GarminMonitoringFitData(FitData):
     """Class for importing monitoring FIT files into a database."""
 
-    def __init__(self, input_dir, latest, measurement_system, debug):
+    def __init__(self, input_dir, latest, measurement_system, debug, workers=1, retry_failed=False):
         """
         Return an instance of GarminMonitoringFitData.
 
@@ -79,15 +83,17 @@ class GarminMonitoringFitData(FitData):
         latest (Boolean): check for latest files only
         measurement_system (enum): which measurement system to use when importing the files
         debug (Boolean): enable debug logging
+        workers (int): number of processes to use for parsing files
+        retry_failed (Boolean): only import files that failed to import the last time they were imported
 
         """
-        super().__init__(input_dir, debug, latest, True, [fitfile.FileType.monitoring_b], measurement_system)
+        super().__init__(input_dir, debug, latest, True, [fitfile.FileType.monitoring_b], measurement_system, workers, retry_failed)
 
 
 class GarminSleepFitData(FitData):
     """Class for importing sleep FIT files into a database."""
 
-    def __init__(self, input_dir, latest, measurement_system, debug):
+    def __init__(self, input_dir, latest, measurement_system, debug, workers=1, retry_failed=False):
         """
         Return an instance of GarminSleepFitData.
 
@@ -97,9 +103,11 @@ class GarminSleepFitData(FitData):
         latest (Boolean): check for latest files only
         measurement_system (enum): which measurement system to use when importing the files
         debug (Boolean): enable debug logging
+        workers (int): number of processes to use for parsing files
+        retry_failed (Boolean): only import files that failed to import the last time they were imported
 
         """
-        super().__init__(input_dir, debug, latest, True, [fitfile.FileType.sleep], measurement_system)
+        super().__init__(input_dir, debug, latest, True, [fitfile.FileType.sleep], measurement_system, workers, retry_failed)
 
 
 class GarminSettingsFitData(FitData):
@@ -137,10 +145,10 @@ class RemSleepActivityLevels(enum.Enum):
     awake = 3.0
 
 
-class GarminSleepData(JsonFileProcessor):
+class GarminSleepData(LedgerJsonFileProcessor):
     """Class for importing JSON formatted Garmin Connect sleep data into a database."""
 
-    def __init__(self, db_params, input_dir, latest, debug):
+    def __init__(self, db_params, input_dir, latest, debug, retry_failed=False, workers=1):
         """
         Return an instance of GarminSleepData.
 
@@ -150,11 +158,13 @@ class GarminSleepData(JsonFileProcessor):
         input_dir (string): directory (full path) to check for sleep data files
         latest (Boolean): check for latest files only
         debug (Boolean): enable debug logging
+        retry_failed (Boolean): only import files that failed to import the last time they were imported
+        workers (int): number of threads to use for parsing files
 
         """
         logger.info("Processing sleep data")
-        super().__init__(r'sleep_\d{4}-\d{2}-\d{2}\.json', input_dir=input_dir, latest=latest, debug=debug)
-        self.garmin_db = GarminDb(db_params)
+        super().__init__(db_params, r'sleep_\d{4}-\d{2}-\d{2}\.json', input_dir=input_dir, latest=latest, debug=debug, retry_failed=retry_failed, workers=workers)
+        self.garmin_db = GarminDb.get(db_params)
         self.conversions = {
             'calendarDate': self._parse_date,
             'sleepTimeSeconds': fitfile.conversions.secs_to_dt_time,
@@ -216,7 +226,8 @@ class GarminSleepData(JsonFileProcessor):
             'score': score,
             'qualifier': qualifier
         }
-        Sleep.insert_or_update(self.garmin_db, day_data, ignore_none=True)
+        self._upsert(Sleep, day_data)
+        self._mark_days([day])
         sleep_levels = json_data.get('sleepLevels')
         if sleep_levels is None:
             return 0
@@ -232,14 +243,14 @@ class GarminSleepData(JsonFileProcessor):
                 'event': event.name,
                 'duration': duration
             }
-            SleepEvents.insert_or_update(self.garmin_db, level_data, ignore_none=True)
+            self._upsert(SleepEvents, level_data)
         return len(sleep_levels)
 
 
-class GarminRhrData(JsonFileProcessor):
+class GarminRhrData(LedgerJsonFileProcessor):
     """Class for importing JSON formatted Garmin Connect resting heart rate data into a database."""
 
-    def __init__(self, db_params, input_dir, latest, debug):
+    def __init__(self, db_params, input_dir, latest, debug, retry_failed=False, workers=1):
         """
         Return an instance of GarminRhrData.
 
@@ -249,11 +260,13 @@ class GarminRhrData(JsonFileProcessor):
         input_dir (string): directory (full path) to check for resting heart rate data files
         latest (Boolean): check for latest files only
         debug (Boolean): enable debug logging
+        retry_failed (Boolean): only import files that failed to import the last time they were imported
+        workers (int): number of threads to use for parsing files
 
         """
         logger.info("Processing rhr data")
-        super().__init__(r'rhr_\d{4}-\d{2}-\d{2}\.json', input_dir=input_dir, latest=latest, debug=debug)
-        self.garmin_db = GarminDb(db_params)
+        super().__init__(db_params, r'rhr_\d{4}-\d{2}-\d{2}\.json', input_dir=input_dir, latest=latest, debug=debug, retry_failed=retry_failed, workers=workers)
+        self.garmin_db = GarminDb.get(db_params)
         self.conversions = {'statisticsStartDate': self._parse_date}
 
     def _process_json(self, json_data):
@@ -265,8 +278,8 @@ class GarminRhrData(JsonFileProcessor):
                     'day': json_data['statisticsStartDate'].date(),
                     'resting_heart_rate': rhr
                 }
-                RestingHeartRate.insert_or_update(
-                    self.garmin_db, point, ignore_none=True)
+                self._upsert(RestingHeartRate, point)
+                self._mark_days([point['day']])
                 return 1
         return 0
 
@@ -288,7 +301,7 @@ class GarminProfile(JsonFileProcessor):
         """
         logger.info("Processing profile data")
         super().__init__(file_regex, input_dir=input_dir, latest=False, debug=debug)
-        self.garmin_db = GarminDb(db_params)
+        self.garmin_db = GarminDb.get(db_params)
         self.conversions = {'calendarDate': self._parse_date}
 
     def _process_json(self, json_data):
@@ -384,10 +397,10 @@ class GarminSocialProfile(GarminProfile):
         }
 
 
-class GarminSummaryData(JsonFileProcessor):
+class GarminSummaryData(LedgerJsonFileProcessor):
     """Class for importing JSON formatted Garmin Connect daily summary data into a database."""
 
-    def __init__(self, db_params, input_dir, latest, measurement_system, debug):
+    def __init__(self, db_params, input_dir, latest, measurement_system, debug, retry_failed=False, workers=1):
         """
         Return an instance of GarminSummaryData.
 
@@ -398,13 +411,16 @@ class GarminSummaryData(JsonFileProcessor):
         latest (Boolean): check for latest files only
         measurement_system (enum): which measurement system to use when importing the files
         debug (Boolean): enable debug logging
+        retry_failed (Boolean): only import files that failed to import the last time they were imported
+        workers (int): number of threads to use for parsing files
 
         """
         logger.info("Processing daily summary data")
-        super().__init__(r'daily_summary_\d{4}-\d{2}-\d{2}\.json', input_dir=input_dir, latest=latest, debug=debug, recursive=True)
+        super().__init__(db_params, r'daily_summary_\d{4}-\d{2}-\d{2}\.json', input_dir=input_dir, latest=latest, debug=debug, recursive=True, retry_failed=retry_failed,
+                         workers=workers)
         self.input_dir = input_dir
         self.measurement_system = measurement_system
-        self.garmin_db = GarminDb(db_params)
+        self.garmin_db = GarminDb.get(db_params)
         self.conversions = {
             'calendarDate': self._parse_date,
             'moderateIntensityMinutes': fitfile.conversions.min_to_dt_time,
@@ -446,15 +462,15 @@ class GarminSummaryData(JsonFileProcessor):
             'bb_min': self._get_field(json_data, 'bodyBatteryLowestValue', int),
             'description': self._get_field(json_data, 'wellnessDescription'),
         }
-        DailySummary.insert_or_update(
-            self.garmin_db, summary, ignore_none=True)
+        self._upsert(DailySummary, summary)
+        self._mark_days([summary['day']])
         return 1
 
 
-class GarminHydrationData(JsonFileProcessor):
+class GarminHydrationData(LedgerJsonFileProcessor):
     """Class for importing JSON formatted Garmin Connect daily summary data into a database."""
 
-    def __init__(self, db_params, input_dir, latest, measurement_system, debug):
+    def __init__(self, db_params, input_dir, latest, measurement_system, debug, retry_failed=False, workers=1):
         """
         Return an instance of GarminHydrationData.
 
@@ -465,13 +481,16 @@ class GarminHydrationData(JsonFileProcessor):
         latest (Boolean): check for latest files only
         measurement_system (enum): which measurement system to use when importing the files
         debug (Boolean): enable debug logging
+        retry_failed (Boolean): only import files that failed to import the last time they were imported
+        workers (int): number of threads to use for parsing files
 
         """
         logger.debug("Processing daily hydration data")
-        super().__init__(r'hydration_\d{4}-\d{2}-\d{2}\.json', input_dir=input_dir, latest=latest, debug=debug, recursive=True)
+        super().__init__(db_params, r'hydration_\d{4}-\d{2}-\d{2}\.json', input_dir=input_dir, latest=latest, debug=debug, recursive=True, retry_failed=retry_failed,
+                         workers=workers)
         self.input_dir = input_dir
         self.measurement_system = measurement_system
-        self.garmin_db = GarminDb(db_params)
+        self.garmin_db = GarminDb.get(db_params)
         self.conversions = {
             'calendarDate': self._parse_date
         }
@@ -487,15 +506,15 @@ class GarminHydrationData(JsonFileProcessor):
             'sweat_loss': sweat_loss.ml_or_oz(self.measurement_system, rounded=True)
         }
         root_logger.debug("Processing daily hydration data %r", summary)
-        DailySummary.insert_or_update(
-            self.garmin_db, summary, ignore_none=True)
+        self._upsert(DailySummary, summary)
+        self._mark_days([summary['day']])
         return 1
 
 
-class GarminHrvData(JsonFileProcessor):
+class GarminHrvData(LedgerJsonFileProcessor):
     """Class for importing JSON formatted Garmin Connect heart rate variability (HRV) data into a database."""
 
-    def __init__(self, db_params, input_dir, latest, debug):
+    def __init__(self, db_params, input_dir, latest, debug, retry_failed=False, workers=1):
         """
         Return an instance of GarminHrvData.
 
@@ -505,10 +524,12 @@ class GarminHrvData(JsonFileProcessor):
         input_dir (string): directory (full path) to check for HRV data files
         latest (Boolean): check for latest files only
         debug (Boolean): enable debug logging
+        retry_failed (Boolean): only import files that failed to import the last time they were imported
+        workers (int): number of threads to use for parsing files
 
         """
-        super().__init__(r'hrv_\d{4}-\d{2}-\d{2}\.json', input_dir=input_dir, latest=latest, debug=debug)
-        self.garmin_db = GarminDb(db_params)
+        super().__init__(db_params, r'hrv_\d{4}-\d{2}-\d{2}\.json', input_dir=input_dir, latest=latest, debug=debug, retry_failed=retry_failed, workers=workers)
+        self.garmin_db = GarminDb.get(db_params)
         self.conversions = {'calendarDate': self._parse_date}
 
     def _process_json(self, json_data):
@@ -529,5 +550,6 @@ class GarminHrvData(JsonFileProcessor):
             'baseline_upper': self._get_field(hrv_summary.get('baseline', {}), 'balancedUpper', int),
             'status': self._get_field(hrv_summary, 'status', str)
         }
-        Hrv.insert_or_update(self.garmin_db, point, ignore_none=True)
+        self._upsert(Hrv, point)
+        self._mark_days([point['day']])
         return 1
@@ -0,0 +1,166 @@
+"""Objects for importing downloaded files while the download is still running."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import sys
+import re
+import logging
+import queue
+import threading
+import traceback
+
+import fitfile
+
+from .import_monitoring import GarminWeightData, GarminSummaryData, GarminHydrationData, GarminMonitoringFitData, GarminSleepData, GarminRhrData, GarminHrvData
+from .garmin_json_data import GarminJsonSummaryData, GarminJsonDetailsData
+from .activities_fit_data import GarminActivitiesFitData
+from .monitoring_fit_file_processor import MonitoringFitFileProcessor
+from .activity_fit_file_processor import ActivityFitFileProcessor
+from .metrics import run_metrics
+
+
+logger = logging.getLogger(__file__)
+logger.addHandler(logging.StreamHandler(stream=sys.stdout))
+root_logger = logging.getLogger()
+
+
+class ImportPipeline():
+    """
+    Import files as they are downloaded, overlapping the network latency of downloading with parsing and writing to the database.
+
+    Download passes the files saved for each item to add_files. The files are imported by a single thread in batches of whatever has been
+    downloaded since the last batch. Within a batch, files are imported in the same order as GarminDbMain.import_data imports them.
+    """
+
+    def __init__(self, db_params, plugin_manager, measurement_system, debug):
+        """
+        Return a new ImportPipeline instance and start the import thread.
+
+        Parameters:
+        ----------
+        db_params (dict): configuration data for accessing the database
+        plugin_manager (PluginManager): the plugins to use when importing FIT files
+        measurement_system (enum): which measurement system to use when importing the files
+        debug (Boolean): enable debug logging
+
+        """
+        self.db_params = db_params
+        self.plugin_manager = plugin_manager
+        self.measurement_system = measurement_system
+        self.debug = debug
+        # (stat name, file name regex, function that returns the function that imports a list of files), in import order
+        self.importer_factories = [
+            ('weight',      r'weight_\d{4}-\d{2}-\d{2}\.json',          self.__weight_importer),
+            ('summary',     r'daily_summary_\d{4}-\d{2}-\d{2}\.json',   self.__summary_importer),
+            ('hydration',   r'hydration_\d{4}-\d{2}-\d{2}\.json',       self.__hydration_importer),
+            ('monitoring',  fitfile.file.name_regex,                    self.__monitoring_importer),
+            ('sleep',       r'sleep_\d{4}-\d{2}-\d{2}\.json',           self.__sleep_importer),
+            ('rhr',         r'rhr_\d{4}-\d{2}-\d{2}\.json',             self.__rhr_importer),
+            ('hrv',         r'hrv_\d{4}-\d{2}-\d{2}\.json',             self.__hrv_importer),
+            ('activity',    r'activity_\d*\.json',                      self.__activity_summary_importer),
+            ('activity',    r'activity_details_\d*\.json',              self.__activity_details_importer),
+            ('activity',    fitfile.file.name_regex,                    self.__activity_fit_importer)
+        ]
+        self.importers = {}
+        self.imported_files = 0
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.__run, name='import', daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def __json_importer(cls, json_data):
+        def import_files(file_names):
+            json_data.file_names = file_names
+            json_data.process()
+        return import_files
+
+    @classmethod
+    def __fit_importer(cls, fit_data, fit_file_processor):
+        def import_files(file_names):
+            fit_data.file_names = file_names
+            fit_data.process_files(fit_file_processor)
+        return import_files
+
+    def __weight_importer(self):
+        return self.__json_importer(GarminWeightData(self.db_params, None, False, self.measurement_system, self.debug))
+
+    def __summary_importer(self):
+        return self.__json_importer(GarminSummaryData(self.db_params, None, False, self.measurement_system, self.debug))
+
+    def __hydration_importer(self):
+        return self.__json_importer(GarminHydrationData(self.db_params, None, False, self.measurement_system, self.debug))
+
+    def __monitoring_importer(self):
+        fit_data = GarminMonitoringFitData(None, False, self.measurement_system, self.debug)
+        return self.__fit_importer(fit_data, MonitoringFitFileProcessor(self.db_params, self.plugin_manager, self.debug))
+
+    def __sleep_importer(self):
+        return self.__json_importer(GarminSleepData(self.db_params, None, False, self.debug))
+
+    def __rhr_importer(self):
+        return self.__json_importer(GarminRhrData(self.db_params, None, False, self.debug))
+
+    def __hrv_importer(self):
+        return self.__json_importer(GarminHrvData(self.db_params, None, False, self.debug))
+
+    def __activity_summary_importer(self):
+        return self.__json_importer(GarminJsonSummaryData(self.db_params, None, False, self.measurement_system, self.debug))
+
+    def __activity_details_importer(self):
+        return self.__json_importer(GarminJsonDetailsData(self.db_params, None, False, self.measurement_system, self.debug))
+
+    def __activity_fit_importer(self):
+        fit_data = GarminActivitiesFitData(None, False, self.measurement_system, self.debug)
+        return self.__fit_importer(fit_data, ActivityFitFileProcessor(self.db_params, self.plugin_manager, self.debug))
+
+    def __find_importer(self, stat, file_name):
+        for index, (importer_stat, file_regex, _) in enumerate(self.importer_factories):
+            if importer_stat == stat and re.search(file_regex, file_name):
+                return index
+
+    def __import_batch(self, batch):
+        file_names_by_importer = {}
+        for stat, file_names in batch:
+            for file_name in file_names:
+                index = self.__find_importer(stat, os.path.basename(file_name))
+                if index is None:
+                    root_logger.info("No importer for %s file %s", stat, file_name)
+                else:
+                    file_names_by_importer.setdefault(index, []).append(file_name)
+        for index in sorted(file_names_by_importer):
+            file_names = file_names_by_importer[index]
+            try:
+                if index not in self.importers:
+                    self.importers[index] = self.importer_factories[index][2]()
+                self.importers[index](file_names)
+                self.imported_files += len(file_names)
+            except Exception as e:
+                logger.error("Failed to import %s: %s", file_names, e)
+                root_logger.error("Failed to import %s: %s - %s", file_names, e, traceback.format_exc())
+
+    def __run(self):
+        finished = False
+        while not finished:
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            finished = None in batch
+            # the import thread's stages aren't nested in the download stage running on the main thread
+            with run_metrics.stage('import_pipeline'):
+                self.__import_batch([files for files in batch if files is not None])
+
+    def add_files(self, stat, file_names):
+        """Queue files that have been downloaded for a stat to be imported."""
+        self.queue.put((stat, file_names))
+
+    def finish(self):
+        """Wait for all of the queued files to be imported and stop the import thread."""
+        self.queue.put(None)
+        self.thread.join()
+        root_logger.info("Imported %d files while downloading", self.imported_files)
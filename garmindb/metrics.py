@@ -0,0 +1,182 @@
+"""Objects for timing the stages of a run and counting the files, messages, rows, and SQL statements processed by each of them."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import sys
+import logging
+import datetime
+import time
+import json
+import threading
+import collections
+import contextlib
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+logger = logging.getLogger(__file__)
+logger.addHandler(logging.StreamHandler(stream=sys.stdout))
+root_logger = logging.getLogger()
+
+
+class RunMetrics():
+    """
+    Collect the duration of each stage of a run and the counts of what was processed during it, and write them as a run report.
+
+    Stages nest: a stage started while another one is running is named <outer>/<inner>, and counts are added to every stage that is running
+    on the thread they're counted on as well as to the run totals. Once SQL tracking is enabled, every SQL statement executed and the rows
+    it inserted, updated, or deleted are counted. Upserts are counted as inserts.
+    """
+
+    slowest_files_count = 50
+    sql_row_counts = {
+        'INSERT'    : 'rows_inserted',
+        'REPLACE'   : 'rows_inserted',
+        'UPDATE'    : 'rows_updated',
+        'DELETE'    : 'rows_deleted'
+    }
+
+    def __init__(self):
+        """Return a new RunMetrics instance."""
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Discard everything recorded so far and restart the run clock."""
+        with self.lock:
+            self.start_time = datetime.datetime.now()
+            self.start = time.perf_counter()
+            self.stages = {}
+            self.totals = collections.Counter()
+            self.files = []
+
+    def __stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Return a context manager that times a stage of the run."""
+        stack = self.__stack()
+        path = '/'.join([stack[-1], name]) if stack else name
+        with self.lock:
+            stage = self.stages.setdefault(path, {'calls': 0, 'duration': 0.0, 'counts': collections.Counter()})
+        stack.append(path)
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            duration = time.perf_counter() - start
+            stack.pop()
+            with self.lock:
+                stage['calls'] += 1
+                stage['duration'] += duration
+            root_logger.debug("Stage %s took %.3fs", path, duration)
+
+    def count(self, name, value=1):
+        """Add to a count for the run and for the stages running on this thread."""
+        stack = self.__stack()
+        with self.lock:
+            self.totals[name] += value
+            for path in stack:
+                self.stages[path]['counts'][name] += value
+
+    def record_file(self, importer, file_name, status, rows=0, duration=None, parse_duration=None):
+        """Record the result of importing a file."""
+        self.count('files')
+        self.count(f'files_{status}')
+        with self.lock:
+            self.files.append({
+                'importer'          : importer,
+                'file'              : file_name,
+                'status'            : status,
+                'rows'              : rows,
+                'duration'          : duration,
+                'parse_duration'    : parse_duration
+            })
+
+    def __after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count('sql_statements')
+        row_count_name = self.sql_row_counts.get(statement.split(None, 1)[0].upper() if statement.strip() else None)
+        if row_count_name is not None and cursor.rowcount > 0:
+            self.count(row_count_name, cursor.rowcount)
+
+    def track_sql(self):
+        """Count the SQL statements executed and the rows they change for all databases."""
+        if not event.contains(Engine, 'after_cursor_execute', self.__after_cursor_execute):
+            event.listen(Engine, 'after_cursor_execute', self.__after_cursor_execute)
+
+    def untrack_sql(self):
+        """Stop counting SQL statements."""
+        if event.contains(Engine, 'after_cursor_execute', self.__after_cursor_execute):
+            event.remove(Engine, 'after_cursor_execute', self.__after_cursor_execute)
+
+    @classmethod
+    def __file_duration(cls, file_entry):
+        return file_entry['parse_duration'] if file_entry['parse_duration'] is not None else (file_entry['duration'] or 0.0)
+
+    def report(self):
+        """Return the run report as a dict."""
+        with self.lock:
+            importers = {}
+            for file_entry in self.files:
+                importer = importers.setdefault(file_entry['importer'], collections.Counter())
+                importer[file_entry['status']] += 1
+                importer['rows'] += file_entry['rows'] or 0
+            return {
+                'start'         : self.start_time.isoformat(),
+                'duration'      : time.perf_counter() - self.start,
+                'totals'        : dict(self.totals),
+                'stages'        : {path: {'calls': stage['calls'], 'duration': stage['duration'], **stage['counts']} for path, stage in self.stages.items()},
+                'importers'     : {name: dict(counts) for name, counts in importers.items()},
+                'slowest_files' : sorted(self.files, key=self.__file_duration, reverse=True)[:self.slowest_files_count]
+            }
+
+    @classmethod
+    def __write_file(cls, file_name, text):
+        # write to a temporary file and move it into place so readers, like the Prometheus node exporter, never see a partial file
+        dir_name = os.path.dirname(os.path.abspath(file_name))
+        os.makedirs(dir_name, exist_ok=True)
+        temp_file = os.path.join(dir_name, '.' + os.path.basename(file_name))
+        with open(temp_file, 'w') as file:
+            file.write(text)
+        os.replace(temp_file, file_name)
+
+    def write_report(self, file_name):
+        """Write the run report to a JSON file."""
+        self.__write_file(file_name, json.dumps(self.report(), indent=4, default=str))
+        root_logger.info("Wrote run report to %s", file_name)
+
+    @classmethod
+    def __prometheus_metric(cls, lines, name, help_text, samples):
+        lines += [f'# HELP garmindb_{name} {help_text}', f'# TYPE garmindb_{name} gauge']
+        for labels, value in samples:
+            label_text = ','.join(f'{label}="{label_value}"' for label, label_value in labels.items())
+            lines.append(f'garmindb_{name}{{{label_text}}} {value}' if label_text else f'garmindb_{name} {value}')
+
+    def prometheus_text(self):
+        """Return the run report in the Prometheus text exposition format."""
+        report = self.report()
+        lines = []
+        self.__prometheus_metric(lines, 'run_timestamp_seconds', 'When the last run started.', [({}, self.start_time.timestamp())])
+        self.__prometheus_metric(lines, 'run_duration_seconds', 'How long the last run took.', [({}, report['duration'])])
+        self.__prometheus_metric(lines, 'run_total', 'Counts of what the last run processed.', [({'count': name}, value) for name, value in report['totals'].items()])
+        self.__prometheus_metric(lines, 'stage_duration_seconds', 'How long each stage of the last run took.',
+                                 [({'stage': path}, stage['duration']) for path, stage in report['stages'].items()])
+        self.__prometheus_metric(lines, 'stage_total', 'Counts of what each stage of the last run processed.',
+                                 [({'stage': path, 'count': name}, value) for path, stage in report['stages'].items() for name, value in stage.items()
+                                  if name not in ['calls', 'duration']])
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, file_name):
+        """Write the run report to a Prometheus node exporter textfile."""
+        self.__write_file(file_name, self.prometheus_text())
+        root_logger.info("Wrote Prometheus metrics to %s", file_name)
+
+
+run_metrics = RunMetrics()
@@ -12,8 +12,10 @@ import datetime
 import fitfile
 import idbutils
 
-from .garmindb import File
+from .garmindb import SummaryDirty, ExportDirty, StressRollup
 from .garmindb import MonitoringDb, Monitoring, MonitoringInfo, MonitoringHeartRate, MonitoringIntensity, MonitoringClimb, MonitoringRespirationRate, MonitoringPulseOx
+from .garmindb import MonitoringHeartRateRollup, MonitoringRespirationRateRollup, MonitoringPulseOxRollup
+from .garmindb import UpsertBuffer
 from .fit_file_processor import FitFileProcessor
 
 
@@ -25,18 +27,40 @@ root_logger = logging.getLogger()
 class MonitoringFitFileProcessor(FitFileProcessor):
     """Class that takes a parsed monitoring FIT file object and imports it into a database."""
 
+    buffered_tables = [MonitoringHeartRate, MonitoringIntensity, MonitoringClimb, Monitoring, MonitoringRespirationRate, MonitoringPulseOx]
+    monitoring_rollup_tables = [MonitoringHeartRateRollup, MonitoringRespirationRateRollup, MonitoringPulseOxRollup]
+
     def write_file(self, fit_file):
         """Given a Fit File object, write all of its messages to the DB."""
-        self.monitoring_fit_file_plugins = [plugin for plugin in self.plugin_manager.get_file_processors('MonitoringFit', fit_file).values()]
+        self.monitoring_fit_file_plugins = self._load_plugins('MonitoringFit', fit_file)
         if len(self.monitoring_fit_file_plugins):
-            root_logger.info("Loaded %d activity plugins %r for file %s", len(self.activity_fit_file_plugins), self.activity_fit_file_plugins, fit_file)
+            root_logger.info("Loaded %d monitoring plugins %r for file %s", len(self.monitoring_fit_file_plugins), self.monitoring_fit_file_plugins, fit_file)
         # Create the db after setting up the plugins so that plugin tables are handled properly
-        self.garmin_mon_db = MonitoringDb(self.db_params, self.debug - 1)
+        self.garmin_mon_db = MonitoringDb.get(self.db_params, self.debug - 1)
+        # Monitoring rows are buffered for the whole file and written with one insert or update statement per table.
+        self.upsert_buffers = {table: UpsertBuffer(table) for table in self.buffered_tables}
         with self.garmin_db.managed_session() as self.garmin_db_session, self.garmin_mon_db.managed_session() as self.garmin_mon_db_session:
             self._write_message_types(fit_file, fit_file.message_types)
+            for upsert_buffer in self.upsert_buffers.values():
+                upsert_buffer.flush(self.garmin_mon_db_session)
+            self._mark_dirty_days(fit_file)
+            self._update_rollups(fit_file)
+        self._file_committed()
+
+    def _mark_dirty_days(self, fit_file):
+        # Daily monitoring summaries at midnight are written to the previous day, see _write_monitoring_entry.
+        if fit_file.time_created_local is not None and fit_file.time_ended_local is not None:
+            start_ts = fit_file.time_created_local - datetime.timedelta(seconds=1)
+            SummaryDirty.s_mark_period(self.garmin_db_session, start_ts, fit_file.time_ended_local)
+            ExportDirty.s_mark_period(self.garmin_db_session, [MonitoringHeartRate, Monitoring], start_ts, fit_file.time_ended_local)
 
-    def _plugin_dispatch(self, handler_name, *args, **kwargs):
-        return super()._plugin_dispatch(self.monitoring_fit_file_plugins, handler_name, *args, **kwargs)
+    def _update_rollups(self, fit_file):
+        # Recompute the rollups for the days the file covers now that all of its values have been written.
+        if fit_file.time_created_local is not None and fit_file.time_ended_local is not None:
+            start_ts = fit_file.time_created_local - datetime.timedelta(seconds=1)
+            for rollup_table in self.monitoring_rollup_tables:
+                rollup_table.s_update(self.garmin_mon_db_session, start_ts, fit_file.time_ended_local)
+            StressRollup.s_update(self.garmin_db_session, start_ts, fit_file.time_ended_local)
 
     @classmethod
     def __unpack_tuple(cls, entry, name, value, index):
@@ -48,7 +72,7 @@ class MonitoringFitFileProcessor(FitFileProcessor):
         if isinstance(activity_types, list):
             for index, activity_type in enumerate(activity_types):
                 entry = {
-                    'file_id'                   : File.s_get_id(self.garmin_db_session, fit_file.filename),
+                    'file_id'                   : self._file_id(fit_file),
                     'timestamp'                 : message_fields.local_timestamp,
                     'activity_type'             : activity_type,
                     'resting_metabolic_rate'    : message_fields.get('resting_metabolic_rate')
@@ -57,6 +81,12 @@ class MonitoringFitFileProcessor(FitFileProcessor):
                 self.__unpack_tuple(entry, 'cycles_to_calories', message_fields.cycles_to_calories, index)
                 MonitoringInfo.s_insert_or_update(self.garmin_mon_db_session, entry)
 
+    def _write_monitoring(self, fit_file, message_type, messages):
+        """Write all monitoring messages to the database and pass them to the plugins that handle them in batches."""
+        for message in messages:
+            self._write_monitoring_entry(fit_file, message.fields)
+        self._plugin_dispatch_batch('write_monitoring_entries', messages, self.garmin_mon_db_session, fit_file)
+
     def _write_monitoring_entry(self, fit_file, message_fields):
         # Only include not None values so that we match and update only if a table's columns if it has values.
         entry = idbutils.list_and_dict.dict_filter_none_values(message_fields)
@@ -69,16 +99,16 @@ class MonitoringFitFileProcessor(FitFileProcessor):
         try:
             intersection = MonitoringHeartRate.intersection(entry)
             if len(intersection) > 1 and intersection['heart_rate'] > 0:
-                MonitoringHeartRate.s_insert_or_update(self.garmin_mon_db_session, intersection)
+                self.upsert_buffers[MonitoringHeartRate].add(intersection)
             intersection = MonitoringIntensity.intersection(entry)
             if len(intersection) > 1:
-                MonitoringIntensity.s_insert_or_update(self.garmin_mon_db_session, intersection)
+                self.upsert_buffers[MonitoringIntensity].add(intersection)
             intersection = MonitoringClimb.intersection(entry)
             if len(intersection) > 1:
-                MonitoringClimb.s_insert_or_update(self.garmin_mon_db_session, intersection)
+                self.upsert_buffers[MonitoringClimb].add(intersection)
             intersection = Monitoring.intersection(entry)
             if len(intersection) > 1:
-                Monitoring.s_insert_or_update(self.garmin_mon_db_session, intersection)
+                self.upsert_buffers[Monitoring].add(intersection)
         except ValueError:
             logger.error("write_monitoring_entry: ValueError for %r: %s", entry, traceback.format_exc())
         except Exception:
@@ -93,7 +123,7 @@ class MonitoringFitFileProcessor(FitFileProcessor):
                 'rr'        : rr,
             }
             if fit_file.type is fitfile.FileType.monitoring_b:
-                MonitoringRespirationRate.s_insert_or_update(self.garmin_mon_db_session, respiration)
+                self.upsert_buffers[MonitoringRespirationRate].add(respiration)
             else:
                 raise ValueError(f'Unexpected file type {repr(fit_file.type)} for respiration message')
 
@@ -106,6 +136,6 @@ class MonitoringFitFileProcessor(FitFileProcessor):
                     'timestamp': fit_file.utc_datetime_to_local(message_fields.timestamp),
                     'pulse_ox': pulse_ox,
                 }
-                MonitoringPulseOx.s_insert_or_update(self.garmin_mon_db_session, pulse_ox_entry)
+                self.upsert_buffers[MonitoringPulseOx].add(pulse_ox_entry)
         else:
             raise ValueError(f'Unexpected file type {repr(fit_file.type)} for pulse ox')
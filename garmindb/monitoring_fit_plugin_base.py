@@ -11,7 +11,12 @@ logger = logging.getLogger(__file__)
 
 
 class MonitoringFitPluginBase():
-    """Base class for GarminDb monitoring FIT file plugins."""
+    """
+    Base class for GarminDb monitoring FIT file plugins.
+
+    Plugins can define write_monitoring_entries(session, fit_file, monitoring) to handle all of the monitoring messages of a file at once.
+    It's called once per file with the messages as column arrays, a dict of field name to a list of the field's values.
+    """
 
     _type = 'MonitoringFit'
 
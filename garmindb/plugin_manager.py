@@ -8,7 +8,7 @@ import logging
 
 import idbutils
 
-from .garmindb import ActivitiesDb, Activities
+from .garmindb import ActivitiesDb, Activities, MonitoringDb, Monitoring
 
 
 logger = logging.getLogger(__file__)
@@ -17,18 +17,28 @@ logger = logging.getLogger(__file__)
 class PluginManager(idbutils.PluginManager):
     """Loads python file based plugins that extend GarminDb."""
 
+    # for each file type: the plugin method that matches files, the one that initializes the plugin, and the db and table it's initialized with
+    file_types = {
+        'ActivityFit'   : ('matches_activity_file', 'init_activity', ActivitiesDb, Activities),
+        'MonitoringFit' : ('matches_monitoring_file', 'init_monitoring', MonitoringDb, Monitoring)
+    }
+
     def __init__(self, plugin_dir, db_params):
         """Load python file based plugins from plugin_dir."""
         logger.info("Loading GarminDb plugins from %s", plugin_dir)
         super().__init__(plugin_dir, {'db_params': db_params})
+        self.initialized_plugins = set()
 
     def get_file_processors(self, file_type, fit_file):
-        """Return a dict of all plugins that handle file_type."""
+        """Return a dict of all plugins that handle file_type. Plugins are initialized the first time they match a file."""
         result = {}
         if file_type in self.plugins:
+            matches_name, init_name, db_class, table = self.file_types[file_type]
             for plugin_name, plugin in self.plugins[file_type].items():
-                if plugin.matches_activity_file(fit_file):
-                    logger.info("Activity Fit plugin %s matches file %s", plugin_name, fit_file)
-                    plugin.init_activity(ActivitiesDb, Activities)
+                if getattr(plugin, matches_name)(fit_file):
+                    logger.debug("%s plugin %s matches file %s", file_type, plugin_name, fit_file)
+                    if (file_type, plugin_name) not in self.initialized_plugins:
+                        getattr(plugin, init_name)(db_class, table)
+                        self.initialized_plugins.add((file_type, plugin_name))
                     result[plugin_name] = plugin
         return result
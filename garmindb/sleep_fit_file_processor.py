@@ -27,6 +27,8 @@ class SleepFitFileProcessor(FitFileProcessor):
         self.last_sleep_level = None
         with self.garmin_db.managed_session() as self.garmin_db_session:
             self._write_message_types(fit_file, fit_file.message_types)
+            self._mark_dirty_days(fit_file)
+        self._file_committed()
 
     def _write_sleep_level_entry(self, fit_file, message_fields):
         logger.debug("sleep level message: %r", message_fields)
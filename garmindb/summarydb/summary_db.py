@@ -10,11 +10,12 @@ from sqlalchemy import Column, Date
 import idbutils
 
 from .summary_base import SummaryBase
+from ..garmindb.sqlite_profile import ProfiledDb
 
 
 logger = logging.getLogger(__name__)
 
-SummaryDb = idbutils.DB.create('summary', 7, "Database for storing summarizing health data.")
+SummaryDb = ProfiledDb.create('summary', 7, "Database for storing summarizing health data.")
 Summary = idbutils.DbObject.create('summary', SummaryDb, 1, base=idbutils.KeyValueObject)
 
 
@@ -22,7 +22,7 @@ import glob
 import shutil
 
 from garmindb import python_version_check, log_version, format_version
-from garmindb.garmindb import GarminDb, Attributes, Sleep, Weight, RestingHeartRate, Hrv, MonitoringDb, MonitoringHeartRate, ActivitiesDb, GarminSummaryDb
+from garmindb.garmindb import GarminDb, ImportLedger, Attributes, Sleep, Weight, RestingHeartRate, Hrv, MonitoringDb, MonitoringHeartRate, ActivitiesDb, GarminSummaryDb
 from garmindb.summarydb import SummaryDb
 
 from garmindb import Download, Copy, Analyze
@@ -30,7 +30,8 @@ from garmindb import FitFileProcessor, ActivityFitFileProcessor, MonitoringFitFi
 from garmindb import GarminUserSettings, GarminSocialProfile, GarminPersonalInformation, GarminWeightData, GarminSummaryData, GarminMonitoringFitData, GarminSleepFitData, \
     GarminSleepData, GarminRhrData, GarminSettingsFitData, GarminHydrationData
 from garmindb import GarminJsonSummaryData, GarminJsonDetailsData, GarminTcxData, GarminActivitiesFitData
-from garmindb import ActivityExporter
+from garmindb import ActivityExporter, ImportPipeline, ColumnarExporter
+from garmindb import run_metrics
 
 from garmindb import GarminConnectConfigManager, PluginManager
 from garmindb import Statistics
@@ -63,6 +64,17 @@ class GarminDbMain():
 
     summary_dbs = [GarminSummaryDb, SummaryDb]
 
+    # the importers, by the name they record files in the import ledger under, that write to databases other than GarminDb
+    db_to_importers_map = {
+        MonitoringDb                     : [GarminMonitoringFitData.__name__],
+        ActivitiesDb                     : [GarminActivitiesFitData.__name__, GarminTcxData.__name__, GarminJsonSummaryData.__name__, GarminJsonDetailsData.__name__]
+    }
+
+    stats_to_columnar_tables = {
+        Statistics.monitoring            : ['monitoring_hr', 'monitoring'],
+        Statistics.activities            : ['activity_records']
+    }
+
     def __init__(self, config_path=None):
         self.gc_config = GarminConnectConfigManager(config_path)
         self.plugin_manager = PluginManager(self.gc_config.get_plugins_dir(), self.gc_config.get_db_params())
@@ -114,8 +126,12 @@ class GarminDbMain():
             copy.copy_sleep(monitoring_dir, latest)
 
 
-    def download_data(self, overwrite, latest, stats):
-        """Download selected activity types from Garmin Connect and save the data in files. Overwrite previously downloaded data if indicated."""
+    def download_data(self, overwrite, latest, stats, pipeline=False, debug=0):
+        """
+        Download selected activity types from Garmin Connect and save the data in files. Overwrite previously downloaded data if indicated.
+
+        If pipeline is set, the downloaded files are imported as they are downloaded.
+        """
         logger.info("___Downloading %s Data___", 'Latest' if latest else 'All')
 
         download = Download(self.gc_config)
@@ -123,6 +139,12 @@ class GarminDbMain():
             logger.error("Failed to login!")
             sys.exit()
 
+        import_pipeline = None
+        if pipeline:
+            measurement_system = self.__import_settings(debug)
+            import_pipeline = ImportPipeline(self.gc_config.get_db_params(), self.plugin_manager, measurement_system, debug)
+            download.file_handler = import_pipeline.add_files
+
         if Statistics.activities in stats:
             if latest:
                 activity_count = self.gc_config.latest_activity_count()
@@ -134,7 +156,7 @@ class GarminDbMain():
             download.get_activities(activities_dir, activity_count, overwrite)
 
         if Statistics.monitoring in stats:
-            date, days = self.__get_date_and_days(MonitoringDb(self.gc_config.get_db_params()), latest, MonitoringHeartRate, MonitoringHeartRate.heart_rate, 'monitoring')
+            date, days = self.__get_date_and_days(MonitoringDb.get(self.gc_config.get_db_params()), latest, MonitoringHeartRate, MonitoringHeartRate.heart_rate, 'monitoring')
             if days > 0:
                 monitoring_dir = self.gc_config.get_monitoring_base_dir()
                 root_logger.info("Date range to update: %s (%d) to %s", date, days, monitoring_dir)
@@ -144,7 +166,7 @@ class GarminDbMain():
                 root_logger.info("Saved monitoring files for %s (%d) to %s for processing", date, days, monitoring_dir)
 
         if Statistics.sleep in stats:
-            date, days = self.__get_date_and_days(GarminDb(self.gc_config.get_db_params()), latest, Sleep, Sleep.total_sleep, 'sleep')
+            date, days = self.__get_date_and_days(GarminDb.get(self.gc_config.get_db_params()), latest, Sleep, Sleep.total_sleep, 'sleep')
             if days > 0:
                 sleep_dir = self.gc_config.get_sleep_dir()
                 root_logger.info("Date range to update: %s (%d) to %s", date, days, sleep_dir)
@@ -152,7 +174,7 @@ class GarminDbMain():
                 root_logger.info("Saved sleep files for %s (%d) to %s for processing", date, days, sleep_dir)
 
         if Statistics.weight in stats:
-            date, days = self.__get_date_and_days(GarminDb(self.gc_config.get_db_params()), latest, Weight, Weight.weight, 'weight')
+            date, days = self.__get_date_and_days(GarminDb.get(self.gc_config.get_db_params()), latest, Weight, Weight.weight, 'weight')
             if days > 0:
                 weight_dir = self.gc_config.get_weight_dir()
                 root_logger.info("Date range to update: %s (%d) to %s", date, days, weight_dir)
@@ -160,7 +182,7 @@ class GarminDbMain():
                 root_logger.info("Saved weight files for %s (%d) to %s for processing", date, days, weight_dir)
 
         if Statistics.rhr in stats:
-            date, days = self.__get_date_and_days(GarminDb(self.gc_config.get_db_params()), latest, RestingHeartRate, RestingHeartRate.resting_heart_rate, 'rhr')
+            date, days = self.__get_date_and_days(GarminDb.get(self.gc_config.get_db_params()), latest, RestingHeartRate, RestingHeartRate.resting_heart_rate, 'rhr')
             if days > 0:
                 rhr_dir = self.gc_config.get_rhr_dir()
                 root_logger.info("Date range to update: %s (%d) to %s", date, days, rhr_dir)
@@ -168,62 +190,72 @@ class GarminDbMain():
                 root_logger.info("Saved rhr files for %s (%d) to %s for processing", date, days, rhr_dir)
 
         if Statistics.hrv in stats:
-            date, days = self.__get_date_and_days(GarminDb(self.gc_config.get_db_params()), latest, Hrv, Hrv.day, 'hrv')
+            date, days = self.__get_date_and_days(GarminDb.get(self.gc_config.get_db_params()), latest, Hrv, Hrv.day, 'hrv')
             if days > 0:
                 hrv_dir = self.gc_config.get_rhr_dir() # HRV tends to be in the same place as RHR or monitoring
                 root_logger.info("Date range to update: %s (%d) to %s", date, days, hrv_dir)
                 download.get_hrv(hrv_dir, date, days, overwrite)
                 root_logger.info("Saved hrv files for %s (%d) to %s for processing", date, days, hrv_dir)
 
+        # stats are downloaded concurrently if download workers are configured, wait for all of them to finish before importing
+        download.wait()
+        if import_pipeline:
+            import_pipeline.finish()
 
-    def import_data(self, debug, latest, stats):
-        """Import previously downloaded Garmin data into the database."""
-        logger.info("___Importing %s Data___", 'Latest' if latest else 'All')
 
-        # Import the user profile and/or settings FIT file first so that we can get the measurement system and some other things sorted out first.
+    def __import_settings(self, debug):
+        """Import the user profile and settings and return the measurement system."""
         fit_files_dir = self.gc_config.get_fit_files_dir()
-        gus = GarminUserSettings(self.gc_config.get_db_params(), fit_files_dir, debug)
-        if gus.file_count() > 0:
-            gus.process()
+        with run_metrics.stage('settings'):
+            gus = GarminUserSettings(self.gc_config.get_db_params(), fit_files_dir, debug)
+            if gus.file_count() > 0:
+                gus.process()
+
+            gpi = GarminPersonalInformation(self.gc_config.get_db_params(), fit_files_dir, debug)
+            if gpi.file_count() > 0:
+                gpi.process()
+
+            gsp = GarminSocialProfile(self.gc_config.get_db_params(), fit_files_dir, debug)
+            if gsp.file_count() > 0:
+                gsp.process()
 
-        gpi = GarminPersonalInformation(self.gc_config.get_db_params(), fit_files_dir, debug)
-        if gpi.file_count() > 0:
-            gpi.process()
+            gsfd = GarminSettingsFitData(fit_files_dir, debug)
+            if gsfd.file_count() > 0:
+                gsfd.process_files(FitFileProcessor(self.gc_config.get_db_params(), self.plugin_manager, debug))
 
-        gsp = GarminSocialProfile(self.gc_config.get_db_params(), fit_files_dir, debug)
-        if gsp.file_count() > 0:
-            gsp.process()
+        gdb = GarminDb.get(self.gc_config.get_db_params())
+        return Attributes.measurements_type(gdb)
 
-        gsfd = GarminSettingsFitData(fit_files_dir, debug)
-        if gsfd.file_count() > 0:
-            gsfd.process_files(FitFileProcessor(self.gc_config.get_db_params(), self.plugin_manager, debug))
+    def import_data(self, debug, latest, stats, workers=1, retry_failed=False):
+        """Import previously downloaded Garmin data into the database."""
+        logger.info("___Importing %s Data___", 'Latest' if latest else 'All')
 
-        gdb = GarminDb(self.gc_config.get_db_params())
-        measurement_system = Attributes.measurements_type(gdb)
+        # Import the user profile and/or settings FIT file first so that we can get the measurement system and some other things sorted out first.
+        measurement_system = self.__import_settings(debug)
 
         if Statistics.weight in stats:
             weight_dir = self.gc_config.get_weight_dir()
-            gwd = GarminWeightData(self.gc_config.get_db_params(), weight_dir, latest, measurement_system, debug)
+            gwd = GarminWeightData(self.gc_config.get_db_params(), weight_dir, latest, measurement_system, debug, retry_failed, workers)
             if gwd.file_count() > 0:
                 gwd.process()
 
         monitoring_dir = self.gc_config.get_monitoring_base_dir()
         if Statistics.monitoring in stats:
-            gsd = GarminSummaryData(self.gc_config.get_db_params(), monitoring_dir, latest, measurement_system, debug)
+            gsd = GarminSummaryData(self.gc_config.get_db_params(), monitoring_dir, latest, measurement_system, debug, retry_failed, workers)
             if gsd.file_count() > 0:
                 gsd.process()
 
-            ghd = GarminHydrationData(self.gc_config.get_db_params(), monitoring_dir, latest, measurement_system, debug)
+            ghd = GarminHydrationData(self.gc_config.get_db_params(), monitoring_dir, latest, measurement_system, debug, retry_failed, workers)
             if ghd.file_count() > 0:
                 ghd.process()
 
-            gfd = GarminMonitoringFitData(monitoring_dir, latest, measurement_system, debug)
+            gfd = GarminMonitoringFitData(monitoring_dir, latest, measurement_system, debug, workers, retry_failed)
             if gfd.file_count() > 0:
                 gfd.process_files(MonitoringFitFileProcessor(self.gc_config.get_db_params(), self.plugin_manager, debug))
 
         if Statistics.sleep in stats:
             # If we have sleep data from Garmin connect, use it, otherwise process FIT sleep files.
-            gsd = GarminSleepData(self.gc_config.get_db_params(), self.gc_config.get_sleep_dir(), latest, debug)
+            gsd = GarminSleepData(self.gc_config.get_db_params(), self.gc_config.get_sleep_dir(), latest, debug, retry_failed, workers)
             if gsd.file_count() > 0:
                 gsd.process()
             else:
@@ -233,42 +265,51 @@ class GarminDbMain():
 
         if Statistics.rhr in stats:
             rhr_dir = self.gc_config.get_rhr_dir()
-            grhrd = GarminRhrData(self.gc_config.get_db_params(), rhr_dir, latest, debug)
+            grhrd = GarminRhrData(self.gc_config.get_db_params(), rhr_dir, latest, debug, retry_failed, workers)
             if grhrd.file_count() > 0:
                 grhrd.process()
 
         if Statistics.hrv in stats:
             from garmindb import GarminHrvData
             hrv_dir = self.gc_config.get_rhr_dir()
-            ghrvd = GarminHrvData(self.gc_config.get_db_params(), hrv_dir, latest, debug)
+            ghrvd = GarminHrvData(self.gc_config.get_db_params(), hrv_dir, latest, debug, retry_failed, workers)
             if ghrvd.file_count() > 0:
                 ghrvd.process()
 
         if Statistics.activities in stats:
             activities_dir = self.gc_config.get_activities_dir()
             # Tcx fields are less precise than the JSON files, so load Tcx first and overwrite with better JSON values.
-            gtd = GarminTcxData(activities_dir, latest, measurement_system, debug)
+            gtd = GarminTcxData(activities_dir, latest, measurement_system, debug, retry_failed)
             if gtd.file_count() > 0:
                 gtd.process_files(self.gc_config.get_db_params())
 
-            gjsd = GarminJsonSummaryData(self.gc_config.get_db_params(), activities_dir, latest, measurement_system, debug)
+            gjsd = GarminJsonSummaryData(self.gc_config.get_db_params(), activities_dir, latest, measurement_system, debug, retry_failed)
             if gjsd.file_count() > 0:
                 gjsd.process()
 
-            gdjd = GarminJsonDetailsData(self.gc_config.get_db_params(), activities_dir, latest, measurement_system, debug)
+            gdjd = GarminJsonDetailsData(self.gc_config.get_db_params(), activities_dir, latest, measurement_system, debug, retry_failed)
             if gdjd.file_count() > 0:
                 gdjd.process()
 
-            gfd = GarminActivitiesFitData(activities_dir, latest, measurement_system, debug)
+            gfd = GarminActivitiesFitData(activities_dir, latest, measurement_system, debug, workers, retry_failed)
             if gfd.file_count() > 0:
                 gfd.process_files(ActivityFitFileProcessor(self.gc_config.get_db_params(), self.plugin_manager, debug))
 
 
-    def analyze_data(self, debug):
+    def export_columnar(self, debug, stats, full=False):
+        """Export the monitoring and activity record tables for the chosen stats to partitioned Parquet or Arrow files."""
+        table_names = [table_name for stat in stats for table_name in self.stats_to_columnar_tables.get(stat, [])]
+        if table_names:
+            logger.info("___Exporting %s to %s files___", ', '.join(table_names), self.gc_config.columnar_export_format())
+            exporter = ColumnarExporter(self.gc_config.get_db_params(), self.gc_config.get_columnar_export_dir(), self.gc_config.columnar_export_format(), debug)
+            exporter.export(table_names, full)
+
+
+    def analyze_data(self, debug, incremental=False, workers=1):
         """Analyze the downloaded and imported Garmin data and create summary tables."""
-        logger.info("___Analyzing Data___")
+        logger.info("___Analyzing %s Data___", 'Incremental' if incremental else 'All')
         analyze = Analyze(self.gc_config, debug - 1)
-        analyze.summary()
+        analyze.summary(incremental, workers)
         analyze.create_dynamic_views()
 
 
@@ -280,17 +321,25 @@ class GarminDbMain():
         with zipfile.ZipFile(backupfile, 'w') as backupzip:
             for db in dbs:
                 backupzip.write(db)
+                # with the performance profile, recent changes may still be in the write ahead log
+                if os.path.exists(db + '-wal'):
+                    backupzip.write(db + '-wal')
 
 
     def delete_dbs(self, delete_db_list=[GarminDb, MonitoringDb, ActivitiesDb, GarminSummaryDb, SummaryDb]):
         """Delete selected database files, or all if none selected."""
         for db in delete_db_list:
             db.delete_db(self.gc_config.get_db_params())
+        # The ledger is deleted with GarminDb. Otherwise forget which files were imported into the deleted databases so that they're imported again.
+        if GarminDb not in delete_db_list:
+            importers = [importer for db in delete_db_list for importer in self.db_to_importers_map.get(db, [])]
+            if importers:
+                ImportLedger.clear(GarminDb.get(self.gc_config.get_db_params()), importers)
 
 
     def export_activity(self, debug, directory, export_activity_id):
         """Export an activity given its database id."""
-        garmin_db = GarminDb(self.gc_config.get_db_params())
+        garmin_db = GarminDb.get(self.gc_config.get_db_params())
         measurement_system = Attributes.measurements_type(garmin_db)
         ae = ActivityExporter(directory, export_activity_id, measurement_system, debug)
         ae.process(self.gc_config.get_db_params())
@@ -310,6 +359,13 @@ class GarminDbMain():
         logger.info("Opening activity %d (%s) in GoogleEarth", export_activity_id, file_with_path)
         OpenWithGoogleEarth.open(file_with_path)
 
+    def write_metrics(self):
+        """Write the timings and counts of this run to the run report and, if configured, the Prometheus textfile."""
+        run_metrics.write_report(self.gc_config.get_metrics_report_file())
+        prometheus_file = self.gc_config.get_metrics_prometheus_file()
+        if prometheus_file:
+            run_metrics.write_prometheus(prometheus_file)
+
     def sync_data(self):
         """Sync data from base_dir to sync_dir if configured."""
         sync_dir = self.gc_config.get_sync_dir()
@@ -342,6 +398,8 @@ def main(argv):
     modes_group.add_argument("-d", "--download", help="Download data from Garmin Connect for the chosen stats.", dest='download_data', action="store_true", default=False)
     modes_group.add_argument("-c", "--copy", help="copy data from a connected device", dest='copy_data', action="store_true", default=False)
     modes_group.add_argument("-i", "--import", help="Import data for the chosen stats", dest='import_data', action="store_true", default=False)
+    modes_group.add_argument("--export-columnar", help="Export the monitoring and activity record tables for the chosen stats to partitioned Parquet or Arrow files.",
+                             dest='export_columnar', action="store_true", default=False)
     modes_group.add_argument("--analyze", help="Analyze data in the db and create summary and derived tables.", dest='analyze_data', action="store_true", default=False)
     modes_group.add_argument("--rebuild_db", help="Delete Garmin DB db files and rebuild the database.", action="store_true", default=False)
     modes_group.add_argument("--delete_db", help="Delete Garmin DB db files for the selected activities.", action="store_true", default=False)
@@ -362,6 +420,16 @@ def main(argv):
     modifiers_group.add_argument("-l", "--latest", help="Only download and/or import the latest data.", action="store_true", default=False)
     modifiers_group.add_argument("-o", "--overwrite", help="Overwrite existing files when downloading. The default is to only download missing files.",
                                  action="store_true", default=False)
+    modifiers_group.add_argument("--workers", help="Number of processes to use for parsing FIT files and analyzing years and threads to use for parsing JSON files. "
+                                 "The default is to do everything in a single process.",
+                                 type=int, default=1)
+    modifiers_group.add_argument("--retry-failed", help="Only import the files that failed to import the last time they were imported.", dest='retry_failed',
+                                 action="store_true", default=False)
+    modifiers_group.add_argument("--pipeline", help="When downloading and importing, import each file as soon as it is downloaded instead of importing "
+                                 "after the download has finished. The import that follows only imports the files the ledger hasn't seen.",
+                                 action="store_true", default=False)
+    modifiers_group.add_argument("--incremental", help="Only analyze the days that have had data imported since the last analyze, and the weeks, months, and years "
+                                 "that contain them.", action="store_true", default=False)
     args = parser.parse_args()
 
     log_version(sys.argv[0])
@@ -371,6 +439,7 @@ def main(argv):
     else:
         root_logger.setLevel(logging.INFO)
 
+    run_metrics.track_sql()
     garminDbMain = GarminDbMain(args.config)
     if args.all:
         stats = garminDbMain.gc_config.enabled_stats()
@@ -388,20 +457,35 @@ def main(argv):
 
     if args.rebuild_db:
         garminDbMain.delete_dbs([GarminDbMain.stats_to_db_map[stat] for stat in garminDbMain.gc_config.enabled_stats()] + garminDbMain.summary_dbs)
-        garminDbMain.import_data(args.trace, args.latest, garminDbMain.gc_config.enabled_stats())
-        garminDbMain.analyze_data(args.trace)
+        with run_metrics.stage('import'):
+            garminDbMain.import_data(args.trace, args.latest, garminDbMain.gc_config.enabled_stats(), args.workers)
+        with run_metrics.stage('analyze'):
+            garminDbMain.analyze_data(args.trace, workers=args.workers)
 
     if args.copy_data:
-        garminDbMain.copy_data(args.overwrite, args.latest, stats)
+        with run_metrics.stage('copy'):
+            garminDbMain.copy_data(args.overwrite, args.latest, stats)
+
+    pipeline = args.pipeline and args.download_data and args.import_data
 
     if args.download_data:
-        garminDbMain.download_data(args.overwrite, args.latest, stats)
+        with run_metrics.stage('download'):
+            garminDbMain.download_data(args.overwrite, args.latest, stats, pipeline, args.trace)
 
     if args.import_data:
-        garminDbMain.import_data(args.trace, args.latest, stats)
+        # The pipeline only imports the files that were downloaded in this run. Files that were downloaded earlier but haven't been imported,
+        # and file types the pipeline doesn't import, are imported here. After the pipeline the import is always ledger driven so that the
+        # files the pipeline imported aren't imported a second time.
+        with run_metrics.stage('import'):
+            garminDbMain.import_data(args.trace, args.latest or pipeline, stats, args.workers, args.retry_failed)
+
+    if args.export_columnar or ((args.import_data or args.rebuild_db) and garminDbMain.gc_config.columnar_export_enabled()):
+        with run_metrics.stage('export_columnar'):
+            garminDbMain.export_columnar(args.trace, stats or garminDbMain.gc_config.enabled_stats())
 
     if args.analyze_data:
-        garminDbMain.analyze_data(args.trace)
+        with run_metrics.stage('analyze'):
+            garminDbMain.analyze_data(args.trace, args.incremental, args.workers)
 
     if args.export_activity:
         garminDbMain.export_activity(args.trace, os.getcwd(), args.export_activity)
@@ -437,6 +521,9 @@ def main(argv):
         except Exception as e:
              root_logger.error(f"Oura authentication failed: {e}")
 
+    if args.copy_data or args.download_data or args.import_data or args.rebuild_db or args.export_columnar or args.analyze_data:
+        garminDbMain.write_metrics()
+
     garminDbMain.sync_data()
 
 
@@ -0,0 +1,224 @@
+"""Objects for writing small FIT files for the tests of the FIT file importers."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import struct
+import datetime
+import random
+
+
+class FitFileWriter():
+    """Write minimal little endian FIT files: a file header, definition messages, data messages with uncompressed timestamps, and the file CRC."""
+
+    fit_epoch = datetime.datetime(1989, 12, 31, tzinfo=datetime.timezone.utc)
+    base_types = {
+        'enum'      : (0x00, 'B'),
+        'uint8'     : (0x02, 'B'),
+        'sint16'    : (0x83, 'h'),
+        'uint16'    : (0x84, 'H'),
+        'sint32'    : (0x85, 'i'),
+        'uint32'    : (0x86, 'I'),
+        'uint32z'   : (0x8c, 'I'),
+    }
+    crc_table = [0x0000, 0xCC01, 0xD801, 0x1400, 0xF001, 0x3C00, 0x2800, 0xE401, 0xA001, 0x6C00, 0x7800, 0xB401, 0x5000, 0x9C01, 0x8801, 0x4400]
+    protocol_version = 0x10
+    profile_version = 2093
+
+    def __init__(self):
+        """Return a new FitFileWriter with no messages."""
+        self.data = bytearray()
+        self.definitions = {}
+
+    @classmethod
+    def timestamp(cls, dt):
+        """Return the FIT timestamp for a datetime, naive datetimes are FIT local time values and are encoded as is."""
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=datetime.timezone.utc)
+        return int((dt - cls.fit_epoch).total_seconds())
+
+    @classmethod
+    def time_offset(cls, seconds):
+        """Return the FIT encoding of a UTC offset in seconds, negative offsets wrap around."""
+        return seconds % (2 ** 32)
+
+    @classmethod
+    def semicircles(cls, degrees):
+        """Return the FIT semicircles value for a position in degrees."""
+        return int(degrees * (2 ** 31) / 180)
+
+    @classmethod
+    def crc(cls, data, crc=0):
+        """Return the FIT CRC of data."""
+        for byte in data:
+            for nibble in (byte & 0xf, byte >> 4):
+                tmp = cls.crc_table[crc & 0xf]
+                crc = (crc >> 4) & 0x0fff
+                crc = crc ^ tmp ^ cls.crc_table[nibble]
+        return crc
+
+    def define(self, local_message_num, global_message_num, fields):
+        """Write a definition message for a local message number with a list of (field number, base type name, array length) tuples."""
+        self.definitions[local_message_num] = fields
+        self.data += struct.pack('<BBBHB', 0x40 | local_message_num, 0, 0, global_message_num, len(fields))
+        for field_num, base_type, count in fields:
+            type_id, type_format = self.base_types[base_type]
+            self.data += struct.pack('<BBB', field_num, struct.calcsize(type_format) * count, type_id)
+
+    def write(self, local_message_num, *values):
+        """Write a data message with one value, or a list of values for array fields, per defined field."""
+        self.data += struct.pack('<B', local_message_num)
+        for (_, base_type, count), value in zip(self.definitions[local_message_num], values):
+            type_format = self.base_types[base_type][1]
+            self.data += struct.pack(f'<{count}{type_format}', *(value if count > 1 else [value]))
+
+    def save(self, filename):
+        """Write the FIT file to disk."""
+        header = struct.pack('<BBHI4s', 14, self.protocol_version, self.profile_version, len(self.data), b'.FIT')
+        header += struct.pack('<H', self.crc(header))
+        with open(filename, 'wb') as file:
+            file.write(header)
+            file.write(self.data)
+            file.write(struct.pack('<H', self.crc(self.data, self.crc(header))))
+
+
+class FitFixtures():
+    """
+    Write activity and monitoring FIT files like the ones a Garmin watch records.
+
+    The files carry the local time zone the way devices do: activities in a device_settings message, a start message, or both, and
+    monitoring files in their monitoring_info message. The files of each type are written to the directory named by the directory attributes.
+    """
+
+    activities_dir = 'activities'
+    monitoring_dir = 'monitoring'
+
+    manufacturer_garmin = 1
+    product = 2697
+    serial_number = 3912345678
+    file_type_activity = 4
+    file_type_monitoring_b = 32
+    activity_type_walking = 6
+    activity_type_running = 1
+    sport_running = 1
+
+    def __init__(self, root_dir, monitoring_interval=600, record_interval=5, utc_offset=-18000, seed=42):
+        """Return a FitFixtures instance that writes its files under root_dir with the given message intervals and UTC offset in seconds."""
+        self.root_dir = root_dir
+        self.monitoring_interval = monitoring_interval
+        self.record_interval = record_interval
+        self.utc_offset = datetime.timedelta(seconds=utc_offset)
+        self.random = random.Random(seed)
+        self.counts = {}
+
+    def dir(self, name):
+        """Return the full path of a data directory, creating it if needed."""
+        path = os.path.join(self.root_dir, name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def __count(self, name, value=1):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def __local_to_utc(self, local_dt):
+        return (local_dt - self.utc_offset).replace(tzinfo=datetime.timezone.utc)
+
+    def __write_file_id(self, fit_file, file_type, time_created):
+        fit_file.define(0, 0, [(0, 'enum', 1), (1, 'uint16', 1), (2, 'uint16', 1), (3, 'uint32z', 1), (4, 'uint32', 1)])
+        fit_file.write(0, file_type, self.manufacturer_garmin, self.product, self.serial_number, FitFileWriter.timestamp(time_created))
+
+    def write_monitoring(self, day):
+        """Write a day of monitoring data, a monitoring_info message followed by monitoring and stress messages, and return the file name."""
+        start = datetime.datetime.combine(day, datetime.time.min)
+        start_utc = self.__local_to_utc(start)
+        fit_file = FitFileWriter()
+        self.__write_file_id(fit_file, self.file_type_monitoring_b, start_utc)
+        # monitoring_info: timestamp, local_timestamp, activity_type, cycles_to_distance, cycles_to_calories, resting_metabolic_rate
+        fit_file.define(1, 103, [(253, 'uint32', 1), (0, 'uint32', 1), (1, 'enum', 2), (3, 'uint16', 2), (4, 'uint16', 2), (5, 'uint16', 1)])
+        fit_file.write(1, FitFileWriter.timestamp(start_utc), FitFileWriter.timestamp(start), [self.activity_type_walking, self.activity_type_running],
+                       [7800, 9500], [4200, 5100], 1650)
+        # monitoring: timestamp, activity_type, current_activity_type_intensity, heart_rate, cycles, active_calories
+        fit_file.define(2, 55, [(253, 'uint32', 1), (5, 'enum', 1), (24, 'uint8', 1), (27, 'uint8', 1), (3, 'uint32', 1), (19, 'uint16', 1)])
+        # stress_level: stress_level, local_timestamp
+        fit_file.define(3, 227, [(0, 'sint16', 1), (1, 'uint32', 1)])
+        cycles = 0
+        calories = 0
+        for second in range(self.monitoring_interval, 86400, self.monitoring_interval):
+            timestamp = start + datetime.timedelta(seconds=second)
+            awake = 7 <= timestamp.hour < 23
+            intensity = self.random.choice([0, 0, 1, 2]) if awake else 0
+            if awake:
+                cycles += self.random.randint(0, 40) + intensity * 20
+                calories += self.random.randint(0, 2) + intensity
+            fit_file.write(2, FitFileWriter.timestamp(self.__local_to_utc(timestamp)), self.activity_type_walking, (intensity << 5) | self.activity_type_walking,
+                           self.random.randint(55, 75) + intensity * 10, cycles, calories)
+            fit_file.write(3, self.random.randint(10, 60) if awake else self.random.randint(0, 25), FitFileWriter.timestamp(timestamp))
+            self.__count('monitoring_messages')
+        file_name = os.path.join(self.dir(self.monitoring_dir), f'{day.strftime("%Y%m%d")}_MONITORING.fit')
+        fit_file.save(file_name)
+        self.__count('monitoring_files')
+        return file_name
+
+    def write_activity(self, day, device_settings=True, start=True):
+        """
+        Write an activity FIT file for a run on the day with records, laps, and a session, and return the file name.
+
+        The local time zone is written in a device_settings message if device_settings is set, and in a start message if start is set.
+        """
+        start_local = datetime.datetime.combine(day, datetime.time(hour=self.random.randint(6, 18), minute=self.random.randint(0, 59)))
+        start_utc = self.__local_to_utc(start_local)
+        duration = self.random.randint(20, 40) * 60
+        fit_file = FitFileWriter()
+        self.__write_file_id(fit_file, self.file_type_activity, start_utc)
+        if device_settings:
+            # device_settings: time_offset
+            fit_file.define(4, 2, [(2, 'uint32', 1)])
+            fit_file.write(4, FitFileWriter.time_offset(int(self.utc_offset.total_seconds())))
+        if start:
+            # start: timestamp, local_timestamp
+            fit_file.define(5, 273, [(253, 'uint32', 1), (2, 'uint32', 1)])
+            fit_file.write(5, FitFileWriter.timestamp(start_utc), FitFileWriter.timestamp(start_local))
+        # record: timestamp, position_lat, position_long, heart_rate, cadence, distance, speed
+        fit_file.define(1, 20, [(253, 'uint32', 1), (0, 'sint32', 1), (1, 'sint32', 1), (3, 'uint8', 1), (4, 'uint8', 1), (5, 'uint32', 1), (6, 'uint16', 1)])
+        # lap: timestamp, start_time, total_elapsed_time, total_timer_time, total_distance, total_calories, avg and max heart rate
+        fit_file.define(2, 19, [(253, 'uint32', 1), (2, 'uint32', 1), (7, 'uint32', 1), (8, 'uint32', 1), (9, 'uint32', 1), (11, 'uint16', 1), (15, 'uint8', 1),
+                                (16, 'uint8', 1)])
+        # session: the lap fields plus sport, sub_sport, avg and max speed, and the number of laps
+        fit_file.define(3, 18, [(253, 'uint32', 1), (2, 'uint32', 1), (7, 'uint32', 1), (8, 'uint32', 1), (9, 'uint32', 1), (11, 'uint16', 1), (16, 'uint8', 1),
+                                (17, 'uint8', 1), (5, 'enum', 1), (6, 'enum', 1), (14, 'uint16', 1), (15, 'uint16', 1), (26, 'uint16', 1)])
+        lat = 42.3 + self.random.random() / 10
+        long = -71.1 + self.random.random() / 10
+        distance = 0.0
+        heart_rates = []
+        lap_start = 0
+        lap_distance = 0.0
+        laps = 0
+        max_speed = 0.0
+        for second in range(0, duration + 1, self.record_interval):
+            speed = 2.5 + self.random.random()
+            max_speed = max(max_speed, speed)
+            heart_rate = self.random.randint(120, 175)
+            heart_rates.append(heart_rate)
+            distance += speed * self.record_interval if second else 0.0
+            lat += self.random.uniform(-0.0001, 0.0001)
+            long += self.random.uniform(-0.0001, 0.0001)
+            timestamp = FitFileWriter.timestamp(start_utc + datetime.timedelta(seconds=second))
+            fit_file.write(1, timestamp, FitFileWriter.semicircles(lat), FitFileWriter.semicircles(long), heart_rate, self.random.randint(80, 90), int(distance * 100),
+                           int(speed * 1000))
+            self.__count('activity_records')
+            if second - lap_start >= 600 or second + self.record_interval > duration:
+                lap_heart_rates = heart_rates[-((second - lap_start) // self.record_interval + 1):]
+                fit_file.write(2, timestamp, FitFileWriter.timestamp(start_utc + datetime.timedelta(seconds=lap_start)), (second - lap_start) * 1000,
+                               (second - lap_start) * 1000, int((distance - lap_distance) * 100), int((distance - lap_distance) / 15),
+                               sum(lap_heart_rates) // len(lap_heart_rates), max(lap_heart_rates))
+                lap_start = second
+                lap_distance = distance
+                laps += 1
+        fit_file.write(3, timestamp, FitFileWriter.timestamp(start_utc), duration * 1000, duration * 1000, int(distance * 100), int(distance / 15),
+                       sum(heart_rates) // len(heart_rates), max(heart_rates), self.sport_running, 0, int(distance * 1000 / duration), int(max_speed * 1000), laps)
+        file_name = os.path.join(self.dir(self.activities_dir), f'{day.strftime("%Y%m%d")}_ACTIVITY.fit')
+        fit_file.save(file_name)
+        self.__count('activity_files')
+        return file_name
@@ -0,0 +1,158 @@
+"""Test that importing activities again only inserts the activity records that aren't in the database yet."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import unittest
+import logging
+import datetime
+import tempfile
+from unittest import mock
+
+import fitfile
+import idbutils
+
+from garmindb import PluginManager, FitData, ActivityFitFileProcessor, GarminActivitiesFitData, GarminTcxData, Tcx
+from garmindb.garmindb import GarminDb, Attributes, ImportLedger, ActivitiesDb, ActivityRecords
+
+from fit_fixtures import FitFixtures
+
+
+root_logger = logging.getLogger()
+handler = logging.FileHandler('activity_records.log', 'w')
+root_logger.addHandler(handler)
+root_logger.setLevel(logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+
+class TestActivityRecords(unittest.TestCase):
+
+    days = 3
+    tcx_points = 20
+    # count the records inserted by the importers by wrapping the unpatched method
+    insert_new = ActivityRecords.s_insert_new
+
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.TemporaryDirectory()
+        cls.fit_fixtures = FitFixtures(cls.temp_dir.name)
+        for day in range(cls.days):
+            cls.fit_fixtures.write_activity(datetime.date(2024, 1, 1) + datetime.timedelta(days=day))
+        cls.activities_dir = os.path.join(cls.temp_dir.name, FitFixtures.activities_dir)
+        cls.tcx_dir = os.path.join(cls.temp_dir.name, 'tcx')
+        os.makedirs(cls.tcx_dir)
+        cls.plugin_dir = os.path.join(cls.temp_dir.name, 'plugins')
+        os.makedirs(cls.plugin_dir)
+        cls.write_tcx(os.path.join(cls.tcx_dir, '1234.tcx'), datetime.datetime(2024, 1, 5, 10))
+
+    @classmethod
+    def write_tcx(cls, file_name, start):
+        tcx = Tcx()
+        tcx.create('Running', start)
+        end = start + datetime.timedelta(seconds=cls.tcx_points - 1)
+        track = tcx.add_lap(start, end, fitfile.Distance.from_meters(cls.tcx_points * 3), 10)
+        for point in range(cls.tcx_points):
+            tcx.add_point(track, start + datetime.timedelta(seconds=point), idbutils.Location(42.3 + point / 10000, -71.1), fitfile.Distance.from_meters(10),
+                          120 + point, fitfile.Speed.from_mps(3))
+        tcx.add_creator('Forerunner 245', FitFixtures.serial_number)
+        tcx.write(file_name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.temp_dir.cleanup()
+
+    def setUp(self):
+        self.db_dir = tempfile.TemporaryDirectory()
+        self.db_params = idbutils.DbParams(db_type='sqlite', db_path=self.db_dir.name)
+        Attributes.set(GarminDb(self.db_params), 'measurement_system', fitfile.field_enums.DisplayMeasure.metric)
+        self.inserted = []
+
+    def tearDown(self):
+        FitData.streaming_file_size = 16 * 1024 * 1024
+        FitData.streaming_chunk_size = 10000
+        self.db_dir.cleanup()
+
+    def s_insert_new(self, session, records):
+        inserted = self.insert_new(session, records)
+        self.inserted.append(inserted)
+        return inserted
+
+    def import_fit(self):
+        self.inserted = []
+        gfd = GarminActivitiesFitData(self.activities_dir, False, fitfile.field_enums.DisplayMeasure.metric, 0)
+        with mock.patch.object(ActivityRecords, 's_insert_new', side_effect=self.s_insert_new):
+            gfd.process_files(ActivityFitFileProcessor(self.db_params, PluginManager(self.plugin_dir, self.db_params)))
+        statuses = ImportLedger.get_entries(GarminDb(self.db_params), 'GarminActivitiesFitData').values()
+        self.assertEqual([entry.status for entry in statuses], [ImportLedger.Status.imported] * self.days)
+        return sum(self.inserted)
+
+    def import_tcx(self):
+        self.inserted = []
+        gtd = GarminTcxData(self.tcx_dir, False, fitfile.field_enums.DisplayMeasure.metric, 0)
+        with mock.patch.object(ActivityRecords, 's_insert_new', side_effect=self.s_insert_new):
+            gtd.process_files(self.db_params)
+        statuses = ImportLedger.get_entries(GarminDb(self.db_params), 'GarminTcxData').values()
+        self.assertEqual([entry.status for entry in statuses], [ImportLedger.Status.imported])
+        return sum(self.inserted)
+
+    def get_records(self):
+        with ActivitiesDb(self.db_params).managed_session() as session:
+            return sorted([{column.name: getattr(record, column.name) for column in ActivityRecords.__table__.columns} for record in session.query(ActivityRecords).all()],
+                          key=lambda record: (record['activity_id'], record['record']))
+
+    def delete_records(self, activity_id, first_record):
+        with ActivitiesDb(self.db_params).managed_session() as session:
+            return session.query(ActivityRecords).filter(ActivityRecords.activity_id == activity_id, ActivityRecords.record >= first_record).delete()
+
+    def test_insert_new(self):
+        start = datetime.datetime(2024, 1, 1, 10)
+        records = [{'activity_id': activity_id, 'record': record_num, 'timestamp': start + datetime.timedelta(seconds=record_num), 'hr': 100 + record_num}
+                   for activity_id in ['1', '2'] for record_num in range(10)]
+        with ActivitiesDb(self.db_params).managed_session() as session:
+            self.assertEqual(ActivityRecords.s_insert_new(session, records[:5]), 5)
+            # records already in the table and repeated records are skipped
+            self.assertEqual(ActivityRecords.s_insert_new(session, records + records[12:14]), 15)
+            self.assertEqual(ActivityRecords.s_insert_new(session, records), 0)
+            self.assertEqual(ActivityRecords.s_insert_new(session, []), 0)
+        self.assertEqual(len(self.get_records()), 20)
+
+    def test_fit_reimport(self):
+        self.assertEqual(self.import_fit(), self.fit_fixtures.counts['activity_records'])
+        records = self.get_records()
+        self.assertEqual(self.import_fit(), 0)
+        self.assertEqual(self.get_records(), records)
+
+    def check_fit_partial_import(self):
+        self.import_fit()
+        records = self.get_records()
+        activity_id = records[0]['activity_id']
+        deleted = self.delete_records(activity_id, 100)
+        self.assertGreater(deleted, 0)
+        self.assertEqual(self.import_fit(), deleted)
+        self.assertEqual(self.get_records(), records)
+
+    def test_fit_partial_import(self):
+        self.check_fit_partial_import()
+
+    def test_fit_partial_import_streamed(self):
+        # streamed files insert their records a chunk at a time
+        FitData.streaming_file_size = 0
+        FitData.streaming_chunk_size = 30
+        self.check_fit_partial_import()
+
+    def test_tcx_reimport(self):
+        self.assertEqual(self.import_tcx(), self.tcx_points)
+        records = self.get_records()
+        self.assertEqual(self.import_tcx(), 0)
+        self.assertEqual(self.get_records(), records)
+        deleted = self.delete_records(records[0]['activity_id'], self.tcx_points // 2)
+        self.assertEqual(deleted, self.tcx_points // 2)
+        self.assertEqual(self.import_tcx(), deleted)
+        self.assertEqual(self.get_records(), records)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
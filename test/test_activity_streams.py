@@ -0,0 +1,151 @@
+"""Test storing the records of activities as compressed arrays in activity streams."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import sqlite3
+import unittest
+import logging
+import datetime
+import tempfile
+
+import numpy
+import pandas
+import fitfile
+import idbutils
+
+from garmindb import FitData, ActivityFitFileProcessor, GarminActivitiesFitData, frames
+from garmindb.garmindb import GarminDb, Attributes, ActivitiesDb, Activities, ActivityRecords, ActivityStreams, ActivityStreamBuffer
+
+from fit_fixtures import FitFixtures
+
+
+root_logger = logging.getLogger()
+handler = logging.FileHandler('activity_streams.log', 'w')
+root_logger.addHandler(handler)
+root_logger.setLevel(logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+
+class TestActivityStreams(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.TemporaryDirectory()
+        cls.fit_fixtures = FitFixtures(cls.temp_dir.name)
+        for day in range(3):
+            cls.fit_fixtures.write_activity(datetime.date(2024, 1, 1) + datetime.timedelta(days=day), device_settings=(day != 1), start=(day != 2))
+        cls.activities_dir = os.path.join(cls.temp_dir.name, FitFixtures.activities_dir)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.temp_dir.cleanup()
+
+    def setUp(self):
+        self.db_dir = tempfile.TemporaryDirectory()
+        self.records_db_params = idbutils.DbParams(db_type='sqlite', db_path=os.path.join(self.db_dir.name, 'records'), activity_storage='records')
+        self.streams_db_params = idbutils.DbParams(db_type='sqlite', db_path=os.path.join(self.db_dir.name, 'streams'), activity_storage='streams')
+        for db_params in [self.records_db_params, self.streams_db_params]:
+            os.makedirs(db_params.db_path)
+            Attributes.set(GarminDb.get(db_params), 'measurement_system', fitfile.field_enums.DisplayMeasure.metric)
+
+    def tearDown(self):
+        for db_params in [self.records_db_params, self.streams_db_params]:
+            GarminDb.release(db_params)
+            ActivitiesDb.release(db_params)
+        FitData.streaming_file_size = 16 * 1024 * 1024
+        FitData.streaming_chunk_size = 10000
+        self.db_dir.cleanup()
+
+    def import_activities(self, db_params):
+        gfd = GarminActivitiesFitData(self.activities_dir, False, fitfile.field_enums.DisplayMeasure.metric, 0)
+        gfd.process_files(ActivityFitFileProcessor(db_params, None, 0))
+
+    def activity_ids(self):
+        return [activity.activity_id for activity in Activities.get_all(ActivitiesDb.get(self.records_db_params))]
+
+    @classmethod
+    def record_values(cls, records):
+        return [{column.name: getattr(record, column.name) for column in ActivityRecords.__table__.columns} for record in records]
+
+    @classmethod
+    def table_rows(cls, db_params):
+        # read with a plain connection, the way the sqlite3 CLI and other database clients read the records
+        connection = sqlite3.connect(ActivitiesDb.get(db_params).engine.url.database)
+        try:
+            return connection.execute('SELECT * FROM activity_records ORDER BY activity_id, record').fetchall()
+        finally:
+            connection.close()
+
+    def test_streams_import(self):
+        self.import_activities(self.records_db_params)
+        self.import_activities(self.streams_db_params)
+        records_db = ActivitiesDb.get(self.records_db_params)
+        streams_db = ActivitiesDb.get(self.streams_db_params)
+        self.assertEqual(ActivityStreams.row_count(records_db), 0)
+        self.assertEqual(ActivityStreams.row_count(streams_db), len(self.activity_ids()))
+        # the records are still written as rows that any database client can query
+        self.assertEqual(ActivityRecords.row_count(streams_db), self.fit_fixtures.counts['activity_records'])
+        self.assertEqual(self.table_rows(self.streams_db_params), self.table_rows(self.records_db_params))
+        with streams_db.managed_session() as session:
+            for activity_id in self.activity_ids():
+                records = self.record_values(ActivityRecords.get_activity(records_db, activity_id))
+                self.assertGreater(len(records), 0)
+                self.assertEqual(self.record_values(ActivityStreams.s_get_records(session, activity_id)), records)
+                pandas.testing.assert_frame_equal(frames.activity_records(self.streams_db_params, activity_id),
+                                                  frames.activity_records(self.records_db_params, activity_id))
+
+    def test_streamed_file(self):
+        FitData.streaming_file_size = 0
+        FitData.streaming_chunk_size = 50
+        self.import_activities(self.streams_db_params)
+        streams_db = ActivitiesDb.get(self.streams_db_params)
+        self.assertEqual(sum(stream.record_count for stream in ActivityStreams.get_all(streams_db)), self.fit_fixtures.counts['activity_records'])
+        self.assertEqual(ActivityRecords.row_count(streams_db), self.fit_fixtures.counts['activity_records'])
+
+    def test_arrays(self):
+        self.import_activities(self.streams_db_params)
+        streams_db = ActivitiesDb.get(self.streams_db_params)
+        for activity_id in self.activity_ids():
+            records = ActivityRecords.get_activity(streams_db, activity_id)
+            arrays = ActivityStreams.get_arrays(streams_db, activity_id)
+            self.assertEqual(arrays['hr'].dtype, numpy.dtype('<i2'))
+            # the arrays share the memory of the decompressed channels
+            self.assertFalse(arrays['hr'].flags.owndata)
+            self.assertFalse(arrays['hr'].flags.writeable)
+            self.assertEqual(arrays['hr'].tolist(), [record.hr for record in records])
+            self.assertEqual(arrays['distance'].tolist(), [record.distance for record in records])
+            self.assertEqual(arrays['timestamp'].astype(datetime.datetime).tolist(), [record.timestamp for record in records])
+            self.assertEqual((arrays['position_lat'] * ActivityStreams.degrees_per_semicircle).tolist(), [record.position_lat for record in records])
+            self.assertTrue(numpy.isnan(arrays['temperature']).all())
+        self.assertIsNone(ActivityStreams.get_arrays(streams_db, 'no_such_activity'))
+
+    def test_missing_values(self):
+        streams_db = ActivitiesDb.get(self.streams_db_params)
+        start = datetime.datetime(2024, 1, 1, 10)
+        stream_buffer = ActivityStreamBuffer('1')
+        records = [{'record': record_num, 'timestamp': start + datetime.timedelta(seconds=record_num * 2), 'hr': None if record_num % 3 else 100 + record_num,
+                    'speed': None if record_num % 2 else 10.5, 'position_lat': None} for record_num in range(10)]
+        stream_buffer.add(records[:4])
+        stream_buffer.add(records[4:])
+        with self.assertRaises(ValueError):
+            stream_buffer.add(records[:1])
+        with streams_db.managed_session() as session:
+            self.assertEqual(stream_buffer.flush(session), 10)
+        with streams_db.managed_session() as session:
+            stream = session.query(ActivityStreams).filter(ActivityStreams.activity_id == '1').one()
+            self.assertIsNone(stream.position_lat)
+            self.assertEqual(stream.values('hr'), [record['hr'] for record in records])
+            self.assertEqual(stream.values('speed'), [record['speed'] for record in records])
+            self.assertEqual(stream.values('timestamp'), [record['timestamp'] for record in records])
+            self.assertEqual(stream.values('position_lat'), [None] * 10)
+            arrays = stream.arrays()
+        self.assertEqual(numpy.ma.masked_equal(arrays['hr'], ActivityStreams.null_values['h']).count(), 4)
+        self.assertEqual(int(numpy.isnan(arrays['speed']).sum()), 5)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
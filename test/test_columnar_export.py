@@ -0,0 +1,140 @@
+"""Test exporting the monitoring tables to partitioned Parquet and Arrow files."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import unittest
+import logging
+import os
+import datetime
+import tempfile
+
+import fitfile
+import idbutils
+
+from garmindb import ColumnarExporter, ColumnarLoader, ColumnarFormat, MonitoringFitFileProcessor, GarminMonitoringFitData
+from garmindb.garmindb import GarminDb, Attributes, ExportDirty, MonitoringDb, MonitoringHeartRate, Monitoring, ActivityRecords, UpsertBuffer
+
+from fit_fixtures import FitFixtures
+
+
+root_logger = logging.getLogger()
+handler = logging.FileHandler('columnar_export.log', 'w')
+root_logger.addHandler(handler)
+root_logger.setLevel(logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+
+class TestColumnarExport(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.db_params = idbutils.DbParams(db_type='sqlite', db_path=self.dir.name)
+        self.export_dir = self.dir.name + os.sep + 'Columnar'
+        self.db = MonitoringDb(self.db_params)
+        self.garmin_db = GarminDb(self.db_params)
+        self.first_day = datetime.datetime(2023, 12, 20)
+        self.add_rows(self.first_day, 30)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def add_rows(self, first_day, days, heart_rate=50):
+        hr_rows = UpsertBuffer(MonitoringHeartRate)
+        monitoring_rows = UpsertBuffer(Monitoring)
+        for day in range(days):
+            for hour in range(24):
+                timestamp = first_day + datetime.timedelta(days=day, hours=hour)
+                hr_rows.add({'timestamp': timestamp, 'heart_rate': heart_rate + hour})
+                monitoring_rows.add({'timestamp': timestamp, 'activity_type': fitfile.field_enums.ActivityType.walking, 'duration': datetime.time(0, 1, 30), 'steps': hour})
+        with self.db.managed_session() as session:
+            hr_rows.flush(session)
+            monitoring_rows.flush(session)
+        self.mark_days(first_day, first_day + datetime.timedelta(days=days - 1))
+
+    def mark_days(self, start, end):
+        # mark the days the way the importers do
+        with self.garmin_db.managed_session() as session:
+            ExportDirty.s_mark_period(session, [MonitoringHeartRate, Monitoring], start, end)
+
+    def check_export(self, file_format):
+        exporter = ColumnarExporter(self.db_params, self.export_dir, file_format)
+        self.assertEqual(exporter.export(), {'monitoring_hr': 2, 'monitoring': 2, 'activity_records': 0})
+        self.assertTrue(os.path.isfile(f'{self.export_dir}/monitoring_hr/year=2024/month=1/data.{file_format.value}'))
+        loader = ColumnarLoader(self.export_dir, file_format)
+        hr_table = loader.load_table('monitoring_hr')
+        self.assertEqual(hr_table.num_rows, 30 * 24)
+        self.assertEqual(hr_table.column_names, ['timestamp', 'heart_rate'])
+        self.assertEqual(hr_table['timestamp'][0].as_py(), self.first_day)
+        monitoring_table = loader.load_table('monitoring', columns=['activity_type', 'duration', 'steps'])
+        self.assertEqual(monitoring_table['activity_type'][0].as_py(), 'walking')
+        self.assertEqual(monitoring_table['duration'][0].as_py(), datetime.time(0, 1, 30))
+        self.assertEqual(loader.load_table('activity_records').num_rows, 0)
+
+    def test_parquet_export(self):
+        self.check_export(ColumnarFormat.parquet)
+
+    def test_arrow_export(self):
+        self.check_export(ColumnarFormat.arrow)
+
+    def test_incremental_export(self):
+        exporter = ColumnarExporter(self.db_params, self.export_dir)
+        exporter.export(['monitoring_hr'])
+        self.assertEqual(exporter.export(['monitoring_hr']), {'monitoring_hr': 0})
+        # only the month with new data is exported again
+        self.add_rows(datetime.datetime(2024, 1, 30), 3)
+        self.assertEqual(exporter.export(['monitoring_hr']), {'monitoring_hr': 2})
+        self.assertEqual(exporter.export(['monitoring_hr']), {'monitoring_hr': 0})
+        self.add_rows(datetime.datetime(2024, 1, 22), 1)
+        self.assertEqual(exporter.export(['monitoring_hr']), {'monitoring_hr': 1})
+        self.assertEqual(exporter.export(['monitoring_hr'], full=True), {'monitoring_hr': 3})
+        self.assertEqual(ColumnarLoader(self.export_dir).load_table('monitoring_hr').num_rows, 34 * 24)
+
+    def test_updated_values_export(self):
+        exporter = ColumnarExporter(self.db_params, self.export_dir)
+        exporter.export(['monitoring_hr', 'monitoring'])
+        self.assertEqual(ExportDirty.get_days(self.garmin_db, MonitoringHeartRate), [])
+        # values updated in place leave the row counts and timestamps of the month the same
+        self.add_rows(datetime.datetime(2024, 1, 5), 1, 70)
+        self.assertEqual(exporter.export(['monitoring_hr']), {'monitoring_hr': 1})
+        frame = ColumnarLoader(self.export_dir).load_frame('monitoring_hr', datetime.datetime(2024, 1, 5), datetime.datetime(2024, 1, 6))
+        self.assertEqual(frame['heart_rate'].tolist(), [70 + hour for hour in range(24)])
+        # the days stay marked for the tables that weren't exported
+        self.assertEqual(ExportDirty.get_days(self.garmin_db, MonitoringHeartRate), [])
+        self.assertEqual(ExportDirty.get_days(self.garmin_db, Monitoring), [datetime.date(2024, 1, 5)])
+        self.assertEqual(exporter.export(['monitoring']), {'monitoring': 1})
+
+    def test_deleted_month_export(self):
+        exporter = ColumnarExporter(self.db_params, self.export_dir)
+        exporter.export(['monitoring_hr'])
+        with self.db.managed_session() as session:
+            session.query(MonitoringHeartRate).filter(MonitoringHeartRate.timestamp >= datetime.datetime(2024, 1, 1)).delete()
+        self.mark_days(datetime.date(2024, 1, 1), datetime.date(2024, 1, 1))
+        self.assertEqual(exporter.export(['monitoring_hr']), {'monitoring_hr': 1})
+        self.assertFalse(os.path.isdir(f'{self.export_dir}/monitoring_hr/year=2024/month=1'))
+        self.assertEqual(ColumnarLoader(self.export_dir).load_table('monitoring_hr').num_rows, 12 * 24)
+
+    def test_import_marks_days(self):
+        Attributes.set(self.garmin_db, 'measurement_system', fitfile.field_enums.DisplayMeasure.metric)
+        for table in [MonitoringHeartRate, Monitoring]:
+            ExportDirty.clear_days(self.garmin_db, table, ExportDirty.get_days(self.garmin_db, table))
+        FitFixtures(self.dir.name).write_monitoring(datetime.date(2024, 2, 2))
+        gfd = GarminMonitoringFitData(os.path.join(self.dir.name, FitFixtures.monitoring_dir), False, fitfile.field_enums.DisplayMeasure.metric, 0)
+        gfd.process_files(MonitoringFitFileProcessor(self.db_params))
+        # the daily summary written at midnight belongs to the previous day
+        for table in [MonitoringHeartRate, Monitoring]:
+            self.assertEqual(ExportDirty.get_days(self.garmin_db, table), [datetime.date(2024, 2, 1), datetime.date(2024, 2, 2)])
+        self.assertEqual(ExportDirty.get_days(self.garmin_db, ActivityRecords), [])
+
+    def test_load_range(self):
+        ColumnarExporter(self.db_params, self.export_dir).export(['monitoring_hr'])
+        frame = ColumnarLoader(self.export_dir).load_frame('monitoring_hr', datetime.datetime(2023, 12, 31, 12), datetime.datetime(2024, 1, 2))
+        self.assertEqual(len(frame), 36)
+        self.assertEqual(frame['heart_rate'].iloc[0], 62)
+        self.assertEqual(str(frame['timestamp'].dtype), 'datetime64[us]')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
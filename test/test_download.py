@@ -0,0 +1,268 @@
+"""Test concurrent rate limited downloading against a stub Garmin Connect server."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import unittest
+import logging
+import os
+import json
+import io
+import time
+import datetime
+import tempfile
+import threading
+import zipfile
+import http.server
+
+import requests
+from garth.exc import GarthHTTPError
+
+from garmindb.download import Download
+from garmindb.download_scheduler import TokenBucket, DownloadScheduler
+from garmindb.download_manifest import DownloadManifest
+
+
+root_logger = logging.getLogger()
+handler = logging.FileHandler('download.log', 'w')
+root_logger.addHandler(handler)
+root_logger.setLevel(logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+
+class StubConnectHandler(http.server.BaseHTTPRequestHandler):
+    """Answer requests with a small JSON document or zip file, responding with HTTP 429 to every too_many_requests'th request."""
+
+    lock = threading.Lock()
+    requests = []
+    too_many_requests = 0
+
+    def do_GET(self):
+        with self.lock:
+            self.requests.append(self.path)
+            reject = self.too_many_requests and len(self.requests) % self.too_many_requests == 0
+        if reject:
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+            self.end_headers()
+            return
+        if self.path.startswith(Download.garmin_connect_download_service_url):
+            body = self.zip_body()
+            content_type = 'application/zip'
+        else:
+            body = json.dumps({'path': self.path}).encode()
+            content_type = 'application/json'
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def zip_body(self):
+        name = self.path.split('/')[-1]
+        zip_buffer = io.BytesIO()
+        with zipfile.ZipFile(zip_buffer, 'w') as files_zip:
+            files_zip.writestr(f'{name}_WELLNESS.fit', name.encode() * 100)
+            files_zip.writestr(f'{name}_METRICS.fit', b'metrics')
+        return zip_buffer.getvalue()
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class StubGarthClient():
+    """Stands in for the garth client, making the same calls to the stub server instead of Garmin Connect."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.session = requests.Session()
+
+    def get(self, subdomain, path, api=False, params=None):
+        response = self.session.get(self.base_url + path, params=params)
+        try:
+            response.raise_for_status()
+        except requests.HTTPError as e:
+            raise GarthHTTPError(msg='Error in request', error=e)
+        return response
+
+    def connectapi(self, path, params=None):
+        return self.get('connectapi', path, api=True, params=params).json()
+
+
+class StubConfig():
+
+    def __init__(self, session_file, workers):
+        self.session_file = session_file
+        self.workers = workers
+
+    def get_session_file(self):
+        return self.session_file
+
+    def get_garmin_base_domain(self):
+        return 'garmin.com'
+
+    def download_workers(self):
+        return self.workers
+
+    def download_requests_per_second(self):
+        return 1000.0
+
+    def get_download_manifest_file(self):
+        return os.path.dirname(self.session_file) + os.sep + 'download_manifest.jsonl'
+
+
+class TestDownload(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StubConnectHandler)
+        cls.server_thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.server_thread.start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_address[1]}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        StubConnectHandler.requests = []
+        StubConnectHandler.too_many_requests = 0
+        DownloadScheduler.initial_backoff = 0
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def new_download(self, workers, file_handler=None):
+        download = Download(StubConfig(f'{self.dir.name}/session.json', workers), file_handler)
+        download.garth = StubGarthClient(self.base_url)
+        download.display_name = 'test'
+        return download
+
+    def download_stats(self, download, date, days, overwrite=True):
+        download.get_sleep(self.dir.name, date, days, overwrite)
+        download.get_rhr(self.dir.name, date, days, overwrite)
+        download.get_hrv(self.dir.name, date, days, overwrite)
+        download.wait()
+
+    def check_files(self, date, days):
+        for day in range(days):
+            date_str = (date + datetime.timedelta(days=day)).strftime('%Y-%m-%d')
+            for filename in [f'sleep_{date_str}.json', f'rhr_{date_str}.json', f'hrv_{date_str}.json']:
+                self.assertTrue(os.path.isfile(f'{self.dir.name}/{filename}'), filename)
+
+    def test_token_bucket(self):
+        token_bucket = TokenBucket(20.0)
+        start = time.monotonic()
+        for _ in range(11):
+            token_bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.45)
+
+    def test_token_bucket_throttle(self):
+        token_bucket = TokenBucket(100.0)
+        token_bucket.acquire()
+        token_bucket.throttle(0.2)
+        self.assertEqual(token_bucket.rate, 50.0)
+        start = time.monotonic()
+        token_bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+        for _ in range(10):
+            token_bucket.recover()
+        self.assertEqual(token_bucket.rate, 100.0)
+
+    def test_sequential_download(self):
+        date = datetime.date(2024, 1, 1)
+        self.download_stats(self.new_download(1), date, 5)
+        self.check_files(date, 5)
+        self.assertEqual(len(StubConnectHandler.requests), 15)
+
+    def test_concurrent_download(self):
+        date = datetime.date(2024, 1, 1)
+        self.download_stats(self.new_download(3), date, 10)
+        self.check_files(date, 10)
+        self.assertEqual(len(StubConnectHandler.requests), 30)
+
+    def test_too_many_requests(self):
+        StubConnectHandler.too_many_requests = 4
+        date = datetime.date(2024, 1, 1)
+        self.download_stats(self.new_download(2), date, 10)
+        self.check_files(date, 10)
+        self.assertGreater(len(StubConnectHandler.requests), 30)
+
+    def test_manifest_skips_downloaded_days(self):
+        date = datetime.date(2024, 1, 1)
+        self.download_stats(self.new_download(2), date, 5, False)
+        self.assertEqual(len(StubConnectHandler.requests), 15)
+        manifest = DownloadManifest(f'{self.dir.name}/download_manifest.jsonl')
+        self.assertEqual(len(manifest), 15)
+        self.assertFalse(manifest.needs_download('sleep/2024-01-03'))
+        self.assertEqual(manifest.get('rhr/2024-01-03')['files'][0]['file'], f'{self.dir.name}/rhr_2024-01-03.json')
+        StubConnectHandler.requests = []
+        self.download_stats(self.new_download(2), date, 7, False)
+        self.assertEqual(len(StubConnectHandler.requests), 6)
+
+    def test_manifest_partial_days(self):
+        date = datetime.datetime.now().date() - datetime.timedelta(days=1)
+        self.download_stats(self.new_download(1), date, 2, False)
+        manifest = DownloadManifest(f'{self.dir.name}/download_manifest.jsonl')
+        self.assertTrue(manifest.needs_download(f'sleep/{date}'))
+        StubConnectHandler.requests = []
+        self.download_stats(self.new_download(1), date, 2, False)
+        self.assertEqual(len(StubConnectHandler.requests), 6)
+
+    def test_manifest_existing_files(self):
+        date = datetime.date(2024, 1, 1)
+        for stat in ['sleep', 'rhr', 'hrv']:
+            Download.save_json_to_file(f'{self.dir.name}/{stat}_2024-01-02', {})
+        self.download_stats(self.new_download(1), date, 3, False)
+        self.assertEqual(len(StubConnectHandler.requests), 6)
+        StubConnectHandler.requests = []
+        self.download_stats(self.new_download(1), date, 3, False)
+        self.assertEqual(len(StubConnectHandler.requests), 0)
+
+    def test_manifest_compact(self):
+        manifest_file = f'{self.dir.name}/download_manifest.jsonl'
+        manifest = DownloadManifest(manifest_file)
+        for _ in range(60):
+            manifest.record('sleep/2024-01-01', [], True)
+            manifest.record('sleep/2024-01-02', [], False)
+        manifest.close()
+        manifest = DownloadManifest(manifest_file)
+        self.assertEqual(len(manifest), 2)
+        with open(manifest_file) as file:
+            self.assertEqual(len(file.readlines()), 2)
+
+    def test_monitoring_zip_extraction(self):
+        monitoring_dir = f'{self.dir.name}/Monitoring'
+        temp_dir = f'{self.dir.name}/tmp'
+        os.mkdir(temp_dir)
+
+        def directory_func(year):
+            directory = f'{monitoring_dir}/{year}'
+            os.makedirs(directory, exist_ok=True)
+            return directory
+
+        saved_files = []
+        download = self.new_download(2, lambda stat, files: saved_files.extend(files))
+        saved_tempdir = tempfile.tempdir
+        tempfile.tempdir = temp_dir
+        try:
+            download.get_monitoring(directory_func, datetime.date(2023, 12, 30), 4)
+            download.wait()
+        finally:
+            tempfile.tempdir = saved_tempdir
+        self.assertEqual(os.listdir(temp_dir), [])
+        self.assertEqual(sorted(os.listdir(f'{monitoring_dir}/2023')), ['2023-12-30_METRICS.fit', '2023-12-30_WELLNESS.fit', '2023-12-31_METRICS.fit', '2023-12-31_WELLNESS.fit'])
+        self.assertEqual(len(os.listdir(f'{monitoring_dir}/2024')), 4)
+        self.assertEqual(len(saved_files), 8)
+        with open(f'{monitoring_dir}/2024/2024-01-02_WELLNESS.fit', 'rb') as file:
+            self.assertEqual(file.read(), b'2024-01-02' * 100)
+        manifest = DownloadManifest(f'{self.dir.name}/download_manifest.jsonl')
+        self.assertEqual(manifest.get('monitoring/2024-01-01')['files'][1]['size'], 7)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
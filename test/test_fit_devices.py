@@ -0,0 +1,107 @@
+"""Test remembering the identity of FIT files and the devices that recorded them while importing."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import unittest
+import logging
+import datetime
+import tempfile
+from unittest import mock
+
+import fitfile
+import idbutils
+
+from garmindb import ActivityFitFileProcessor, MonitoringFitFileProcessor, GarminActivitiesFitData, GarminMonitoringFitData
+from garmindb.garmindb import GarminDb, Attributes, File, Device, MonitoringDb, MonitoringInfo, ActivitiesDb, Activities
+
+from fit_fixtures import FitFixtures
+
+
+root_logger = logging.getLogger()
+handler = logging.FileHandler('fit_devices.log', 'w')
+root_logger.addHandler(handler)
+root_logger.setLevel(logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+
+class TestFitDevices(unittest.TestCase):
+
+    days = 3
+
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.TemporaryDirectory()
+        cls.fit_fixtures = FitFixtures(cls.temp_dir.name, monitoring_interval=600)
+        for day in range(cls.days):
+            cls.fit_fixtures.write_activity(datetime.date(2024, 1, 1) + datetime.timedelta(days=day), device_settings=(day != 1), start=(day != 2))
+            cls.fit_fixtures.write_monitoring(datetime.date(2024, 1, 1) + datetime.timedelta(days=day))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.temp_dir.cleanup()
+
+    def setUp(self):
+        self.db_dir = tempfile.TemporaryDirectory()
+        self.db_params = idbutils.DbParams(db_type='sqlite', db_path=self.db_dir.name)
+        self.garmin_db = GarminDb.get(self.db_params)
+        Attributes.set(self.garmin_db, 'measurement_system', fitfile.field_enums.DisplayMeasure.metric)
+
+    def tearDown(self):
+        GarminDb.release(self.db_params)
+        self.db_dir.cleanup()
+
+    def import_activities(self):
+        gfd = GarminActivitiesFitData(os.path.join(self.temp_dir.name, FitFixtures.activities_dir), False, fitfile.field_enums.DisplayMeasure.metric, 0)
+        with mock.patch.object(Device, 's_insert_or_update', wraps=Device.s_insert_or_update) as device_writes:
+            gfd.process_files(ActivityFitFileProcessor(self.db_params, None, 0))
+        return device_writes.call_count
+
+    def import_monitoring(self):
+        gfd = GarminMonitoringFitData(os.path.join(self.temp_dir.name, FitFixtures.monitoring_dir), False, fitfile.field_enums.DisplayMeasure.metric, 0)
+        with mock.patch.object(Device, 's_insert_or_update', wraps=Device.s_insert_or_update) as device_writes:
+            gfd.process_files(MonitoringFitFileProcessor(self.db_params, None, 0))
+        return device_writes.call_count
+
+    def test_device_written_once(self):
+        # the device row is written by the first file, the later files only write its timestamp if they're newer
+        self.assertLessEqual(self.import_activities(), self.days)
+        devices = Device.get_all(self.garmin_db)
+        self.assertEqual(len(devices), 1)
+        self.assertEqual(devices[0].serial_number, FitFixtures.serial_number)
+        self.assertEqual(devices[0].manufacturer, Device.Manufacturer.Garmin)
+        with ActivitiesDb(self.db_params).managed_session() as session:
+            last_file_time = max(activity.start_time for activity in session.query(Activities).all())
+        self.assertEqual(devices[0].timestamp, last_file_time)
+        # the device is known from the activity files and the monitoring files are older
+        self.assertEqual(self.import_monitoring(), 0)
+        self.assertEqual(Device.get_all(self.garmin_db)[0].timestamp, last_file_time)
+
+    def test_reimport(self):
+        self.import_activities()
+        self.assertEqual(self.import_activities(), 0)
+
+    def test_known_device_after_delete(self):
+        self.import_activities()
+        GarminDb.delete_db(self.db_params)
+        self.garmin_db = GarminDb.get(self.db_params)
+        # a recreated database doesn't have the devices that were written to the deleted one
+        self.import_activities()
+        self.assertEqual(len(Device.get_all(self.garmin_db)), 1)
+
+    def test_monitoring_info_file_id(self):
+        self.import_monitoring()
+        with self.garmin_db.managed_session() as session:
+            file_ids = {file.id for file in session.query(File).all()}
+        with MonitoringDb(self.db_params).managed_session() as session:
+            monitoring_infos = session.query(MonitoringInfo).all()
+        self.assertEqual(len(monitoring_infos), 2 * self.days)
+        for monitoring_info in monitoring_infos:
+            self.assertIn(str(monitoring_info.file_id), file_ids)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
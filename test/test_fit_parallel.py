@@ -0,0 +1,137 @@
+"""Test parsing FIT files in worker processes while importing them."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import unittest
+import logging
+import datetime
+import tempfile
+from unittest import mock
+
+import fitfile
+import idbutils
+from sqlalchemy import text
+
+from garmindb import PluginManager, ActivityFitFileProcessor, MonitoringFitFileProcessor, GarminActivitiesFitData, GarminMonitoringFitData
+from garmindb.garmindb import GarminDb, Attributes, File, ImportLedger, ActivitiesDb, Activities, ActivityRecords, ActivityLaps
+from garmindb.garmindb import MonitoringDb, Monitoring, MonitoringInfo, MonitoringHeartRate
+
+from fit_fixtures import FitFixtures
+
+
+root_logger = logging.getLogger()
+handler = logging.FileHandler('fit_parallel.log', 'w')
+root_logger.addHandler(handler)
+root_logger.setLevel(logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+
+class TestFitParallel(unittest.TestCase):
+
+    days = 4
+
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.TemporaryDirectory()
+        fit_fixtures = FitFixtures(cls.temp_dir.name)
+        for day in range(cls.days):
+            fit_fixtures.write_activity(datetime.date(2024, 1, 1) + datetime.timedelta(days=day), device_settings=(day % 2 == 0))
+            fit_fixtures.write_monitoring(datetime.date(2024, 1, 1) + datetime.timedelta(days=day))
+        cls.activities_dir = os.path.join(cls.temp_dir.name, FitFixtures.activities_dir)
+        cls.monitoring_dir = os.path.join(cls.temp_dir.name, FitFixtures.monitoring_dir)
+        cls.plugin_dir = os.path.join(cls.temp_dir.name, 'plugins')
+        os.makedirs(cls.plugin_dir)
+        # a file that fails to parse between files that don't
+        cls.bad_file_name = os.path.join(cls.activities_dir, '20240102_BAD_ACTIVITY.fit')
+        with open(cls.bad_file_name, 'wb') as file:
+            file.write(b'this is not a FIT file')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.temp_dir.cleanup()
+
+    def setUp(self):
+        self.db_dirs = [tempfile.TemporaryDirectory(), tempfile.TemporaryDirectory()]
+        self.db_params = [idbutils.DbParams(db_type='sqlite', db_path=db_dir.name) for db_dir in self.db_dirs]
+        for db_params in self.db_params:
+            Attributes.set(GarminDb(db_params), 'measurement_system', fitfile.field_enums.DisplayMeasure.metric)
+
+    def tearDown(self):
+        for db_dir in self.db_dirs:
+            db_dir.cleanup()
+
+    def import_files(self, db_params, workers):
+        gfd = GarminActivitiesFitData(self.activities_dir, False, fitfile.field_enums.DisplayMeasure.metric, 0, workers)
+        gfd.process_files(ActivityFitFileProcessor(db_params, PluginManager(self.plugin_dir, db_params)))
+        gfd = GarminMonitoringFitData(self.monitoring_dir, False, fitfile.field_enums.DisplayMeasure.metric, 0, workers)
+        gfd.process_files(MonitoringFitFileProcessor(db_params, PluginManager(self.plugin_dir, db_params)))
+
+    @classmethod
+    def get_rows(cls, db, table):
+        # rows in the order they were inserted
+        with db.managed_session() as session:
+            return [tuple(row) for row in session.execute(text(f'SELECT * FROM {table.__tablename__} ORDER BY rowid'))]
+
+    @classmethod
+    def get_all_rows(cls, db_params):
+        garmin_db = GarminDb(db_params)
+        activities_db = ActivitiesDb(db_params)
+        monitoring_db = MonitoringDb(db_params)
+        tables = [(garmin_db, File), (activities_db, Activities), (activities_db, ActivityRecords), (activities_db, ActivityLaps), (monitoring_db, Monitoring),
+                  (monitoring_db, MonitoringInfo), (monitoring_db, MonitoringHeartRate)]
+        return {table.__tablename__: cls.get_rows(db, table) for db, table in tables}
+
+    @classmethod
+    def ledger_statuses(cls, db_params, importer):
+        return {os.path.basename(path): entry.status for path, entry in ImportLedger.get_entries(GarminDb(db_params), importer).items()}
+
+    def test_parallel_import(self):
+        self.import_files(self.db_params[0], 1)
+        self.import_files(self.db_params[1], 2)
+        serial_rows = self.get_all_rows(self.db_params[0])
+        parallel_rows = self.get_all_rows(self.db_params[1])
+        self.assertEqual(len(serial_rows[Activities.__tablename__]), self.days)
+        self.assertEqual(len(serial_rows[MonitoringInfo.__tablename__]), 2 * self.days)
+        for name, rows in serial_rows.items():
+            self.assertGreater(len(rows), 0, name)
+            self.assertEqual(parallel_rows[name], rows, name)
+        for importer in ['GarminActivitiesFitData', 'GarminMonitoringFitData']:
+            self.assertEqual(self.ledger_statuses(self.db_params[1], importer), self.ledger_statuses(self.db_params[0], importer))
+
+    def check_parse_failure(self, workers):
+        with self.assertLogs(level=logging.ERROR) as logs:
+            gfd = GarminActivitiesFitData(self.activities_dir, False, fitfile.field_enums.DisplayMeasure.metric, 0, workers)
+            gfd.process_files(ActivityFitFileProcessor(self.db_params[0], PluginManager(self.plugin_dir, self.db_params[0])))
+        self.assertTrue(any(f'Failed to parse {self.bad_file_name}' in message for message in logs.output))
+        self.assertFalse(any('Failed to import' in message for message in logs.output))
+        statuses = self.ledger_statuses(self.db_params[0], 'GarminActivitiesFitData')
+        self.assertEqual(statuses.pop(os.path.basename(self.bad_file_name)), ImportLedger.Status.failed)
+        self.assertEqual(list(statuses.values()), [ImportLedger.Status.imported] * self.days)
+        self.assertEqual(Activities.row_count(ActivitiesDb(self.db_params[0])), self.days)
+
+    def test_parse_failure(self):
+        self.check_parse_failure(1)
+
+    def test_parse_failure_in_worker(self):
+        self.check_parse_failure(2)
+
+    def test_write_failure(self):
+        # files that parse, but fail to be written, are logged as failing to import not to parse
+        with self.assertLogs(level=logging.ERROR) as logs, mock.patch.object(ActivityFitFileProcessor, 'write_file', side_effect=ValueError('write failed')):
+            gfd = GarminActivitiesFitData(self.activities_dir, False, fitfile.field_enums.DisplayMeasure.metric, 0)
+            gfd.process_files(ActivityFitFileProcessor(self.db_params[0], PluginManager(self.plugin_dir, self.db_params[0])))
+        failed_imports = [message for message in logs.output if 'Failed to import' in message]
+        failed_parses = [message for message in logs.output if 'Failed to parse' in message]
+        self.assertEqual(len(failed_parses), 2)
+        self.assertEqual(len(failed_imports), 2 * self.days)
+        statuses = self.ledger_statuses(self.db_params[0], 'GarminActivitiesFitData')
+        self.assertEqual(list(statuses.values()), [ImportLedger.Status.failed] * (self.days + 1))
+        self.assertEqual(Activities.row_count(ActivitiesDb(self.db_params[0])), 0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,143 @@
+"""Test dispatching FIT file messages to plugins."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import unittest
+import logging
+import datetime
+import tempfile
+
+import fitfile
+import idbutils
+
+from garmindb import PluginManager, ActivityFitFileProcessor, MonitoringFitFileProcessor, GarminActivitiesFitData, GarminMonitoringFitData
+from garmindb.garmindb import GarminDb, Attributes, ActivitiesDb, ActivityRecords, ActivityLaps, MonitoringDb, Monitoring
+
+from fit_fixtures import FitFixtures
+
+
+root_logger = logging.getLogger()
+handler = logging.FileHandler('fit_plugins.log', 'w')
+root_logger.addHandler(handler)
+root_logger.setLevel(logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+
+batch_plugin = '''
+from garmindb import ActivityFitPluginBase
+
+
+class batch_records(ActivityFitPluginBase):
+
+    _tables = {}
+    init_calls = 0
+    batches = 0
+
+    @classmethod
+    def init_activity(cls, act_db_class, activities_table):
+        cls.init_calls += 1
+        super().init_activity(act_db_class, activities_table)
+
+    def write_record_entry(self, session, fit_file, activity_id, message_fields, record_num):
+        raise ValueError('batch plugins are not called per message')
+
+    def write_record_entries(self, session, fit_file, activity_id, records):
+        type(self).batches += 1
+        return {'rr': [heart_rate / 4 for heart_rate in records['heart_rate']]}
+
+    def write_lap_entries(self, session, fit_file, activity_id, laps):
+        return {'avg_temperature': [lap_num for lap_num in range(len(laps['timestamp']))]}
+'''
+
+per_message_plugin = '''
+from garmindb import ActivityFitPluginBase
+
+
+class per_message_records(ActivityFitPluginBase):
+
+    _tables = {}
+
+    def write_record_entry(self, session, fit_file, activity_id, message_fields, record_num):
+        return {'temperature': 20}
+'''
+
+monitoring_plugin = '''
+from garmindb import MonitoringFitPluginBase
+
+
+class batch_monitoring(MonitoringFitPluginBase):
+
+    messages = 0
+
+    def write_monitoring_entries(self, session, fit_file, monitoring):
+        type(self).messages += len(monitoring['timestamp'])
+'''
+
+
+class TestFitPlugins(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.TemporaryDirectory()
+        cls.plugin_dir = os.path.join(cls.temp_dir.name, 'plugins')
+        os.makedirs(cls.plugin_dir)
+        for name, source in [('batch_records', batch_plugin), ('per_message_records', per_message_plugin), ('batch_monitoring', monitoring_plugin)]:
+            with open(os.path.join(cls.plugin_dir, f'{name}_plugin.py'), 'w') as file:
+                file.write(source)
+        cls.data_dir = os.path.join(cls.temp_dir.name, 'data')
+        cls.fit_fixtures = FitFixtures(cls.data_dir, monitoring_interval=600)
+        for day in range(3):
+            cls.fit_fixtures.write_activity(datetime.date(2024, 1, 1) + datetime.timedelta(days=day), device_settings=(day != 1), start=(day != 2))
+        cls.fit_fixtures.write_monitoring(datetime.date(2024, 1, 1))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.temp_dir.cleanup()
+
+    def setUp(self):
+        self.db_dir = tempfile.TemporaryDirectory()
+        self.db_params = idbutils.DbParams(db_type='sqlite', db_path=self.db_dir.name)
+        Attributes.set(GarminDb(self.db_params), 'measurement_system', fitfile.field_enums.DisplayMeasure.metric)
+        self.plugin_manager = PluginManager(self.plugin_dir, self.db_params)
+
+    def tearDown(self):
+        self.db_dir.cleanup()
+
+    def plugin(self, file_type, name):
+        return type(self.plugin_manager.plugins[file_type][name])
+
+    def test_activity_plugins(self):
+        batch_records = self.plugin('ActivityFit', 'batch_records')
+        batch_records.init_calls = 0
+        batch_records.batches = 0
+        gfd = GarminActivitiesFitData(os.path.join(self.data_dir, FitFixtures.activities_dir), False, fitfile.field_enums.DisplayMeasure.metric, 0)
+        gfd.process_files(ActivityFitFileProcessor(self.db_params, self.plugin_manager, 0))
+        self.assertEqual(batch_records.init_calls, 1)
+        self.assertEqual(batch_records.batches, 3)
+        act_db = ActivitiesDb(self.db_params)
+        with act_db.managed_session() as session:
+            records = session.query(ActivityRecords).all()
+            self.assertEqual(len(records), self.fit_fixtures.counts['activity_records'])
+            for record in records:
+                self.assertEqual(record.rr, record.hr / 4)
+                self.assertEqual(record.temperature, 20)
+            laps = session.query(ActivityLaps).all()
+            self.assertGreater(len(laps), 0)
+            for lap in laps:
+                self.assertEqual(lap.avg_temperature, lap.lap)
+
+    def test_monitoring_plugins(self):
+        batch_monitoring = self.plugin('MonitoringFit', 'batch_monitoring')
+        batch_monitoring.messages = 0
+        gfd = GarminMonitoringFitData(os.path.join(self.data_dir, FitFixtures.monitoring_dir), False, fitfile.field_enums.DisplayMeasure.metric, 0)
+        gfd.process_files(MonitoringFitFileProcessor(self.db_params, self.plugin_manager, 0))
+        self.assertEqual(batch_monitoring.messages, Monitoring.row_count(MonitoringDb(self.db_params)))
+        self.assertGreater(batch_monitoring.messages, 0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,157 @@
+"""Test importing FIT files whose messages are read in chunks."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import unittest
+import logging
+import datetime
+import tempfile
+
+import fitfile
+import idbutils
+
+from garmindb import FitData, ActivityFitFileProcessor, GarminActivitiesFitData
+from garmindb.fit_data import StreamingFitFile
+from garmindb.garmindb import GarminDb, Attributes, ActivitiesDb, Activities, ActivityRecords, ActivityLaps
+
+from fit_fixtures import FitFixtures
+
+
+root_logger = logging.getLogger()
+handler = logging.FileHandler('fit_streaming.log', 'w')
+root_logger.addHandler(handler)
+root_logger.setLevel(logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+
+class TestFitStreaming(unittest.TestCase):
+
+    chunk_size = 97
+
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.TemporaryDirectory()
+        cls.fit_fixtures = FitFixtures(cls.temp_dir.name, record_interval=1)
+        for day in range(3):
+            cls.fit_fixtures.write_activity(datetime.date(2024, 1, 1) + datetime.timedelta(days=day), device_settings=(day != 1), start=(day != 2))
+        cls.monitoring_file_name = cls.fit_fixtures.write_monitoring(datetime.date(2024, 1, 1))
+        cls.activities_dir = os.path.join(cls.temp_dir.name, FitFixtures.activities_dir)
+        cls.file_names = sorted(os.path.join(cls.activities_dir, file_name) for file_name in os.listdir(cls.activities_dir))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.temp_dir.cleanup()
+
+    def setUp(self):
+        self.db_dirs = [tempfile.TemporaryDirectory(), tempfile.TemporaryDirectory()]
+        self.db_params = [idbutils.DbParams(db_type='sqlite', db_path=db_dir.name) for db_dir in self.db_dirs]
+        for db_params in self.db_params:
+            Attributes.set(GarminDb.get(db_params), 'measurement_system', fitfile.field_enums.DisplayMeasure.metric)
+
+    def tearDown(self):
+        for db_params, db_dir in zip(self.db_params, self.db_dirs):
+            GarminDb.release(db_params)
+            ActivitiesDb.release(db_params)
+            db_dir.cleanup()
+        FitData.streaming_file_size = 16 * 1024 * 1024
+        FitData.streaming_chunk_size = 10000
+        StreamingFitFile.supported = hasattr(fitfile.file.File, '_File__save_message')
+
+    @classmethod
+    def get_rows(cls, db_params, table):
+        with ActivitiesDb.get(db_params).managed_session() as session:
+            return sorted([{col.name: getattr(row, col.name) for col in table.__table__.columns} for row in session.query(table).all()], key=repr)
+
+    def import_activities(self, db_params, workers=1):
+        gfd = GarminActivitiesFitData(self.activities_dir, False, fitfile.field_enums.DisplayMeasure.metric, 0, workers)
+        gfd.process_files(ActivityFitFileProcessor(db_params, None, 0))
+
+    def check_streamed_import(self, workers):
+        self.import_activities(self.db_params[0])
+        FitData.streaming_file_size = 0
+        FitData.streaming_chunk_size = self.chunk_size
+        self.import_activities(self.db_params[1], workers)
+        for table in [Activities, ActivityRecords, ActivityLaps]:
+            self.assertEqual(self.get_rows(self.db_params[1], table), self.get_rows(self.db_params[0], table), table.__tablename__)
+        self.assertEqual(len(self.get_rows(self.db_params[1], ActivityRecords)), self.fit_fixtures.counts['activity_records'])
+
+    def test_streamed_import(self):
+        self.check_streamed_import(1)
+
+    def test_streamed_import_parallel(self):
+        self.check_streamed_import(2)
+
+    def test_streaming_unsupported(self):
+        # with a fitfile release that doesn't have the message hook the files are read whole
+        StreamingFitFile.supported = False
+        self.check_streamed_import(1)
+
+    summary_attributes = ['type', 'time_created_local', 'time_ended_local', 'utc_offset', 'start_time', 'end_time', 'sport_type', 'record_count']
+
+    def check_streaming_file(self, file_name, streamed_message_types):
+        fit_file = fitfile.file.File(file_name, fitfile.field_enums.DisplayMeasure.metric)
+        streaming_fit_file = StreamingFitFile(file_name, fitfile.field_enums.DisplayMeasure.metric, streamed_message_types, self.chunk_size)
+        self.assertIsInstance(streaming_fit_file, fitfile.file.File)
+        for attribute in self.summary_attributes:
+            self.assertEqual(getattr(streaming_fit_file, attribute), getattr(fit_file, attribute), attribute)
+        self.assertEqual(streaming_fit_file.message_types, fit_file.message_types)
+        self.assertEqual(streaming_fit_file.message_count, len(fit_file.messages))
+        # the streamed messages aren't kept, they're read a chunk at a time
+        for message_type in streamed_message_types:
+            self.assertEqual(streaming_fit_file[message_type], [])
+        self.assertEqual(len(streaming_fit_file.messages), len([message for message in fit_file.messages if message.type not in streamed_message_types]))
+        chunks = []
+        streaming_fit_file.write_chunks(chunks.append)
+        self.assertTrue(all(len(chunk) <= self.chunk_size for chunk in chunks))
+        streamed_messages = [message for chunk in chunks for message in chunk]
+        self.assertEqual([message.fields for message in streamed_messages], [message.fields for message in fit_file.messages if message.type in streamed_message_types])
+        streaming_fit_file.close()
+        return streaming_fit_file
+
+    def test_streaming_file_decoded_once(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_name = os.path.join(temp_dir, os.path.basename(self.file_names[0]))
+            with open(self.file_names[0], 'rb') as src, open(file_name, 'wb') as dst:
+                dst.write(src.read())
+            streaming_fit_file = StreamingFitFile(file_name, fitfile.field_enums.DisplayMeasure.metric, ActivityFitFileProcessor.streamed_message_types,
+                                                  self.chunk_size)
+            os.remove(file_name)
+            # the streamed messages are read back from where they were kept when the file was decoded, not from the FIT file
+            chunks = []
+            streaming_fit_file.write_chunks(chunks.append)
+            streaming_fit_file.close()
+        fit_file = fitfile.file.File(self.file_names[0], fitfile.field_enums.DisplayMeasure.metric)
+        self.assertEqual(sum(len(chunk) for chunk in chunks), len(fit_file[fitfile.MessageType.record]) + len(fit_file[fitfile.MessageType.lap]))
+
+    def test_streaming_file(self):
+        for file_name in self.file_names:
+            streaming_fit_file = self.check_streaming_file(file_name, ActivityFitFileProcessor.streamed_message_types)
+            self.assertEqual(len(streaming_fit_file[fitfile.MessageType.session]), 1)
+
+    def test_streaming_file_utc_offset(self):
+        # the files get their UTC offset from device_settings, start, and monitoring_info messages
+        utc_offset_message_types = [fitfile.MessageType.device_settings, fitfile.MessageType.start, fitfile.MessageType.monitoring_info]
+        found_message_types = set()
+        for file_name in self.file_names + [self.monitoring_file_name]:
+            streaming_fit_file = self.check_streaming_file(file_name, [fitfile.MessageType.record, fitfile.MessageType.lap, fitfile.MessageType.monitoring])
+            self.assertEqual(streaming_fit_file.utc_offset, -18000)
+            found_message_types.update(message_type for message_type in utc_offset_message_types if message_type in streaming_fit_file.message_types)
+        self.assertEqual(found_message_types, set(utc_offset_message_types))
+
+    def test_streamed_import_utc_offset(self):
+        FitData.streaming_file_size = 0
+        FitData.streaming_chunk_size = self.chunk_size
+        self.import_activities(self.db_params[0])
+        activities = self.get_rows(self.db_params[0], Activities)
+        self.assertEqual(len(activities), len(self.file_names))
+        for file_name, activity in zip(self.file_names, sorted(activities, key=lambda activity: activity['start_time'])):
+            fit_file = fitfile.file.File(file_name, fitfile.field_enums.DisplayMeasure.metric)
+            self.assertEqual(activity['start_time'], fit_file.time_created_local)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,98 @@
+"""Test querying the database tables into DataFrames."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import unittest
+import logging
+import datetime
+import tempfile
+
+import fitfile
+import idbutils
+
+from garmindb import frames
+from garmindb.garmindb import MonitoringDb, MonitoringHeartRate, Monitoring, ActivitiesDb, ActivityRecords, UpsertBuffer
+from garmindb.summarydb import SummaryDb, DaysSummary
+
+
+root_logger = logging.getLogger()
+handler = logging.FileHandler('frames.log', 'w')
+root_logger.addHandler(handler)
+root_logger.setLevel(logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+
+class TestFrames(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.db_dir = tempfile.TemporaryDirectory()
+        cls.db_params = idbutils.DbParams(db_type='sqlite', db_path=cls.db_dir.name)
+        cls.first_day = datetime.datetime(2024, 1, 1)
+        monitoring_db = MonitoringDb(cls.db_params)
+        activities_db = ActivitiesDb(cls.db_params)
+        summary_db = SummaryDb(cls.db_params)
+        hr_rows = UpsertBuffer(MonitoringHeartRate)
+        monitoring_rows = UpsertBuffer(Monitoring)
+        for minute in range(0, 3 * 1440, 10):
+            timestamp = cls.first_day + datetime.timedelta(minutes=minute)
+            hr_rows.add({'timestamp': timestamp, 'heart_rate': 50 + minute % 60})
+            monitoring_rows.add({'timestamp': timestamp, 'activity_type': fitfile.field_enums.ActivityType.walking, 'duration': datetime.time(0, 1, 30),
+                                 'steps': minute, 'intensity': 2 if minute % 20 else None})
+        with monitoring_db.managed_session() as session:
+            hr_rows.flush(session)
+            monitoring_rows.flush(session)
+        record_rows = UpsertBuffer(ActivityRecords)
+        for activity_id in ['1', '2']:
+            for record in range(100):
+                record_rows.add({'activity_id': activity_id, 'record': record, 'timestamp': cls.first_day + datetime.timedelta(seconds=record), 'hr': 100 + record})
+        with activities_db.managed_session() as session:
+            record_rows.flush(session)
+        summary_rows = UpsertBuffer(DaysSummary)
+        for day in range(3):
+            summary_rows.add({'day': (cls.first_day + datetime.timedelta(days=day)).date(), 'steps': 5000 * day, 'steps_goal': 10000,
+                              'intensity_time': datetime.time(0, 15 * day), 'intensity_time_goal': datetime.time(0, 30)})
+        with summary_db.managed_session() as session:
+            summary_rows.flush(session)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.db_dir.cleanup()
+
+    def test_monitoring_hr(self):
+        frame = frames.monitoring_hr(self.db_params, datetime.date(2024, 1, 2), self.first_day + datetime.timedelta(days=2))
+        self.assertEqual(len(frame), 144)
+        self.assertEqual(str(frame['timestamp'].dtype), 'datetime64[us]')
+        self.assertEqual(frame['timestamp'].iloc[0], datetime.datetime(2024, 1, 2))
+        self.assertEqual(frame['heart_rate'].iloc[0], 50)
+        self.assertTrue(frame['timestamp'].is_monotonic_increasing)
+
+    def test_monitoring(self):
+        frame = frames.monitoring(self.db_params, self.first_day, self.first_day + datetime.timedelta(hours=1))
+        self.assertEqual(len(frame), 6)
+        self.assertEqual(frame['activity_type'].iloc[0], 'walking')
+        self.assertEqual(frame['duration'].iloc[0], datetime.timedelta(minutes=1, seconds=30))
+        self.assertEqual(str(frame['intensity'].dtype), 'float64')
+        self.assertEqual(frame['intensity'].isna().sum(), 3)
+
+    def test_activity_records(self):
+        frame = frames.activity_records(self.db_params, '2')
+        self.assertEqual(len(frame), 100)
+        self.assertEqual(frame['record'].tolist(), list(range(100)))
+        self.assertEqual(frame['hr'].max(), 199)
+
+    def test_days_summary(self):
+        frame = frames.days_summary(self.db_params, self.first_day.date(), datetime.date(2024, 1, 3))
+        self.assertEqual(len(frame), 2)
+        self.assertEqual(str(frame['day'].dtype), 'datetime64[us]')
+        self.assertEqual(frame['steps_goal_percent'].tolist(), [0.0, 50.0])
+        self.assertEqual(frame['intensity_time_mins'].tolist(), [0.0, 15.0])
+        self.assertEqual(frame['intensity_time_goal_percent'].tolist(), [0.0, 50.0])
+        self.assertEqual(frame['floors_goal_percent'].tolist(), [0.0, 0.0])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
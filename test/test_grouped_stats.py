@@ -0,0 +1,174 @@
+"""Test per day statistics computed with grouped queries and rolled up to longer periods."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import unittest
+import logging
+import datetime
+import tempfile
+
+import fitfile
+import idbutils
+
+from garmindb.garmindb import MonitoringDb, MonitoringHeartRate, MonitoringIntensity, MonitoringClimb, Monitoring, UpsertBuffer
+from garmindb.garmindb import GarminDb, DailySummary, Sleep, Weight, RestingHeartRate, Stress, ActivitiesDb, Activities, GarminSummaryDb, IntensityHR
+
+
+root_logger = logging.getLogger()
+handler = logging.FileHandler('grouped_stats.log', 'w')
+root_logger.addHandler(handler)
+root_logger.setLevel(logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+
+class TestGroupedStats(unittest.TestCase):
+
+    active_calories_activity_types = [fitfile.field_enums.ActivityType.walking, fitfile.field_enums.ActivityType.running, fitfile.field_enums.ActivityType.cycling]
+    monitoring_activity_types = active_calories_activity_types + [fitfile.field_enums.ActivityType.generic]
+
+    @classmethod
+    def setUpClass(cls):
+        cls.db_dir = tempfile.TemporaryDirectory()
+        db_params = idbutils.DbParams(db_type='sqlite', db_path=cls.db_dir.name)
+        cls.db = MonitoringDb(db_params)
+        cls.garmin_db = GarminDb(db_params)
+        cls.act_db = ActivitiesDb(db_params)
+        cls.sum_db = GarminSummaryDb(db_params)
+        cls.first_day = datetime.date(2024, 1, 1)
+        cls.end_day = datetime.date(2024, 3, 1)
+        rows = {table: UpsertBuffer(table) for table in [MonitoringHeartRate, MonitoringIntensity, MonitoringClimb, Monitoring]}
+        garmin_rows = {table: UpsertBuffer(table) for table in [DailySummary, Sleep, Weight, RestingHeartRate, Stress]}
+        act_rows = UpsertBuffer(Activities)
+        sum_rows = UpsertBuffer(IntensityHR)
+        cls.monitoring_rows = []
+        for day in range(0, 58, 3):
+            day_date = cls.first_day + datetime.timedelta(days=day)
+            day_ts = datetime.datetime.combine(day_date, datetime.time.min)
+            for minute in range(0, 1440, 37):
+                timestamp = day_ts + datetime.timedelta(minutes=minute)
+                rows[MonitoringHeartRate].add({'timestamp': timestamp, 'heart_rate': (minute * 7 + day) % 90})
+                rows[MonitoringIntensity].add({'timestamp': timestamp, 'moderate_activity_time': datetime.time(0, minute % 3, minute % 11),
+                                               'vigorous_activity_time': datetime.time.min})
+                rows[MonitoringClimb].add({'timestamp': timestamp, 'cum_ascent': float(minute + day)})
+                monitoring = {'timestamp': timestamp, 'activity_type': cls.monitoring_activity_types[minute % 4], 'steps': minute + day,
+                              'active_calories': (minute * 3 + day) % 200}
+                rows[Monitoring].add(monitoring)
+                cls.monitoring_rows.append(monitoring)
+                garmin_rows[Stress].add({'timestamp': timestamp, 'stress': (minute + day) % 60 - 2})
+                sum_rows.add({'timestamp': timestamp, 'intensity': minute % 3, 'heart_rate': (minute * 5 + day) % 120})
+            garmin_rows[DailySummary].add({
+                'day': day_date, 'rhr': 50 + day % 7, 'stress_avg': 20 + day % 11, 'step_goal': 8000, 'steps': 5000 + day * 31,
+                'moderate_activity_time': datetime.time(0, day % 50, day % 13), 'vigorous_activity_time': datetime.time(0, day % 20),
+                'intensity_time_goal': datetime.time(2, 30), 'floors_up': float(day % 9), 'floors_goal': 10.0, 'calories_goal': 2000,
+                'calories_total': 2100 + day, 'calories_bmr': 1700, 'calories_active': 400 + day, 'calories_consumed': None if day % 2 else 1900,
+                'hydration_goal': 2000, 'hydration_intake': 1500 + day, 'sweat_loss': 300 + day % 5, 'spo2_avg': 95.0 + day % 3, 'spo2_min': 88.0 + day % 4,
+                'rr_waking_avg': 14.0 + day % 3, 'rr_max': 20.0 + day % 5, 'rr_min': 10.0 + day % 2, 'bb_max': 80 + day % 15, 'bb_min': 10 + day % 9
+            })
+            garmin_rows[Sleep].add({'day': day_date, 'total_sleep': datetime.time(6 + day % 3, day % 60), 'rem_sleep': datetime.time(1, day % 45),
+                                    'deep_sleep': datetime.time.min, 'light_sleep': datetime.time.min, 'awake': datetime.time.min})
+            garmin_rows[Weight].add({'day': day_date, 'weight': 70.0 + day / 10, 'bmi': 22.0 + day / 100, 'body_fat': 0.0 if day % 2 else 18.0 + day / 50})
+            garmin_rows[RestingHeartRate].add({'day': day_date, 'resting_heart_rate': 0.0 if day % 5 == 0 else 50.0 + day % 7})
+            for activity in range(day % 3 + 1):
+                act_rows.add({'activity_id': f'{day}_{activity}', 'start_time': day_ts + datetime.timedelta(hours=8 + activity * 4),
+                              'calories': 300 + day + activity, 'distance': 5.0 + activity + day / 10})
+        with cls.db.managed_session() as session:
+            for table_rows in rows.values():
+                table_rows.flush(session)
+        with cls.garmin_db.managed_session() as session:
+            for table_rows in garmin_rows.values():
+                table_rows.flush(session)
+        with cls.act_db.managed_session() as session:
+            act_rows.flush(session)
+        with cls.sum_db.managed_session() as session:
+            sum_rows.flush(session)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.db_dir.cleanup()
+
+    @classmethod
+    def __without(cls, stats, changed):
+        return {name: value for name, value in stats.items() if name not in changed}
+
+    def check_stats(self, table, *args, db=None, daily_changed=(), changed=()):
+        """Check that the grouped stats match the ones computed with a query per period, except for the stats whose results were changed."""
+        with (db or self.db).managed_session() as session:
+            daily_stats = table.s_get_grouped_stats(session, self.first_day, self.end_day, *args)
+            for day in range(0, 60):
+                day_date = self.first_day + datetime.timedelta(days=day)
+                self.assertEqual(self.__without(daily_stats.get_daily_stats(day_date), changed + daily_changed),
+                                 self.__without(table.get_daily_stats(session, day_date, *args), changed + daily_changed), day_date)
+            for day in range(0, 53, 7):
+                week_date = self.first_day + datetime.timedelta(days=day)
+                self.assertEqual(self.__without(daily_stats.get_weekly_stats(week_date), changed),
+                                 self.__without(table.get_weekly_stats(session, week_date, *args), changed), week_date)
+            month_stats = daily_stats.get_monthly_stats(self.first_day, datetime.date(2024, 1, 31))
+            self.assertEqual(self.__without(month_stats, changed),
+                             self.__without(table.get_monthly_stats(session, self.first_day, datetime.date(2024, 1, 31), *args), changed))
+        return daily_stats
+
+    def test_heart_rate_stats(self):
+        self.check_stats(MonitoringHeartRate)
+
+    def test_time_stats(self):
+        self.check_stats(MonitoringIntensity)
+
+    def test_sum_of_max_stats(self):
+        self.check_stats(MonitoringClimb, fitfile.field_enums.DisplayMeasure.metric)
+
+    def test_activities_stats(self):
+        self.check_stats(Activities, db=self.act_db)
+
+    def test_daily_summary_stats(self):
+        # the old daily intensity time goal lost the parentheses of its SQL expression, it's now 1/7 of the weekly goal
+        daily_stats = self.check_stats(DailySummary, db=self.garmin_db, daily_changed=('intensity_time_goal',))
+        self.assertEqual(daily_stats.get_daily_stats(self.first_day)['intensity_time_goal'], datetime.time(0, 21, 25))
+
+    def test_sleep_stats(self):
+        self.check_stats(Sleep, db=self.garmin_db)
+
+    def test_weight_stats(self):
+        self.check_stats(Weight, db=self.garmin_db)
+
+    def test_resting_heart_rate_stats(self):
+        self.check_stats(RestingHeartRate, db=self.garmin_db)
+
+    def test_stress_stats(self):
+        self.check_stats(Stress, db=self.garmin_db)
+
+    def test_intensity_hr_stats(self):
+        self.check_stats(IntensityHR, db=self.sum_db)
+
+    def expected_active_calories(self, start, end):
+        # each activity type's calories are the average of its daily maximums, only walking, running, and cycling are counted
+        active_calories = 0
+        for activity_type in self.active_calories_activity_types:
+            daily_max = {}
+            for row in self.monitoring_rows:
+                day = row['timestamp'].date()
+                if row['activity_type'] is activity_type and start <= day < end:
+                    daily_max[day] = max(daily_max.get(day, 0), row['active_calories'])
+            if daily_max:
+                active_calories += sum(daily_max.values()) / len(daily_max)
+        return active_calories
+
+    def test_monitoring_stats(self):
+        # the old active calories query dropped the activity type filter, the activity types are now filtered
+        daily_stats = self.check_stats(Monitoring, changed=('calories_active_avg',))
+        for day in range(0, 60):
+            day_date = self.first_day + datetime.timedelta(days=day)
+            self.assertEqual(daily_stats.get_daily_stats(day_date)['calories_active_avg'],
+                             self.expected_active_calories(day_date, day_date + datetime.timedelta(days=1)))
+        for day in range(0, 53, 7):
+            week_date = self.first_day + datetime.timedelta(days=day)
+            self.assertAlmostEqual(daily_stats.get_weekly_stats(week_date)['calories_active_avg'],
+                                   self.expected_active_calories(week_date, week_date + datetime.timedelta(days=7)))
+        # the maximums of walking, running, and cycling on the first day, the generic maximum of 197 isn't included
+        self.assertEqual(daily_stats.get_daily_stats(self.first_day)['calories_active_avg'], 196 + 199 + 198)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
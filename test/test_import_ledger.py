@@ -0,0 +1,176 @@
+"""Test using the import ledger to choose which files to import."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import unittest
+import logging
+import os
+import datetime
+import tempfile
+from unittest import mock
+
+import idbutils
+
+from garmindb import Download, GarminRhrData, GarminSleepData
+from garmindb import import_ledger
+from garmindb.garmindb import GarminDb, RestingHeartRate, ImportLedger, SummaryDirty
+
+
+root_logger = logging.getLogger()
+handler = logging.FileHandler('import_ledger.log', 'w')
+root_logger.addHandler(handler)
+root_logger.setLevel(logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+
+class TestImportLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.db_params = idbutils.DbParams(db_type='sqlite', db_path=self.dir.name)
+        self.first_day = datetime.date(2024, 1, 1)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def save_rhr(self, day, rhr, age_days=0):
+        json_data = {
+            'statisticsStartDate'   : day.isoformat(),
+            'allMetrics'            : {'metricsMap': {'WELLNESS_RESTING_HEART_RATE': [{'value': rhr}]}}
+        }
+        file_name = Download.save_json_to_file(f'{self.dir.name}/rhr_{day}', json_data, True)['file']
+        mtime = (datetime.datetime.now() - datetime.timedelta(days=age_days)).timestamp()
+        os.utime(file_name, (mtime, mtime))
+        return file_name
+
+    def save_days(self, days, rhr=50, age_days=0):
+        return [self.save_rhr(self.first_day + datetime.timedelta(days=day), rhr + day, age_days) for day in range(days)]
+
+    def import_rhr(self, latest, retry_failed=False, workers=1, batch_size=None):
+        grhrd = GarminRhrData(self.db_params, self.dir.name, latest, 0, retry_failed, workers)
+        if batch_size is not None:
+            grhrd.batch_size = batch_size
+        if grhrd.file_count() > 0:
+            grhrd.process()
+        return grhrd.file_count()
+
+    def ledger_entries(self):
+        return ImportLedger.get_entries(GarminDb(self.db_params), 'GarminRhrData')
+
+    def test_full_import(self):
+        self.save_days(5)
+        self.assertEqual(self.import_rhr(False), 5)
+        entries = self.ledger_entries()
+        self.assertEqual(len(entries), 5)
+        self.assertTrue(all(entry.status == ImportLedger.Status.imported and entry.hash is not None for entry in entries.values()))
+        self.assertEqual(self.import_rhr(False), 5)
+
+    def test_latest_import(self):
+        file_names = self.save_days(5)
+        self.import_rhr(False)
+        self.assertEqual(self.import_rhr(True), 0)
+        # a changed file and a new file are imported
+        self.save_rhr(self.first_day, 70)
+        self.save_rhr(self.first_day + datetime.timedelta(days=5), 60)
+        self.assertEqual(self.import_rhr(True), 2)
+        self.assertEqual(RestingHeartRate.row_count(GarminDb(self.db_params)), 6)
+        self.assertEqual(RestingHeartRate.get_col_max(GarminDb(self.db_params), RestingHeartRate.resting_heart_rate), 70)
+        # a file that was touched, but not changed, is not imported
+        os.utime(file_names[1])
+        self.assertEqual(self.import_rhr(True), 0)
+
+    def test_retry_failed(self):
+        self.save_days(3)
+        bad_file_name = f'{self.dir.name}/rhr_2024-01-04.json'
+        with open(bad_file_name, 'w') as file:
+            file.write('{"statisticsStartDate": ')
+        self.import_rhr(False)
+        entries = self.ledger_entries()
+        self.assertEqual(entries[bad_file_name].status, ImportLedger.Status.failed)
+        self.assertEqual(RestingHeartRate.row_count(GarminDb(self.db_params)), 3)
+        self.save_rhr(datetime.date(2024, 1, 4), 65)
+        self.assertEqual(self.import_rhr(True, True), 1)
+        self.assertEqual(self.ledger_entries()[bad_file_name].status, ImportLedger.Status.imported)
+        self.assertEqual(RestingHeartRate.row_count(GarminDb(self.db_params)), 4)
+        self.assertEqual(self.import_rhr(True, True), 0)
+
+    def test_latest_without_ledger(self):
+        self.save_days(5, age_days=10)
+        self.save_rhr(self.first_day + datetime.timedelta(days=5), 60)
+        self.assertEqual(self.import_rhr(True), 1)
+        entries = self.ledger_entries()
+        self.assertEqual(len(entries), 6)
+        self.assertEqual(len([entry for entry in entries.values() if entry.status == ImportLedger.Status.existing]), 5)
+        self.assertEqual(self.import_rhr(True), 0)
+
+    def test_hash_only_changed_files(self):
+        file_names = self.save_days(5)
+        with mock.patch.object(import_ledger.FileImportTracker, 'file_hash', wraps=import_ledger.FileImportTracker.file_hash) as file_hash:
+            self.import_rhr(False)
+            self.assertEqual(file_hash.call_count, 5)
+            # the hashes of files that haven't changed are reused when they're imported again
+            file_hash.reset_mock()
+            self.assertEqual(self.import_rhr(False), 5)
+            self.assertEqual(file_hash.call_count, 0)
+            # a file whose size changed is imported without comparing hashes, then its new contents are hashed
+            self.save_rhr(self.first_day, 100)
+            self.assertEqual(self.import_rhr(True), 1)
+            self.assertEqual(file_hash.call_args_list, [mock.call(file_names[0])])
+        self.assertEqual(self.ledger_entries()[file_names[0]].hash, import_ledger.FileImportTracker.file_hash(file_names[0]))
+
+    def test_long_paths(self):
+        garmin_db = GarminDb(self.db_params)
+        path = os.path.join(self.dir.name, *(['sub_directory_' * 4] * 20), 'rhr_2024-01-01.json')
+        self.assertGreater(len(path), 1000)
+        ImportLedger.record(garmin_db, [{'path': path, 'importer': 'GarminRhrData', 'size': 10, 'status': ImportLedger.Status.failed}])
+        ImportLedger.record(garmin_db, [{'path': path, 'importer': 'GarminRhrData', 'size': 20, 'status': ImportLedger.Status.imported}])
+        entries = self.ledger_entries()
+        self.assertEqual(list(entries.keys()), [path])
+        self.assertEqual((entries[path].size, entries[path].status), (20, ImportLedger.Status.imported))
+
+    def test_clear_importers(self):
+        garmin_db = GarminDb(self.db_params)
+        ImportLedger.record(garmin_db, [{'path': f'{self.dir.name}/{importer}_file', 'importer': importer, 'status': ImportLedger.Status.imported}
+                                        for importer in ['GarminRhrData', 'GarminActivitiesFitData', 'GarminTcxData']])
+        ImportLedger.clear(garmin_db, ['GarminActivitiesFitData', 'GarminTcxData'])
+        self.assertEqual(len(self.ledger_entries()), 1)
+        self.assertEqual(ImportLedger.get_entries(garmin_db, 'GarminActivitiesFitData'), {})
+        ImportLedger.clear(garmin_db)
+        self.assertEqual(self.ledger_entries(), {})
+
+    def test_batched_import(self):
+        self.save_days(7)
+        # valid JSON that the importer fails on only drops that file from its batch
+        bad_file_name = Download.save_json_to_file(f'{self.dir.name}/rhr_2024-01-08', {'statisticsStartDate': '2024-01-08', 'allMetrics': {}}, True)['file']
+        self.assertEqual(self.import_rhr(False, workers=3, batch_size=3), 8)
+        entries = self.ledger_entries()
+        self.assertEqual(entries[bad_file_name].status, ImportLedger.Status.failed)
+        self.assertEqual(len([entry for entry in entries.values() if entry.status == ImportLedger.Status.imported]), 7)
+        self.assertEqual(RestingHeartRate.row_count(GarminDb(self.db_params)), 7)
+        self.assertEqual(RestingHeartRate.get_col_max(GarminDb(self.db_params), RestingHeartRate.resting_heart_rate), 56)
+        self.assertEqual(SummaryDirty.get_days(GarminDb(self.db_params)), [self.first_day + datetime.timedelta(days=day) for day in range(7)])
+
+    def test_json_decoders(self):
+        json_data = {
+            'dailySleepDTO' : {'calendarDate': '2024-01-01', 'sleepStartTimestampGMT': 1704064800000, 'deepSleepSeconds': 3600},
+            'sleepLevels'   : [{'startGMT': '2024-01-01T00:00:00.0', 'endGMT': '2024-01-01T01:00:00.0', 'activityLevel': 0}]
+        }
+        file_name = Download.save_json_to_file(f'{self.dir.name}/sleep_2024-01-01', json_data, True)['file']
+        gsd = GarminSleepData(self.db_params, self.dir.name, False, 0)
+        parsed = gsd._parse_file(file_name)
+        self.assertEqual(parsed['dailySleepDTO']['calendarDate'], datetime.datetime(2024, 1, 1))
+        self.assertEqual(parsed['dailySleepDTO']['deepSleepSeconds'], datetime.time(1))
+        self.assertEqual(parsed['sleepLevels'][0]['endGMT'], datetime.datetime(2024, 1, 1, 1))
+        orjson = import_ledger.orjson
+        try:
+            import_ledger.orjson = None
+            self.assertEqual(gsd._parse_file(file_name), parsed)
+        finally:
+            import_ledger.orjson = orjson
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,89 @@
+"""Test importing files as they are downloaded."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import unittest
+import logging
+import datetime
+import tempfile
+
+import fitfile
+import idbutils
+
+from garmindb import Download, ImportPipeline, GarminRhrData
+from garmindb.garmindb import GarminDb, RestingHeartRate, Weight
+
+
+root_logger = logging.getLogger()
+handler = logging.FileHandler('import_pipeline.log', 'w')
+root_logger.addHandler(handler)
+root_logger.setLevel(logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+
+class TestImportPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.db_params = idbutils.DbParams(db_type='sqlite', db_path=self.dir.name)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def save_rhr(self, day, rhr):
+        json_data = {
+            'statisticsStartDate'   : day.isoformat(),
+            'allMetrics'            : {'metricsMap': {'WELLNESS_RESTING_HEART_RATE': [{'value': rhr}]}}
+        }
+        return Download.save_json_to_file(f'{self.dir.name}/rhr_{day}', json_data)['file']
+
+    def save_weight(self, day, grams):
+        json_data = {
+            'startDate'         : day.isoformat(),
+            'dateWeightList'    : [{'weight': grams}]
+        }
+        return Download.save_json_to_file(f'{self.dir.name}/weight_{day}', json_data)['file']
+
+    def test_import_while_downloading(self):
+        pipeline = ImportPipeline(self.db_params, None, fitfile.field_enums.DisplayMeasure.metric, 0)
+        first_day = datetime.date(2024, 1, 1)
+        for day in range(10):
+            date = first_day + datetime.timedelta(days=day)
+            pipeline.add_files('rhr', [self.save_rhr(date, 50 + day)])
+        pipeline.add_files('weight', [self.save_weight(first_day, 70000)])
+        pipeline.add_files('rhr', [f'{self.dir.name}/unknown.txt'])
+        pipeline.finish()
+        self.assertEqual(pipeline.imported_files, 11)
+        garmin_db = GarminDb(self.db_params)
+        self.assertEqual(RestingHeartRate.row_count(garmin_db), 10)
+        self.assertEqual(RestingHeartRate.get_col_max(garmin_db, RestingHeartRate.resting_heart_rate), 59)
+        self.assertEqual(Weight.row_count(garmin_db), 1)
+
+    def test_failed_import(self):
+        pipeline = ImportPipeline(self.db_params, None, fitfile.field_enums.DisplayMeasure.metric, 0)
+        pipeline.add_files('rhr', [f'{self.dir.name}/rhr_2024-01-01.json'])
+        pipeline.add_files('rhr', [self.save_rhr(datetime.date(2024, 1, 2), 55)])
+        pipeline.finish()
+        self.assertEqual(RestingHeartRate.row_count(GarminDb(self.db_params)), 1)
+
+    def test_import_after_pipeline(self):
+        # files that were downloaded by an earlier run but never imported aren't passed to the pipeline
+        first_day = datetime.date(2024, 1, 1)
+        for day in range(3):
+            self.save_rhr(first_day + datetime.timedelta(days=day), 50 + day)
+        pipeline = ImportPipeline(self.db_params, None, fitfile.field_enums.DisplayMeasure.metric, 0)
+        pipeline.add_files('rhr', [self.save_rhr(first_day + datetime.timedelta(days=3), 53)])
+        pipeline.finish()
+        self.assertEqual(RestingHeartRate.row_count(GarminDb(self.db_params)), 1)
+        # the ledger driven import that follows the pipeline imports them and skips the file the pipeline imported
+        grhrd = GarminRhrData(self.db_params, self.dir.name, True, 0)
+        self.assertEqual(grhrd.file_count(), 3)
+        grhrd.process()
+        self.assertEqual(RestingHeartRate.row_count(GarminDb(self.db_params)), 4)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,103 @@
+"""Test populating the heart rate values that fall within intensity periods."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import unittest
+import logging
+import datetime
+import random
+import tempfile
+
+import fitfile
+import idbutils
+
+from garmindb import Analyze
+from garmindb.garmindb import GarminDb, Attributes, MonitoringDb, Monitoring, MonitoringHeartRate, GarminSummaryDb, IntensityHR, UpsertBuffer
+
+
+root_logger = logging.getLogger()
+handler = logging.FileHandler('intensity_hr.log', 'w')
+root_logger.addHandler(handler)
+root_logger.setLevel(logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+
+class StubConfig():
+
+    def __init__(self, db_params):
+        self.db_params = db_params
+
+    def get_db_params(self):
+        return self.db_params
+
+
+class TestIntensityHR(unittest.TestCase):
+
+    def setUp(self):
+        self.db_dir = tempfile.TemporaryDirectory()
+        self.db_params = idbutils.DbParams(db_type='sqlite', db_path=self.db_dir.name)
+        self.garmin_db = GarminDb(self.db_params)
+        self.mon_db = MonitoringDb(self.db_params)
+        self.sum_db = GarminSummaryDb(self.db_params)
+        Attributes.set(self.garmin_db, 'measurement_system', fitfile.field_enums.DisplayMeasure.metric)
+        self.first_day = datetime.datetime(2024, 1, 30)
+        self.days = 3
+        self.add_monitoring()
+
+    def tearDown(self):
+        self.db_dir.cleanup()
+
+    def add_monitoring(self):
+        rand = random.Random(42)
+        monitoring_rows = UpsertBuffer(Monitoring)
+        hr_rows = UpsertBuffer(MonitoringHeartRate)
+        timestamp = self.first_day
+        end_ts = self.first_day + datetime.timedelta(days=self.days)
+        while timestamp < end_ts:
+            monitoring_rows.add({'timestamp': timestamp, 'activity_type': fitfile.field_enums.ActivityType.walking, 'intensity': rand.randint(0, 3), 'steps': 10})
+            timestamp += datetime.timedelta(seconds=rand.choice([30, 60, 61, 120, 300]))
+        for second in range(0, self.days * 86400, 15):
+            hr_rows.add({'timestamp': self.first_day + datetime.timedelta(seconds=second), 'heart_rate': 60 + second % 90})
+        with self.mon_db.managed_session() as session:
+            monitoring_rows.flush(session)
+            hr_rows.flush(session)
+
+    def expected_intensity_hr(self):
+        # the per minute queries that the intensity HR values were originally populated with
+        expected = {}
+        with self.mon_db.managed_session() as session:
+            for day in range(self.days):
+                day_date = (self.first_day + datetime.timedelta(days=day)).date()
+                previous_ts = None
+                for monitoring in Monitoring._get_for_day(session, day_date, not_none_col=Monitoring.intensity):
+                    if previous_ts is not None and (monitoring.timestamp - previous_ts).total_seconds() > 60:
+                        for hr in MonitoringHeartRate.s_get_for_period(session, previous_ts, previous_ts + datetime.timedelta(seconds=60)):
+                            expected[hr.timestamp] = (monitoring.intensity, hr.heart_rate)
+                    previous_ts = monitoring.timestamp
+        return expected
+
+    def intensity_hr(self):
+        with self.sum_db.managed_session() as session:
+            return {row.timestamp: (row.intensity, row.heart_rate) for row in session.query(IntensityHR).all()}
+
+    def test_intensity_hr(self):
+        expected = self.expected_intensity_hr()
+        self.assertGreater(len(expected), 0)
+        Analyze(StubConfig(self.db_params), 0).summary()
+        self.assertEqual(self.intensity_hr(), expected)
+
+    def test_populated_days_skipped(self):
+        existing_ts = self.first_day + datetime.timedelta(hours=12, seconds=1)
+        IntensityHR.insert_or_update(self.sum_db, {'timestamp': existing_ts, 'intensity': 5, 'heart_rate': 200})
+        Analyze(StubConfig(self.db_params), 0).summary()
+        intensity_hr = self.intensity_hr()
+        self.assertEqual(intensity_hr[existing_ts], (5, 200))
+        self.assertFalse([timestamp for timestamp in intensity_hr if timestamp.date() == self.first_day.date() and timestamp != existing_ts])
+        self.assertTrue([timestamp for timestamp in intensity_hr if timestamp.date() != self.first_day.date()])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
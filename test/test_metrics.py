@@ -0,0 +1,98 @@
+"""Test timing the stages of a run and counting what they process."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import unittest
+import logging
+import os
+import json
+import datetime
+import tempfile
+
+import idbutils
+
+from garmindb import Download, GarminRhrData, RunMetrics, run_metrics
+from garmindb.garmindb import MonitoringDb, MonitoringHeartRate, UpsertBuffer
+
+
+root_logger = logging.getLogger()
+handler = logging.FileHandler('metrics.log', 'w')
+root_logger.addHandler(handler)
+root_logger.setLevel(logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.db_params = idbutils.DbParams(db_type='sqlite', db_path=self.dir.name)
+        run_metrics.reset()
+
+    def tearDown(self):
+        run_metrics.untrack_sql()
+        self.dir.cleanup()
+
+    def test_stages(self):
+        metrics = RunMetrics()
+        with metrics.stage('import'):
+            metrics.count('messages', 10)
+            with metrics.stage('GarminRhrData'):
+                metrics.count('messages', 5)
+                metrics.record_file('GarminRhrData', 'rhr_2024-01-01.json', 'imported', 1, 0.5, 0.25)
+        with metrics.stage('import'):
+            pass
+        report = metrics.report()
+        self.assertEqual(report['stages']['import']['calls'], 2)
+        self.assertEqual(report['stages']['import']['messages'], 15)
+        self.assertEqual(report['stages']['import/GarminRhrData']['messages'], 5)
+        self.assertEqual(report['stages']['import/GarminRhrData']['files_imported'], 1)
+        self.assertEqual(report['totals'], {'messages': 15, 'files': 1, 'files_imported': 1})
+        self.assertEqual(report['importers'], {'GarminRhrData': {'imported': 1, 'rows': 1}})
+        self.assertEqual(report['slowest_files'][0]['parse_duration'], 0.25)
+
+    def test_sql_counts(self):
+        mon_db = MonitoringDb(self.db_params)
+        run_metrics.track_sql()
+        hr_rows = UpsertBuffer(MonitoringHeartRate)
+        for minute in range(100):
+            hr_rows.add({'timestamp': datetime.datetime(2024, 1, 1) + datetime.timedelta(minutes=minute), 'heart_rate': 60})
+        with run_metrics.stage('write'):
+            with mon_db.managed_session() as session:
+                hr_rows.flush(session)
+        stage = run_metrics.report()['stages']['write']
+        self.assertGreater(stage['sql_statements'], 0)
+        self.assertEqual(stage['rows_inserted'], 100)
+
+    def test_importer_files(self):
+        for day in range(3):
+            date = datetime.date(2024, 1, 1) + datetime.timedelta(days=day)
+            json_data = {'statisticsStartDate': date.isoformat(), 'allMetrics': {'metricsMap': {'WELLNESS_RESTING_HEART_RATE': [{'value': 50 + day}]}}}
+            Download.save_json_to_file(f'{self.dir.name}/rhr_{date}', json_data)
+        GarminRhrData(self.db_params, self.dir.name, False, 0).process()
+        report = run_metrics.report()
+        self.assertEqual(report['stages']['GarminRhrData']['files_imported'], 3)
+        self.assertEqual(report['importers']['GarminRhrData']['imported'], 3)
+        self.assertTrue(all(file_entry['parse_duration'] is not None for file_entry in report['slowest_files']))
+
+    def test_write_report(self):
+        with run_metrics.stage('analyze'):
+            run_metrics.count('rows_inserted', 3)
+        report_file = os.path.join(self.dir.name, 'reports', 'run_report.json')
+        prometheus_file = os.path.join(self.dir.name, 'garmindb.prom')
+        run_metrics.write_report(report_file)
+        run_metrics.write_prometheus(prometheus_file)
+        with open(report_file) as file:
+            self.assertEqual(json.load(file)['stages']['analyze']['rows_inserted'], 3)
+        with open(prometheus_file) as file:
+            prometheus_text = file.read()
+        self.assertIn('# TYPE garmindb_stage_duration_seconds gauge', prometheus_text)
+        self.assertIn('garmindb_stage_total{stage="analyze",count="rows_inserted"} 3', prometheus_text)
+        self.assertEqual(sorted(os.listdir(self.dir.name)), ['garmindb.prom', 'reports'])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
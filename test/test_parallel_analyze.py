@@ -0,0 +1,130 @@
+"""Test computing the summaries of years in worker processes."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import unittest
+import logging
+import datetime
+import random
+import tempfile
+
+import fitfile
+import idbutils
+from sqlalchemy import exc
+
+from garmindb import Analyze, summarydb
+from garmindb.garmindb import GarminDb, Attributes, SummaryDirty, Stress, Sleep, SleepEvents, MonitoringDb, Monitoring, MonitoringHeartRate, UpsertBuffer
+from garmindb.garmindb import GarminSummaryDb, IntensityHR, DaysSummary, WeeksSummary, MonthsSummary, YearsSummary
+
+
+root_logger = logging.getLogger()
+handler = logging.FileHandler('parallel_analyze.log', 'w')
+root_logger.addHandler(handler)
+root_logger.setLevel(logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+
+class StubConfig():
+
+    def __init__(self, db_params):
+        self.db_params = db_params
+
+    def get_db_params(self):
+        return self.db_params
+
+
+class TestParallelAnalyze(unittest.TestCase):
+
+    # the data spans a year boundary so that there is more than one year to compute
+    first_day = datetime.datetime(2023, 12, 28)
+    days = 8
+
+    def setUp(self):
+        self.db_dirs = [tempfile.TemporaryDirectory(), tempfile.TemporaryDirectory()]
+        self.db_params = [idbutils.DbParams(db_type='sqlite', db_path=db_dir.name) for db_dir in self.db_dirs]
+        for db_params in self.db_params:
+            self.add_data(db_params)
+
+    def tearDown(self):
+        for db_dir in self.db_dirs:
+            db_dir.cleanup()
+
+    def add_data(self, db_params):
+        rand = random.Random(42)
+        garmin_db = GarminDb(db_params)
+        mon_db = MonitoringDb(db_params)
+        Attributes.set(garmin_db, 'measurement_system', fitfile.field_enums.DisplayMeasure.metric)
+        monitoring_rows = UpsertBuffer(Monitoring)
+        hr_rows = UpsertBuffer(MonitoringHeartRate)
+        stress_rows = UpsertBuffer(Stress)
+        sleep_event_rows = UpsertBuffer(SleepEvents)
+        timestamp = self.first_day
+        end_ts = self.first_day + datetime.timedelta(days=self.days)
+        while timestamp < end_ts:
+            monitoring_rows.add({'timestamp': timestamp, 'activity_type': fitfile.field_enums.ActivityType.walking, 'intensity': rand.randint(0, 3),
+                                 'steps': rand.randint(0, 100)})
+            timestamp += datetime.timedelta(seconds=rand.choice([60, 61, 120, 300]))
+        for minute in range(self.days * 1440):
+            timestamp = self.first_day + datetime.timedelta(minutes=minute)
+            hr_rows.add({'timestamp': timestamp, 'heart_rate': rand.randint(50, 150)})
+            if minute % 3 == 0:
+                stress_rows.add({'timestamp': timestamp, 'stress': rand.randint(0, 100)})
+        for day in range(self.days):
+            night = self.first_day + datetime.timedelta(days=day, hours=1)
+            for hour, event in enumerate(['light_sleep', 'deep_sleep', 'rem_sleep', 'awake']):
+                sleep_event_rows.add({'timestamp': night + datetime.timedelta(hours=hour), 'event': event, 'duration': datetime.time(0, rand.randint(10, 59))})
+        with mon_db.managed_session() as session:
+            monitoring_rows.flush(session)
+            hr_rows.flush(session)
+        with garmin_db.managed_session() as session:
+            stress_rows.flush(session)
+            sleep_event_rows.flush(session)
+
+    @classmethod
+    def get_rows(cls, db, table):
+        with db.managed_session() as session:
+            return sorted([{col.name: getattr(row, col.name) for col in table.__table__.columns} for row in session.query(table).all()], key=repr)
+
+    @classmethod
+    def get_all_rows(cls, db_params):
+        garmin_sum_db = GarminSummaryDb(db_params)
+        sum_db = summarydb.SummaryDb(db_params)
+        tables = [(garmin_sum_db, table) for table in [IntensityHR, DaysSummary, WeeksSummary, MonthsSummary, YearsSummary]]
+        tables += [(sum_db, table) for table in [summarydb.DaysSummary, summarydb.WeeksSummary, summarydb.MonthsSummary, summarydb.YearsSummary]]
+        tables += [(GarminDb(db_params), Sleep)]
+        return {table.__tablename__ + '_' + db.db_name: cls.get_rows(db, table) for db, table in tables}
+
+    def test_parallel_summary(self):
+        Analyze(StubConfig(self.db_params[0]), 0).summary()
+        Analyze(StubConfig(self.db_params[1]), 0).summary(workers=2)
+        serial_rows = self.get_all_rows(self.db_params[0])
+        parallel_rows = self.get_all_rows(self.db_params[1])
+        years = [row['first_day'].year for row in serial_rows[YearsSummary.__tablename__ + '_' + GarminSummaryDb(self.db_params[0]).db_name]]
+        self.assertEqual(years, [2023, 2024])
+        self.assertGreater(len(serial_rows[IntensityHR.__tablename__ + '_' + GarminSummaryDb(self.db_params[0]).db_name]), 0)
+        self.assertEqual(len(serial_rows[Sleep.__tablename__ + '_' + GarminDb(self.db_params[0]).db_name]), self.days)
+        for name, rows in serial_rows.items():
+            self.assertEqual(parallel_rows[name], rows, name)
+
+    def test_incremental_parallel_summary(self):
+        for db_params, workers in zip(self.db_params, [1, 2]):
+            analyze = Analyze(StubConfig(db_params), 0)
+            analyze.summary(workers=workers)
+            Stress.insert_or_update(GarminDb(db_params), {'timestamp': datetime.datetime(2023, 12, 31, 12), 'stress': 100})
+            Stress.insert_or_update(GarminDb(db_params), {'timestamp': datetime.datetime(2024, 1, 2, 12), 'stress': 100})
+            SummaryDirty.mark_days(GarminDb(db_params), [datetime.date(2023, 12, 31), datetime.date(2024, 1, 2)])
+            analyze.summary(incremental=True, workers=workers)
+        self.assertEqual(self.get_all_rows(self.db_params[1]), self.get_all_rows(self.db_params[0]))
+
+    def test_read_only(self):
+        analyze = Analyze(StubConfig(self.db_params[0]), 0, read_only=True)
+        self.assertGreater(len(analyze.derived_rows(2024)[IntensityHR]), 0)
+        with self.assertRaises(exc.OperationalError):
+            Stress.insert_or_update(analyze.garmin_db, {'timestamp': datetime.datetime(2024, 1, 1, 12), 'stress': 100})
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
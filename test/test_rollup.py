@@ -0,0 +1,113 @@
+"""Test rolling up time series to 5 minute, hourly, and daily resolutions."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import unittest
+import logging
+import datetime
+import tempfile
+
+import idbutils
+
+from garmindb import frames
+from garmindb.garmindb import GarminDb, Stress, StressRollup, MonitoringDb, MonitoringHeartRate, MonitoringHeartRateRollup, RollupResolution, UpsertBuffer
+
+
+root_logger = logging.getLogger()
+handler = logging.FileHandler('rollup.log', 'w')
+root_logger.addHandler(handler)
+root_logger.setLevel(logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+
+class TestRollup(unittest.TestCase):
+
+    def setUp(self):
+        self.db_dir = tempfile.TemporaryDirectory()
+        self.db_params = idbutils.DbParams(db_type='sqlite', db_path=self.db_dir.name)
+        self.mon_db = MonitoringDb(self.db_params)
+        self.garmin_db = GarminDb(self.db_params)
+        self.first_day = datetime.datetime(2024, 1, 1)
+        self.add_hr(self.first_day, 2)
+
+    def tearDown(self):
+        self.db_dir.cleanup()
+
+    def add_hr(self, first_ts, days, offset=0):
+        hr_rows = UpsertBuffer(MonitoringHeartRate)
+        for minute in range(days * 1440):
+            hr_rows.add({'timestamp': first_ts + datetime.timedelta(minutes=minute), 'heart_rate': 50 + minute % 60 + offset})
+        with self.mon_db.managed_session() as session:
+            hr_rows.flush(session)
+
+    def get_rollups(self, table, resolution, db):
+        with db.managed_session() as session:
+            return table.s_get_for_resolution(session, self.first_day, self.first_day + datetime.timedelta(days=2), resolution)
+
+    def test_resolution(self):
+        self.assertEqual(RollupResolution.coarsest(60), None)
+        self.assertEqual(RollupResolution.coarsest(300), RollupResolution.five_minutes)
+        self.assertEqual(RollupResolution.coarsest(1800), RollupResolution.five_minutes)
+        self.assertEqual(RollupResolution.coarsest(7 * 86400), RollupResolution.day)
+        self.assertEqual(RollupResolution.hour.bucket(datetime.datetime(2024, 1, 1, 13, 59, 59)), datetime.datetime(2024, 1, 1, 13))
+        self.assertEqual(RollupResolution.five_minutes.bucket(datetime.datetime(2024, 1, 1, 13, 59, 59)), datetime.datetime(2024, 1, 1, 13, 55))
+
+    def test_heart_rate_rollup(self):
+        self.assertEqual(MonitoringHeartRateRollup.update(self.mon_db, self.first_day, self.first_day + datetime.timedelta(days=1)), 2 * (288 + 24 + 1))
+        five_minutes = self.get_rollups(MonitoringHeartRateRollup, 300, self.mon_db)
+        self.assertEqual(len(five_minutes), 2 * 288)
+        self.assertEqual((five_minutes[1].min, five_minutes[1].avg, five_minutes[1].max, five_minutes[1].count), (55, 57, 59, 5))
+        hours = self.get_rollups(MonitoringHeartRateRollup, 3600, self.mon_db)
+        self.assertEqual(len(hours), 48)
+        self.assertEqual((hours[0].min, hours[0].avg, hours[0].max, hours[0].count), (50, 79.5, 109, 60))
+        days = self.get_rollups(MonitoringHeartRateRollup, 86400, self.mon_db)
+        self.assertEqual([day.count for day in days], [1440, 1440])
+        self.assertEqual(days[0].avg, MonitoringHeartRate.get_col_avg(self.mon_db, MonitoringHeartRate.heart_rate, self.first_day, self.first_day + datetime.timedelta(days=1)))
+
+    def test_update(self):
+        MonitoringHeartRateRollup.update(self.mon_db, self.first_day, self.first_day + datetime.timedelta(days=1))
+        # new values for the second day only change the rollups for that day
+        self.add_hr(self.first_day + datetime.timedelta(days=1), 1, 10)
+        MonitoringHeartRateRollup.update(self.mon_db, self.first_day + datetime.timedelta(days=1), self.first_day + datetime.timedelta(days=1))
+        days = self.get_rollups(MonitoringHeartRateRollup, 86400, self.mon_db)
+        self.assertEqual([day.max for day in days], [109, 119])
+        self.assertEqual(MonitoringHeartRateRollup.row_count(self.mon_db), 2 * (288 + 24 + 1))
+
+    def test_backfill(self):
+        self.assertEqual(MonitoringHeartRateRollup.backfill(self.mon_db), 2)
+        self.assertEqual(MonitoringHeartRateRollup.row_count(self.mon_db), 2 * (288 + 24 + 1))
+        # days that are already rolled up are not computed again
+        self.assertEqual(MonitoringHeartRateRollup.backfill(self.mon_db), 0)
+        self.add_hr(self.first_day + datetime.timedelta(days=40), 1)
+        with self.mon_db.managed_session() as session:
+            self.assertEqual(MonitoringHeartRateRollup.s_get_missing_days(session), [datetime.date(2024, 2, 10)])
+        self.assertEqual(MonitoringHeartRateRollup.backfill(self.mon_db), 1)
+        self.assertEqual(MonitoringHeartRateRollup.row_count(self.mon_db), 3 * (288 + 24 + 1))
+
+    def test_stress_rollup(self):
+        stress_rows = UpsertBuffer(Stress)
+        for minute in range(0, 1440, 3):
+            stress_rows.add({'timestamp': self.first_day + datetime.timedelta(minutes=minute), 'stress': (minute % 50) - 2})
+        with self.garmin_db.managed_session() as session:
+            stress_rows.flush(session)
+        StressRollup.update(self.garmin_db, self.first_day, self.first_day)
+        days = self.get_rollups(StressRollup, 86400, self.garmin_db)
+        self.assertEqual(len(days), 1)
+        self.assertEqual(days[0].min, 1)
+        self.assertEqual(days[0].max, 47)
+
+    def test_frames(self):
+        MonitoringHeartRateRollup.update(self.mon_db, self.first_day, self.first_day + datetime.timedelta(days=1))
+        self.assertEqual(len(frames.heart_rate_rollup(self.db_params, self.first_day, self.first_day + datetime.timedelta(days=1), 60)), 1440)
+        self.assertEqual(len(frames.heart_rate_rollup(self.db_params, self.first_day, self.first_day + datetime.timedelta(days=1))), 288)
+        frame = frames.heart_rate_rollup(self.db_params, resolution=3 * 3600)
+        self.assertEqual(len(frame), 48)
+        self.assertEqual(frame.columns.tolist(), ['timestamp', 'min', 'avg', 'max', 'count'])
+        self.assertEqual(frame['timestamp'].iloc[1], datetime.datetime(2024, 1, 1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,103 @@
+"""Test opening the databases with SQLite profiles and migrating the indexes of existing databases."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import unittest
+import logging
+import os
+import sqlite3
+import tempfile
+
+import idbutils
+from sqlalchemy import text, inspect, Integer
+
+from garmindb.garmindb import GarminDb, ActivitiesDb, Activities, SqliteProfile
+
+
+root_logger = logging.getLogger()
+handler = logging.FileHandler('sqlite_profile.log', 'w')
+root_logger.addHandler(handler)
+root_logger.setLevel(logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+
+class TestSqliteProfile(unittest.TestCase):
+
+    def setUp(self):
+        self.db_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.db_dir.cleanup()
+
+    def db_params(self, profile):
+        return idbutils.DbParams(db_type='sqlite', db_path=self.db_dir.name, sqlite_profile=profile.value)
+
+    def pragmas(self, db):
+        with db.engine.connect() as connection:
+            return {name: connection.execute(text(f'PRAGMA {name}')).scalar() for name in ['journal_mode', 'synchronous', 'cache_size', 'mmap_size']}
+
+    def indexes(self, db_file):
+        with sqlite3.connect(os.path.join(self.db_dir.name, db_file)) as connection:
+            return [row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'ix_%'")]
+
+    def test_performance_profile(self):
+        pragmas = self.pragmas(GarminDb(self.db_params(SqliteProfile.performance)))
+        self.assertEqual(pragmas['journal_mode'], 'wal')
+        # NORMAL
+        self.assertEqual(pragmas['synchronous'], 1)
+        self.assertEqual(pragmas['cache_size'], SqliteProfile.performance.pragmas()['cache_size'])
+        self.assertEqual(pragmas['mmap_size'], SqliteProfile.performance.pragmas()['mmap_size'])
+
+    def test_default_profile(self):
+        GarminDb(self.db_params(SqliteProfile.performance)).engine.dispose()
+        pragmas = self.pragmas(GarminDb(idbutils.DbParams(db_type='sqlite', db_path=self.db_dir.name)))
+        self.assertEqual(pragmas['journal_mode'], 'delete')
+        # FULL
+        self.assertEqual(pragmas['synchronous'], 2)
+
+    def test_missing_indexes_created(self):
+        ActivitiesDb(self.db_params(SqliteProfile.default)).engine.dispose()
+        self.assertEqual(sorted(self.indexes('garmin_activities.db')), ['ix_activities_sport_start_time', 'ix_activity_records_activity_id_timestamp'])
+        with sqlite3.connect(os.path.join(self.db_dir.name, 'garmin_activities.db')) as connection:
+            connection.execute('DROP INDEX ix_activity_records_activity_id_timestamp')
+        self.assertEqual(self.indexes('garmin_activities.db'), ['ix_activities_sport_start_time'])
+        ActivitiesDb(self.db_params(SqliteProfile.default))
+        self.assertEqual(sorted(self.indexes('garmin_activities.db')), ['ix_activities_sport_start_time', 'ix_activity_records_activity_id_timestamp'])
+
+    def test_delete_db(self):
+        db_params = self.db_params(SqliteProfile.performance)
+        garmin_db = GarminDb(db_params)
+        with garmin_db.managed_session() as session:
+            session.execute(text("INSERT INTO sleep_events (timestamp, event, duration) VALUES ('2024-01-01 00:00:00.000000', 'deep_sleep', '00:01:00.000000')"))
+        self.assertTrue(os.path.exists(os.path.join(self.db_dir.name, 'garmin.db-wal')))
+        GarminDb.delete_db(db_params)
+        self.assertEqual(os.listdir(self.db_dir.name), [])
+
+    def test_shared_db(self):
+        db_params = self.db_params(SqliteProfile.performance)
+        garmin_db = GarminDb.get(db_params)
+        self.assertIs(GarminDb.get(self.db_params(SqliteProfile.performance)), garmin_db)
+        self.assertIsNot(GarminDb.get(self.db_params(SqliteProfile.default)), garmin_db)
+        self.assertIsNot(ActivitiesDb.get(db_params), garmin_db)
+        GarminDb.delete_db(db_params)
+        self.assertIsNot(GarminDb.get(db_params), garmin_db)
+        GarminDb.release(db_params)
+        GarminDb.release(self.db_params(SqliteProfile.default))
+        ActivitiesDb.release(db_params)
+
+    def test_shared_db_new_tables(self):
+        db_params = self.db_params(SqliteProfile.default)
+        activities_db = ActivitiesDb.get(db_params)
+        # plugins add tables to a database after it may have been opened
+        Activities.create('shared_db_test_records', ActivitiesDb, 1, ['activity_id', 'record'], {'activity_id': {'args': [Integer]}, 'record': {'args': [Integer]}})
+        self.assertFalse(inspect(activities_db.engine).has_table('shared_db_test_records'))
+        self.assertIs(ActivitiesDb.get(db_params), activities_db)
+        self.assertTrue(inspect(activities_db.engine).has_table('shared_db_test_records'))
+        ActivitiesDb.release(db_params)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,142 @@
+"""Test marking the days that have had data imported and incrementally summarizing them."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import json
+import unittest
+import logging
+import datetime
+import tempfile
+from types import SimpleNamespace
+
+import fitfile
+import idbutils
+
+from garmindb import PluginManager, Analyze, ActivityFitFileProcessor, MonitoringFitFileProcessor, GarminActivitiesFitData, GarminMonitoringFitData
+from garmindb import GarminJsonSummaryData
+from garmindb.garmindb import GarminDb, Attributes, SummaryDirty, Stress, MonitoringDb, Monitoring, UpsertBuffer
+from garmindb.garmindb import GarminSummaryDb, DaysSummary, WeeksSummary, MonthsSummary, YearsSummary
+
+from fit_fixtures import FitFixtures
+
+
+root_logger = logging.getLogger()
+handler = logging.FileHandler('summary_dirty.log', 'w')
+root_logger.addHandler(handler)
+root_logger.setLevel(logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+
+class StubConfig():
+
+    def __init__(self, db_params):
+        self.db_params = db_params
+
+    def get_db_params(self):
+        return self.db_params
+
+
+class TestSummaryDirty(unittest.TestCase):
+
+    # the data spans a month and year boundary
+    first_day = datetime.datetime(2023, 12, 28)
+    days = 8
+
+    def setUp(self):
+        self.db_dir = tempfile.TemporaryDirectory()
+        self.db_params = idbutils.DbParams(db_type='sqlite', db_path=self.db_dir.name)
+        self.garmin_db = GarminDb(self.db_params)
+        Attributes.set(self.garmin_db, 'measurement_system', fitfile.field_enums.DisplayMeasure.metric)
+        self.plugin_manager = PluginManager(self.db_dir.name, self.db_params)
+
+    def tearDown(self):
+        self.db_dir.cleanup()
+
+    def test_mark_monitoring_file(self):
+        fit_fixtures = FitFixtures(self.db_dir.name)
+        fit_fixtures.write_monitoring(datetime.date(2024, 1, 2))
+        gfd = GarminMonitoringFitData(os.path.join(self.db_dir.name, FitFixtures.monitoring_dir), False, fitfile.field_enums.DisplayMeasure.metric, 0)
+        gfd.process_files(MonitoringFitFileProcessor(self.db_params, self.plugin_manager))
+        # the daily summary written at midnight belongs to the previous day
+        self.assertEqual(SummaryDirty.get_days(self.garmin_db), [datetime.date(2024, 1, 1), datetime.date(2024, 1, 2)])
+
+    def test_mark_activity_files(self):
+        fit_fixtures = FitFixtures(self.db_dir.name)
+        for day in [datetime.date(2024, 1, 2), datetime.date(2024, 1, 5)]:
+            fit_fixtures.write_activity(day)
+        gfd = GarminActivitiesFitData(os.path.join(self.db_dir.name, FitFixtures.activities_dir), False, fitfile.field_enums.DisplayMeasure.metric, 0)
+        gfd.process_files(ActivityFitFileProcessor(self.db_params, self.plugin_manager))
+        self.assertEqual(SummaryDirty.get_days(self.garmin_db), [datetime.date(2024, 1, 2), datetime.date(2024, 1, 5)])
+
+    def test_mark_json_activities(self):
+        json_dir = os.path.join(self.db_dir.name, 'activities')
+        os.makedirs(json_dir)
+        # the second activity runs past midnight
+        for activity_id, start, elapsed in [(1, '2024-01-02 10:00:00', 3600), (2, '2024-01-05 23:00:00', 7200)]:
+            activity = {'activityId': activity_id, 'activityName': 'cycling', 'eventType': {'typeId': 9}, 'activityType': {'typeId': 2, 'parentTypeId': 2},
+                        'startTimeLocal': start, 'elapsedDuration': elapsed, 'distance': 10000.0}
+            with open(os.path.join(json_dir, f'activity_{activity_id}.json'), 'w') as file:
+                json.dump(activity, file)
+        GarminJsonSummaryData(self.db_params, json_dir, False, fitfile.field_enums.DisplayMeasure.metric, 0).process()
+        self.assertEqual(SummaryDirty.get_days(self.garmin_db), [datetime.date(2024, 1, 2), datetime.date(2024, 1, 5), datetime.date(2024, 1, 6)])
+
+    def test_mark_file_without_times(self):
+        fit_file = SimpleNamespace(time_created_local=None, time_ended_local=None)
+        for processor in [ActivityFitFileProcessor(self.db_params, self.plugin_manager), MonitoringFitFileProcessor(self.db_params, self.plugin_manager)]:
+            with self.garmin_db.managed_session() as processor.garmin_db_session:
+                processor._mark_dirty_days(fit_file)
+        self.assertEqual(SummaryDirty.get_days(self.garmin_db), [])
+
+    def add_data(self):
+        mon_db = MonitoringDb(self.db_params)
+        monitoring_rows = UpsertBuffer(Monitoring)
+        stress_rows = UpsertBuffer(Stress)
+        for minute in range(0, self.days * 1440, 3):
+            timestamp = self.first_day + datetime.timedelta(minutes=minute)
+            monitoring_rows.add({'timestamp': timestamp, 'activity_type': fitfile.field_enums.ActivityType.walking, 'intensity': minute % 4, 'steps': minute % 100})
+            stress_rows.add({'timestamp': timestamp, 'stress': minute % 50})
+        with mon_db.managed_session() as session:
+            monitoring_rows.flush(session)
+        with self.garmin_db.managed_session() as session:
+            stress_rows.flush(session)
+
+    @classmethod
+    def get_rows(cls, db, table):
+        with db.managed_session() as session:
+            return {row.first_day if hasattr(row, 'first_day') else row.day: row.stress_avg for row in session.query(table).all()}
+
+    def test_incremental_summary(self):
+        self.add_data()
+        analyze = Analyze(StubConfig(self.db_params), 0)
+        analyze.summary()
+        garmin_sum_db = GarminSummaryDb(self.db_params)
+        tables = [DaysSummary, WeeksSummary, MonthsSummary, YearsSummary]
+        before = {table: self.get_rows(garmin_sum_db, table) for table in tables}
+        # stress changes on two days, but only one of them is marked as having had data imported
+        dirty_day = datetime.date(2024, 1, 2)
+        clean_day = datetime.date(2023, 12, 29)
+        for day in [dirty_day, clean_day]:
+            Stress.insert_or_update(self.garmin_db, {'timestamp': datetime.datetime.combine(day, datetime.time(12)), 'stress': 100})
+        SummaryDirty.mark_days(self.garmin_db, [dirty_day])
+        analyze.summary(incremental=True)
+        after = {table: self.get_rows(garmin_sum_db, table) for table in tables}
+        self.assertEqual(SummaryDirty.get_days(self.garmin_db), [])
+        # the dirty day and the week, month, and year that contain it are recalculated
+        dirty_week = datetime.date(2024, 1, 1)
+        for table, key in [(DaysSummary, dirty_day), (WeeksSummary, dirty_week), (MonthsSummary, datetime.date(2024, 1, 1)), (YearsSummary, datetime.date(2024, 1, 1))]:
+            self.assertGreater(after[table][key], before[table][key], table.__tablename__)
+        # the other days, weeks, months, and years aren't
+        for table in tables:
+            for key, stress_avg in before[table].items():
+                if key not in [dirty_day, dirty_week, datetime.date(2024, 1, 1)]:
+                    self.assertEqual(after[table][key], stress_avg, f'{table.__tablename__} {key}')
+        self.assertIn(clean_day, before[DaysSummary])
+        self.assertIn(datetime.date(2023, 12, 1), before[MonthsSummary])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,117 @@
+"""Test set based insert or update of database rows."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import unittest
+import logging
+import datetime
+import tempfile
+
+import fitfile
+import idbutils
+
+from garmindb import summarydb
+from garmindb.garmindb import MonitoringDb, Monitoring, MonitoringClimb, MonitoringHeartRate, MonitoringIntensity, UpsertBuffer, MirroredUpsertBuffer
+from garmindb.garmindb import GarminSummaryDb, DaysSummary
+
+
+root_logger = logging.getLogger()
+handler = logging.FileHandler('upsert.log', 'w')
+root_logger.addHandler(handler)
+root_logger.setLevel(logging.INFO)
+
+logger = logging.getLogger(__name__)
+
+
+class TestUpsert(unittest.TestCase):
+
+    def setUp(self):
+        self.db_dir = tempfile.TemporaryDirectory()
+        self.db = MonitoringDb(idbutils.DbParams(db_type='sqlite', db_path=self.db_dir.name))
+        self.timestamp = datetime.datetime(2024, 1, 1, 10, 0, 0)
+
+    def tearDown(self):
+        self.db_dir.cleanup()
+
+    def test_insert_and_merge(self):
+        upsert_buffer = UpsertBuffer(MonitoringClimb)
+        upsert_buffer.add({'timestamp': self.timestamp, 'cum_ascent': 10.0, 'heart_rate': 60})
+        upsert_buffer.add({'timestamp': self.timestamp, 'cum_descent': 5.0, 'ascent': None})
+        self.assertEqual(len(upsert_buffer), 1)
+        with self.db.managed_session() as session:
+            self.assertEqual(upsert_buffer.flush(session), 1)
+        self.assertEqual(len(upsert_buffer), 0)
+        with self.db.managed_session() as session:
+            climb = MonitoringClimb.s_get(session, self.timestamp)
+            self.assertEqual((climb.cum_ascent, climb.cum_descent, climb.ascent), (10.0, 5.0, None))
+
+    def test_update_only_present_columns(self):
+        with self.db.managed_session() as session:
+            MonitoringClimb.s_insert_or_update(session, {'timestamp': self.timestamp, 'cum_ascent': 10.0, 'cum_descent': 5.0})
+        upsert_buffer = UpsertBuffer(MonitoringClimb)
+        upsert_buffer.add({'timestamp': self.timestamp, 'cum_ascent': 20.0})
+        upsert_buffer.add({'timestamp': self.timestamp + datetime.timedelta(minutes=1), 'cum_descent': 7.0})
+        with self.db.managed_session() as session:
+            upsert_buffer.flush(session)
+        with self.db.managed_session() as session:
+            climb = MonitoringClimb.s_get(session, self.timestamp)
+            self.assertEqual((climb.cum_ascent, climb.cum_descent), (20.0, 5.0))
+        self.assertEqual(MonitoringClimb.row_count(self.db), 2)
+
+    def test_column_defaults(self):
+        upsert_buffer = UpsertBuffer(MonitoringIntensity)
+        upsert_buffer.add({'timestamp': self.timestamp, 'moderate_activity_time': datetime.time(minute=1)})
+        with self.db.managed_session() as session:
+            upsert_buffer.flush(session)
+        with self.db.managed_session() as session:
+            intensity = MonitoringIntensity.s_get(session, self.timestamp)
+            self.assertEqual(intensity.vigorous_activity_time, datetime.time.min)
+
+    def test_composite_key(self):
+        upsert_buffer = UpsertBuffer(Monitoring)
+        for activity_type in [fitfile.field_enums.ActivityType.walking, fitfile.field_enums.ActivityType.running]:
+            upsert_buffer.add({'timestamp': self.timestamp, 'activity_type': activity_type, 'steps': 100})
+        with self.assertRaises(ValueError):
+            upsert_buffer.add({'timestamp': self.timestamp + datetime.timedelta(minutes=1), 'active_calories': 3})
+        with self.db.managed_session() as session:
+            upsert_buffer.flush(session)
+        upsert_buffer.add({'timestamp': self.timestamp, 'activity_type': fitfile.field_enums.ActivityType.walking, 'steps': 200})
+        with self.db.managed_session() as session:
+            upsert_buffer.flush(session)
+        self.assertEqual(Monitoring.row_count(self.db), 2)
+        self.assertEqual(Monitoring.get_col_max(self.db, Monitoring.steps), 200)
+
+    def test_heart_rate_bulk(self):
+        upsert_buffer = UpsertBuffer(MonitoringHeartRate)
+        for minute in range(1000):
+            upsert_buffer.add({'timestamp': self.timestamp + datetime.timedelta(minutes=minute), 'heart_rate': 60})
+        with self.db.managed_session() as session:
+            upsert_buffer.flush(session)
+        self.assertEqual(MonitoringHeartRate.row_count(self.db), 1000)
+
+    def test_mirrored(self):
+        db_params = idbutils.DbParams(db_type='sqlite', db_path=self.db_dir.name)
+        garmin_sum_db = GarminSummaryDb(db_params)
+        sum_db = summarydb.SummaryDb(db_params)
+        day = self.timestamp.date()
+        with garmin_sum_db.managed_session() as garmin_sum_session, sum_db.managed_session() as sum_session:
+            DaysSummary.s_insert_or_update(garmin_sum_session, {'day': day, 'hr_avg': 60.0, 'steps': 1000})
+            summarydb.DaysSummary.s_insert_or_update(sum_session, {'day': day, 'hr_avg': 60.0, 'steps': 1000})
+        upsert_buffer = MirroredUpsertBuffer(DaysSummary, [summarydb.DaysSummary])
+        upsert_buffer.add({'day': day, 'steps': 2000, 'hr_avg': None})
+        upsert_buffer.add({'day': day + datetime.timedelta(days=1), 'steps': 3000})
+        with garmin_sum_db.managed_session() as garmin_sum_session, sum_db.managed_session() as sum_session:
+            with self.assertRaises(ValueError):
+                upsert_buffer.flush(garmin_sum_session)
+            self.assertEqual(upsert_buffer.flush(garmin_sum_session, sum_session), 2)
+        for table, db in [(DaysSummary, garmin_sum_db), (summarydb.DaysSummary, sum_db)]:
+            with db.managed_session() as session:
+                days_summary = table.s_get(session, day)
+                self.assertEqual((days_summary.hr_avg, days_summary.steps), (60.0, 2000))
+            self.assertEqual(table.row_count(db), 2)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)